@@ -55,6 +55,30 @@ class Settings(BaseSettings):
     UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "uploads")
     MAX_UPLOAD_SIZE: int = 10 * 1024 * 1024  # 10MB
     
+    # Process execution settings
+    PROCESS_POOL_WORKERS: int = int(os.getenv("PROCESS_POOL_WORKERS", str(os.cpu_count() or 2)))
+    PROCESS_POOL_MIN_ENTITIES: int = int(os.getenv("PROCESS_POOL_MIN_ENTITIES", "8"))  # Smaller groups run in-process
+    PROCESS_EXECUTION_BATCH_SIZE: int = int(os.getenv("PROCESS_EXECUTION_BATCH_SIZE", "100"))
+    PROCESS_JOB_WORKERS: int = int(os.getenv("PROCESS_JOB_WORKERS", "4"))  # Concurrent background executions
+    PROCESS_JOB_RETENTION_SECONDS: int = int(os.getenv("PROCESS_JOB_RETENTION_SECONDS", "3600"))
+    PROCESS_EVENT_POLL_SECONDS: float = float(os.getenv("PROCESS_EVENT_POLL_SECONDS", "0.25"))
+    SCENARIO_CACHE_MAX_ENTRIES: int = int(os.getenv("SCENARIO_CACHE_MAX_ENTRIES", "64"))  # Cached scenario balance vectors
+    SCENARIO_CACHE_TTL_SECONDS: int = int(os.getenv("SCENARIO_CACHE_TTL_SECONDS", "900"))
+    RULE_PLAN_CACHE_SIZE: int = int(os.getenv("RULE_PLAN_CACHE_SIZE", "4096"))  # Compiled consolidation rules
+    JOURNAL_SINK_BUFFER_ROWS: int = int(os.getenv("JOURNAL_SINK_BUFFER_ROWS", "50000"))  # Lines per COPY batch
+    REPORT_CACHE_MAX_BYTES: int = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # Serialized reports per worker
+    REPORT_CACHE_TTL_SECONDS: int = int(os.getenv("REPORT_CACHE_TTL_SECONDS", "3600"))  # Redis tier expiry
+    REPORT_CACHE_REDIS: bool = os.getenv("REPORT_CACHE_REDIS", "false").lower() in ("true", "1", "t")
+    ETAG_VERSION_TTL_SECONDS: float = float(os.getenv("ETAG_VERSION_TTL_SECONDS", "10"))  # 304s served from memory this long
+    REPORT_PACK_WORKERS: int = int(os.getenv("REPORT_PACK_WORKERS", str(os.cpu_count() or 2)))
+    REPORT_PACK_DIR: str = os.getenv("REPORT_PACK_DIR", "report_packs")  # Pack archives, per company
+    KPI_SNAPSHOT_REFRESH_SECONDS: int = int(os.getenv("KPI_SNAPSHOT_REFRESH_SECONDS", "300"))  # Scheduler tick, 0 disables
+    KPI_SNAPSHOT_MAX_AGE_SECONDS: int = int(os.getenv("KPI_SNAPSHOT_MAX_AGE_SECONDS", "3600"))  # Recompute even without writes
+    KPI_SNAPSHOT_DEBOUNCE_SECONDS: float = float(os.getenv("KPI_SNAPSHOT_DEBOUNCE_SECONDS", "5"))
+    KPI_SNAPSHOT_MAX_DELAY_SECONDS: float = float(os.getenv("KPI_SNAPSHOT_MAX_DELAY_SECONDS", "60"))  # Cap for write bursts
+    KPI_RECENT_ACTIVITY_LIMIT: int = int(os.getenv("KPI_RECENT_ACTIVITY_LIMIT", "50"))
+    KPI_TREND_PERIODS: int = int(os.getenv("KPI_TREND_PERIODS", "24"))
+
     # Logging configuration
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     LOG_FORMAT: str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
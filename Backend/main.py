@@ -103,10 +103,15 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"Warning: Could not initialize process tables on startup: {e}")
 
+    # Scheduled refresh of the dashboard KPI snapshots
+    from routers import kpi_snapshots
+    kpi_snapshots.start()
+
     yield
 
     # Shutdown
     logger.info("Shutting down application...")
+    kpi_snapshots.stop()
 
 
 def custom_openapi():
@@ -200,7 +205,7 @@ app.add_middleware(
     allow_credentials=allow_credentials,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition"],
+    expose_headers=["Content-Disposition", "X-Next-Cursor", "ETag"],
     max_age=600,  # 10 minutes
 )
 
@@ -1,6 +1,7 @@
 """
 Migration script to create/update financial process tables in company databases
-Run this to ensure all tables exist with correct schema
+Run this to ensure all tables exist with correct schema, and to move the legacy
+{process}_{data_type}_entries tables into the partitioned fact tables
 """
 
 import psycopg2
@@ -8,6 +9,8 @@ from psycopg2.extras import RealDictCursor
 import os
 import re
 
+from routers import fact_tables
+
 def get_db_config():
     """Get database connection configuration."""
     if os.getenv('DOCKER_ENV') == 'true':
@@ -136,6 +139,12 @@ def migrate_company_database(company_name: str):
     try:
         conn = psycopg2.connect(database=db_name, **get_db_config())
         ensure_financial_tables(conn)
+        
+        print("Moving per-process entry tables into the partitioned fact tables...")
+        result = fact_tables.migrate_all(conn)
+        print(f"✓ Moved {result['rows']} rows from {len(result['migrated'])} process table(s)")
+        for failure in result['failed']:
+            print(f"✗ Could not migrate {failure['table']}: {failure['error']}")
         conn.close()
         print(f"✓ Successfully migrated {db_name}")
     except psycopg2.OperationalError as e:
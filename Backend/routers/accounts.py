@@ -7,7 +7,14 @@ from database import get_db, Company
 import psycopg2
 import os
 
-router = APIRouter(prefix="/ifrs-accounts", tags=["IFRS Accounts"])
+from routers import conditional_get, report_cache
+
+# Writes drop the remembered reference-data versions used for ETags
+router = APIRouter(
+    prefix="/ifrs-accounts",
+    tags=["IFRS Accounts"],
+    dependencies=[Depends(conditional_get.invalidate_after_write(report_cache.REFERENCE_DOMAIN))],
+)
 
 class AccountCreate(BaseModel):
     account_code: str
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import text, create_engine
 from typing import List, Optional, Dict, Any
@@ -12,7 +12,19 @@ import re
 from datetime import datetime
 from contextlib import contextmanager
 
-router = APIRouter(prefix="/axes-account", tags=["Axes Account"])
+from routers import conditional_get, report_cache
+
+# Account axes reads are validated by ETag. Writes through this router drop the remembered
+# versions of both axes domains, which share the hierarchies and hierarchy_nodes tables
+ACCOUNT_DOMAINS = [report_cache.ACCOUNT_AXES_DOMAIN]
+
+router = APIRouter(
+    prefix="/axes-account",
+    tags=["Axes Account"],
+    dependencies=[Depends(conditional_get.invalidate_after_write(
+        report_cache.ACCOUNT_AXES_DOMAIN, report_cache.ENTITY_AXES_DOMAIN
+    ))],
+)
 
 # Add a diagnostic endpoint
 @router.get("/health")
@@ -1072,6 +1084,8 @@ async def get_account_elements(
 
 @router.get("/accounts")
 async def get_accounts(
+    request: Request,
+    response: Response,
     company_name: str = Query(...),
     hierarchy_id: Optional[int] = Query(None),
     parent_id: Optional[int] = Query(None),
@@ -1081,10 +1095,16 @@ async def get_accounts(
 ):
     """Get accounts with optional filtering and hierarchical structure"""
     try:
+        # Unchanged since the client's copy: answer before touching the database
+        not_modified = conditional_get.not_modified(request, company_name, ACCOUNT_DOMAINS)
+        if not_modified:
+            return not_modified
+
         # Ensure all tables exist first
         init_axes_tables(company_name)
 
         with get_company_connection(company_name) as conn:
+            etag = conditional_get.current_etag(conn, company_name, ACCOUNT_DOMAINS)
             cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
             # Get custom field configuration for dynamic queries
@@ -1142,6 +1162,7 @@ async def get_accounts(
                 # Convert to list of dicts with custom fields properly formatted
                 result = [convert_account_result_to_dict(dict(account), custom_fields_config) for account in accounts]
 
+            conditional_get.set_etag(response, etag)
             return {"accounts": result, "total": len(result)}
 
     except Exception as e:
@@ -1419,10 +1440,15 @@ async def delete_account(
         )
 
 @router.get("/hierarchy-tree")
-async def get_hierarchy_tree(company_name: str = Query(...)):
+async def get_hierarchy_tree(request: Request, response: Response, company_name: str = Query(...)):
     """Get complete hierarchy tree structure"""
     try:
+        not_modified = conditional_get.not_modified(request, company_name, ACCOUNT_DOMAINS)
+        if not_modified:
+            return not_modified
+
         with get_company_connection(company_name) as conn:
+            etag = conditional_get.current_etag(conn, company_name, ACCOUNT_DOMAINS)
             cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
             # Get all accounts
@@ -1452,6 +1478,7 @@ async def get_hierarchy_tree(company_name: str = Query(...)):
                     if parent:
                         parent['children'].append(account)
 
+            conditional_get.set_etag(response, etag)
             return {
                 "tree": root_accounts,
                 "total_accounts": len(accounts),
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import text, create_engine
 from typing import List, Optional, Dict, Any
@@ -12,7 +12,19 @@ import re
 from datetime import datetime
 from contextlib import contextmanager
 
-router = APIRouter(prefix="/axes-entity", tags=["Axes Entity"])
+from routers import conditional_get, report_cache
+
+# Entity axes reads are validated by ETag. Writes through this router drop the remembered
+# versions of both axes domains, which share the hierarchies and hierarchy_nodes tables
+ENTITY_DOMAINS = [report_cache.ENTITY_AXES_DOMAIN]
+
+router = APIRouter(
+    prefix="/axes-entity",
+    tags=["Axes Entity"],
+    dependencies=[Depends(conditional_get.invalidate_after_write(
+        report_cache.ENTITY_AXES_DOMAIN, report_cache.ACCOUNT_AXES_DOMAIN
+    ))],
+)
 
 # Add a diagnostic endpoint
 @router.get("/health")
@@ -1198,6 +1210,8 @@ async def get_entity_elements(
 
 @router.get("/entities")
 async def get_entities(
+    request: Request,
+    response: Response,
     company_name: str = Query(...),
     hierarchy_id: Optional[int] = Query(None),
     parent_id: Optional[int] = Query(None),
@@ -1207,10 +1221,16 @@ async def get_entities(
 ):
     """Get entities with optional filtering and hierarchical structure"""
     try:
+        # Unchanged since the client's copy: answer before touching the database
+        not_modified = conditional_get.not_modified(request, company_name, ENTITY_DOMAINS)
+        if not_modified:
+            return not_modified
+
         # Ensure all tables exist first
         ensure_tables_exist(company_name)
         
         with get_company_connection(company_name) as conn:
+            etag = conditional_get.current_etag(conn, company_name, ENTITY_DOMAINS)
             cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
             
             # Get custom field configuration for dynamic queries
@@ -1268,6 +1288,7 @@ async def get_entities(
                 # Convert to list of dicts with custom fields properly formatted
                 result = [convert_entity_result_to_dict(dict(entity), custom_fields_config) for entity in entities]
             
+            conditional_get.set_etag(response, etag)
             return {"entities": result, "total": len(result)}
             
     except Exception as e:
@@ -1781,11 +1802,18 @@ async def delete_hierarchy(
 @router.get("/hierarchy-structure/{hierarchy_id}")
 async def get_hierarchy_structure(
     hierarchy_id: int,
+    request: Request,
+    response: Response,
     company_name: str = Query(...)
 ):
     """Get hierarchy structure with nodes and unassigned entities"""
     try:
+        not_modified = conditional_get.not_modified(request, company_name, ENTITY_DOMAINS)
+        if not_modified:
+            return not_modified
+
         with get_company_connection(company_name) as conn:
+            etag = conditional_get.current_etag(conn, company_name, ENTITY_DOMAINS)
             cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
             
             # Get all hierarchy nodes for this company using materialized path ordering
@@ -1880,6 +1908,7 @@ async def get_hierarchy_structure(
                     "node_id": entity['node_id']
                 })
             
+            conditional_get.set_etag(response, etag)
             return {
                 "hierarchy_id": hierarchy_id,
                 "nodes": nodes,
@@ -0,0 +1,334 @@
+"""
+Pre-aggregated balance cube for reports.
+
+report_balance_cube holds one row per (process, scenario, period, entity,
+counterparty, account, source type, currency) with the summed amount and
+the number of source rows, built from the shared entity_amounts /
+ic_amounts / other_amounts tables. Reports read the cube, so their cost
+follows the number of balances rather than the number of transactions.
+
+The source tables have been created with different column sets over time
+(codes vs ids, period_id vs period_code, from/to vs entity/counterparty),
+so every key is a COALESCE over whichever of its candidate columns the
+table actually has, cast to text.
+
+Maintenance:
+* apply_rows() adds (or, with sign=-1, removes) specific source rows as
+  deltas; writers call it in their own transaction right after the write.
+* refresh_process() rebuilds one process' slice in a single transaction;
+  readers keep seeing the previous slice until it commits. Bulk writers
+  (uploads) call it, and ensure_fresh() calls it for processes that have
+  never been built. Both keep the drill-down lineage index (lineage_index)
+  in step: a refresh rebuilds it, deltas mark it stale.
+"""
+
+import logging
+import threading
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+SOURCE_TABLES = {"entity": "entity_amounts", "ic": "ic_amounts", "other": "other_amounts"}
+INTEGER_TYPES = ("smallint", "integer", "bigint")
+# Process registries whose ids are the process_id of the source rows
+PROCESS_TABLES = ("financial_processes", "processes")
+
+# Candidate columns per cube key, in order of preference
+KEY_COLUMNS = {
+    "process_key": ["process_id"],
+    "scenario_key": ["scenario_id", "scenario_code"],
+    "period_key": ["period_id", "period_code"],
+    "entity_key": ["entity_code", "from_entity_code", "entity_id", "from_entity_id"],
+    "counterparty_key": ["counterparty_entity_code", "to_entity_code", "to_entity_id"],
+    "account_key": ["account_code", "from_account_code", "account_id", "from_account_id"],
+    "currency": ["currency", "currency_code"],
+}
+LABEL_COLUMNS = {
+    "entity_name": ["entity_name", "from_entity_name"],
+    "account_name": ["account_name", "from_account_name"],
+}
+
+
+_ready_databases = set()
+_lock = threading.Lock()
+
+
+def ensure_cube(conn) -> None:
+    """Create the cube tables once per database. Commits."""
+    database = conn.info.dbname
+    if database in _ready_databases:
+        return
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS report_balance_cube (
+            process_key VARCHAR(64) NOT NULL,
+            scenario_key VARCHAR(100) NOT NULL DEFAULT '',
+            period_key VARCHAR(100) NOT NULL DEFAULT '',
+            entity_key VARCHAR(100) NOT NULL DEFAULT '',
+            counterparty_key VARCHAR(100) NOT NULL DEFAULT '',
+            account_key VARCHAR(100) NOT NULL DEFAULT '',
+            currency VARCHAR(10) NOT NULL DEFAULT '',
+            source_type VARCHAR(20) NOT NULL,
+            entity_name VARCHAR(255),
+            account_name VARCHAR(255),
+            amount NUMERIC(20, 2) NOT NULL DEFAULT 0,
+            row_count BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (process_key, scenario_key, period_key, entity_key, counterparty_key,
+                         account_key, currency, source_type)
+        )
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_report_balance_cube_account
+        ON report_balance_cube(account_key, process_key, scenario_key)
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS report_balance_cube_state (
+            process_key VARCHAR(64) PRIMARY KEY,
+            source_rows BIGINT DEFAULT 0,
+            refreshed_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+    conn.commit()
+    with _lock:
+        _ready_databases.add(database)
+
+
+def _table_columns(conn, table_name: str) -> List[str]:
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = %s AND table_schema = current_schema()
+    """, (table_name,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def _column_type(conn, table_name: str, column: str) -> Optional[str]:
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT format_type(atttypid, NULL) FROM pg_attribute
+        WHERE attrelid = to_regclass(%s) AND attname = %s AND NOT attisdropped
+    """, (table_name, column))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _fits(value: str, column_type: str) -> bool:
+    if column_type in INTEGER_TYPES:
+        return value.lstrip("-").isdigit()
+    if column_type == "uuid":
+        try:
+            uuid.UUID(value)
+        except ValueError:
+            return False
+    return True
+
+
+def column_in(conn, table_name: str, column: str, values: Sequence[Any],
+              alias: str = "") -> Tuple[str, List[Any]]:
+    """``column = ANY(...)`` condition and its param, comparing the column as stored so its index is usable.
+
+    The parameter is cast to the column's type; values that cannot be of
+    that type (a UUID against an integer id) match nothing and are dropped.
+    """
+    column_type = _column_type(conn, table_name, column)
+    values = [str(value) for value in values]
+    if column_type is None:
+        return f"CAST({alias}{column} AS VARCHAR) = ANY(%s)", [values]
+    return (f"{alias}{column} = ANY(CAST(%s AS {column_type}[]))",
+            [[value for value in values if _fits(value, column_type)]])
+
+
+def source_projection(conn, source_type: str) -> Optional[Dict[str, str]]:
+    """Key and label expressions for a source table, or None if it does not exist."""
+    columns = set(_table_columns(conn, SOURCE_TABLES[source_type]))
+    if "amount" not in columns or "process_id" not in columns:
+        return None
+
+    def _expr(candidates: Sequence[str], default: Optional[str]) -> str:
+        present = [f"CAST({c} AS VARCHAR)" for c in candidates if c in columns]
+        if default is not None:
+            present.append(default)
+        if not present:
+            return "NULL"
+        return present[0] if len(present) == 1 else f"COALESCE({', '.join(present)})"
+
+    projection = {key: _expr(candidates, "''") for key, candidates in KEY_COLUMNS.items()}
+    projection.update({key: _expr(candidates, None) for key, candidates in LABEL_COLUMNS.items()})
+    return projection
+
+
+def _aggregate_sql(source_type: str, projection: Dict[str, str], where: str, sign: int = 1) -> str:
+    keys = ", ".join(f"{projection[key]}" for key in KEY_COLUMNS)
+    return f"""
+        SELECT {keys}, '{source_type}',
+               MAX({projection['entity_name']}), MAX({projection['account_name']}),
+               {sign} * COALESCE(SUM(amount), 0), {sign} * COUNT(*)
+        FROM {SOURCE_TABLES[source_type]}
+        WHERE {where}
+        GROUP BY {keys}
+    """
+
+
+INSERT_COLUMNS = ", ".join(list(KEY_COLUMNS) + ["source_type", "entity_name", "account_name", "amount", "row_count"])
+
+
+# ============================================================================
+# MAINTENANCE
+# ============================================================================
+
+def refresh_process(conn, process_id: Any) -> Dict[str, int]:
+    """Rebuild the cube slice of one process from the source tables and commit."""
+    ensure_cube(conn)
+    process_key = str(process_id)
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('report_balance_cube'), hashtext(%s))", (process_key,))
+        cur.execute("DELETE FROM report_balance_cube WHERE process_key = %s", (process_key,))
+        source_rows = 0
+        for source_type in SOURCE_TABLES:
+            projection = source_projection(conn, source_type)
+            if projection is None:
+                continue
+            condition, params = column_in(conn, SOURCE_TABLES[source_type], "process_id", [process_key])
+            cur.execute(f"""
+                INSERT INTO report_balance_cube ({INSERT_COLUMNS})
+                {_aggregate_sql(source_type, projection, condition)}
+            """, params)
+            cur.execute("""
+                SELECT COALESCE(SUM(row_count), 0) FROM report_balance_cube
+                WHERE process_key = %s AND source_type = %s
+            """, (process_key, source_type))
+            source_rows += int(cur.fetchone()[0])
+        cur.execute("SELECT COUNT(*) FROM report_balance_cube WHERE process_key = %s", (process_key,))
+        cells = int(cur.fetchone()[0])
+        # Imported here: lineage_index builds on this module's projections
+        from routers import lineage_index
+        lineage_index.index_inputs(conn, process_key)
+        cur.execute("""
+            INSERT INTO report_balance_cube_state (process_key, source_rows, refreshed_at)
+            VALUES (%s, %s, NOW())
+            ON CONFLICT (process_key) DO UPDATE SET
+                source_rows = EXCLUDED.source_rows, refreshed_at = EXCLUDED.refreshed_at
+        """, (process_key, source_rows))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info(f"Refreshed balance cube for process {process_key}: {source_rows} rows -> {cells} cells")
+    return {"source_rows": source_rows, "cells": cells}
+
+
+def apply_rows(conn, source_type: str, row_ids: Sequence[Any], sign: int = 1) -> int:
+    """Add (sign=1) or remove (sign=-1) specific source rows as deltas. Does not commit.
+
+    Call with sign=-1 before deleting rows and with sign=1 after inserting
+    them; an update is a removal before and an addition after. Processes
+    whose slice was never built are left to ensure_fresh().
+    """
+    if not row_ids:
+        return 0
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('report_balance_cube_state')")
+    if cur.fetchone()[0] is None:
+        # Nothing has been built yet, so there is nothing to keep in step
+        return 0
+    projection = source_projection(conn, source_type)
+    if projection is None:
+        return 0
+    condition, params = column_in(conn, SOURCE_TABLES[source_type], "id", row_ids)
+    cur.execute(f"""
+        INSERT INTO report_balance_cube ({INSERT_COLUMNS})
+        SELECT delta.* FROM (
+            {_aggregate_sql(source_type, projection, condition, sign)}
+        ) AS delta (
+            {INSERT_COLUMNS}
+        )
+        WHERE EXISTS (
+            SELECT 1 FROM report_balance_cube_state s WHERE s.process_key = delta.process_key
+        )
+        ON CONFLICT (process_key, scenario_key, period_key, entity_key, counterparty_key,
+                     account_key, currency, source_type)
+        DO UPDATE SET
+            amount = report_balance_cube.amount + EXCLUDED.amount,
+            row_count = report_balance_cube.row_count + EXCLUDED.row_count,
+            entity_name = COALESCE(EXCLUDED.entity_name, report_balance_cube.entity_name),
+            account_name = COALESCE(EXCLUDED.account_name, report_balance_cube.account_name),
+            updated_at = NOW()
+        RETURNING process_key
+    """, params)
+    touched = cur.rowcount
+    touched_processes = sorted({row[0] for row in cur.fetchall()})
+    if touched_processes:
+        cur.execute("DELETE FROM report_balance_cube WHERE process_key = ANY(%s) AND row_count <= 0",
+                    (touched_processes,))
+    from routers import lineage_index
+    lineage_index.mark_stale(conn, SOURCE_TABLES[source_type], row_ids)
+    return touched
+
+
+def ensure_fresh(conn, process_id: Any = None) -> List[str]:
+    """Build the slices of processes that have never been built; returns their keys.
+
+    Without a process id every process of the process registries
+    (PROCESS_TABLES) without a cube state row is built, so the check reads
+    the small registry and state tables rather than the source rows.
+    """
+    ensure_cube(conn)
+    cur = conn.cursor()
+    if process_id is not None:
+        cur.execute("SELECT 1 FROM report_balance_cube_state WHERE process_key = %s", (str(process_id),))
+        missing = [] if cur.fetchone() else [str(process_id)]
+    else:
+        missing = set()
+        for table_name in PROCESS_TABLES:
+            cur.execute("SELECT to_regclass(%s)", (table_name,))
+            if cur.fetchone()[0] is None:
+                continue
+            cur.execute(f"""
+                SELECT CAST(p.id AS VARCHAR) FROM {table_name} p
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM report_balance_cube_state s WHERE s.process_key = CAST(p.id AS VARCHAR)
+                )
+            """)
+            missing.update(row[0] for row in cur.fetchall())
+        missing = sorted(missing)
+    for process_key in missing:
+        refresh_process(conn, process_key)
+    return missing
+
+
+# ============================================================================
+# READS
+# ============================================================================
+
+def query(conn, process_id: Any = None, scenario_id: Any = None, period_keys: Sequence[Any] = (),
+          account_keys: Sequence[Any] = (), source_types: Sequence[str] = ()) -> List[Dict[str, Any]]:
+    """Cube cells summed over counterparties: one row per account, entity, source type and currency."""
+    ensure_fresh(conn, process_id)
+    conditions: List[str] = []
+    params: List[Any] = []
+    for column, values in (
+        ("process_key", [process_id] if process_id is not None else []),
+        ("scenario_key", [scenario_id] if scenario_id is not None else []),
+        ("period_key", period_keys),
+        ("account_key", account_keys),
+        ("source_type", source_types),
+    ):
+        if values:
+            conditions.append(f"{column} = ANY(%s)")
+            params.append([str(v) for v in values])
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(f"""
+        SELECT account_key, entity_key, source_type, NULLIF(currency, '') AS currency,
+               MAX(account_name) AS account_name, MAX(entity_name) AS entity_name,
+               SUM(amount) AS total_amount, SUM(row_count) AS row_count
+        FROM report_balance_cube
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        GROUP BY account_key, entity_key, source_type, currency
+        ORDER BY account_key, entity_key
+    """, params)
+    return cur.fetchall()
@@ -0,0 +1,406 @@
+"""
+Indirect-method cash-flow statement from period-end balance snapshots.
+
+The movement of every account in a period is the difference between its
+period-end closing balance and the previous period's, taken from
+process_balance_snapshots (see roll_forward) for all requested entities and
+periods at once as an ``entities x accounts x periods`` array. The year-end
+close - P&L accounts restarting at zero and retained earnings receiving the
+prior year's net income - is not a cash flow, so the part of the difference
+that the snapshot already carried into the period's opening balance is
+taken out again.
+
+Each account maps onto one cash-flow line:
+
+* revenue and expense accounts make up "Profit for the period";
+* cash and bank accounts are the cash position the statement reconciles to;
+* every other balance-sheet account's movement is a line of the operating
+  (working capital, or a non-cash adjustment such as depreciation),
+  investing or financing section, or the effect of exchange rate changes.
+
+Defaults come from the axes_accounts name / category / type; rows in
+cash_flow_mappings override them per account (section, line, non-cash flag,
+sign, or section "excluded"). Balances carry their natural sign, as in
+roll_forward, so an account's cash effect is its movement times +1 for
+liabilities, equity and revenue and -1 for assets and expenses.
+
+The mapping is a one-hot ``accounts x lines`` matrix: every line of every
+entity and period comes out of one matrix product, and the consolidated
+column is the sum over the entity axis.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from psycopg2.extras import RealDictCursor, execute_values
+
+from routers import roll_forward
+from routers.process_executor import ASSET, EQUITY, EXPENSE, LIABILITY, REVENUE, classify_account
+
+logger = logging.getLogger(__name__)
+
+OPERATING = "operating"
+INVESTING = "investing"
+FINANCING = "financing"
+FX = "fx"
+CASH = "cash"
+EXCLUDED = "excluded"
+SECTIONS = (OPERATING, INVESTING, FINANCING, FX)
+MAPPING_SECTIONS = SECTIONS + (CASH, EXCLUDED)
+SECTION_TITLES = {
+    OPERATING: "CASH FLOWS FROM OPERATING ACTIVITIES",
+    INVESTING: "CASH FLOWS FROM INVESTING ACTIVITIES",
+    FINANCING: "CASH FLOWS FROM FINANCING ACTIVITIES",
+    FX: "EFFECT OF EXCHANGE RATE CHANGES ON CASH",
+}
+PROFIT_LINE = "Profit for the period"
+CONSOLIDATED = "consolidated"
+
+_CASH_WORDS = ("cash", "bank")
+_NON_CASH_WORDS = ("depreciation", "amortisation", "amortization", "impairment")
+_FX_WORDS = ("translation", "exchange", "foreign currency", "fx")
+_INVESTING_WORDS = ("non-current", "noncurrent", "non current", "fixed", "property", "plant", "equipment",
+                    "intangible", "investment", "goodwill")
+_BORROWING_WORDS = ("loan", "borrowing", "debt", "bond", "lease", "non-current", "noncurrent", "non current")
+
+
+# ============================================================================
+# MAPPING
+# ============================================================================
+
+def ensure_mapping_table(conn) -> None:
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS cash_flow_mappings (
+            account_code VARCHAR(100) PRIMARY KEY,
+            section VARCHAR(20) NOT NULL,
+            line_name VARCHAR(255),
+            is_non_cash BOOLEAN DEFAULT FALSE,
+            sign SMALLINT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+
+def default_line(code: str, name: Optional[str], category: Optional[str], account_type: Optional[str],
+                 statement: Optional[str]) -> Dict[str, Any]:
+    """Cash-flow line of an account without a configured mapping."""
+    account_class = classify_account(category, account_type, statement)
+    text_value = " ".join(filter(None, [name, category, account_type])).lower()
+    label = category or name or code
+    sign = 1 if account_class in (LIABILITY, EQUITY, REVENUE) else -1
+    line = {"section": OPERATING, "line_name": f"Change in {label}", "is_non_cash": False, "sign": sign,
+            "account_class": account_class}
+    if account_class in (REVENUE, EXPENSE):
+        line["line_name"] = PROFIT_LINE
+    elif account_class == ASSET and any(word in text_value for word in _CASH_WORDS):
+        line.update(section=CASH, line_name="Cash and cash equivalents")
+    elif any(word in text_value for word in _NON_CASH_WORDS):
+        line.update(line_name="Depreciation, amortisation and impairment", is_non_cash=True)
+    elif account_class == EQUITY and any(word in text_value for word in _FX_WORDS):
+        line.update(section=FX, line_name="Effect of exchange rate changes")
+    elif account_class == EQUITY and "retained" in text_value:
+        line.update(section=FINANCING, line_name="Dividends and other movements in retained earnings")
+    elif account_class == EQUITY:
+        line.update(section=FINANCING, line_name="Share capital and reserves")
+    elif account_class == ASSET and any(word in text_value for word in _INVESTING_WORDS):
+        line.update(section=INVESTING, line_name=f"Net (purchase) / disposal of {label}")
+    elif account_class == LIABILITY and any(word in text_value for word in _BORROWING_WORDS):
+        line.update(section=FINANCING, line_name=f"Net proceeds / (repayment) of {label}")
+    return line
+
+
+def load_mapping(conn) -> Dict[str, Dict[str, Any]]:
+    """Cash-flow line of every account: defaults from axes_accounts with configured overrides applied."""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    mapping: Dict[str, Dict[str, Any]] = {}
+    cur.execute("SELECT to_regclass('axes_accounts') AS present")
+    if cur.fetchone()["present"]:
+        cur.execute("SELECT code, name, category, account_type, statement FROM axes_accounts")
+        for row in cur.fetchall():
+            mapping[row["code"]] = default_line(row["code"], row["name"], row["category"],
+                                                row["account_type"], row["statement"])
+    ensure_mapping_table(conn)
+    cur.execute("SELECT account_code, section, line_name, is_non_cash, sign FROM cash_flow_mappings")
+    for row in cur.fetchall():
+        line = mapping.setdefault(row["account_code"], default_line(row["account_code"], None, None, None, None))
+        line["section"] = row["section"]
+        if row["line_name"]:
+            line["line_name"] = row["line_name"]
+        line["is_non_cash"] = bool(row["is_non_cash"])
+        if row["sign"]:
+            line["sign"] = int(row["sign"])
+        line["configured"] = True
+    return mapping
+
+
+def save_mapping(conn, rows: Sequence[Dict[str, Any]]) -> int:
+    """Upsert configured account mappings and commit; section None removes an override."""
+    ensure_mapping_table(conn)
+    cur = conn.cursor()
+    removed = [row["account_code"] for row in rows if not row.get("section")]
+    upserts = [
+        (row["account_code"], row["section"], row.get("line_name"), bool(row.get("is_non_cash")), row.get("sign"))
+        for row in rows if row.get("section")
+    ]
+    for row in upserts:
+        if row[1] not in MAPPING_SECTIONS:
+            raise ValueError(f"Unknown cash-flow section {row[1]!r}; expected one of {', '.join(MAPPING_SECTIONS)}")
+    if removed:
+        cur.execute("DELETE FROM cash_flow_mappings WHERE account_code = ANY(%s)", (removed,))
+    if upserts:
+        execute_values(cur, """
+            INSERT INTO cash_flow_mappings (account_code, section, line_name, is_non_cash, sign)
+            VALUES %s
+            ON CONFLICT (account_code) DO UPDATE SET
+                section = EXCLUDED.section,
+                line_name = EXCLUDED.line_name,
+                is_non_cash = EXCLUDED.is_non_cash,
+                sign = EXCLUDED.sign,
+                updated_at = CURRENT_TIMESTAMP
+        """, upserts)
+    conn.commit()
+    return len(upserts) + len(removed)
+
+
+def compile_lines(account_codes: Sequence[str], mapping: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Statement lines in display order and the signed accounts x lines matrix.
+
+    Accounts missing from the mapping are classified as unnamed assets.
+    """
+    lines: List[Dict[str, Any]] = []
+    line_index: Dict[Tuple[str, str], int] = {}
+    account_line = np.full(len(account_codes), -1, dtype=np.int64)
+    account_sign = np.zeros(len(account_codes))
+    is_cash = np.zeros(len(account_codes), dtype=bool)
+
+    # Profit first, then non-cash adjustments, then the rest in account order
+    def _rank(position: int) -> Tuple[int, int, int]:
+        line = mapping.get(account_codes[position]) or {}
+        return (
+            (MAPPING_SECTIONS.index(line.get("section", OPERATING))),
+            0 if line.get("line_name") == PROFIT_LINE else 1 if line.get("is_non_cash") else 2,
+            position,
+        )
+
+    for position in sorted(range(len(account_codes)), key=_rank):
+        code = account_codes[position]
+        line = mapping.get(code) or default_line(code, None, None, None, None)
+        if line["section"] == CASH:
+            is_cash[position] = True
+            continue
+        if line["section"] == EXCLUDED:
+            continue
+        key = (line["section"], line["line_name"])
+        if key not in line_index:
+            line_index[key] = len(lines)
+            lines.append({"section": line["section"], "line_name": line["line_name"],
+                          "is_non_cash": line["is_non_cash"], "accounts": []})
+        lines[line_index[key]]["accounts"].append(code)
+        account_line[position] = line_index[key]
+        account_sign[position] = line["sign"]
+
+    matrix = np.zeros((len(account_codes), len(lines)))
+    mapped = account_line >= 0
+    matrix[np.flatnonzero(mapped), account_line[mapped]] = account_sign[mapped]
+    return {"lines": lines, "matrix": matrix, "is_cash": is_cash}
+
+
+# ============================================================================
+# SNAPSHOTS
+# ============================================================================
+
+def load_balances(conn, process_id: str, scenario_id: Optional[str], period_seqs: Sequence[int],
+                  entities: Sequence[str] = ()) -> Dict[str, Any]:
+    """Closing balances at each requested period and the one before it, plus the requested openings.
+
+    Returns ``entities x accounts x periods`` arrays ``closing``,
+    ``previous_closing`` and ``opening``.
+    """
+    key = roll_forward.scenario_key(scenario_id)
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT is_stale, built_at FROM process_balance_snapshot_runs
+        WHERE process_id = %s AND scenario_key = %s
+    """, (process_id, key))
+    run = cur.fetchone()
+    if not run:
+        raise LookupError("No balance snapshots have been built for this process and scenario")
+
+    requested = np.asarray(period_seqs, dtype=np.int64)
+    wanted = sorted(set(requested.tolist()) | set((requested - 1).tolist()) - {-1})
+    conditions = ["process_id = %s", "scenario_key = %s", "period_seq = ANY(%s)"]
+    params: List[Any] = [process_id, key, wanted]
+    if entities:
+        conditions.append("entity_code = ANY(%s)")
+        params.append(list(entities))
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT entity_code, account_code, period_seq, opening_balance, closing_balance
+        FROM process_balance_snapshots
+        WHERE {' AND '.join(conditions)}
+    """, params)
+    rows = cur.fetchall()
+
+    entity_codes = list(entities) or sorted({row[0] for row in rows})
+    account_codes = sorted({row[1] for row in rows})
+    entity_index = {code: index for index, code in enumerate(entity_codes)}
+    account_index = {code: index for index, code in enumerate(account_codes)}
+    seq_position = {seq: index for index, seq in enumerate(wanted)}
+
+    # One dense array over every loaded period, then sliced per requested / previous period
+    closing_all = np.zeros((len(entity_codes), len(account_codes), len(wanted) + 1))
+    opening_all = np.zeros_like(closing_all)
+    if rows:
+        e = np.fromiter((entity_index.get(row[0], -1) for row in rows), dtype=np.int64, count=len(rows))
+        a = np.fromiter((account_index[row[1]] for row in rows), dtype=np.int64, count=len(rows))
+        p = np.fromiter((seq_position[row[2]] for row in rows), dtype=np.int64, count=len(rows))
+        keep = e >= 0
+        closing_all[e[keep], a[keep], p[keep]] = np.asarray([float(row[4] or 0) for row in rows])[keep]
+        opening_all[e[keep], a[keep], p[keep]] = np.asarray([float(row[3] or 0) for row in rows])[keep]
+    # Position len(wanted) stays zero: the period before the first one in the calendar
+    current = np.asarray([seq_position[seq] for seq in requested.tolist()], dtype=np.int64)
+    previous = np.asarray([seq_position.get(seq - 1, len(wanted)) for seq in requested.tolist()], dtype=np.int64)
+    return {
+        "entity_codes": entity_codes,
+        "account_codes": account_codes,
+        "closing": closing_all[:, :, current],
+        "previous_closing": closing_all[:, :, previous],
+        "opening": opening_all[:, :, current],
+        "is_stale": run["is_stale"],
+        "built_at": run["built_at"],
+    }
+
+
+# ============================================================================
+# STATEMENT
+# ============================================================================
+
+def compute(balances: Dict[str, Any], mapping: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Cash-flow lines, section totals and the cash reconciliation of every entity and period.
+
+    Arrays are ``entities x lines x periods`` (lines) and ``entities x
+    periods`` (totals and cash positions).
+    """
+    closing, previous, opening = balances["closing"], balances["previous_closing"], balances["opening"]
+    movement = closing - previous
+    # Less what the year-end close carried into the opening balance (zero outside year starts)
+    movement -= opening - previous
+    compiled = compile_lines(balances["account_codes"], mapping)
+    lines, matrix, is_cash = compiled["lines"], compiled["matrix"], compiled["is_cash"]
+
+    entity_count, account_count, period_count = movement.shape
+    # (entities * periods) x accounts @ accounts x lines
+    flat = movement.transpose(0, 2, 1).reshape(entity_count * period_count, account_count)
+    line_values = (flat @ matrix).reshape(entity_count, period_count, len(lines)).transpose(0, 2, 1)
+
+    section_of_line = np.asarray([line["section"] for line in lines], dtype=object)
+    section_totals = {
+        section: line_values[:, section_of_line == section, :].sum(axis=1) for section in SECTIONS
+    }
+    net_cash_flow = sum(section_totals.values())
+    opening_cash = previous[:, is_cash, :].sum(axis=1)
+    closing_cash = closing[:, is_cash, :].sum(axis=1)
+    return {
+        "lines": lines,
+        "line_values": line_values,
+        "section_totals": section_totals,
+        "net_cash_flow": net_cash_flow,
+        "opening_cash": opening_cash,
+        "closing_cash": closing_cash,
+        # Non-zero when the balances do not balance or accounts are excluded
+        "unreconciled": closing_cash - opening_cash - net_cash_flow,
+    }
+
+
+def with_consolidated(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Append the group total as the last entity."""
+    def _append(values: np.ndarray) -> np.ndarray:
+        return np.concatenate([values, values.sum(axis=0, keepdims=True)], axis=0)
+
+    return {
+        **result,
+        "line_values": _append(result["line_values"]),
+        "section_totals": {section: _append(values) for section, values in result["section_totals"].items()},
+        "net_cash_flow": _append(result["net_cash_flow"]),
+        "opening_cash": _append(result["opening_cash"]),
+        "closing_cash": _append(result["closing_cash"]),
+        "unreconciled": _append(result["unreconciled"]),
+    }
+
+
+def statement(result: Dict[str, Any], entity: int, periods: Sequence[int], decimals: int = 2) -> Dict[str, Any]:
+    """One entity's (or the group's) statement over consecutive periods, laid out by section.
+
+    Flows add up over the periods; opening cash is the first period's and
+    closing cash the last one's.
+    """
+    periods = list(periods)
+
+    def _total(values: np.ndarray) -> float:
+        return round(float(values[entity, periods].sum()), decimals)
+
+    sections = {
+        section: {"title": SECTION_TITLES[section], "items": [], "total": _total(result["section_totals"][section])}
+        for section in SECTIONS
+    }
+    for index, line in enumerate(result["lines"]):
+        amount = round(float(result["line_values"][entity, index, periods].sum()), decimals)
+        if amount == 0 and line["line_name"] != PROFIT_LINE:
+            continue
+        sections[line["section"]]["items"].append({
+            "line_name": line["line_name"],
+            "amount": amount,
+            "is_non_cash": line["is_non_cash"],
+            "accounts": line["accounts"],
+        })
+    return {
+        "sections": sections,
+        "totals": {
+            "net_cash_flow": _total(result["net_cash_flow"]),
+            "opening_cash": round(float(result["opening_cash"][entity, periods[0]]), decimals) if periods else 0.0,
+            "closing_cash": round(float(result["closing_cash"][entity, periods[-1]]), decimals) if periods else 0.0,
+            "unreconciled": _total(result["unreconciled"]),
+        },
+    }
+
+
+def resolve_periods(calendar: Sequence[Dict[str, Any]], period_ids: Sequence[Any]) -> List[Dict[str, Any]]:
+    """Calendar entries of period ids (or codes unique across years), in request order."""
+    by_id = {str(period["period_id"]): period for period in calendar}
+    by_code: Dict[str, List[Dict[str, Any]]] = {}
+    for period in calendar:
+        by_code.setdefault(str(period["period_code"]), []).append(period)
+    resolved = []
+    for period_id in period_ids:
+        period = by_id.get(str(period_id))
+        if period is None and len(by_code.get(str(period_id), [])) == 1:
+            period = by_code[str(period_id)][0]
+        if period is None:
+            raise ValueError(f"Period {period_id} is not a posting period of the fiscal calendar")
+        resolved.append(period)
+    return resolved
+
+
+def generate(conn, process_id: str, scenario_id: Optional[str], period_ids: Sequence[Any],
+             entities: Sequence[str] = (), consolidated: bool = True) -> Dict[str, Any]:
+    """Indirect cash-flow lines for every requested entity and period of a process in one pass."""
+    periods = resolve_periods(roll_forward.load_calendar(conn), period_ids)
+    balances = load_balances(conn, process_id, scenario_id, [p["period_seq"] for p in periods], entities)
+    result = compute(balances, load_mapping(conn))
+    entity_codes = list(balances["entity_codes"])
+    if consolidated:
+        result = with_consolidated(result)
+        entity_codes.append(CONSOLIDATED)
+    logger.info(f"Cash flow for process {process_id}: {len(entity_codes)} entities x {len(periods)} periods, "
+                f"{len(result['lines'])} lines from {len(balances['account_codes'])} accounts")
+    return {
+        **result,
+        "entity_codes": entity_codes,
+        "periods": [{"period_id": p["period_id"], "period_code": p["period_code"],
+                     "fiscal_year_id": p["fiscal_year_id"]} for p in periods],
+        "is_stale": balances["is_stale"],
+        "built_at": balances["built_at"],
+    }
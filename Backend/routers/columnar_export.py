@@ -0,0 +1,452 @@
+"""
+Columnar (Parquet / Arrow IPC) export of process data input.
+
+The CSV exports write every value as text and keep custom_fields as a JSON
+string per row. Here the same rows are written as typed Arrow columns:
+
+* amounts are float64, dates and timestamps keep their types;
+* codes, names, currencies and other repeating dimension values are
+  dictionary encoded, so each distinct value is stored once;
+* custom_fields is flattened into one ``cf_<name>`` column per key, typed
+  from the data_input_custom_fields definitions (number, checkbox, date;
+  anything else is a string).
+
+export_parquet() writes a Hive-partitioned dataset
+(``<root>/<data type>/period_code=.../entity_code=.../part-0.parquet``)
+that pandas, pyarrow.dataset and DuckDB read directly. A per-partition
+fingerprint (row count, latest created/updated timestamp, amount sum) is
+kept in ``_manifest.json`` and only partitions whose fingerprint changed
+are rewritten; partitions that disappeared are removed. A change in the
+set of custom fields rewrites the whole dataset so every file shares one
+schema.
+
+arrow_stream() serves the same columns as an Arrow IPC stream, batch by
+batch from a server-side cursor.
+
+pyarrow is optional; available() tells whether it is installed.
+"""
+
+import json
+import logging
+import os
+import shutil
+from datetime import date, datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+from routers import pagination
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Optional dependency
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+BATCH_ROWS = 50000
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+CUSTOM_PREFIX = "cf_"
+HIVE_DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+MANIFEST_NAME = "_manifest.json"
+
+PARTITION_COLUMNS = {
+    "entity_amounts": ("period_code", "entity_code"),
+    "other_amounts": ("period_code", "entity_code"),
+    "ic_amounts": ("period_code", "from_entity_code"),
+}
+# Low-cardinality text columns stored dictionary encoded
+DIMENSION_COLUMNS = {
+    "process_id", "period_id", "period_code", "period_name", "fiscal_year", "fiscal_month",
+    "entity_id", "entity_code", "entity_name", "account_id", "account_code", "account_name",
+    "from_entity_id", "from_entity_code", "from_entity_name", "to_entity_id", "to_entity_code",
+    "to_entity_name", "from_account_id", "from_account_code", "from_account_name",
+    "to_account_id", "to_account_code", "to_account_name", "currency", "scenario_id",
+    "scenario_code", "transaction_type", "adjustment_type", "custom_transaction_type", "created_by",
+}
+TRUE_VALUES = {"true", "1", "yes", "y", "on", "checked"}
+
+
+def available() -> bool:
+    return pa is not None
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise RuntimeError("Columnar export needs the pyarrow package")
+
+
+# ============================================================================
+# SCHEMA
+# ============================================================================
+
+def _arrow_type(data_type: str):
+    """Arrow type of a PostgreSQL information_schema data type."""
+    if data_type in ("numeric", "double precision", "real", "decimal"):
+        return pa.float64()
+    if data_type in ("integer", "smallint", "bigint"):
+        return pa.int64()
+    if data_type == "boolean":
+        return pa.bool_()
+    if data_type == "date":
+        return pa.date32()
+    if data_type.startswith("timestamp"):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def _custom_arrow_type(field_type: Optional[str]):
+    if field_type == "number":
+        return pa.float64()
+    if field_type == "checkbox":
+        return pa.bool_()
+    if field_type == "date":
+        return pa.date32()
+    return pa.string()
+
+
+def custom_field_types(conn, table_name: str, data_type: str, where_sql: str,
+                       params: Sequence[Any]) -> List[Tuple[str, Optional[str]]]:
+    """(key, declared field type) of every custom field key present in the rows."""
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT DISTINCT jsonb_object_keys(custom_fields)
+        FROM {table_name}
+        WHERE {where_sql} AND jsonb_typeof(custom_fields) = 'object'
+    """, list(params))
+    keys = sorted(row[0] for row in cur.fetchall())
+    declared: Dict[str, str] = {}
+    cur.execute("SELECT to_regclass('data_input_custom_fields')")
+    if keys and cur.fetchone()[0] is not None:
+        cur.execute("""
+            SELECT field_name, field_type FROM data_input_custom_fields WHERE card_type = %s
+        """, (data_type,))
+        declared = {name: field_type for name, field_type in cur.fetchall()}
+    return [(key, declared.get(key)) for key in keys]
+
+
+def table_columns(conn, table_name: str) -> List[Tuple[str, str]]:
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_name = %s AND table_schema = current_schema()
+        ORDER BY ordinal_position
+    """, (table_name,))
+    return cur.fetchall()
+
+
+class ColumnLayout:
+    """Selected columns, their Arrow schema and row-to-batch conversion."""
+
+    def __init__(self, columns: Sequence[Tuple[str, str]], custom_fields: Sequence[Tuple[str, Optional[str]]],
+                 drop: Sequence[str] = ()):
+        self.select_columns = [name for name, _ in columns if name != "custom_fields"]
+        self.has_custom_fields = any(name == "custom_fields" for name, _ in columns)
+        self.custom_fields = list(custom_fields) if self.has_custom_fields else []
+        self.keep = [name not in drop for name in self.select_columns]
+        fields = []
+        for name, pg_type in columns:
+            if name == "custom_fields" or name in drop:
+                continue
+            arrow_type = _arrow_type(pg_type)
+            if name in DIMENSION_COLUMNS and arrow_type == pa.string():
+                arrow_type = pa.dictionary(pa.int32(), pa.string())
+            fields.append(pa.field(name, arrow_type))
+        for key, field_type in self.custom_fields:
+            arrow_type = _custom_arrow_type(field_type)
+            if arrow_type == pa.string() and field_type in ("dropdown", "select", "sql_dropdown"):
+                arrow_type = pa.dictionary(pa.int32(), pa.string())
+            fields.append(pa.field(f"{CUSTOM_PREFIX}{key}", arrow_type))
+        self.schema = pa.schema(fields)
+
+    @property
+    def select_list(self) -> str:
+        columns = list(self.select_columns)
+        if self.has_custom_fields:
+            columns.append("custom_fields")
+        return ", ".join(columns)
+
+    def batch(self, rows: Sequence[Sequence[Any]]):
+        """RecordBatch of rows fetched with select_list."""
+        width = len(self.select_columns)
+        columns: List[List[Any]] = []
+        for index in range(width):
+            if self.keep[index]:
+                columns.append([row[index] for row in rows])
+        if self.custom_fields:
+            documents = [_as_object(row[width]) for row in rows]
+            for key, field_type in self.custom_fields:
+                columns.append([_coerce(document.get(key), field_type) for document in documents])
+        arrays = []
+        for values, field in zip(columns, self.schema):
+            if pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+            else:
+                if field.type == pa.string():
+                    values = [_as_text(value) for value in values]
+                arrays.append(pa.array(values, type=field.type))
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+
+def _as_object(value: Any) -> Dict[str, Any]:
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return {}
+    return value if isinstance(value, dict) else {}
+
+
+def _as_text(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def _coerce(value: Any, field_type: Optional[str]) -> Any:
+    """Custom field value converted to its declared type; None when it does not convert."""
+    if value is None or value == "":
+        return None
+    if field_type == "number":
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    if field_type == "checkbox":
+        return value if isinstance(value, bool) else str(value).strip().lower() in TRUE_VALUES
+    if field_type == "date":
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        try:
+            return date.fromisoformat(str(value)[:10])
+        except ValueError:
+            return None
+    return _as_text(value)
+
+
+# ============================================================================
+# READING
+# ============================================================================
+
+def _row_chunks(conn, query: str, params: Sequence[Any], name: str) -> Iterator[List[Tuple]]:
+    """Lists of up to BATCH_ROWS rows from a server-side cursor."""
+    with conn.cursor(name=name) as cur:
+        pagination.float_numerics(cur)
+        cur.itersize = BATCH_ROWS
+        cur.execute(query, list(params))
+        while True:
+            rows = cur.fetchmany(BATCH_ROWS)
+            if not rows:
+                break
+            yield rows
+
+
+class _ChunkSink:
+    """Write-only file object handing out what was written since the last take()."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def take(self) -> bytes:
+        chunk = b"".join(self._chunks)
+        self._chunks = []
+        return chunk
+
+
+def arrow_stream(conn, table_name: str, data_type: str, where_sql: str,
+                 params: Sequence[Any]) -> Iterator[bytes]:
+    """Arrow IPC stream bytes of the matching rows, one message per batch."""
+    _require_pyarrow()
+    layout = ColumnLayout(
+        table_columns(conn, table_name),
+        custom_field_types(conn, table_name, data_type, where_sql, params),
+    )
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, layout.schema)
+    yield sink.take()
+    query = f"SELECT {layout.select_list} FROM {table_name} WHERE {where_sql}"
+    for rows in _row_chunks(conn, query, params, "arrow_stream"):
+        writer.write_batch(layout.batch(rows))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+# ============================================================================
+# PARQUET DATASET
+# ============================================================================
+
+def _partition_dir(column: str, value: str) -> str:
+    return f"{column}={quote(value, safe='') if value else HIVE_DEFAULT_PARTITION}"
+
+
+def partition_fingerprints(conn, table_name: str, partition_columns: Sequence[str],
+                           where_sql: str, params: Sequence[Any]) -> Dict[Tuple[str, ...], str]:
+    """Change fingerprint of every (period, entity) partition of the rows."""
+    columns = {name for name, _ in table_columns(conn, table_name)}
+    keys = ", ".join(f"COALESCE({column}::text, '')" for column in partition_columns)
+    changed_at = ", ".join(
+        f"MAX({column})::text" for column in ("created_at", "updated_at") if column in columns
+    ) or "''"
+    amount = "SUM(amount)::text" if "amount" in columns else "''"
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {keys}, COUNT(*), {changed_at}, {amount}
+        FROM {table_name}
+        WHERE {where_sql}
+        GROUP BY {', '.join(str(i + 1) for i in range(len(partition_columns)))}
+    """, list(params))
+    width = len(partition_columns)
+    return {
+        tuple(row[:width]): "|".join("" if value is None else str(value) for value in row[width:])
+        for row in cur.fetchall()
+    }
+
+
+def _read_manifest(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_atomically(path: str, write) -> int:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    write(temp_path)
+    os.replace(temp_path, path)
+    return os.path.getsize(path)
+
+
+def export_parquet(conn, table_name: str, data_type: str, process_id: str, root_dir: str,
+                   incremental: bool = True, progress=None) -> Dict[str, Any]:
+    """Write (or refresh) the Hive-partitioned Parquet dataset of one process data type."""
+    _require_pyarrow()
+    partition_columns = PARTITION_COLUMNS[data_type]
+    where_sql, params = "process_id = %s", [process_id]
+    dataset_dir = os.path.join(root_dir, data_type)
+    manifest_path = os.path.join(dataset_dir, MANIFEST_NAME)
+
+    custom_fields = custom_field_types(conn, table_name, data_type, where_sql, params)
+    layout = ColumnLayout(table_columns(conn, table_name), custom_fields, drop=partition_columns)
+    fingerprints = partition_fingerprints(conn, table_name, partition_columns, where_sql, params)
+
+    manifest = _read_manifest(manifest_path) if incremental else {}
+    previous = manifest.get("partitions", {}) if manifest.get("schema") == layout.schema.to_string() else {}
+
+    def encode(key: Tuple[str, ...]) -> str:
+        return "/".join(_partition_dir(column, value) for column, value in zip(partition_columns, key))
+
+    changed = {key for key, fingerprint in fingerprints.items()
+               if previous.get(encode(key), {}).get("fingerprint") != fingerprint}
+    current_paths = {encode(key) for key in fingerprints}
+    removed = [path for path in previous if path not in current_paths]
+    if not previous and os.path.isdir(dataset_dir):
+        # Full rewrite: clear files of an older schema
+        shutil.rmtree(dataset_dir)
+
+    partitions = {path: entry for path, entry in previous.items() if path not in removed}
+    written_rows, written_bytes = 0, 0
+    if changed:
+        key_sql = [f"COALESCE({column}::text, '')" for column in partition_columns]
+        filter_sql, filter_params = "", []
+        if len(changed) < len(fingerprints):
+            placeholders = ", ".join(["(" + ", ".join(["%s"] * len(partition_columns)) + ")"] * len(changed))
+            filter_sql = f" AND ({', '.join(key_sql)}) IN ({placeholders})"
+            filter_params = [value for key in sorted(changed) for value in key]
+        query = f"""
+            SELECT {layout.select_list}, {', '.join(key_sql)}
+            FROM {table_name}
+            WHERE {where_sql}{filter_sql}
+            ORDER BY {', '.join(key_sql)}
+        """
+        width = len(partition_columns)
+        current_key, pending = None, []
+
+        def _flush():
+            nonlocal written_rows, written_bytes, pending
+            table = pa.Table.from_batches(pending, schema=layout.schema)
+            pending = []
+            relative = encode(current_key)
+            size = _write_atomically(
+                os.path.join(dataset_dir, relative, "part-0.parquet"),
+                lambda path: pq.write_table(table, path, compression="zstd", use_dictionary=True),
+            )
+            partitions[relative] = {"fingerprint": fingerprints[current_key], "rows": table.num_rows, "bytes": size}
+            written_rows += table.num_rows
+            written_bytes += size
+            if progress:
+                progress("partition_written", partition=relative, rows=table.num_rows)
+
+        # Rows arrive ordered by partition; each partition's file is written when the key changes
+        for rows in _row_chunks(conn, query, list(params) + filter_params, "parquet_export"):
+            start = 0
+            for index, row in enumerate(rows):
+                key = tuple(row[-width:])
+                if key == current_key:
+                    continue
+                if index > start:
+                    pending.append(layout.batch(rows[start:index]))
+                if pending:
+                    _flush()
+                current_key, start = key, index
+            if start < len(rows):
+                pending.append(layout.batch(rows[start:]))
+        if pending:
+            _flush()
+
+    for relative in removed:
+        shutil.rmtree(os.path.join(dataset_dir, relative), ignore_errors=True)
+
+    manifest = {
+        "data_type": data_type,
+        "process_id": process_id,
+        "partition_columns": list(partition_columns),
+        "schema": layout.schema.to_string(),
+        "exported_at": datetime.now().isoformat(),
+        "partitions": partitions,
+    }
+    _write_atomically(manifest_path, lambda path: _dump_json(manifest, path))
+    logger.info(f"Parquet export of {table_name}: {len(changed)} partitions written, {len(removed)} removed")
+    return {
+        "data_type": data_type,
+        "path": dataset_dir,
+        "partitions_written": len(changed),
+        "partitions_unchanged": len(fingerprints) - len(changed),
+        "partitions_removed": len(removed),
+        "rows_written": written_rows,
+        "bytes_written": written_bytes,
+        "total_rows": sum(entry["rows"] for entry in partitions.values()),
+        "total_bytes": sum(entry["bytes"] for entry in partitions.values()),
+    }
+
+
+def _dump_json(value: Any, path: str) -> None:
+    with open(path, "w", encoding="utf-8") as output:
+        json.dump(value, output, indent=2)
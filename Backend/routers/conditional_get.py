@@ -0,0 +1,132 @@
+"""
+ETag / If-None-Match support for reference-data endpoints.
+
+The SPA re-fetches entities, accounts, hierarchies, fiscal years and
+periods on almost every screen although they rarely change. Each such
+endpoint belongs to one or more data-version domains of report_cache
+(statement-level triggers bump a domain's counter in report_data_versions
+on every write to its tables), and its ETag is derived from the tenant and
+the versions of those domains.
+
+The versions last read for a tenant are kept in memory, so a request whose
+If-None-Match matches is answered with 304 Not Modified before any
+database access:
+
+* writes through this API drop the affected tenant's versions once the
+  write has finished (invalidate_after_write(), a router dependency);
+* writes from other workers or outside the API are picked up once the
+  remembered versions are older than ETAG_VERSION_TTL_SECONDS, after which
+  the request runs normally and re-reads them.
+
+Responses are sent with ``Cache-Control: private, no-cache`` so browsers
+keep them but always revalidate.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+from fastapi import Request, Response
+
+from config import settings
+from routers import report_cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_CONTROL = "private, no-cache"
+
+# (tenant, domain) -> (version, monotonic time it was read)
+_known_versions: Dict[Tuple[str, str], Tuple[int, float]] = {}
+_lock = threading.Lock()
+
+
+def tenant_key(company_name: str) -> str:
+    """Tenants are identified by their database name, however the request spelled the company."""
+    return company_name.lower().replace(" ", "_").replace("-", "_")
+
+
+def _etag(tenant: str, versions: Dict[str, int]) -> str:
+    token = "|".join([tenant] + [f"{domain}:{versions[domain]}" for domain in sorted(versions)])
+    return f'W/"{hashlib.sha1(token.encode("utf-8")).hexdigest()[:20]}"'
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+    # Weak comparison: W/"x" and "x" are the same validator
+    bare = etag[2:] if etag.startswith("W/") else etag
+    return any((value[2:] if value.startswith("W/") else value) == bare for value in candidates)
+
+
+def not_modified(request: Request, company_name: str, domains: Sequence[str]) -> Optional[Response]:
+    """A 304 response when the client's ETag matches the remembered versions, else None."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match or not company_name:
+        return None
+    tenant = tenant_key(company_name)
+    now = time.monotonic()
+    versions = {}
+    with _lock:
+        for domain in domains:
+            known = _known_versions.get((tenant, domain))
+            if known is None or now - known[1] > settings.ETAG_VERSION_TTL_SECONDS:
+                return None
+            versions[domain] = known[0]
+    etag = _etag(tenant, versions)
+    if not _matches(if_none_match, etag):
+        return None
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def current_etag(conn, company_name: str, domains: Sequence[str]) -> Optional[str]:
+    """Read the domains' versions (before the data, so a racing write yields an older tag) and remember them.
+
+    Returns None, and the response goes out untagged, when the versions cannot be read.
+    """
+    tenant = tenant_key(company_name)
+    try:
+        versions = report_cache.data_versions(conn, tenant, domains)
+    except Exception as e:
+        logger.warning(f"Could not read data versions for {tenant}: {e}")
+        conn.rollback()
+        return None
+    now = time.monotonic()
+    with _lock:
+        for domain, version in versions.items():
+            _known_versions[(tenant, domain)] = (version, now)
+    return _etag(tenant, versions)
+
+
+def set_etag(response: Response, etag: Optional[str]) -> None:
+    if etag:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = CACHE_CONTROL
+
+
+def forget(company_name: Optional[str], domains: Sequence[str]) -> None:
+    """Drop remembered versions so the next request re-reads them; every tenant without a company name."""
+    tenant = tenant_key(company_name) if company_name else None
+    with _lock:
+        for key in [key for key in _known_versions
+                    if key[1] in domains and (tenant is None or key[0] == tenant)]:
+            del _known_versions[key]
+
+
+def invalidate_after_write(*domains: str):
+    """Router dependency dropping the tenant's remembered versions after every non-GET request."""
+
+    async def dependency(request: Request):
+        try:
+            yield
+        finally:
+            # Also after a failed write, which may have committed part of its work
+            if request.method not in ("GET", "HEAD", "OPTIONS"):
+                forget(
+                    request.query_params.get("company_name") or request.headers.get("X-Company-Database"),
+                    domains,
+                )
+
+    return dependency
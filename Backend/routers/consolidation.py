@@ -16,7 +16,7 @@ from fastapi import (
 from typing import Optional, Dict, Any, List, Set
 from pydantic import BaseModel, validator
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from psycopg2 import sql
 import os
 import json
@@ -27,6 +27,7 @@ from contextlib import contextmanager
 
 from auth.dependencies import get_current_active_user
 from database import User
+from routers import fair_value_schedules, journal_sink, rule_compiler
 
 
 router = APIRouter(prefix="/consolidation", tags=["Consolidation"])
@@ -354,6 +355,84 @@ def ensure_consolidation_schema(conn: psycopg2.extensions.connection) -> None:
         """
     )
 
+    # Fair value / goodwill schedules: one row per item with per-period arrays
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS consolidation_fv_schedule_runs (
+            process_id INTEGER PRIMARY KEY REFERENCES consolidation_processes(id),
+            input_hash VARCHAR(32) NOT NULL,
+            period_codes TEXT[] DEFAULT '{}',
+            periods_per_year INTEGER,
+            item_count INTEGER DEFAULT 0,
+            settings JSONB DEFAULT '{}',
+            generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS consolidation_fv_schedules (
+            id SERIAL PRIMARY KEY,
+            process_id INTEGER NOT NULL REFERENCES consolidation_processes(id),
+            item_key VARCHAR(64) NOT NULL,
+            fair_value_id INTEGER,
+            item_type VARCHAR(50),
+            entity_code VARCHAR(255),
+            asset_code VARCHAR(255),
+            base_amount NUMERIC(18, 2),
+            deferred_tax_base NUMERIC(18, 2) DEFAULT 0,
+            start_position INTEGER DEFAULT 0,
+            charges NUMERIC(18, 2)[] DEFAULT '{}',
+            impairments NUMERIC(18, 2)[] DEFAULT '{}',
+            tax_release NUMERIC(18, 2)[] DEFAULT '{}',
+            UNIQUE(process_id, item_key)
+        )
+        """
+    )
+
+    # Run journals written by the bulk journal sink (one set per process/period)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS consolidation_run_journals (
+            id SERIAL PRIMARY KEY,
+            run_id VARCHAR(100) NOT NULL,
+            process_id INTEGER NOT NULL REFERENCES consolidation_processes(id),
+            journal_key VARCHAR(255) NOT NULL,
+            journal_type VARCHAR(100),
+            period VARCHAR(50),
+            line_count INTEGER DEFAULT 0,
+            total_debit NUMERIC(18, 2) DEFAULT 0,
+            total_credit NUMERIC(18, 2) DEFAULT 0,
+            is_balanced BOOLEAN DEFAULT false,
+            status VARCHAR(50) DEFAULT 'draft',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS consolidation_run_journal_lines (
+            run_id VARCHAR(100) NOT NULL,
+            process_id INTEGER NOT NULL,
+            journal_key VARCHAR(255) NOT NULL,
+            journal_type VARCHAR(100),
+            line_number INTEGER NOT NULL,
+            entity_code VARCHAR(255),
+            account_code VARCHAR(255),
+            counterparty_entity_code VARCHAR(255),
+            period VARCHAR(50),
+            debit_amount NUMERIC(18, 2) DEFAULT 0,
+            credit_amount NUMERIC(18, 2) DEFAULT 0,
+            currency VARCHAR(10),
+            description TEXT,
+            source VARCHAR(255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
     # Create indexes
     cur.execute("CREATE INDEX IF NOT EXISTS idx_consol_entities_code ON consolidation_entities(entity_code)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_consol_scenarios_year ON consolidation_scenarios(fiscal_year)")
@@ -363,6 +442,9 @@ def ensure_consolidation_schema(conn: psycopg2.extensions.connection) -> None:
     cur.execute("CREATE INDEX IF NOT EXISTS idx_consol_rules_process ON consolidation_rules(process_id)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_consol_audit_process ON consolidation_audit_trail(process_id)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_consol_staging_process ON consolidation_staging(process_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_consol_run_journals_process ON consolidation_run_journals(process_id, period)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_consol_run_journal_lines_process ON consolidation_run_journal_lines(process_id, period)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_consol_run_journal_lines_run ON consolidation_run_journal_lines(run_id, journal_key, line_number)")
 
     conn.commit()
     cur.close()
@@ -685,6 +767,8 @@ async def add_consolidation_rule(
 ):
     """Add a consolidation rule to a process."""
     try:
+        # Reject rule_logic the compiler cannot execute before it is stored
+        rule_compiler.RulePlan(None, rule.rule_type, "", rule.priority, rule.rule_logic)
         with company_connection(company_name) as conn:
             ensure_consolidation_schema(conn)
             rule_key = f"{rule.rule_type}_{datetime.now().timestamp()}"
@@ -704,6 +788,255 @@ async def add_consolidation_rule(
             conn.commit()
             cur.close()
             return dict(result) if result else {}
+    except rule_compiler.RuleCompileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+RULE_OUTPUT_TYPE = "rule_output"
+RULE_PREVIEW_LINES = 1000
+RULE_AXES = ["entity_code", "account_code", "period", "data_type", "currency", "node_id"]
+
+
+def load_process_rules(cur, process_id: int) -> List[Dict[str, Any]]:
+    cur.execute(
+        """
+        SELECT id, rule_key, rule_type, rule_name, rule_logic, priority
+        FROM consolidation_rules
+        WHERE process_id = %s AND enabled = true
+        ORDER BY priority, id
+        """,
+        (process_id,),
+    )
+    return cur.fetchall()
+
+
+def post_rule_journals(conn, process_id: int, period: Optional[str], rules: List[Dict[str, Any]],
+                       balances: "rule_compiler.BalanceSet", start: int) -> Dict[str, Any]:
+    """Write the lines generated by each rule as one journal through the bulk sink."""
+    columns = balances.columns(start)
+    rule_types = {rule["rule_key"]: rule["rule_type"] for rule in rules}
+    sink = journal_sink.JournalSink(conn, process_id, period=period)
+    for rule_key in rule_types:
+        mask = columns["origin"] == rule_key
+        if not mask.any():
+            continue
+        sink.add(
+            rule_key, rule_types[rule_key] or "adjustment",
+            columns["entity_code"][mask], columns["account_code"][mask], columns["amount"][mask],
+            period=columns["period"][mask], currency=columns["currency"][mask], source=rule_key,
+        )
+    return sink.swap()
+
+
+@router.get("/processes/{process_id}/journals")
+async def list_run_journals(
+    company_name: str = Query(...),
+    process_id: int = None,
+    period: Optional[str] = Query(None),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Current run journals of a process with their SQL-computed totals."""
+    try:
+        with company_connection(company_name) as conn:
+            ensure_consolidation_schema(conn)
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            query = "SELECT * FROM consolidation_run_journals WHERE process_id = %s"
+            params: List[Any] = [process_id]
+            if period:
+                query += " AND period = %s"
+                params.append(period)
+            cur.execute(query + " ORDER BY period, journal_key", params)
+            journals = cur.fetchall()
+            cur.close()
+            return {"journals": [dict(j) for j in journals]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/processes/{process_id}/rules/compile")
+async def compile_consolidation_rules(
+    company_name: str = Query(...),
+    process_id: int = None,
+    current_user: User = Depends(get_current_active_user),
+):
+    """Compile every enabled rule of a process and report versions and errors."""
+    try:
+        with company_connection(company_name) as conn:
+            ensure_consolidation_schema(conn)
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            results = []
+            for rule in load_process_rules(cur, process_id):
+                try:
+                    plan = rule_compiler.compile_rule(rule)
+                    results.append({"rule_id": rule["id"], "rule_key": rule["rule_key"], "version": plan.version,
+                                    "mode": plan.mode, "targets": len(plan.allocations), "valid": True})
+                except rule_compiler.RuleCompileError as e:
+                    results.append({"rule_id": rule["id"], "rule_key": rule["rule_key"], "valid": False,
+                                    "error": str(e)})
+            cur.close()
+            return {"rules": results, "valid": all(r["valid"] for r in results)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/processes/{process_id}/rules/apply")
+async def apply_consolidation_rules(
+    company_name: str = Query(...),
+    process_id: int = None,
+    period: Optional[str] = Query(None),
+    persist: bool = Query(False, description="Replace the process' rule output lines in consolidation_staging"),
+    post_journals: bool = Query(False, description="Replace the process' run journals with one journal per rule"),
+    include_schedules: bool = Query(True, description="Add the period's fair value / goodwill schedule lines to the input"),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Apply all enabled rules in priority order over the process' staged balances."""
+    try:
+        with company_connection(company_name) as conn:
+            ensure_consolidation_schema(conn)
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            rules = load_process_rules(cur, process_id)
+            try:
+                plans = [rule_compiler.compile_rule(rule) for rule in rules]
+            except rule_compiler.RuleCompileError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
+            # Previous rule output is regenerated, never fed back in as input
+            conditions = ["process_id = %s", "COALESCE(data_type, '') NOT IN (%s, %s)"]
+            params: List[Any] = [process_id, RULE_OUTPUT_TYPE, fair_value_schedules.SCHEDULE_DATA_TYPE]
+            if period:
+                conditions.append("period = %s")
+                params.append(period)
+            cur.execute(
+                f"SELECT {', '.join(RULE_AXES)}, amount FROM consolidation_staging WHERE {' AND '.join(conditions)}",
+                params,
+            )
+            input_rows = cur.fetchall()
+            schedule_lines = 0
+            if period and include_schedules:
+                # Fair value amortization and goodwill come precomputed from the schedules
+                header = fair_value_schedules.ensure_schedules(conn, process_id)
+                lines = fair_value_schedules.schedule_lines(
+                    fair_value_schedules.period_amounts(conn, process_id, period, header),
+                    period, header["settings"],
+                )
+                input_rows.extend(lines)
+                schedule_lines = len(lines)
+            balances = rule_compiler.BalanceSet.from_rows(input_rows, RULE_AXES)
+            input_lines = len(balances)
+            stats = rule_compiler.apply_rules(balances, plans)
+            generated = balances.rows(input_lines)
+
+            if persist:
+                scenario_id = None
+                cur.execute("SELECT scenario_id FROM consolidation_processes WHERE id = %s", (process_id,))
+                process = cur.fetchone()
+                if process:
+                    scenario_id = process["scenario_id"]
+                delete_sql = "DELETE FROM consolidation_staging WHERE process_id = %s AND data_type = %s"
+                delete_params: List[Any] = [process_id, RULE_OUTPUT_TYPE]
+                if period:
+                    delete_sql += " AND period = %s"
+                    delete_params.append(period)
+                cur.execute(delete_sql, delete_params)
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO consolidation_staging
+                    (process_id, scenario_id, node_id, data_type, entity_code, account_code, period,
+                     amount, currency, calculation_method)
+                    VALUES %s
+                    """,
+                    [
+                        (process_id, scenario_id, line["node_id"] or None, RULE_OUTPUT_TYPE,
+                         line["entity_code"], line["account_code"], line["period"], line["amount"],
+                         line["currency"] or None, line["origin"])
+                        for line in generated
+                    ],
+                    page_size=1000,
+                )
+                conn.commit()
+            cur.close()
+
+            journals = None
+            if post_journals:
+                journals = post_rule_journals(conn, process_id, period, rules, balances, input_lines)
+
+            return {
+                "process_id": process_id,
+                "input_lines": input_lines,
+                "schedule_lines": schedule_lines,
+                "generated_lines": len(generated),
+                "persisted": persist,
+                "journals": journals,
+                "rules": stats,
+                "lines": [] if persist else generated[:RULE_PREVIEW_LINES],
+            }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/processes/{process_id}/fair-value/schedules/generate")
+async def generate_fair_value_schedules(
+    company_name: str = Query(...),
+    process_id: int = None,
+    force: bool = Query(False, description="Regenerate even if the inputs did not change"),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Generate fair value, goodwill and deferred tax schedules for every period of a process."""
+    try:
+        with company_connection(company_name) as conn:
+            ensure_consolidation_schema(conn)
+            try:
+                header = fair_value_schedules.ensure_schedules(conn, process_id, force=force)
+            except LookupError as e:
+                raise HTTPException(status_code=404, detail=str(e))
+            return {"schedule": header}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/processes/{process_id}/fair-value/schedules")
+async def get_fair_value_schedules(
+    company_name: str = Query(...),
+    process_id: int = None,
+    period: Optional[str] = Query(None, description="Return one period's amounts instead of the full arrays"),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Stored schedules of a process, regenerated first if their inputs changed."""
+    try:
+        with company_connection(company_name) as conn:
+            ensure_consolidation_schema(conn)
+            try:
+                header = fair_value_schedules.ensure_schedules(conn, process_id)
+            except LookupError as e:
+                raise HTTPException(status_code=404, detail=str(e))
+            if period:
+                if period not in (header["period_codes"] or []):
+                    raise HTTPException(status_code=404, detail=f"Period {period} is not part of this process")
+                amounts = fair_value_schedules.period_amounts(conn, process_id, period, header)
+                return {"schedule": header, "period": period, "items": [dict(a) for a in amounts]}
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute(
+                "SELECT * FROM consolidation_fv_schedules WHERE process_id = %s ORDER BY item_key",
+                (process_id,),
+            )
+            items = cur.fetchall()
+            cur.close()
+            return {"schedule": header, "items": [dict(i) for i in items]}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1,10 +1,13 @@
 from fastapi import APIRouter, HTTPException, Query
 from typing import Optional
+from contextlib import contextmanager
 import psycopg2
 import os
 from datetime import datetime, timedelta
 import random
 
+from routers import kpi_snapshots
+
 router = APIRouter(prefix="/dashboard", tags=["Dashboard"])
 
 def get_db_config():
@@ -21,143 +24,56 @@ def get_db_config():
         'password': 'root@123'
     }
 
+@contextmanager
+def company_db(company_name: str):
+    """Connection to a company database, closed on exit"""
+    company_db_name = company_name.lower().replace(' ', '_').replace('-', '_')
+    conn = psycopg2.connect(database=company_db_name, **get_db_config())
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+# Dashboard figures are served from precomputed KPI snapshots
+kpi_snapshots.configure(company_db)
+
+SAMPLE_FINANCIAL_SUMMARY = {
+    "total_assets": 1500000,
+    "total_liabilities": 800000,
+    "total_equity": 700000,
+    "total_revenue": 2200000,
+    "total_expenses": 1800000,
+    "net_income": 400000,
+    "current_ratio": 1.875,
+    "debt_to_equity": 1.14
+}
+
 @router.get("/financial-summary")
 def get_financial_summary(company_name: str = Query(...)):
     """Get consolidated financial summary for dashboard"""
     try:
-        db_config = get_db_config()
-        company_db_name = company_name.lower().replace(' ', '_').replace('-', '_')
-        
         try:
-            # Try to connect to company database
-            conn = psycopg2.connect(
-                database=company_db_name,
-                **db_config
-            )
-            
-            cur = conn.cursor()
-            
-            # Get financial summary from trial balance entries
-            cur.execute("""
-                SELECT 
-                    account_type,
-                    SUM(CASE WHEN debit_amount > 0 THEN debit_amount ELSE 0 END) as total_debits,
-                    SUM(CASE WHEN credit_amount > 0 THEN credit_amount ELSE 0 END) as total_credits,
-                    SUM(balance_amount) as net_balance
-                FROM accounts a
-                LEFT JOIN tb_entries tb ON a.account_code = tb.account_code
-                WHERE tb.year = EXTRACT(YEAR FROM CURRENT_DATE)
-                GROUP BY account_type
-            """)
-            
-            results = cur.fetchall()
-            cur.close()
-            conn.close()
-            
-            summary = {
-                "total_assets": 0,
-                "total_liabilities": 0,
-                "total_equity": 0,
-                "total_revenue": 0,
-                "total_expenses": 0,
-                "net_income": 0,
-                "current_ratio": 0,
-                "debt_to_equity": 0
-            }
-            
-            for row in results:
-                account_type, debits, credits, balance = row
-                if account_type == 'Asset':
-                    summary["total_assets"] += balance or 0
-                elif account_type == 'Liability':
-                    summary["total_liabilities"] += balance or 0
-                elif account_type == 'Equity':
-                    summary["total_equity"] += balance or 0
-                elif account_type == 'Revenue':
-                    summary["total_revenue"] += balance or 0
-                elif account_type == 'Expense':
-                    summary["total_expenses"] += balance or 0
-            
-            summary["net_income"] = summary["total_revenue"] - summary["total_expenses"]
-            
-            if summary["total_liabilities"] > 0:
-                summary["current_ratio"] = summary["total_assets"] / summary["total_liabilities"]
-            
-            if summary["total_equity"] > 0:
-                summary["debt_to_equity"] = summary["total_liabilities"] / summary["total_equity"]
-            
-            return summary
-            
+            snapshot = kpi_snapshots.get(company_name)
         except psycopg2.OperationalError:
             # Return sample data if company database doesn't exist
-            return {
-                "total_assets": 1500000,
-                "total_liabilities": 800000,
-                "total_equity": 700000,
-                "total_revenue": 2200000,
-                "total_expenses": 1800000,
-                "net_income": 400000,
-                "current_ratio": 1.875,
-                "debt_to_equity": 1.14
-            }
+            return dict(SAMPLE_FINANCIAL_SUMMARY)
+
+        summary = snapshot.sections.get("financial_summary")
+        if summary is None:
+            return dict(SAMPLE_FINANCIAL_SUMMARY)
+        return {**summary, "snapshot": snapshot.freshness()}
             
     except Exception as e:
         print(f"Error fetching financial summary: {e}")
         # Return sample data on error
-        return {
-            "total_assets": 1500000,
-            "total_liabilities": 800000,
-            "total_equity": 700000,
-            "total_revenue": 2200000,
-            "total_expenses": 1800000,
-            "net_income": 400000,
-            "current_ratio": 1.875,
-            "debt_to_equity": 1.14
-        }
+        return dict(SAMPLE_FINANCIAL_SUMMARY)
 
 @router.get("/recent-activities")
 def get_recent_activities(company_name: str = Query(...), limit: int = 10):
     """Get recent activities for dashboard"""
     try:
-        db_config = get_db_config()
-        company_db_name = company_name.lower().replace(' ', '_').replace('-', '_')
-        
         try:
-            conn = psycopg2.connect(
-                database=company_db_name,
-                **db_config
-            )
-            
-            cur = conn.cursor()
-            
-            # Get recent uploads and journal entries
-            cur.execute("""
-                SELECT 'upload' as type, filename as description, upload_date as created_at
-                FROM uploads
-                WHERE upload_date >= CURRENT_DATE - INTERVAL '30 days'
-                UNION ALL
-                SELECT 'journal' as type, journal_name as description, created_at
-                FROM consolidation_journals
-                WHERE created_at >= CURRENT_DATE - INTERVAL '30 days'
-                ORDER BY created_at DESC
-                LIMIT %s
-            """, (limit,))
-            
-            activities = []
-            for row in cur.fetchall():
-                activity_type, description, created_at = row
-                activities.append({
-                    "type": activity_type,
-                    "description": description,
-                    "timestamp": created_at.isoformat() if created_at else None,
-                    "user": "System"
-                })
-            
-            cur.close()
-            conn.close()
-            
-            return {"activities": activities}
-            
+            snapshot = kpi_snapshots.get(company_name)
         except psycopg2.OperationalError:
             # Return sample activities if database doesn't exist
             sample_activities = [
@@ -181,6 +97,10 @@ def get_recent_activities(company_name: str = Query(...), limit: int = 10):
                 }
             ]
             return {"activities": sample_activities[:limit]}
+
+        # The snapshot keeps the newest KPI_RECENT_ACTIVITY_LIMIT activities
+        activities = snapshot.sections.get("recent_activities") or []
+        return {"activities": activities[:limit], "snapshot": snapshot.freshness()}
             
     except Exception as e:
         print(f"Error fetching recent activities: {e}")
@@ -190,50 +110,13 @@ def get_recent_activities(company_name: str = Query(...), limit: int = 10):
 def get_company_overview(company_name: str = Query(...)):
     """Get company overview statistics"""
     try:
-        db_config = get_db_config()
-        company_db_name = company_name.lower().replace(' ', '_').replace('-', '_')
-        
         try:
-            conn = psycopg2.connect(
-                database=company_db_name,
-                **db_config
-            )
-            
-            cur = conn.cursor()
-            
-            # Get entity count
-            cur.execute("SELECT COUNT(*) FROM entities")
-            entity_count = cur.fetchone()[0]
-            
-            # Get account count
-            cur.execute("SELECT COUNT(*) FROM accounts")
-            account_count = cur.fetchone()[0]
-            
-            # Get recent uploads count
-            cur.execute("""
-                SELECT COUNT(*) FROM uploads 
-                WHERE upload_date >= CURRENT_DATE - INTERVAL '30 days'
-            """)
-            recent_uploads = cur.fetchone()[0]
-            
-            # Get journal entries count
-            cur.execute("SELECT COUNT(*) FROM consolidation_journals")
-            journal_count = cur.fetchone()[0]
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                "total_entities": entity_count,
-                "total_accounts": account_count,
-                "recent_uploads": recent_uploads,
-                "total_journals": journal_count,
-                "consolidation_status": "In Progress",
-                "last_consolidation": (datetime.now() - timedelta(days=7)).isoformat(),
-                "data_quality_score": 85
-            }
-            
+            snapshot = kpi_snapshots.get(company_name)
         except psycopg2.OperationalError:
+            snapshot = None
+
+        overview = snapshot.sections.get("company_overview") if snapshot else None
+        if overview is None:
             # Return sample data if database doesn't exist
             return {
                 "total_entities": 5,
@@ -244,6 +127,14 @@ def get_company_overview(company_name: str = Query(...)):
                 "last_consolidation": (datetime.now() - timedelta(days=7)).isoformat(),
                 "data_quality_score": 85
             }
+
+        return {
+            **overview,
+            "consolidation_status": "In Progress",
+            "last_consolidation": (datetime.now() - timedelta(days=7)).isoformat(),
+            "data_quality_score": 85,
+            "snapshot": snapshot.freshness()
+        }
             
     except Exception as e:
         print(f"Error fetching company overview: {e}")
@@ -256,3 +147,24 @@ def get_company_overview(company_name: str = Query(...)):
             "last_consolidation": None,
             "data_quality_score": 0
         }
+
+@router.get("/kpi-snapshot")
+def get_kpi_snapshot(company_name: str = Query(...)):
+    """Get every precomputed dashboard KPI section, including period trends"""
+    try:
+        snapshot = kpi_snapshots.get(company_name)
+    except psycopg2.OperationalError:
+        raise HTTPException(status_code=404, detail=f"Company database for '{company_name}' not found")
+    return {**snapshot.sections, "snapshot": snapshot.freshness()}
+
+@router.post("/kpi-snapshot/refresh")
+def refresh_kpi_snapshot(company_name: str = Query(...)):
+    """Recompute the dashboard KPIs now instead of waiting for the scheduled refresh"""
+    try:
+        snapshot = kpi_snapshots.refresh(company_name)
+    except psycopg2.OperationalError:
+        raise HTTPException(status_code=404, detail=f"Company database for '{company_name}' not found")
+    except Exception as e:
+        print(f"Error refreshing KPI snapshot: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to refresh KPI snapshot: {str(e)}")
+    return {"success": True, "snapshot": snapshot.freshness()}
@@ -1,18 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Response
 from fastapi.responses import StreamingResponse
 from datetime import datetime
 from typing import Optional, List, Dict, Any
+import numpy as np
 import pandas as pd
 import io
 import json
 import psycopg2
 import psycopg2.extras
 import os
-import csv
 import re
 import logging
 from contextlib import contextmanager
 from auth.dependencies import get_current_user
+from routers import balance_cube, fact_tables, pagination, pivot_engine, streaming_export
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -252,17 +253,24 @@ async def get_custom_fields(
 # Entries Endpoints
 @router.get("/{card_type}/entries")
 async def get_entries(
+    response: Response,
     card_type: str,
     process_id: int = Query(...),
     scenario_id: int = Query(...),
     company_name: str = Query(...),
-    limit: int = Query(500),
+    limit: int = Query(500, ge=1, le=10000),
     offset: int = Query(0),
+    cursor: Optional[str] = Query(None),
     entity_id: Optional[str] = Query(None),
     account_code: Optional[str] = Query(None),
     period_id: Optional[int] = Query(None)
 ):
-    """Get entries for a specific card type filtered by process and scenario"""
+    """Get entries for a specific card type filtered by process and scenario.
+
+    Pages are keyset-based: pass the X-Next-Cursor header of a response as
+    ``cursor`` to get the next page. ``offset`` is still honoured for old
+    clients when no cursor is given.
+    """
     try:
         create_tables_if_not_exist(company_name)
         table_map = {
@@ -275,8 +283,6 @@ async def get_entries(
             raise HTTPException(status_code=400, detail="Invalid card type")
 
         with get_company_connection(company_name) as conn:
-            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
             # Build dynamic query with optional filters
             where_conditions = ["process_id = %s", "scenario_id = %s"]
             params = [process_id, scenario_id]
@@ -295,17 +301,29 @@ async def get_entries(
 
             where_clause = " AND ".join(where_conditions)
 
-            query = f"""
-                SELECT * FROM {table_name}
-                WHERE {where_clause}
-                ORDER BY created_at DESC
-                LIMIT %s OFFSET %s
-            """
-
-            cur.execute(query, params + [limit, offset])
-            rows = cur.fetchall()
+            if offset and not cursor:
+                cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+                pagination.float_numerics(cur)
+                cur.execute(f"""
+                    SELECT * FROM {table_name}
+                    WHERE {where_clause}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s OFFSET %s
+                """, params + [limit, offset])
+                return cur.fetchall()
+
+            page = pagination.keyset_page(
+                conn, f"SELECT * FROM {table_name}", where_clause, params,
+                ["created_at", "id"], limit, cursor,
+            )
 
-        return rows
+        if page["next_cursor"]:
+            response.headers["X-Next-Cursor"] = page["next_cursor"]
+        return page["rows"]
+    except pagination.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -558,6 +576,8 @@ async def upload_data(
                     print(f"Error inserting row: {row_error}")
                     continue
             conn.commit()
+            # Bulk loads rebuild the process' cube slice rather than applying row deltas
+            balance_cube.refresh_process(conn, process_id)
         
         return {"message": "Upload successful", "rows_inserted": rows_inserted}
     except Exception as e:
@@ -607,6 +627,7 @@ async def create_manual_entry(
                         process_id, scenario_id, year_id, period_id, entity_id, account_id,
                         amount, currency, description, custom_fields, origin, created_by, created_at, updated_at
                     ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING id
                     """,
                     (
                         process_id, scenario_id, year_id, period_id, entity_id, account_id,
@@ -614,6 +635,7 @@ async def create_manual_entry(
                         origin, username, now, now
                     )
                 )
+                balance_cube.apply_rows(conn, 'entity', [cur.fetchone()[0]])
             elif card_type == 'ic_amounts':
                 from_entity_id = int(entry_data.get('from_entity_id'))
                 to_entity_id = int(entry_data.get('to_entity_id'))
@@ -645,6 +667,7 @@ async def create_manual_entry(
                         process_id, scenario_id, year_id, period_id, entity_id, account_id,
                         amount, currency, description, custom_fields, origin, created_by, created_at, updated_at
                     ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING id
                     """,
                     (
                         process_id, scenario_id, year_id, period_id, entity_id, account_id,
@@ -652,6 +675,7 @@ async def create_manual_entry(
                         origin, username, now, now
                     )
                 )
+                balance_cube.apply_rows(conn, 'other', [cur.fetchone()[0]])
             else:
                 raise HTTPException(status_code=400, detail="Unsupported card type")
 
@@ -685,9 +709,11 @@ async def export_data(
             if not process_row:
                 raise HTTPException(status_code=404, detail="Process not found")
             
-            # Create table name
-            safe_name = re.sub(r'[^a-zA-Z0-9_]', '_', process_row['name'].lower())
-            table_name = f"{safe_name}_{card_type}_entries"
+            # Partitioned fact table for migrated processes, else the legacy per-process table
+            table_name = fact_tables.routed_table(conn, process_id, card_type)
+            if not table_name:
+                safe_name = re.sub(r'[^a-zA-Z0-9_]', '_', process_row['name'].lower())
+                table_name = f"{safe_name}_{card_type}_entries"
             
             print(f"📋 Exporting from table: {table_name}")
             
@@ -712,105 +738,89 @@ async def export_data(
             }
             
             important_fields = field_mappings.get(card_type, ['*'])
-            
-            # Build query with only important fields
+
+            # Only select columns the table actually has; missing ones export empty
+            cur.execute(
+                "SELECT column_name FROM information_schema.columns WHERE table_name = %s ORDER BY ordinal_position",
+                (table_name,)
+            )
+            table_columns = [r['column_name'] for r in cur.fetchall()]
+            if not table_columns:
+                raise HTTPException(status_code=404, detail=f"No data table for {card_type}")
             if important_fields == ['*']:
-                select_clause = "*"
-            else:
-                select_clause = ", ".join(important_fields)
-            
+                important_fields = table_columns
+            selected = [field for field in important_fields if field in table_columns]
+            select_clause = ", ".join(selected)
+
             where_parts = ["process_id = %s"]
             params = [process_id]
-            
+
             if scenario_id:
                 where_parts.append("(scenario_id = %s OR scenario_id IS NULL)")
                 params.append(scenario_id)
-            
+
             where_clause = " AND ".join(where_parts)
-            
+
             query = f"SELECT {select_clause} FROM {table_name} WHERE {where_clause} ORDER BY created_at DESC"
-            
+
             print(f"📄 Query: {query}")
             print(f"📄 Params: {params}")
-            
-            cur.execute(query, params)
-            rows = cur.fetchall()
-            
-            print(f"✅ Got {len(rows)} rows")
-            
+
             # Get custom fields for this card type
             cur.execute(
                 "SELECT field_name, field_type FROM data_input_custom_fields WHERE card_type = %s ORDER BY created_at",
                 (card_type,)
             )
             custom_field_defs = cur.fetchall()
-            
-            # Create enhanced CSV with custom fields expanded
-            output = io.StringIO()
-            
-            if rows:
-                # Build header with custom fields expanded
-                base_headers = [field for field in important_fields if field != 'custom_fields']
-                custom_headers = [f"custom_{cf['field_name']}" for cf in custom_field_defs]
-                all_headers = base_headers + custom_headers
-                
-                writer = csv.writer(output)
-                writer.writerow(all_headers)  # Header
-                
-                for row in rows:
-                    row_data = []
-                    
-                    # Add base field values
-                    for field in base_headers:
-                        value = row.get(field, '')
-                        if value is None:
-                            value = ''
-                        elif isinstance(value, (dict, list)) and field != 'custom_fields':
-                            value = json.dumps(value)
-                        elif hasattr(value, 'isoformat'):  # datetime/date
-                            value = value.isoformat()
-                        row_data.append(str(value))
-                    
-                    # Add custom field values
-                    custom_fields_data = row.get('custom_fields', {})
-                    if isinstance(custom_fields_data, str):
-                        try:
-                            custom_fields_data = json.loads(custom_fields_data)
-                        except:
-                            custom_fields_data = {}
-                    
-                    for cf in custom_field_defs:
-                        field_name = cf['field_name']
-                        custom_value = custom_fields_data.get(field_name, '')
-                        row_data.append(str(custom_value))
-                    
-                    writer.writerow(row_data)
-            else:
-                # Empty CSV with headers
-                writer = csv.writer(output)
-                headers = field_mappings.get(card_type, ['No data available'])
-                if headers != ['No data available']:
-                    # Add custom field headers even for empty export
-                    base_headers = [field for field in headers if field != 'custom_fields']
-                    custom_headers = [f"custom_{cf['field_name']}" for cf in custom_field_defs]
-                    headers = base_headers + custom_headers
-                writer.writerow(headers)
-            
-            csv_content = output.getvalue()
-            output.close()
-            
-            # Return CSV
-            timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-            filename = f"{card_type}_data_input_export_{timestamp}.csv"
-            
-            print(f"✅ Enhanced export ready: {filename}")
-            
-            return StreamingResponse(
-                io.StringIO(csv_content),
-                media_type="text/csv",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
-            
+
+        # Header with custom fields expanded
+        base_headers = [field for field in important_fields if field != 'custom_fields']
+        custom_names = [cf['field_name'] for cf in custom_field_defs]
+        all_headers = base_headers + [f"custom_{name}" for name in custom_names]
+
+        def format_row(row):
+            row_data = []
+
+            # Add base field values
+            for field in base_headers:
+                value = row.get(field, '')
+                if value is None:
+                    value = ''
+                elif isinstance(value, (dict, list)):
+                    value = json.dumps(value)
+                elif hasattr(value, 'isoformat'):  # datetime/date
+                    value = value.isoformat()
+                row_data.append(str(value))
+
+            # Add custom field values
+            custom_fields_data = row.get('custom_fields') or {}
+            if isinstance(custom_fields_data, str):
+                try:
+                    custom_fields_data = json.loads(custom_fields_data)
+                except ValueError:
+                    custom_fields_data = {}
+            row_data.extend(str(custom_fields_data.get(name, '')) for name in custom_names)
+            return row_data
+
+        def export_rows():
+            # Rows are read through a server-side cursor on the streaming connection
+            with get_company_connection(company_name) as stream_conn:
+                for row in streaming_export.server_cursor_rows(stream_conn, query, params):
+                    yield format_row(row)
+
+        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+        filename = f"{card_type}_data_input_export_{timestamp}.csv"
+
+        print(f"✅ Enhanced export streaming: {filename}")
+
+        return StreamingResponse(
+            streaming_export.csv_stream(all_headers, export_rows()),
+            media_type="text/csv",
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Export failed: {e}")
         import traceback
@@ -847,177 +857,118 @@ async def download_template(
         raise HTTPException(status_code=500, detail=str(e))
 
 # Reports Data Endpoint - Efficient aggregation for ProcessReports
+REPORT_SOURCE_TYPES = {'entity_amounts': 'entity', 'ic_amounts': 'ic', 'other_amounts': 'other'}
+REPORT_MEASURES = {'entity': 'entity_amount', 'ic': 'ic_amount', 'other': 'other_amount'}
+
+def report_hierarchy(conn, hierarchy_id: int, company_name: str):
+    """Axes hierarchy nodes and the accounts assigned to them, as pivot_engine nodes / leaves"""
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cur.execute("""
+        SELECT id, parent_id, name FROM hierarchy_nodes
+        WHERE hierarchy_id = %s AND company_id = %s
+        ORDER BY path, sort_order, name
+    """, (hierarchy_id, company_name))
+    nodes = [{'key': n['id'], 'parent': n['parent_id'], 'label': n['name']} for n in cur.fetchall()]
+    cur.execute("""
+        SELECT code, name, node_id FROM axes_accounts
+        WHERE hierarchy_id = %s AND company_id = %s
+        ORDER BY code
+    """, (hierarchy_id, company_name))
+    leaves = [{'key': a['code'], 'node': a['node_id'], 'label': a['name']} for a in cur.fetchall()]
+    return nodes, leaves
+
 @router.get("/reports-data")
 async def get_reports_data(
     process_id: int = Query(...),
     scenario_id: int = Query(...),
     company_name: str = Query(...),
     hierarchy_id: Optional[int] = Query(None),
-    card_types: Optional[str] = Query("entity_amounts")  # comma-separated
+    card_types: Optional[str] = Query("entity_amounts"),  # comma-separated
+    layout: str = Query("columnar", pattern="^(columnar|nested)$")
 ):
-    """Get aggregated data for reports generation - efficient single query approach"""
+    """Account x entity matrix of the requested card types, optionally rolled up along an axes hierarchy"""
     try:
         create_tables_if_not_exist(company_name)
 
         # Parse card types
         card_types_list = [ct.strip() for ct in card_types.split(',') if ct.strip()]
+        measures = [REPORT_MEASURES[REPORT_SOURCE_TYPES[ct]] for ct in card_types_list if ct in REPORT_SOURCE_TYPES]
 
         with get_company_connection(company_name) as conn:
-            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-            # Get entities for column headers
-            cur.execute("""
-                SELECT DISTINCT
-                    COALESCE(entity_code, CAST(entity_id AS VARCHAR)) as entity_code,
-                    COALESCE(entity_name, CONCAT('Entity ', entity_id)) as entity_name,
-                    entity_id
-                FROM entity_amounts
-                WHERE process_id = %s AND scenario_id = %s
-                ORDER BY entity_code
-            """, (process_id, scenario_id))
-
-            entities = cur.fetchall()
-
-            # Get all accounts with their data aggregated by entity
-            all_accounts_data = {}
-
-            for card_type in card_types_list:
-                if card_type == 'entity_amounts':
-                    # Get entity amounts aggregated by account and entity
-                    cur.execute("""
-                        SELECT
-                            account_code,
-                            account_name,
-                            entity_code,
-                            entity_name,
-                            SUM(amount) as total_amount,
-                            currency
-                        FROM entity_amounts
-                        WHERE process_id = %s AND scenario_id = %s
-                        GROUP BY account_code, account_name, entity_code, entity_name, currency
-                        ORDER BY account_code, entity_code
-                    """, (process_id, scenario_id))
-
-                    rows = cur.fetchall()
-                    for row in rows:
-                        account_key = row['account_code']
-                        entity_key = row['entity_code']
-
-                        if account_key not in all_accounts_data:
-                            all_accounts_data[account_key] = {
-                                'account_code': account_key,
-                                'account_name': row['account_name'],
-                                'entities': {}
-                            }
-
-                        all_accounts_data[account_key]['entities'][entity_key] = {
-                            'entity_amount': float(row['total_amount'] or 0),
-                            'ic_amount': 0,
-                            'other_amount': 0,
-                            'currency': row['currency'],
-                            'entity_name': row['entity_name']
-                        }
-
-                elif card_type == 'ic_amounts':
-                    # Get IC amounts aggregated by account and entity
-                    cur.execute("""
-                        SELECT
-                            COALESCE(
-                                (SELECT account_code FROM axes_accounts WHERE id = ic.from_account_id LIMIT 1),
-                                CAST(ic.from_account_id AS VARCHAR)
-                            ) as account_code,
-                            COALESCE(
-                                (SELECT name FROM axes_accounts WHERE id = ic.from_account_id LIMIT 1),
-                                CONCAT('Account ', ic.from_account_id)
-                            ) as account_name,
-                            from_entity_code,
-                            from_entity_name,
-                            to_entity_code,
-                            to_entity_name,
-                            SUM(amount) as total_amount,
-                            currency_code as currency
-                        FROM ic_amounts ic
-                        WHERE process_id = %s AND scenario_id = %s
-                        GROUP BY account_code, account_name, from_entity_code, from_entity_name,
-                                 to_entity_code, to_entity_name, currency_code
-                        ORDER BY account_code, from_entity_code
-                    """, (process_id, scenario_id))
-
-                    rows = cur.fetchall()
-                    for row in rows:
-                        account_key = row['account_code']
-                        entity_key = row['from_entity_code']
-
-                        if account_key not in all_accounts_data:
-                            all_accounts_data[account_key] = {
-                                'account_code': account_key,
-                                'account_name': row['account_name'],
-                                'entities': {}
-                            }
-
-                        if entity_key not in all_accounts_data[account_key]['entities']:
-                            all_accounts_data[account_key]['entities'][entity_key] = {
-                                'entity_amount': 0,
-                                'ic_amount': 0,
-                                'other_amount': 0,
-                                'currency': row['currency'],
-                                'entity_name': row['from_entity_name']
-                            }
-
-                        all_accounts_data[account_key]['entities'][entity_key]['ic_amount'] = float(row['total_amount'] or 0)
-
-                elif card_type == 'other_amounts':
-                    # Get other amounts aggregated by account and entity
-                    cur.execute("""
-                        SELECT
-                            COALESCE(account_code, CAST(account_id AS VARCHAR)) as account_code,
-                            COALESCE(account_name, CONCAT('Account ', account_id)) as account_name,
-                            COALESCE(entity_code, CAST(entity_id AS VARCHAR)) as entity_code,
-                            COALESCE(entity_name, CONCAT('Entity ', entity_id)) as entity_name,
-                            SUM(amount) as total_amount,
-                            currency
-                        FROM other_amounts
-                        WHERE process_id = %s AND scenario_id = %s
-                        GROUP BY account_code, account_name, entity_code, entity_name, currency
-                        ORDER BY account_code, entity_code
-                    """, (process_id, scenario_id))
-
-                    rows = cur.fetchall()
-                    for row in rows:
-                        account_key = row['account_code']
-                        entity_key = row['entity_code']
-
-                        if account_key not in all_accounts_data:
-                            all_accounts_data[account_key] = {
-                                'account_code': account_key,
-                                'account_name': row['account_name'],
-                                'entities': {}
-                            }
-
-                        if entity_key not in all_accounts_data[account_key]['entities']:
-                            all_accounts_data[account_key]['entities'][entity_key] = {
-                                'entity_amount': 0,
-                                'ic_amount': 0,
-                                'other_amount': 0,
-                                'currency': row['currency'],
-                                'entity_name': row['entity_name']
-                            }
-
-                        all_accounts_data[account_key]['entities'][entity_key]['other_amount'] = float(row['total_amount'] or 0)
-
-            # Format response for ProcessReports component
-            result = {
+            # One set-based read of the pre-aggregated cube for every card type
+            cells = balance_cube.query(
+                conn, process_id=process_id, scenario_id=scenario_id,
+                source_types=sorted(REPORT_SOURCE_TYPES[ct] for ct in card_types_list if ct in REPORT_SOURCE_TYPES),
+            )
+            for cell in cells:
+                cell['measure'] = REPORT_MEASURES[cell['source_type']]
+            pivot = pivot_engine.Pivot.from_cells(
+                cells, 'account_key', 'entity_key', 'measure', 'total_amount', measures,
+                row_label_field='account_name', column_label_field='entity_name',
+            )
+            if hierarchy_id is not None:
+                nodes, leaves = report_hierarchy(conn, hierarchy_id, company_name)
+                pivot = pivot.with_hierarchy(nodes, leaves)
+
+        entities = [
+            {'entity_code': key, 'entity_name': label, 'entity_id': key}
+            for key, label in zip(pivot.column_keys, pivot.column_labels)
+        ]
+        if layout == 'columnar':
+            return {
+                **pivot.to_columnar(drop_empty_rows=True),
                 'entities': entities,
-                'accounts': all_accounts_data,
                 'card_types': card_types_list,
-                'total_accounts': len(all_accounts_data),
-                'total_entities': len(entities)
+                'hierarchy_id': hierarchy_id,
             }
 
-            return result
+        # Nested per-account / per-entity objects, built from the non-zero cells of the matrix
+        currencies = {(cell['account_key'], cell['entity_key']): cell['currency'] for cell in cells}
+        all_accounts_data = {}
+        rows, columns = np.nonzero(np.abs(pivot.values).sum(axis=0))
+        for row, column in zip(rows.tolist(), columns.tolist()):
+            if pivot.row_kind is not None and pivot.row_kind[row] != 'row':
+                continue
+            account_key, entity_key = pivot.row_keys[row], pivot.column_keys[column]
+            account = all_accounts_data.setdefault(account_key, {
+                'account_code': account_key,
+                'account_name': pivot.row_labels[row],
+                'entities': {}
+            })
+            account['entities'][entity_key] = {
+                'entity_amount': 0,
+                'ic_amount': 0,
+                'other_amount': 0,
+                **{measure: float(pivot.values[m, row, column]) for m, measure in enumerate(pivot.measures)},
+                'currency': currencies.get((account_key, entity_key)),
+                'entity_name': pivot.column_labels[column]
+            }
+
+        return {
+            'entities': entities,
+            'accounts': all_accounts_data,
+            'card_types': card_types_list,
+            'total_accounts': len(all_accounts_data),
+            'total_entities': len(entities)
+        }
 
     except Exception as e:
         import traceback
         print(f"❌ Reports data error: {e}")
         print(f"❌ Full traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Failed to get reports data: {str(e)}")
+
+# Rebuild the pre-aggregated balances behind the reports for one process
+@router.post("/reports-data/refresh")
+async def refresh_reports_data(
+    process_id: str = Query(...),
+    company_name: str = Query(...)
+):
+    """Rebuild a process' slice of the balance cube; reports keep reading the old slice until it commits"""
+    try:
+        create_tables_if_not_exist(company_name)
+        with get_company_connection(company_name) as conn:
+            result = balance_cube.refresh_process(conn, process_id)
+        return {"process_id": process_id, **result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to refresh reports data: {str(e)}")
@@ -9,7 +9,14 @@ import os
 import json
 from datetime import datetime
 
-router = APIRouter(prefix="/entities", tags=["Entities"])
+from routers import conditional_get, report_cache
+
+# Writes drop the remembered reference-data versions used for ETags
+router = APIRouter(
+    prefix="/entities",
+    tags=["Entities"],
+    dependencies=[Depends(conditional_get.invalidate_after_write(report_cache.REFERENCE_DOMAIN))],
+)
 
 class EntityCreate(BaseModel):
     entity_name: str
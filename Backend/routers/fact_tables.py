@@ -0,0 +1,405 @@
+"""
+Partitioned fact tables for process data input.
+
+Data input used to live in one dynamically named table per process and
+data type (``{process_name}_{data_type}_entries``). The name follows the
+mutable process name, two processes with the same sanitized name share a
+table, and every read first has to resolve the name and check that the
+table exists.
+
+Instead there is one fact table per data type (``{data_type}_facts``),
+declaratively partitioned by process and, inside each process, by fiscal
+year:
+
+    entity_amounts_facts                      PARTITION BY LIST (process_id)
+      entity_amounts_facts_p<process hash>    PARTITION BY LIST (fiscal_year)
+        ..._y<year hash>                      one per fiscal year
+        ..._ydef                              DEFAULT (years not split out yet)
+
+Queries keep filtering on ``process_id = %s`` (and ``fiscal_year``), which
+the planner uses to prune to the process's partitions, so the table name is
+a constant. The fact_partitions registry maps processes and years to their
+partitions; a process appears in it once its data lives in the fact table.
+
+* routed_table() returns the fact table for a registered process (None
+  otherwise, leaving callers on the legacy table);
+* ensure_process_partition() / ensure_year_partition() create partitions on
+  first write, moving any rows the default partition already holds;
+* migrate_table() / migrate_all() copy legacy tables into the fact tables,
+  split by process_id, and rename the legacy tables out of the way;
+* archive_year() detaches a closed year's partition (a catalog-only change;
+  the detached table stays queryable) and restore_year() re-attaches it.
+"""
+
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from psycopg2.extras import RealDictCursor
+
+from routers import index_manager
+
+logger = logging.getLogger(__name__)
+
+DATA_TYPES = index_manager.DATA_TYPES
+DEFAULT_YEAR = ""  # fiscal_year is part of the partition key and so cannot be NULL
+
+COMMON_COLUMNS = """
+    id VARCHAR(36) NOT NULL,
+    process_id VARCHAR(36) NOT NULL,
+    period_id VARCHAR(36),
+    period_code VARCHAR(50),
+    period_name VARCHAR(255),
+    fiscal_year VARCHAR(100) NOT NULL DEFAULT '',
+    fiscal_month VARCHAR(10),
+    transaction_date DATE,
+    amount DECIMAL(18,2),
+    currency VARCHAR(10) DEFAULT 'USD',
+    scenario_id VARCHAR(36),
+    scenario_code VARCHAR(50),
+    description TEXT,
+    reference_id VARCHAR(100),
+    custom_fields JSONB DEFAULT '{}',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_by VARCHAR(100),
+"""
+ENTITY_COLUMNS = """
+    entity_id VARCHAR(36),
+    entity_code VARCHAR(50),
+    entity_name VARCHAR(255),
+    account_id VARCHAR(36),
+    account_code VARCHAR(50),
+    account_name VARCHAR(255),
+"""
+TYPE_COLUMNS = {
+    "entity_amounts": ENTITY_COLUMNS,
+    "other_amounts": ENTITY_COLUMNS + """
+    adjustment_type VARCHAR(100),
+    custom_transaction_type VARCHAR(100),
+""",
+    "ic_amounts": """
+    from_entity_id VARCHAR(36),
+    from_entity_code VARCHAR(50),
+    from_entity_name VARCHAR(255),
+    to_entity_id VARCHAR(36),
+    to_entity_code VARCHAR(50),
+    to_entity_name VARCHAR(255),
+    from_account_id VARCHAR(36),
+    from_account_code VARCHAR(50),
+    from_account_name VARCHAR(255),
+    to_account_id VARCHAR(36),
+    to_account_code VARCHAR(50),
+    to_account_name VARCHAR(255),
+    transaction_type VARCHAR(100),
+    fx_rate DECIMAL(10,6) DEFAULT 1.0,
+""",
+}
+
+_ready_databases = set()
+_routed: set = set()
+_lock = threading.Lock()
+
+
+def fact_table_name(data_type: str) -> str:
+    if data_type not in DATA_TYPES:
+        raise ValueError(f"Unknown data type: {data_type}")
+    return f"{data_type}_facts"
+
+
+def is_fact_table(table_name: Optional[str]) -> bool:
+    return bool(table_name) and table_name in {fact_table_name(t) for t in DATA_TYPES}
+
+
+def _hash(value: str, length: int) -> str:
+    return hashlib.md5(value.encode("utf-8")).hexdigest()[:length]
+
+
+def process_partition_name(data_type: str, process_id: str) -> str:
+    return f"{fact_table_name(data_type)}_p{_hash(process_id, 12)}"
+
+
+def year_partition_name(data_type: str, process_id: str, fiscal_year: str) -> str:
+    return f"{process_partition_name(data_type, process_id)}_y{_hash(fiscal_year, 8)}"
+
+
+# ============================================================================
+# SCHEMA
+# ============================================================================
+
+def ensure_fact_tables(conn) -> None:
+    """Create the partitioned parents, their indexes and the registry once per database. Commits."""
+    database = conn.info.dbname
+    if database in _ready_databases:
+        return
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS fact_partitions (
+            partition_name VARCHAR(63) PRIMARY KEY,
+            data_type VARCHAR(50) NOT NULL,
+            process_id VARCHAR(36) NOT NULL,
+            fiscal_year VARCHAR(100),
+            status VARCHAR(20) NOT NULL DEFAULT 'attached',
+            row_count BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            archived_at TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_fact_partitions_process
+        ON fact_partitions(process_id, data_type, fiscal_year)
+    """)
+    for data_type in DATA_TYPES:
+        table_name = fact_table_name(data_type)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                {COMMON_COLUMNS}
+                {TYPE_COLUMNS[data_type]}
+                PRIMARY KEY (process_id, fiscal_year, id)
+            ) PARTITION BY LIST (process_id)
+        """)
+        # Created on the parent, so every partition gets them
+        index_manager.ensure_indexes(conn, table_name, data_type)
+    conn.commit()
+    _ready_databases.add(database)
+
+
+def _register(conn, partition_name: str, data_type: str, process_id: str,
+              fiscal_year: Optional[str]) -> None:
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO fact_partitions (partition_name, data_type, process_id, fiscal_year)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (partition_name) DO NOTHING
+    """, (partition_name, data_type, process_id, fiscal_year))
+
+
+def ensure_process_partition(conn, data_type: str, process_id: str) -> str:
+    """Create a process's partition (with its default year partition). Does not commit."""
+    ensure_fact_tables(conn)
+    partition = process_partition_name(data_type, process_id)
+    cur = conn.cursor()
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {partition}
+        PARTITION OF {fact_table_name(data_type)} FOR VALUES IN (%s)
+        PARTITION BY LIST (fiscal_year)
+    """, (process_id,))
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {partition}_ydef PARTITION OF {partition} DEFAULT")
+    _register(conn, partition, data_type, process_id, None)
+    return partition
+
+
+def ensure_year_partition(conn, data_type: str, process_id: str, fiscal_year: Optional[str]) -> str:
+    """Make sure a fiscal year has its own partition; returns the partition key value to write.
+
+    Rows of that year already in the default partition are moved into the
+    new partition before it is attached. Does not commit.
+    """
+    year = fiscal_year or DEFAULT_YEAR
+    if year == DEFAULT_YEAR:
+        return year
+    partition = year_partition_name(data_type, process_id, year)
+    cur = conn.cursor()
+    # Concurrent first writes of a year would otherwise race to attach it
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (partition,))
+    cur.execute("SELECT status FROM fact_partitions WHERE partition_name = %s", (partition,))
+    row = cur.fetchone()
+    if row is not None:
+        if row[0] == "archived":
+            raise ValueError(f"Fiscal year {year} of process {process_id} is archived")
+        return year
+    parent = ensure_process_partition(conn, data_type, process_id)
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {partition} (LIKE {parent} INCLUDING DEFAULTS)")
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM {parent}_ydef WHERE fiscal_year = %s RETURNING *
+        )
+        INSERT INTO {partition} SELECT * FROM moved
+    """, (year,))
+    cur.execute(f"ALTER TABLE {parent} ATTACH PARTITION {partition} FOR VALUES IN (%s)", (year,))
+    _register(conn, partition, data_type, process_id, year)
+    return year
+
+
+def routed_table(conn, process_id: str, data_type: str) -> Optional[str]:
+    """The fact table if this process's data lives there, else None."""
+    database = conn.info.dbname
+    key = (database, data_type, process_id)
+    if key in _routed:
+        return fact_table_name(data_type)
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('fact_partitions')")
+    if cur.fetchone()[0] is None:
+        return None
+    cur.execute("""
+        SELECT 1 FROM fact_partitions
+        WHERE process_id = %s AND data_type = %s AND fiscal_year IS NULL
+    """, (process_id, data_type))
+    if cur.fetchone() is None:
+        return None
+    with _lock:
+        _routed.add(key)
+    return fact_table_name(data_type)
+
+
+# ============================================================================
+# MIGRATION
+# ============================================================================
+
+def _columns(conn, table_name: str) -> List[str]:
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = %s AND table_schema = current_schema()
+        ORDER BY ordinal_position
+    """, (table_name,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def migrate_table(conn, legacy_table: str, data_type: str) -> Dict[str, Any]:
+    """Copy a legacy per-process table into the fact table and rename it away. Commits.
+
+    Rows are split by their own process_id, so a table shared by processes
+    with the same sanitized name ends up in separate partitions.
+    """
+    ensure_fact_tables(conn)
+    target = fact_table_name(data_type)
+    cur = conn.cursor()
+    # Serialize migrations of the same table across workers
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (legacy_table,))
+    cur.execute("SELECT to_regclass(%s)", (legacy_table,))
+    if cur.fetchone()[0] is None:
+        conn.rollback()
+        return {"table": legacy_table, "rows": 0, "processes": []}
+
+    target_columns = set(_columns(conn, target))
+    columns = [c for c in _columns(conn, legacy_table) if c in target_columns]
+    select_list = ", ".join(
+        f"COALESCE({c}, '')" if c == "fiscal_year" else c for c in columns
+    )
+
+    cur.execute(f"""
+        SELECT process_id, COALESCE(fiscal_year, '') AS fiscal_year, COUNT(*) AS row_count
+        FROM {legacy_table} GROUP BY 1, 2
+    """)
+    groups = cur.fetchall()
+    processes = sorted({process_id for process_id, _, _ in groups})
+    for process_id, fiscal_year, _ in groups:
+        ensure_process_partition(conn, data_type, process_id)
+        ensure_year_partition(conn, data_type, process_id, fiscal_year)
+
+    cur.execute(f"""
+        INSERT INTO {target} ({', '.join(columns)})
+        SELECT {select_list} FROM {legacy_table}
+        ON CONFLICT DO NOTHING
+    """)
+    moved = cur.rowcount
+    cur.execute(f"ALTER TABLE {legacy_table} RENAME TO {legacy_table[:54]}_migrated")
+    conn.commit()
+    for process_id in processes:
+        _routed.discard((conn.info.dbname, data_type, process_id))
+    logger.info(f"Migrated {moved} rows of {legacy_table} into {target} for {len(processes)} process(es)")
+    return {"table": legacy_table, "rows": moved, "processes": processes}
+
+
+def migrate_all(conn, table_names: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Migrate every legacy ``{process}_{data_type}_entries`` table (or the given ones)."""
+    results, failed = [], []
+    for legacy_table, data_type in index_manager.process_tables(conn, table_names):
+        try:
+            results.append(migrate_table(conn, legacy_table, data_type))
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Could not migrate {legacy_table}: {e}")
+            failed.append({"table": legacy_table, "error": str(e)})
+    return {"migrated": results, "failed": failed, "rows": sum(r["rows"] for r in results)}
+
+
+# ============================================================================
+# ARCHIVING
+# ============================================================================
+
+def partitions(conn, process_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Registered partitions, optionally of one process."""
+    ensure_fact_tables(conn)
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT p.partition_name, p.data_type, p.process_id, p.fiscal_year, p.status,
+               p.created_at, p.archived_at,
+               COALESCE(s.n_live_tup, p.row_count) AS row_count
+        FROM fact_partitions p
+        LEFT JOIN pg_stat_user_tables s ON s.relname = p.partition_name
+        WHERE %s::text IS NULL OR p.process_id = %s
+        ORDER BY p.process_id, p.data_type, p.fiscal_year NULLS FIRST
+    """, (process_id, process_id))
+    return [dict(row) for row in cur.fetchall()]
+
+
+def leaf_partitions(conn, process_id: str) -> List[str]:
+    """Attached year and default partitions holding a process's rows."""
+    roots = [process_partition_name(data_type, process_id) for data_type in DATA_TYPES]
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT leaf.relname
+        FROM pg_class root
+        CROSS JOIN LATERAL pg_partition_tree(root.oid) tree
+        JOIN pg_class leaf ON leaf.oid = tree.relid
+        WHERE root.relname = ANY(%s) AND tree.isleaf
+        ORDER BY leaf.relname
+    """, (roots,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def archive_year(conn, data_type: str, process_id: str, fiscal_year: str) -> Dict[str, Any]:
+    """Detach a closed fiscal year's partition. Commits.
+
+    The detached table keeps its name and data; reads through the fact table
+    no longer see it.
+    """
+    partition = year_partition_name(data_type, process_id, fiscal_year)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT status FROM fact_partitions WHERE partition_name = %s FOR UPDATE
+    """, (partition,))
+    row = cur.fetchone()
+    if row is None:
+        raise LookupError(f"No partition for fiscal year {fiscal_year} of process {process_id}")
+    if row[0] == "archived":
+        conn.rollback()
+        return {"partition": partition, "status": "archived"}
+    cur.execute(f"SELECT COUNT(*) FROM {partition}")
+    row_count = cur.fetchone()[0]
+    cur.execute(f"ALTER TABLE {process_partition_name(data_type, process_id)} DETACH PARTITION {partition}")
+    cur.execute("""
+        UPDATE fact_partitions SET status = 'archived', archived_at = CURRENT_TIMESTAMP, row_count = %s
+        WHERE partition_name = %s
+    """, (row_count, partition))
+    conn.commit()
+    logger.info(f"Archived {partition}")
+    return {"partition": partition, "status": "archived", "row_count": row_count}
+
+
+def restore_year(conn, data_type: str, process_id: str, fiscal_year: str) -> Dict[str, Any]:
+    """Re-attach an archived fiscal year partition. Commits."""
+    partition = year_partition_name(data_type, process_id, fiscal_year)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT status FROM fact_partitions WHERE partition_name = %s FOR UPDATE
+    """, (partition,))
+    row = cur.fetchone()
+    if row is None:
+        raise LookupError(f"No partition for fiscal year {fiscal_year} of process {process_id}")
+    if row[0] == "attached":
+        conn.rollback()
+        return {"partition": partition, "status": "attached"}
+    cur.execute(f"""
+        ALTER TABLE {process_partition_name(data_type, process_id)}
+        ATTACH PARTITION {partition} FOR VALUES IN (%s)
+    """, (fiscal_year,))
+    cur.execute("""
+        UPDATE fact_partitions SET status = 'attached', archived_at = NULL
+        WHERE partition_name = %s
+    """, (partition,))
+    conn.commit()
+    return {"partition": partition, "status": "attached"}
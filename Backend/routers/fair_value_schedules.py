@@ -0,0 +1,337 @@
+"""
+Fair value and goodwill schedules for consolidation processes.
+
+Every consolidation_fair_values row of a process' scenario yields up to two
+schedule items: the fair value step-up of the asset (amortized or
+depreciated over useful_life) and the goodwill recognized on acquisition
+(impaired, and amortized only when the goodwill_impairment node asks for it).
+All items are computed together as (items x periods) matrices over the
+process' consolidation_periods, including the deferred tax liability on the
+step-up and its release as the step-up is amortized.
+
+Schedules are stored compactly, one row per item with per-period arrays, in
+consolidation_fv_schedules. The header row keeps a hash of every input
+(fair value rows, acquisition dates, periods, node settings); schedules are
+regenerated only when that hash changes. Consolidation runs read one array
+slot per item for the period instead of recomputing.
+"""
+
+import hashlib
+import json
+import logging
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from psycopg2.extras import RealDictCursor, execute_values
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_DATA_TYPE = "fair_value_schedule"
+SCHEDULE_NODE_TYPES = ("fair_value_adjustment", "goodwill_impairment", "deferred_tax")
+
+DEFAULT_SETTINGS: Dict[str, Any] = {
+    "tax_rate": 0.25,
+    "periods_per_year": None,  # Inferred from the period dates when not set
+    "goodwill_amortization_years": None,  # IFRS: goodwill is impaired, not amortized
+    "impairment_period": None,  # Defaults to the last period of the process
+    "amortization_expense_account": "FV_AMORTIZATION_EXPENSE",
+    "accumulated_amortization_account": None,  # Defaults to the asset code
+    "goodwill_account": "GOODWILL",
+    "goodwill_expense_account": "GOODWILL_IMPAIRMENT_EXPENSE",
+    "deferred_tax_account": "DEFERRED_TAX_LIABILITY",
+    "deferred_tax_expense_account": "DEFERRED_TAX_EXPENSE",
+}
+
+
+# ============================================================================
+# INPUTS
+# ============================================================================
+
+def load_inputs(conn, process_id: int) -> Dict[str, Any]:
+    """Fair value rows, acquisition dates, periods and node settings of a process."""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("SELECT scenario_id FROM consolidation_processes WHERE id = %s", (process_id,))
+    process = cur.fetchone()
+    if not process:
+        raise LookupError(f"Consolidation process {process_id} not found")
+
+    cur.execute("""
+        SELECT fv.id, fv.acquired_entity_code, fv.asset_code, fv.fair_value, fv.carrying_amount,
+               fv.adjustment, fv.useful_life, fv.depreciation_method, fv.goodwill_amount,
+               fv.impairment_amount, e.acquisition_date
+        FROM consolidation_fair_values fv
+        LEFT JOIN consolidation_entities e ON e.entity_code = fv.acquired_entity_code
+        WHERE fv.scenario_id = %s
+        ORDER BY fv.id
+    """, (process["scenario_id"],))
+    items = cur.fetchall()
+
+    cur.execute("""
+        SELECT period_code, start_date, end_date FROM consolidation_periods
+        WHERE process_id = %s
+        ORDER BY period_order, start_date, id
+    """, (process_id,))
+    periods = cur.fetchall()
+
+    # Node config overrides the defaults; later nodes in execution order win
+    cur.execute("""
+        SELECT node_type, config FROM consolidation_nodes
+        WHERE process_id = %s AND enabled = true AND node_type = ANY(%s)
+        ORDER BY execution_order NULLS LAST, id
+    """, (process_id, list(SCHEDULE_NODE_TYPES)))
+    node_settings = dict(DEFAULT_SETTINGS)
+    for node in cur.fetchall():
+        config = node["config"] or {}
+        node_settings.update({k: v for k, v in config.items() if k in DEFAULT_SETTINGS and v is not None})
+
+    return {"items": items, "periods": periods, "settings": node_settings}
+
+
+def input_hash(inputs: Dict[str, Any]) -> str:
+    """Stable hash of everything a schedule depends on."""
+    payload = json.dumps(
+        {"items": inputs["items"], "periods": inputs["periods"], "settings": inputs["settings"]},
+        sort_keys=True, default=str,
+    )
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+def periods_per_year(periods: Sequence[Dict[str, Any]], configured: Any = None) -> int:
+    """Configured periods per year, else inferred from the median period length (monthly by default)."""
+    if configured:
+        return int(configured)
+    lengths = [
+        (p["end_date"] - p["start_date"]).days + 1
+        for p in periods
+        if isinstance(p.get("start_date"), date) and isinstance(p.get("end_date"), date)
+    ]
+    if not lengths:
+        return 12
+    return max(1, int(round(365.0 / float(np.median(lengths)))))
+
+
+def _start_positions(acquisition_dates: Sequence[Optional[date]], periods: Sequence[Dict[str, Any]]) -> np.ndarray:
+    """Index of the first period ending on or after each acquisition date (0 when unknown)."""
+    ends = [p["end_date"] for p in periods]
+    if not ends or not all(isinstance(end, date) for end in ends):
+        return np.zeros(len(acquisition_dates), dtype=np.int64)
+    end_ordinals = np.asarray([end.toordinal() for end in ends])
+    acquired = np.asarray([d.toordinal() if isinstance(d, date) else 0 for d in acquisition_dates], dtype=np.int64)
+    return np.minimum(np.searchsorted(end_ordinals, acquired, side="left"), len(ends) - 1)
+
+
+# ============================================================================
+# SCHEDULES
+# ============================================================================
+
+def _accumulated_fraction(start: np.ndarray, life_periods: np.ndarray, declining: np.ndarray,
+                          n_periods: int) -> np.ndarray:
+    """Share of each item's base amount written off by the end of every period.
+
+    Straight line writes off 1/life per period; declining balance uses twice
+    the straight-line rate on the remaining amount and writes off the rest in
+    the last period of the life. Items without a life are never written off.
+    """
+    elapsed = np.arange(n_periods)[None, :] - start[:, None] + 1  # Periods charged so far
+    life = np.maximum(life_periods, 1)[:, None].astype(np.float64)
+    clipped = np.clip(elapsed, 0, life)
+    straight = clipped / life
+    rate = np.minimum(2.0 / life, 1.0)
+    declining_fraction = np.where(clipped >= life, 1.0, 1.0 - (1.0 - rate) ** clipped)
+    fraction = np.where(declining[:, None], declining_fraction, straight)
+    return np.where(life_periods[:, None] > 0, fraction, 0.0)
+
+
+def compute_schedules(inputs: Dict[str, Any]) -> Dict[str, Any]:
+    """Amortization, impairment and deferred tax of every item for all periods at once."""
+    rows = inputs["items"]
+    periods = inputs["periods"]
+    node_settings = inputs["settings"]
+    n_periods = len(periods)
+    per_year = periods_per_year(periods, node_settings.get("periods_per_year"))
+    tax_rate = float(node_settings.get("tax_rate") or 0)
+    period_codes = [p["period_code"] for p in periods]
+
+    def _amount(value: Any) -> float:
+        return float(value or 0)
+
+    starts = _start_positions([row["acquisition_date"] for row in rows], periods)
+
+    # Fair value step-ups: adjustment, or fair value over carrying amount
+    fv_rows = [
+        (pos, row) for pos, row in enumerate(rows)
+        if (_amount(row["adjustment"]) or _amount(row["fair_value"]) - _amount(row["carrying_amount"]))
+    ]
+    fv_base = np.asarray([
+        _amount(row["adjustment"]) or _amount(row["fair_value"]) - _amount(row["carrying_amount"])
+        for _, row in fv_rows
+    ], dtype=np.float64)
+    fv_life = np.asarray([int(row["useful_life"] or 0) * per_year for _, row in fv_rows], dtype=np.int64)
+    fv_declining = np.asarray([
+        "declin" in (row["depreciation_method"] or "").lower() for _, row in fv_rows
+    ], dtype=bool)
+    fv_start = starts[[pos for pos, _ in fv_rows]] if fv_rows else np.zeros(0, dtype=np.int64)
+
+    # Goodwill: optional straight-line amortization plus the recorded impairment
+    gw_rows = [(pos, row) for pos, row in enumerate(rows) if _amount(row["goodwill_amount"])]
+    gw_base = np.asarray([_amount(row["goodwill_amount"]) for _, row in gw_rows], dtype=np.float64)
+    gw_years = int(node_settings.get("goodwill_amortization_years") or 0)
+    gw_life = np.full(len(gw_rows), gw_years * per_year, dtype=np.int64)
+    gw_start = starts[[pos for pos, _ in gw_rows]] if gw_rows else np.zeros(0, dtype=np.int64)
+
+    base = np.concatenate([fv_base, gw_base])
+    fraction = _accumulated_fraction(
+        np.concatenate([fv_start, gw_start]), np.concatenate([fv_life, gw_life]),
+        np.concatenate([fv_declining, np.zeros(len(gw_rows), dtype=bool)]), n_periods,
+    )
+    # Rounding the accumulated amount first keeps every schedule summing to its base
+    accumulated = np.round(base[:, None] * fraction, 2)
+    charges = np.diff(accumulated, axis=1, prepend=0.0) if n_periods else accumulated
+
+    impairments = np.zeros_like(charges)
+    if gw_rows and n_periods:
+        impairment_period = node_settings.get("impairment_period")
+        impairment_pos = period_codes.index(impairment_period) if impairment_period in period_codes else n_periods - 1
+        gw_impairment = np.minimum([_amount(row["impairment_amount"]) for _, row in gw_rows], gw_base)
+        impairment_at = np.maximum(gw_start, impairment_pos)
+        impairments[np.arange(len(fv_rows), len(base)), impairment_at] = gw_impairment
+        # Amortization stops once goodwill is fully impaired
+        carrying = gw_base[:, None] - np.cumsum(impairments[len(fv_rows):] + charges[len(fv_rows):], axis=1)
+        overshoot = np.minimum(carrying, 0.0)
+        charges[len(fv_rows):] += np.diff(overshoot, axis=1, prepend=0.0)
+
+    # Deferred tax liability on the step-up unwinds with its amortization;
+    # goodwill carries none (initial recognition exemption)
+    tax_release = np.zeros_like(charges)
+    tax_release[:len(fv_rows)] = np.round(charges[:len(fv_rows)] * tax_rate, 2)
+
+    items = []
+    for pos, row in fv_rows:
+        items.append({"item_key": f"fv:{row['id']}", "fair_value_id": row["id"], "item_type": "fair_value",
+                      "entity_code": row["acquired_entity_code"], "asset_code": row["asset_code"]})
+    for pos, row in gw_rows:
+        items.append({"item_key": f"gw:{row['id']}", "fair_value_id": row["id"], "item_type": "goodwill",
+                      "entity_code": row["acquired_entity_code"], "asset_code": row["asset_code"]})
+    item_start = np.concatenate([fv_start, gw_start])
+    for idx, item in enumerate(items):
+        item["base_amount"] = round(float(base[idx]), 2)
+        item["start_position"] = int(item_start[idx])
+        item["deferred_tax_base"] = round(float(base[idx]) * tax_rate, 2) if item["item_type"] == "fair_value" else 0.0
+
+    return {
+        "period_codes": period_codes,
+        "periods_per_year": per_year,
+        "items": items,
+        "charges": charges,
+        "impairments": impairments,
+        "tax_release": tax_release,
+    }
+
+
+# ============================================================================
+# STORAGE
+# ============================================================================
+
+def ensure_schedules(conn, process_id: int, force: bool = False) -> Dict[str, Any]:
+    """Regenerate the process' schedules if their inputs changed and return the header.
+
+    Commits when schedules are rewritten.
+    """
+    inputs = load_inputs(conn, process_id)
+    digest = input_hash(inputs)
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("SELECT * FROM consolidation_fv_schedule_runs WHERE process_id = %s", (process_id,))
+    header = cur.fetchone()
+    if header and header["input_hash"] == digest and not force:
+        return {**dict(header), "regenerated": False}
+
+    schedules = compute_schedules(inputs)
+    items = schedules["items"]
+    try:
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('consolidation_fv_schedules'), %s)", (int(process_id),))
+        cur.execute("DELETE FROM consolidation_fv_schedules WHERE process_id = %s", (process_id,))
+        execute_values(
+            cur,
+            """
+            INSERT INTO consolidation_fv_schedules
+            (process_id, item_key, fair_value_id, item_type, entity_code, asset_code, base_amount,
+             deferred_tax_base, start_position, charges, impairments, tax_release)
+            VALUES %s
+            """,
+            [
+                (process_id, item["item_key"], item["fair_value_id"], item["item_type"], item["entity_code"],
+                 item["asset_code"], item["base_amount"], item["deferred_tax_base"], item["start_position"],
+                 schedules["charges"][idx].tolist(), schedules["impairments"][idx].tolist(),
+                 schedules["tax_release"][idx].tolist())
+                for idx, item in enumerate(items)
+            ],
+            page_size=500,
+        )
+        cur.execute("""
+            INSERT INTO consolidation_fv_schedule_runs
+            (process_id, input_hash, period_codes, periods_per_year, item_count, settings, generated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, NOW())
+            ON CONFLICT (process_id) DO UPDATE SET
+                input_hash = EXCLUDED.input_hash,
+                period_codes = EXCLUDED.period_codes,
+                periods_per_year = EXCLUDED.periods_per_year,
+                item_count = EXCLUDED.item_count,
+                settings = EXCLUDED.settings,
+                generated_at = EXCLUDED.generated_at
+            RETURNING *
+        """, (process_id, digest, schedules["period_codes"], schedules["periods_per_year"], len(items),
+              json.dumps(inputs["settings"])))
+        header = cur.fetchone()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info(f"Regenerated {len(items)} fair value schedules over "
+                f"{len(schedules['period_codes'])} periods for process {process_id}")
+    return {**dict(header), "regenerated": True}
+
+
+def period_amounts(conn, process_id: int, period: str, header: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Per-item amounts of one period, read from the stored arrays."""
+    codes = header["period_codes"] or []
+    if period not in codes:
+        return []
+    slot = codes.index(period) + 1  # Postgres arrays are 1-based
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT item_key, fair_value_id, item_type, entity_code, asset_code, base_amount,
+               charges[%s] AS charge, impairments[%s] AS impairment, tax_release[%s] AS tax_release,
+               (SELECT COALESCE(SUM(c), 0) FROM unnest(charges[1:%s]) c)
+             + (SELECT COALESCE(SUM(i), 0) FROM unnest(impairments[1:%s]) i) AS accumulated
+        FROM consolidation_fv_schedules
+        WHERE process_id = %s
+        ORDER BY item_key
+    """, (slot, slot, slot, slot, slot, process_id))
+    return cur.fetchall()
+
+
+def schedule_lines(amounts: Sequence[Dict[str, Any]], period: str, settings: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Balanced staging lines (debit positive) for one period of schedule amounts."""
+    lines: List[Dict[str, Any]] = []
+
+    def _pair(entity_code, debit_account, credit_account, amount, item_key):
+        if not amount:
+            return
+        for account_code, signed in ((debit_account, amount), (credit_account, -amount)):
+            lines.append({"entity_code": entity_code, "account_code": account_code, "period": period,
+                          "data_type": SCHEDULE_DATA_TYPE, "currency": None, "node_id": None,
+                          "amount": signed, "source": item_key})
+
+    for row in amounts:
+        charge = float(row["charge"] or 0)
+        if row["item_type"] == "fair_value":
+            accumulated_account = settings.get("accumulated_amortization_account") or row["asset_code"]
+            _pair(row["entity_code"], settings["amortization_expense_account"], accumulated_account,
+                  charge, row["item_key"])
+            _pair(row["entity_code"], settings["deferred_tax_account"], settings["deferred_tax_expense_account"],
+                  float(row["tax_release"] or 0), row["item_key"])
+        else:
+            _pair(row["entity_code"], settings["goodwill_expense_account"], settings["goodwill_account"],
+                  charge + float(row["impairment"] or 0), row["item_key"])
+    return lines
@@ -3,11 +3,12 @@ Enhanced Financial Process API Router
 Comprehensive API for all financial consolidation and process management features
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Body
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Body, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import text, func, and_, or_, desc
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any, Literal
+from typing import Optional, List, Dict, Any, Literal, Tuple
 from datetime import datetime, date
 from decimal import Decimal
 import json
@@ -23,6 +24,11 @@ from pathlib import Path
 from database import get_db
 from auth.dependencies import get_current_active_user
 from models.financial_process import *
+from routers import (
+    cash_flow, columnar_export, conditional_get, fact_tables, ic_unrealized_profit, index_manager, pagination,
+    process_executor, process_jobs, process_scheduler, report_cache, roll_forward, scenario_variance,
+    simulation_overlay,
+)
 
 router = APIRouter(prefix="/financial-process", tags=["Financial Process"])
 
@@ -296,6 +302,127 @@ def ensure_financial_tables(conn):
         )
     """)
 
+    # Create run log tables used by the DAG scheduler (per-run and per-node state)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS process_run_logs (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            process_id UUID REFERENCES financial_processes(id) ON DELETE CASCADE,
+            entity_id VARCHAR(255),
+            scenario_id UUID,
+            start_time TIMESTAMP NOT NULL,
+            end_time TIMESTAMP,
+            status VARCHAR(20) NOT NULL, -- 'Running', 'Completed', 'Error', 'Cancelled'
+            nodes_executed INTEGER DEFAULT 0,
+            nodes_failed INTEGER DEFAULT 0,
+            summary JSONB DEFAULT '{}',
+            executed_by UUID,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS process_node_run_logs (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            run_log_id UUID REFERENCES process_run_logs(id) ON DELETE CASCADE,
+            node_id UUID REFERENCES financial_process_nodes(id) ON DELETE CASCADE,
+            start_time TIMESTAMP NOT NULL,
+            end_time TIMESTAMP,
+            status VARCHAR(20) NOT NULL, -- 'Running', 'Completed', 'Error', 'Skipped', 'Cancelled'
+            input_data JSONB DEFAULT '{}',
+            output_data JSONB DEFAULT '{}',
+            error_message TEXT,
+            execution_time_ms INTEGER,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+
+    # Simulation run headers; the changed rows live in {process}_{type}_entries_overlay
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS process_simulation_runs (
+            id VARCHAR(100) PRIMARY KEY,
+            process_id UUID REFERENCES financial_processes(id) ON DELETE CASCADE,
+            data_type VARCHAR(50) NOT NULL,
+            name VARCHAR(255),
+            scenario_id UUID,
+            status VARCHAR(20) NOT NULL DEFAULT 'Open', -- 'Open', 'Promoted', 'Discarded'
+            rows_changed INTEGER DEFAULT 0,
+            rows_deleted INTEGER DEFAULT 0,
+            created_by VARCHAR(100),
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW(),
+            promoted_at TIMESTAMP
+        )
+    """)
+
+    # Period-end balance snapshots written by the roll-forward engine
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS process_balance_snapshot_runs (
+            process_id UUID REFERENCES financial_processes(id) ON DELETE CASCADE,
+            scenario_key VARCHAR(36) NOT NULL DEFAULT '',
+            data_type VARCHAR(50) NOT NULL,
+            retained_earnings_account VARCHAR(50),
+            period_count INTEGER DEFAULT 0,
+            row_count INTEGER DEFAULT 0,
+            is_stale BOOLEAN DEFAULT FALSE,
+            built_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (process_id, scenario_key)
+        )
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS process_balance_snapshots (
+            process_id UUID NOT NULL,
+            scenario_key VARCHAR(36) NOT NULL DEFAULT '',
+            entity_code VARCHAR(50),
+            account_code VARCHAR(50),
+            fiscal_year_id INTEGER,
+            period_id INTEGER NOT NULL,
+            period_code VARCHAR(50),
+            period_seq INTEGER NOT NULL,
+            opening_balance DECIMAL(18,2) DEFAULT 0,
+            movement DECIMAL(18,2) DEFAULT 0,
+            closing_balance DECIMAL(18,2) DEFAULT 0
+        )
+    """)
+
+    # Run journals written through journal_sink (same columns as the consolidation run journals)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS process_run_journals (
+            id SERIAL PRIMARY KEY,
+            run_id VARCHAR(100) NOT NULL,
+            process_id UUID NOT NULL REFERENCES financial_processes(id) ON DELETE CASCADE,
+            journal_key VARCHAR(255) NOT NULL,
+            journal_type VARCHAR(100),
+            period VARCHAR(50),
+            line_count INTEGER DEFAULT 0,
+            total_debit DECIMAL(18,2) DEFAULT 0,
+            total_credit DECIMAL(18,2) DEFAULT 0,
+            is_balanced BOOLEAN DEFAULT FALSE,
+            status VARCHAR(50) DEFAULT 'draft',
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS process_run_journal_lines (
+            run_id VARCHAR(100) NOT NULL,
+            process_id UUID NOT NULL,
+            journal_key VARCHAR(255) NOT NULL,
+            journal_type VARCHAR(100),
+            line_number INTEGER NOT NULL,
+            entity_code VARCHAR(50),
+            account_code VARCHAR(50),
+            counterparty_entity_code VARCHAR(50),
+            period VARCHAR(50),
+            debit_amount DECIMAL(18,2) DEFAULT 0,
+            credit_amount DECIMAL(18,2) DEFAULT 0,
+            currency VARCHAR(10),
+            description TEXT,
+            source VARCHAR(255),
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+
     # Create csv_exports table for tracking CSV file exports
     cur.execute("""
         CREATE TABLE IF NOT EXISTS csv_exports (
@@ -334,6 +461,30 @@ def ensure_financial_tables(conn):
         CREATE INDEX IF NOT EXISTS idx_process_executions 
         ON process_executions(process_id, entity_code, status)
     """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_run_logs_process 
+        ON process_run_logs(process_id, start_time)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_node_run_logs 
+        ON process_node_run_logs(run_log_id, node_id)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_simulation_runs_process 
+        ON process_simulation_runs(process_id, status)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_balance_snapshots_lookup 
+        ON process_balance_snapshots(process_id, scenario_key, period_id, entity_code, account_code)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_process_run_journals 
+        ON process_run_journals(process_id, period)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_process_run_journal_lines 
+        ON process_run_journal_lines(process_id, period, journal_key)
+    """)
     cur.execute("""
         CREATE INDEX IF NOT EXISTS idx_csv_exports 
         ON csv_exports(process_id, entity_code, export_type)
@@ -829,6 +980,16 @@ async def create_connection(
         connection_id = str(uuid.uuid4())
         with company_connection(company_name) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
+
+            # Reject connections that would close a cycle in the node graph
+            cur.execute(
+                "SELECT from_node_id, to_node_id FROM process_connections WHERE process_id = %s",
+                (process_id,)
+            )
+            edges = [(str(r["from_node_id"]), str(r["to_node_id"])) for r in cur.fetchall()]
+            edges.append((str(connection_data.get("from_node_id")), str(connection_data.get("to_node_id"))))
+            process_scheduler.assert_acyclic({node for edge in edges for node in edge}, edges)
+
             cur.execute(
                 """
                 INSERT INTO process_connections 
@@ -858,6 +1019,8 @@ async def create_connection(
 
     except HTTPException:
         raise
+    except process_scheduler.ProcessGraphCycleError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating connection: {str(e)}")
 
@@ -1094,14 +1257,22 @@ async def execute_process(
 # REFERENCE DATA
 # ============================================================================
 
+REFERENCE_DOMAINS = [report_cache.REFERENCE_DOMAIN]
+
 @router.get("/reference-data")
 async def get_reference_data(
+    request: Request,
+    response: Response,
     company_name: str = Query(...),
     current_user = Depends(get_current_active_user)
 ):
-    """Get reference data for process building"""
+    """Get reference data for process building; revalidated by ETag"""
+    not_modified = conditional_get.not_modified(request, company_name, REFERENCE_DOMAINS)
+    if not_modified:
+        return not_modified
     try:
         with company_connection(company_name) as conn:
+            etag = conditional_get.current_etag(conn, company_name, REFERENCE_DOMAINS)
             cur = conn.cursor(cursor_factory=RealDictCursor)
             
             # Get accounts
@@ -1120,6 +1291,7 @@ async def get_reference_data(
             """)
             entities = [dict(row) for row in cur.fetchall()]
             
+            conditional_get.set_etag(response, etag)
             return {
                 "accounts": accounts,
                 "entities": entities,
@@ -1177,228 +1349,6 @@ async def get_process_alerts(
 # NODE EXECUTION AND STATUS TRACKING
 # ============================================================================
 
-@router.post("/processes/{process_id}/execute-node")
-async def execute_individual_node(
-    process_id: str,
-    node_data: dict = Body(...),
-    company_name: str = Query(...),
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_active_user)
-):
-    """Execute an individual node in the process"""
-    try:
-        company_db_name = f"company_{company_name.lower().replace(' ', '_').replace('-', '_')}"
-        node_id = node_data.get("node_id")
-        node_type = node_data.get("node_type")
-        entities = node_data.get("entities", [])
-        
-        # Create node execution record
-        execution_id = str(uuid.uuid4())
-        
-        create_execution_query = text(f"""
-            INSERT INTO {company_db_name}.process_executions 
-            (id, company_id, process_id, execution_type, status, started_at, executed_by, 
-             execution_data)
-            VALUES (:id, :company_id, :process_id, :execution_type, 'running', NOW(), 
-                    :executed_by, :execution_data)
-        """)
-        
-        execution_data = {
-            "node_id": node_id,
-            "node_type": node_type,
-            "entities": entities,
-            "execution_mode": "individual_node"
-        }
-        
-        db.execute(create_execution_query, {
-            "id": execution_id,
-            "company_id": str(uuid.uuid4()),
-            "process_id": process_id,
-            "execution_type": "node_execution",
-            "executed_by": str(current_user.id),
-            "execution_data": json.dumps(execution_data)
-        })
-        
-        # Simulate node execution based on type
-        import time
-        import random
-        
-        # Simulate processing time
-        processing_time = random.uniform(1, 3)  # 1-3 seconds
-        time.sleep(processing_time)
-        
-        # Simulate success/failure
-        success_rate = 0.9  # 90% success rate
-        is_success = random.random() < success_rate
-        
-        if is_success:
-            results = {
-                "status": "completed",
-                "message": f"{node_type} executed successfully",
-                "entities_processed": len(entities),
-                "processing_time_ms": int(processing_time * 1000),
-                "records_affected": random.randint(10, 100)
-            }
-            status = "success"
-        else:
-            results = {
-                "status": "error",
-                "message": f"Failed to execute {node_type}",
-                "error_details": "Simulated execution error for testing",
-                "processing_time_ms": int(processing_time * 1000)
-            }
-            status = "error"
-        
-        # Update execution record
-        update_execution_query = text(f"""
-            UPDATE {company_db_name}.process_executions 
-            SET status = :status, completed_at = NOW(), 
-                execution_time_ms = :execution_time,
-                results = :results
-            WHERE id = :execution_id
-        """)
-        
-        db.execute(update_execution_query, {
-            "execution_id": execution_id,
-            "status": status,
-            "execution_time": int(processing_time * 1000),
-            "results": json.dumps(results)
-        })
-        
-        db.commit()
-        
-        return {
-            "execution_id": execution_id,
-            "node_id": node_id,
-            "status": status,
-            "results": results
-        }
-        
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Error executing node: {str(e)}")
-
-@router.post("/processes/{process_id}/execute-flow")
-async def execute_process_flow(
-    process_id: str,
-    flow_data: dict = Body(...),
-    company_name: str = Query(...),
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_active_user)
-):
-    """Execute entire process flow sequentially"""
-    try:
-        company_db_name = f"company_{company_name.lower().replace(' ', '_').replace('-', '_')}"
-        
-        flow_mode = flow_data.get("flow_mode", "entity")
-        entities = flow_data.get("entities", [])
-        year = flow_data.get("year")
-        period = flow_data.get("period")
-        
-        # Create flow execution record
-        execution_id = str(uuid.uuid4())
-        
-        create_execution_query = text(f"""
-            INSERT INTO {company_db_name}.process_executions 
-            (id, company_id, process_id, execution_type, status, started_at, executed_by, 
-             execution_data)
-            VALUES (:id, :company_id, :process_id, :execution_type, 'running', NOW(), 
-                    :executed_by, :execution_data)
-        """)
-        
-        execution_data = {
-            "flow_mode": flow_mode,
-            "entities": entities,
-            "year": year,
-            "period": period,
-            "execution_mode": "full_flow"
-        }
-        
-        db.execute(create_execution_query, {
-            "id": execution_id,
-            "company_id": str(uuid.uuid4()),
-            "process_id": process_id,
-            "execution_type": "flow_execution",
-            "executed_by": str(current_user.id),
-            "execution_data": json.dumps(execution_data)
-        })
-        
-        # Define flow steps based on mode
-        if flow_mode == "entity":
-            flow_steps = [
-                "data_input", "journal_entry", "fx_translation", "deferred_tax",
-                "profit_loss", "retained_earnings", "validation", "report_generation"
-            ]
-        else:  # consolidation
-            flow_steps = [
-                "data_input", "intercompany_elimination", "nci_allocation",
-                "goodwill_impairment", "consolidation_output", "report_generation"
-            ]
-        
-        # Execute each step
-        step_results = []
-        total_processing_time = 0
-        
-        for i, step in enumerate(flow_steps):
-            import time
-            import random
-            
-            step_time = random.uniform(0.5, 2.0)  # 0.5-2 seconds per step
-            time.sleep(step_time)
-            total_processing_time += step_time
-            
-            step_result = {
-                "step": i + 1,
-                "node_type": step,
-                "status": "completed",
-                "processing_time_ms": int(step_time * 1000),
-                "entities_processed": len(entities),
-                "records_affected": random.randint(5, 50)
-            }
-            step_results.append(step_result)
-        
-        # Final results
-        results = {
-            "status": "completed",
-            "flow_mode": flow_mode,
-            "total_steps": len(flow_steps),
-            "entities_processed": len(entities),
-            "total_processing_time_ms": int(total_processing_time * 1000),
-            "step_results": step_results,
-            "summary": {
-                "journals_created": random.randint(20, 100),
-                "eliminations_processed": random.randint(5, 25) if flow_mode == "consolidation" else 0,
-                "reports_generated": 3
-            }
-        }
-        
-        # Update execution record
-        update_execution_query = text(f"""
-            UPDATE {company_db_name}.process_executions 
-            SET status = 'success', completed_at = NOW(), 
-                execution_time_ms = :execution_time,
-                results = :results
-            WHERE id = :execution_id
-        """)
-        
-        db.execute(update_execution_query, {
-            "execution_id": execution_id,
-            "execution_time": int(total_processing_time * 1000),
-            "results": json.dumps(results)
-        })
-        
-        db.commit()
-        
-        return {
-            "execution_id": execution_id,
-            "status": "success",
-            "results": results
-        }
-        
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Error executing flow: {str(e)}")
-
 @router.get("/processes/{process_id}/execution-history")
 async def get_execution_history(
     process_id: str,
@@ -1448,6 +1398,15 @@ def create_process_table(conn, process_id: str, process_name: str, data_type: st
     # Sanitize process name for table naming
     safe_process_name = re.sub(r'[^a-zA-Z0-9_]', '_', process_name.lower())
     table_name = f"{safe_process_name}_{data_type}_entries"
+    routed = fact_tables.routed_table(conn, process_id, data_type)
+    if routed:
+        return routed
+    cur.execute("SELECT to_regclass(%s)", (table_name,))
+    if cur.fetchone()[0] is None:
+        # New processes write straight into the partitioned fact table
+        fact_tables.ensure_process_partition(conn, data_type, process_id)
+        conn.commit()
+        return fact_tables.fact_table_name(data_type)
     
     # Create table if it doesn't exist
     if data_type == 'entity_amounts':
@@ -1559,6 +1518,20 @@ def create_process_table(conn, process_id: str, process_name: str, data_type: st
     conn.commit()
     return table_name
 
+def get_process_table_name(conn, process_id: str, data_type: str) -> Optional[str]:
+    """Resolve the process-specific data input table, or None if it has not been created yet"""
+    routed = fact_tables.routed_table(conn, process_id, data_type)
+    if routed:
+        return routed
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("SELECT name FROM financial_processes WHERE id = %s", (process_id,))
+    process_result = cur.fetchone()
+    process_name = process_result['name'] if process_result else f"process_{process_id[:8]}"
+    safe_process_name = re.sub(r'[^a-zA-Z0-9_]', '_', process_name.lower())
+    table_name = f"{safe_process_name}_{data_type}_entries"
+    cur.execute("SELECT to_regclass(%s) AS present", (table_name,))
+    return table_name if cur.fetchone()['present'] else None
+
 def convert_date_to_period(transaction_date: str, conn, company_name: str):
     """Convert transaction date to fiscal period information"""
     try:
@@ -1653,6 +1626,11 @@ async def create_data_input(
                 # Convert transaction date to period information
                 transaction_date = data.get('transaction_date') or data.get('period_date')
                 period_info = convert_date_to_period(transaction_date, conn, company_name)
+                if fact_tables.is_fact_table(table_name):
+                    # Routes the row into its fiscal year partition
+                    period_info['fiscal_year'] = fact_tables.ensure_year_partition(
+                        conn, data_type, process_id, period_info['fiscal_year']
+                    )
                 
                 # Get entity information - handle both entity_id and entity_code
                 entity_info = {}
@@ -1869,7 +1847,9 @@ async def create_data_input(
                     ))
             
                 result = cur.fetchone()
+                roll_forward.mark_stale(conn, process_id)
                 conn.commit()
+                scenario_variance.invalidate_process(company_name, process_id)
                 
                 print(f"✅ Created {data_type} entry in table {table_name}: {result}")
                 return {
@@ -1896,35 +1876,21 @@ async def get_data_input(
     company_name: str = Query(...),
     entity_filter: Optional[str] = Query(None, description="Filter by entity ID or code"),
     year_id: Optional[str] = Query(None, description="Filter by fiscal year"),
-    scenario_id: Optional[str] = Query(None, description="Filter by scenario")
+    scenario_id: Optional[str] = Query(None, description="Filter by scenario"),
+    simulation_run_id: Optional[str] = Query(None, description="Show base data plus this simulation's changes"),
+    limit: int = Query(1000, ge=1, le=10000, description="Entries per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page")
 ):
-    """Get all data input entries for a specific type with optional filtering from process-specific tables"""
+    """Get one page of data input entries for a specific type with optional filtering from process-specific tables"""
     try:
         with company_connection(company_name) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             
-            # Get process information to determine table name
-            cur.execute("SELECT name FROM financial_processes WHERE id = %s", (process_id,))
-            process_result = cur.fetchone()
-            process_name = process_result['name'] if process_result else f"process_{process_id[:8]}"
-            
-            # Generate process-specific table name
-            safe_process_name = re.sub(r'[^a-zA-Z0-9_]', '_', process_name.lower())
-            table_name = f"{safe_process_name}_{data_type}_entries"
-            
-            # Check if table exists
-            cur.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables 
-                    WHERE table_name = %s
-                )
-            """, (table_name,))
-            
-            result = cur.fetchone()
-            table_exists = result['exists'] if result else False
+            # Fact table (pruned to this process's partitions) or the legacy per-process table
+            table_name = get_process_table_name(conn, process_id, data_type)
             
-            if not table_exists:
-                print(f"⚠️ Table {table_name} does not exist, returning empty results")
+            if not table_name:
+                print(f"⚠️ No {data_type} data for process {process_id}, returning empty results")
                 return {
                     "entries": [],
                     "filters": {
@@ -1980,47 +1946,23 @@ async def get_data_input(
                 params.append(scenario_id)
             
             where_clause = " AND ".join(where_conditions)
-            
-            query = f"""
-                SELECT * FROM {table_name}
-                WHERE {where_clause}
-                ORDER BY created_at DESC
-            """
-            
-            print(f"🔍 Executing query: {query}")
-            print(f"📋 Query params: {params}")
-            
-            cur.execute(query, params)
-            entries = cur.fetchall()
-            
-            # Convert to list of dicts for JSON serialization
-            entries_list = []
-            for entry in entries:
-                entry_dict = dict(entry)
-                # Convert any Decimal values to float for JSON serialization
-                for key, value in entry_dict.items():
-                    if isinstance(value, Decimal):
-                        entry_dict[key] = float(value)
-                entries_list.append(entry_dict)
-            
+            source, source_params = simulation_overlay.merged_source(conn, table_name, simulation_run_id)
+
+            # Newest first, keyset-paged on (created_at, id)
+            page = pagination.keyset_page(
+                conn, f"SELECT * FROM {source}", where_clause, source_params + params,
+                ["created_at", "id"], limit, cursor,
+            )
+            entries_list = [dict(entry) for entry in page["rows"]]
+            # Counted once, on the first page; later pages only follow the cursor
+            total_count, total_is_estimate = None, False
+            if not cursor:
+                total_count, total_is_estimate = pagination.estimated_count(
+                    conn, source, where_clause, source_params + params
+                )
+
             print(f"✅ Retrieved {len(entries_list)} entries from table {table_name}")
-            
-            # Debug: Show sample of entries if any exist
-            if entries_list:
-                print(f"📋 Sample entry: {entries_list[0]}")
-            else:
-                # Debug: Check if there are any entries at all in the table
-                cur.execute(f"SELECT COUNT(*) as total FROM {table_name}")
-                total_count = cur.fetchone()['total']
-                print(f"🔍 Total entries in table {table_name}: {total_count}")
-                
-                if total_count > 0:
-                    # Show a sample entry to understand the data structure
-                    cur.execute(f"SELECT * FROM {table_name} LIMIT 1")
-                    sample_entry = cur.fetchone()
-                    if sample_entry:
-                        print(f"📋 Sample entry in table: {dict(sample_entry)}")
-            
+
             return {
                 "entries": entries_list,
                 "filters": {
@@ -2029,11 +1971,17 @@ async def get_data_input(
                     "scenario_id": scenario_id,
                     "data_type": data_type
                 },
-                "total_count": len(entries_list),
+                "total_count": total_count,
+                "total_count_estimated": total_is_estimate,
+                "next_cursor": page["next_cursor"],
+                "has_more": page["has_more"],
                 "table_name": table_name,
-                "table_exists": True
+                "table_exists": True,
+                "simulation_run_id": simulation_run_id
             }
             
+    except pagination.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -2059,11 +2007,13 @@ async def delete_data_input(
             """, (entry_id, process_id))
             
             result = cur.fetchone()
+            roll_forward.mark_stale(conn, process_id)
             conn.commit()
             
             if not result:
                 raise HTTPException(status_code=404, detail="Entry not found")
             
+            scenario_variance.invalidate_process(company_name, process_id)
             return {"message": "Entry deleted successfully"}
             
     except Exception as e:
@@ -2475,6 +2425,9 @@ class ProcessExecutionRequest(BaseModel):
     scenario_id: Optional[str] = None
     flow_mode: str = "entity"
     node_id: Optional[str] = None  # For single node execution
+    node_type: Optional[str] = None  # Falls back to the stored node type
+    max_workers: Optional[int] = None  # Overrides PROCESS_POOL_WORKERS
+    simulation_run_id: Optional[str] = None  # Read base data through this simulation's overlay
 
 class CSVExportRequest(BaseModel):
     entity_codes: List[str] = []
@@ -2710,150 +2663,871 @@ async def get_entity_node_configurations(
 # PROCESS EXECUTION ENDPOINTS
 # ============================================================================
 
-@router.post("/processes/{process_id}/execute-node")
+@router.post("/processes/{process_id}/execute-node", status_code=202)
 async def execute_process_node(
     process_id: str,
     execution_request: ProcessExecutionRequest,
     company_name: str = Query(...),
     current_user = Depends(get_current_active_user)
 ):
-    """Execute a specific process node for selected entities."""
+    """Queue a process node for the selected entities; progress is streamed from /executions/{id}/events."""
     try:
         ensure_tables_via_sqlalchemy(company_name)
         
         with company_connection(company_name) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             
-            # Create execution record
-            execution_id = str(uuid.uuid4())
-            
-            for entity_code in execution_request.entities:
+            node_type = execution_request.node_type
+            if execution_request.node_id:
                 cur.execute("""
-                    INSERT INTO process_executions 
-                    (id, process_id, entity_code, node_id, execution_type, status, 
-                     start_time, execution_data, created_at)
-                    VALUES (%s, %s, %s, %s, 'node', 'running', NOW(), %s, NOW())
-                """, (
-                    str(uuid.uuid4()),
+                    SELECT node_type FROM financial_process_nodes
+                    WHERE id = %s AND process_id = %s
+                """, (execution_request.node_id, process_id))
+                node_row = cur.fetchone()
+                if not node_row:
+                    raise HTTPException(status_code=404, detail="Node not found")
+                node_type = node_row['node_type']
+            if not node_type:
+                raise HTTPException(status_code=400, detail="node_id or node_type is required")
+            try:
+                process_executor.check_node_type(node_type)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        
+        def _work(job):
+            with company_connection(company_name) as conn:
+                # None when no data has been entered yet; entities then run on empty balances
+                table_name = get_process_table_name(conn, process_id, 'entity_amounts')
+                return process_executor.execute_node_for_entities(
+                    conn,
+                    table_name,
                     process_id,
-                    entity_code,
                     execution_request.node_id,
-                    json.dumps({
+                    node_type,
+                    execution_request.entities,
+                    {
                         "fiscal_year": execution_request.fiscal_year,
                         "periods": execution_request.periods,
                         "scenario_id": execution_request.scenario_id,
-                        "flow_mode": execution_request.flow_mode
-                    })
-                ))
-            
-            conn.commit()
-            
-            # Simulate processing time
-            import time
-            time.sleep(2)
-            
-            # Update execution status to completed
-            cur.execute("""
-                UPDATE process_executions 
-                SET status = 'completed', end_time = NOW()
-                WHERE process_id = %s AND node_id = %s
-            """, (process_id, execution_request.node_id))
-            
-            conn.commit()
-            
-            return {
-                "message": "Node executed successfully",
-                "execution_id": execution_id,
-                "entities_processed": len(execution_request.entities)
-            }
+                        "flow_mode": execution_request.flow_mode,
+                        "node_type": node_type,
+                        "simulation_run_id": execution_request.simulation_run_id
+                    },
+                    max_workers=execution_request.max_workers,
+                    execution_id=job.execution_id,
+                    job=job
+                )
+        
+        job = process_jobs.submit_job(process_id, "node", _work)
+        return _execution_accepted(process_id, job, company_name)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error executing node: {str(e)}")
 
-@router.post("/processes/{process_id}/execute-flow")
+@router.post("/processes/{process_id}/execute-flow", status_code=202)
 async def execute_full_process_flow(
     process_id: str,
     execution_request: ProcessExecutionRequest,
     company_name: str = Query(...),
+    resume_run_id: Optional[str] = Query(None, description="Resume a failed run from its failed nodes"),
     current_user = Depends(get_current_active_user)
 ):
-    """Execute the complete process flow for selected entities."""
+    """Queue the complete process flow (DAG order) for selected entities; returns the run id immediately."""
     try:
         ensure_tables_via_sqlalchemy(company_name)
         
+        # Cycles and unknown resume runs fail the request instead of the background job
         with company_connection(company_name) as conn:
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            
-            # Get all nodes for this process
-            cur.execute("""
-                SELECT id, node_type, sequence 
-                FROM financial_process_nodes 
-                WHERE process_id = %s AND is_active = true
-                ORDER BY sequence
-            """, (process_id,))
-            
-            nodes = cur.fetchall()
-            
-            execution_id = str(uuid.uuid4())
-            
-            # Create execution records for full flow
-            for entity_code in execution_request.entities:
-                cur.execute("""
-                    INSERT INTO process_executions 
-                    (id, process_id, entity_code, execution_type, status, 
-                     start_time, execution_data, created_at)
-                    VALUES (%s, %s, %s, 'full_process', 'running', NOW(), %s, NOW())
-                """, (
-                    str(uuid.uuid4()),
+            process_scheduler.check_flow(conn, process_id, resume_run_id)
+        
+        def _work(job):
+            with company_connection(company_name) as conn:
+                table_name = get_process_table_name(conn, process_id, 'entity_amounts')
+                return process_scheduler.run_process_flow(
+                    conn,
+                    lambda: company_connection(company_name),
                     process_id,
-                    entity_code,
-                    json.dumps({
+                    table_name,
+                    execution_request.entities,
+                    {
                         "fiscal_year": execution_request.fiscal_year,
                         "periods": execution_request.periods,
                         "scenario_id": execution_request.scenario_id,
                         "flow_mode": execution_request.flow_mode,
-                        "nodes_count": len(nodes)
-                    })
-                ))
-            
-            conn.commit()
-            
-            # Simulate processing
-            import time
-            time.sleep(5)
-            
-            # Update execution status
-            cur.execute("""
-                UPDATE process_executions 
-                SET status = 'completed', end_time = NOW()
-                WHERE process_id = %s AND execution_type = 'full_process'
-            """, (process_id,))
-            
-            conn.commit()
-            
-            return {
-                "message": "Full process flow executed successfully",
-                "execution_id": execution_id,
-                "entities_processed": len(execution_request.entities),
-                "nodes_executed": len(nodes)
-            }
+                        "simulation_run_id": execution_request.simulation_run_id
+                    },
+                    resume_run_id=resume_run_id,
+                    run_id=job.execution_id,
+                    job=job
+                )
         
+        # The run id doubles as the execution id so /runs/{id} and the event stream line up
+        job = process_jobs.submit_job(process_id, "flow", _work, execution_id=resume_run_id)
+        return _execution_accepted(process_id, job, company_name)
+        
+    except process_scheduler.ProcessGraphCycleError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error executing process flow: {str(e)}")
 
-# ============================================================================
-# CSV EXPORT ENDPOINTS
-# ============================================================================
+def _execution_accepted(process_id: str, job, company_name: str) -> Dict[str, Any]:
+    """Response body for a queued execution."""
+    base = f"/api/financial-process/processes/{process_id}/executions/{job.execution_id}"
+    return {
+        "message": "Execution queued",
+        "execution_id": job.execution_id,
+        "status": job.status,
+        "status_url": f"{base}?company_name={company_name}",
+        "events_url": f"{base}/events?company_name={company_name}",
+        "cancel_url": f"{base}/cancel?company_name={company_name}"
+    }
 
-@router.post("/processes/{process_id}/export-csv")
-async def export_process_data_to_csv(
+def _get_process_job(process_id: str, execution_id: str):
+    job = process_jobs.get_job(execution_id)
+    if not job or job.process_id != process_id:
+        raise HTTPException(status_code=404, detail="Execution not found on this server")
+    return job
+
+@router.get("/processes/{process_id}/executions/{execution_id}")
+async def get_execution_status(
     process_id: str,
-    export_request: CSVExportRequest,
+    execution_id: str,
     company_name: str = Query(...),
     current_user = Depends(get_current_active_user)
 ):
-    """Export process data to CSV files for consolidation."""
-    try:
+    """Get the current state of a background execution."""
+    return _get_process_job(process_id, execution_id).snapshot()
+
+@router.get("/processes/{process_id}/executions/{execution_id}/events")
+async def stream_execution_events(
+    process_id: str,
+    execution_id: str,
+    request: Request,
+    company_name: str = Query(...),
+    current_user = Depends(get_current_active_user)
+):
+    """Server-Sent Events stream of per-node progress (started, rows processed, finished, error)."""
+    job = _get_process_job(process_id, execution_id)
+    last_event_id = request.headers.get("last-event-id")
+    return StreamingResponse(
+        process_jobs.stream_events(job, int(last_event_id) if last_event_id and last_event_id.isdigit() else 0),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/processes/{process_id}/executions/{execution_id}/cancel")
+async def cancel_execution(
+    process_id: str,
+    execution_id: str,
+    company_name: str = Query(...),
+    current_user = Depends(get_current_active_user)
+):
+    """Request cancellation; running nodes stop after their current batch."""
+    job = _get_process_job(process_id, execution_id)
+    process_jobs.cancel_job(execution_id)
+    return {"execution_id": execution_id, "status": job.status, "cancel_requested": True}
+
+@router.get("/processes/{process_id}/runs/{run_id}")
+async def get_process_run(
+    process_id: str,
+    run_id: str,
+    company_name: str = Query(...),
+    current_user = Depends(get_current_active_user)
+):
+    """Get a flow run with per-node start/end times, outputs and failure state."""
+    try:
+        with company_connection(company_name) as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            
+            cur.execute("""
+                SELECT id, status, start_time, end_time, nodes_executed, nodes_failed, summary
+                FROM process_run_logs
+                WHERE id = %s AND process_id = %s
+            """, (run_id, process_id))
+            run = cur.fetchone()
+            if not run:
+                raise HTTPException(status_code=404, detail="Run not found")
+            
+            cur.execute("""
+                SELECT l.node_id, n.name, n.node_type, l.status, l.start_time, l.end_time,
+                       l.input_data, l.output_data, l.error_message, l.execution_time_ms
+                FROM process_node_run_logs l
+                LEFT JOIN financial_process_nodes n ON n.id = l.node_id
+                WHERE l.run_log_id = %s
+                ORDER BY l.start_time
+            """, (run_id,))
+            
+            return {
+                "run": dict(run),
+                "nodes": [dict(row) for row in cur.fetchall()]
+            }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching run: {str(e)}")
+
+# ============================================================================
+# SIMULATION OVERLAYS
+# ============================================================================
+
+class SimulationCreate(BaseModel):
+    data_type: str = "entity_amounts"
+    name: Optional[str] = None
+    scenario_id: Optional[str] = None
+
+class SimulationChange(BaseModel):
+    op: Literal["upsert", "delete"] = "upsert"
+    id: Optional[str] = None  # Base or overlay row id; omitted for new rows
+    values: Dict[str, Any] = {}
+
+class SimulationChanges(BaseModel):
+    changes: List[SimulationChange]
+
+def _simulation_table(conn, process_id: str, run_id: str):
+    """Return (run, base table name) for a simulation run or raise 404."""
+    try:
+        run = simulation_overlay.get_run(conn, process_id, run_id)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    table_name = get_process_table_name(conn, process_id, run['data_type'])
+    if not table_name:
+        raise HTTPException(status_code=404, detail=f"No {run['data_type']} data for this process")
+    return run, table_name
+
+@router.post("/processes/{process_id}/simulations")
+async def create_simulation(
+    process_id: str,
+    simulation: SimulationCreate,
+    company_name: str = Query(...),
+    current_user = Depends(get_current_active_user)
+):
+    """Open a simulation run; changes are stored as an overlay on the process data."""
+    try:
+        ensure_tables_via_sqlalchemy(company_name)
+        
+        with company_connection(company_name) as conn:
+            table_name = get_process_table_name(conn, process_id, simulation.data_type)
+            if not table_name:
+                raise HTTPException(status_code=404, detail=f"No {simulation.data_type} data for this process")
+            simulation_overlay.ensure_overlay_table(conn, table_name)
+            
+            run_id = simulation_overlay.new_run_id()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute("""
+                INSERT INTO process_simulation_runs (id, process_id, data_type, name, scenario_id, created_by)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                RETURNING *
+            """, (run_id, process_id, simulation.data_type, simulation.name,
+                  simulation.scenario_id, str(current_user.id)))
+            run = cur.fetchone()
+            conn.commit()
+            
+            return {"simulation": dict(run), "overlay_table": simulation_overlay.overlay_table_name(table_name)}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating simulation: {str(e)}")
+
+@router.get("/processes/{process_id}/simulations/{run_id}")
+async def get_simulation(
+    process_id: str,
+    run_id: str,
+    company_name: str = Query(...)
+):
+    """Simulation run header plus the size of its overlay."""
+    try:
+        with company_connection(company_name) as conn:
+            run, table_name = _simulation_table(conn, process_id, run_id)
+            return {
+                "simulation": dict(run),
+                "overlay": simulation_overlay.overlay_stats(conn, table_name, run_id)
+            }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching simulation: {str(e)}")
+
+@router.post("/processes/{process_id}/simulations/{run_id}/changes")
+async def record_simulation_changes(
+    process_id: str,
+    run_id: str,
+    payload: SimulationChanges,
+    company_name: str = Query(...),
+    current_user = Depends(get_current_active_user)
+):
+    """Record row upserts/deletes in the simulation overlay without touching the base data."""
+    try:
+        with company_connection(company_name) as conn:
+            _, table_name = _simulation_table(conn, process_id, run_id)
+            try:
+                counts = simulation_overlay.record_changes(
+                    conn, table_name, process_id, run_id,
+                    [change.model_dump() for change in payload.changes]
+                )
+            except simulation_overlay.SimulationStateError as e:
+                conn.rollback()
+                raise HTTPException(status_code=409, detail=str(e))
+            except ValueError as e:
+                conn.rollback()
+                raise HTTPException(status_code=400, detail=str(e))
+            conn.commit()
+            
+            return {
+                "simulation_run_id": run_id,
+                "applied": counts,
+                "overlay": simulation_overlay.overlay_stats(conn, table_name, run_id)
+            }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error recording simulation changes: {str(e)}")
+
+@router.post("/processes/{process_id}/simulations/{run_id}/promote")
+async def promote_simulation(
+    process_id: str,
+    run_id: str,
+    company_name: str = Query(...),
+    current_user = Depends(get_current_active_user)
+):
+    """Apply the simulation's delta to the process data in one transaction."""
+    try:
+        with company_connection(company_name) as conn:
+            _, table_name = _simulation_table(conn, process_id, run_id)
+            try:
+                result = simulation_overlay.promote(conn, table_name, process_id, run_id)
+            except simulation_overlay.SimulationStateError as e:
+                conn.rollback()
+                raise HTTPException(status_code=409, detail=str(e))
+            roll_forward.mark_stale(conn, process_id)
+            conn.commit()
+            scenario_variance.invalidate_process(company_name, process_id)
+            
+            print(f"✅ Promoted simulation {run_id} into {table_name}: {result}")
+            return {"simulation_run_id": run_id, "status": "Promoted", **result}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error promoting simulation: {str(e)}")
+
+@router.delete("/processes/{process_id}/simulations/{run_id}")
+async def discard_simulation(
+    process_id: str,
+    run_id: str,
+    company_name: str = Query(...),
+    current_user = Depends(get_current_active_user)
+):
+    """Discard a simulation; only its overlay rows are removed."""
+    try:
+        with company_connection(company_name) as conn:
+            _, table_name = _simulation_table(conn, process_id, run_id)
+            try:
+                dropped = simulation_overlay.discard(conn, table_name, process_id, run_id)
+            except simulation_overlay.SimulationStateError as e:
+                conn.rollback()
+                raise HTTPException(status_code=409, detail=str(e))
+            conn.commit()
+            
+            return {"simulation_run_id": run_id, "status": "Discarded", "overlay_rows_dropped": dropped}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error discarding simulation: {str(e)}")
+
+# ============================================================================
+# BALANCE ROLL-FORWARD
+# ============================================================================
+
+@router.post("/processes/{process_id}/balances/roll-forward")
+async def build_balance_snapshots(
+    process_id: str,
+    company_name: str = Query(...),
+    scenario_id: Optional[str] = Query(None),
+    data_type: str = Query("entity_amounts"),
+    retained_earnings_account: Optional[str] = Query(None),
+    current_user = Depends(get_current_active_user)
+):
+    """Roll balances forward over the fiscal calendar and store period-end snapshots."""
+    try:
+        with company_connection(company_name) as conn:
+            table_name = get_process_table_name(conn, process_id, data_type)
+            if not table_name:
+                raise HTTPException(status_code=404, detail=f"No {data_type} data for this process")
+            calendar = roll_forward.load_calendar(conn)
+            if not calendar:
+                raise HTTPException(status_code=400, detail="No fiscal periods defined; set up fiscal years first")
+            
+            retained_earnings_account = retained_earnings_account or roll_forward.default_retained_earnings_account(conn)
+            movements = roll_forward.load_movements(conn, table_name, process_id, scenario_id, calendar)
+            try:
+                result = roll_forward.roll_forward(
+                    movements, calendar, roll_forward.load_account_classes(conn), retained_earnings_account
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            written = roll_forward.write_snapshots(
+                conn, process_id, scenario_id, calendar, result, data_type, retained_earnings_account
+            )
+            
+            unmatched = int((movements["period_seq"] < 0).sum())
+            print(f"✅ Rolled forward {len(result['entity_code'])} balances over {len(calendar)} periods "
+                  f"for process {process_id} ({written['rows_written']} snapshot rows)")
+            return {
+                "process_id": process_id,
+                "scenario_id": scenario_id,
+                "periods": len(calendar),
+                "balance_keys": len(result["entity_code"]),
+                "movement_rows": len(movements["amount"]),
+                "unmatched_period_rows": unmatched,
+                "retained_earnings_account": retained_earnings_account,
+                "year_end_close": result["year_end_close"],
+                **written
+            }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error rolling balances forward: {str(e)}")
+
+@router.get("/processes/{process_id}/balances/as-of")
+async def get_balances_as_of(
+    process_id: str,
+    company_name: str = Query(...),
+    period_id: Optional[int] = Query(None),
+    period_code: Optional[str] = Query(None),
+    fiscal_year_id: Optional[int] = Query(None),
+    scenario_id: Optional[str] = Query(None),
+    entities: List[str] = Query([]),
+    accounts: List[str] = Query([])
+):
+    """Opening, movement and closing balances of one period, read from the snapshots."""
+    try:
+        with company_connection(company_name) as conn:
+            if period_id is None:
+                if not period_code:
+                    raise HTTPException(status_code=400, detail="period_id or period_code is required")
+                cur = conn.cursor()
+                cur.execute("""
+                    SELECT id FROM periods
+                    WHERE period_code = %s AND (%s IS NULL OR fiscal_year_id = %s)
+                    ORDER BY start_date
+                """, (period_code, fiscal_year_id, fiscal_year_id))
+                matches = cur.fetchall()
+                if not matches:
+                    raise HTTPException(status_code=404, detail=f"Period {period_code} not found")
+                if len(matches) > 1:
+                    raise HTTPException(status_code=400, detail=f"Period {period_code} exists in several fiscal years; pass fiscal_year_id")
+                period_id = matches[0][0]
+            
+            try:
+                result = roll_forward.balances_as_of(conn, process_id, scenario_id, period_id, entities, accounts)
+            except LookupError as e:
+                raise HTTPException(status_code=404, detail=str(e))
+            
+            return {
+                "process_id": process_id,
+                "period_id": period_id,
+                "is_stale": result["snapshot"]["is_stale"],
+                "built_at": result["snapshot"]["built_at"],
+                "balances": [dict(row) for row in result["balances"]],
+                "total_count": len(result["balances"])
+            }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching balances: {str(e)}")
+
+# ============================================================================
+# CASH FLOW
+# ============================================================================
+
+class CashFlowMapping(BaseModel):
+    account_code: str
+    section: Optional[str] = None  # operating / investing / financing / fx / cash / excluded; None drops the override
+    line_name: Optional[str] = None
+    is_non_cash: bool = False
+    sign: Optional[int] = None  # Cash effect of an increase; defaults from the account class
+
+@router.get("/processes/{process_id}/cash-flow")
+async def get_cash_flow(
+    process_id: str,
+    company_name: str = Query(...),
+    period_ids: List[str] = Query(...),
+    scenario_id: Optional[str] = Query(None),
+    entities: List[str] = Query([]),
+    consolidated: bool = Query(True),
+    by_period: bool = Query(False)
+):
+    """Indirect cash-flow statement of every entity (and the group) from the balance snapshots.
+
+    Flows are added up over the requested periods; ``by_period`` adds one
+    statement per period as well.
+    """
+    try:
+        with company_connection(company_name) as conn:
+            try:
+                result = cash_flow.generate(conn, process_id, scenario_id, period_ids, entities, consolidated)
+            except LookupError as e:
+                raise HTTPException(status_code=404, detail=str(e))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            
+            all_periods = list(range(len(result["periods"])))
+            statements = {}
+            for index, entity_code in enumerate(result["entity_codes"]):
+                statements[entity_code] = cash_flow.statement(result, index, all_periods)
+                if by_period:
+                    statements[entity_code]["periods"] = [
+                        {**result["periods"][period], **cash_flow.statement(result, index, [period])}
+                        for period in all_periods
+                    ]
+            return {
+                "process_id": process_id,
+                "scenario_id": scenario_id,
+                "periods": result["periods"],
+                "entities": result["entity_codes"],
+                "is_stale": result["is_stale"],
+                "built_at": result["built_at"],
+                "statements": statements
+            }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating cash flow: {str(e)}")
+
+@router.get("/cash-flow/mappings")
+async def get_cash_flow_mappings(company_name: str = Query(...)):
+    """Cash-flow line of every account, defaults and configured overrides."""
+    try:
+        with company_connection(company_name) as conn:
+            mapping = cash_flow.load_mapping(conn)
+            return {
+                "sections": list(cash_flow.MAPPING_SECTIONS),
+                "mappings": [{"account_code": code, **line} for code, line in sorted(mapping.items())]
+            }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching cash-flow mappings: {str(e)}")
+
+@router.put("/cash-flow/mappings")
+async def save_cash_flow_mappings(
+    mappings: List[CashFlowMapping],
+    company_name: str = Query(...),
+    current_user = Depends(get_current_active_user)
+):
+    """Override the cash-flow line of accounts."""
+    try:
+        with company_connection(company_name) as conn:
+            try:
+                saved = cash_flow.save_mapping(conn, [mapping.model_dump() for mapping in mappings])
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            return {"success": True, "saved": saved}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error saving cash-flow mappings: {str(e)}")
+
+# ============================================================================
+# INTERCOMPANY UNREALIZED PROFIT
+# ============================================================================
+
+class UnrealizedProfitRatio(BaseModel):
+    seller_entity: Optional[str] = None  # Blank matches any seller
+    buyer_entity: Optional[str] = None
+    product_class: Optional[str] = None
+    margin: Optional[float] = None
+    on_hand_ratio: Optional[float] = None
+
+class UnrealizedProfitRequest(BaseModel):
+    period_code: str
+    scenario_id: Optional[str] = None
+    default_margin: float = 0.0
+    default_on_hand_ratio: float = 1.0
+    tax_rate: float = 0.25
+    ratios: List[UnrealizedProfitRatio] = []
+    accounts: Dict[str, str] = {}
+    post_journals: bool = True
+
+@router.post("/processes/{process_id}/ic/unrealized-profit")
+async def eliminate_unrealized_profit(
+    process_id: str,
+    request: UnrealizedProfitRequest,
+    company_name: str = Query(...),
+    current_user = Depends(get_current_active_user)
+):
+    """Eliminate unrealized profit on IC inventory and asset transfers held by the buyer."""
+    try:
+        unknown = set(request.accounts) - set(ic_unrealized_profit.DEFAULT_ACCOUNTS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown account settings: {sorted(unknown)}")
+        
+        with company_connection(company_name) as conn:
+            table_name = get_process_table_name(conn, process_id, 'ic_amounts')
+            if not table_name:
+                raise HTTPException(status_code=404, detail="No ic_amounts data for this process")
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute("SELECT reporting_currency FROM financial_processes WHERE id = %s", (process_id,))
+            process_row = cur.fetchone()
+            
+            result = ic_unrealized_profit.run_elimination(
+                conn, table_name, process_id, request.period_code, request.scenario_id,
+                [ratio.model_dump() for ratio in request.ratios],
+                request.default_margin, request.default_on_hand_ratio, request.tax_rate,
+                accounts=request.accounts, post=request.post_journals,
+                currency=(process_row or {}).get('reporting_currency'),
+            )
+            
+            groups = result.pop("groups")
+            print(f"✅ Unrealized profit for process {process_id} {request.period_code}: "
+                  f"{result['total_unrealized_profit']} over {result['lines']} IC lines")
+            return {
+                "process_id": process_id,
+                "period_code": request.period_code,
+                **result,
+                "groups": groups.to_dict(orient="records")
+            }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error eliminating unrealized profit: {str(e)}")
+
+@router.get("/processes/{process_id}/journals")
+async def get_process_run_journals(
+    process_id: str,
+    company_name: str = Query(...),
+    period: Optional[str] = Query(None),
+    include_lines: bool = Query(False)
+):
+    """Run journals generated for a process, with their totals."""
+    try:
+        with company_connection(company_name) as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            conditions = ["process_id = %s"]
+            params: List[Any] = [process_id]
+            if period:
+                conditions.append("period = %s")
+                params.append(period)
+            cur.execute(f"""
+                SELECT * FROM process_run_journals
+                WHERE {' AND '.join(conditions)}
+                ORDER BY period, journal_key
+            """, params)
+            journals = [dict(j) for j in cur.fetchall()]
+            
+            if include_lines and journals:
+                cur.execute(f"""
+                    SELECT * FROM process_run_journal_lines
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY journal_key, line_number
+                """, params)
+                lines: Dict[str, List[Dict[str, Any]]] = {}
+                for line in cur.fetchall():
+                    lines.setdefault(line['journal_key'], []).append(dict(line))
+                for journal in journals:
+                    journal['lines'] = lines.get(journal['journal_key'], [])
+            
+            return {"journals": journals, "total_count": len(journals)}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching journals: {str(e)}")
+
+# ============================================================================
+# PROCESS TABLE INDEXES
+# ============================================================================
+
+def _process_entry_tables(conn, process_id: str) -> List[str]:
+    """Existing data input tables of a process."""
+    tables = [get_process_table_name(conn, process_id, data_type) for data_type in index_manager.DATA_TYPES]
+    return [table for table in tables if table]
+
+def _process_index_tables(conn, process_id: str) -> Tuple[List[str], List[str]]:
+    """A process's legacy entry tables and, when routed to the fact tables, its leaf partitions."""
+    tables = _process_entry_tables(conn, process_id)
+    legacy = [table for table in tables if not fact_tables.is_fact_table(table)]
+    if len(legacy) == len(tables):
+        return legacy, []
+    return legacy, fact_tables.leaf_partitions(conn, process_id)
+
+def _require_legacy_tables(conn, process_id: str) -> List[str]:
+    """Legacy entry tables of a process; 409 when all its data lives in the fact tables."""
+    legacy, partitions = _process_index_tables(conn, process_id)
+    if not legacy and partitions:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Process {process_id} is stored in the partitioned fact tables; their indexes are "
+                   f"managed on the parent tables and cannot be backfilled or dropped per process"
+        )
+    if not legacy:
+        raise HTTPException(status_code=404, detail=f"Process {process_id} has no data tables")
+    return legacy
+
+@router.post("/processes/{process_id}/indexes/backfill", status_code=202)
+async def backfill_process_indexes(
+    process_id: str,
+    company_name: str = Query(...),
+    all_processes: bool = Query(False, description="Backfill every process table in the company"),
+    current_user = Depends(get_current_active_user)
+):
+    """Queue a CREATE INDEX CONCURRENTLY backfill of the filter indexes on existing process tables."""
+    table_names = None
+    if not all_processes:
+        with company_connection(company_name) as conn:
+            table_names = _require_legacy_tables(conn, process_id)
+
+    def _work(job):
+        with company_connection(company_name) as conn:
+            return index_manager.backfill_indexes(
+                conn, table_names,
+                progress=job.emit
+            )
+    
+    job = process_jobs.submit_job(process_id, "index_backfill", _work)
+    return _execution_accepted(process_id, job, company_name)
+
+@router.get("/processes/{process_id}/indexes")
+async def get_process_index_usage(
+    process_id: str,
+    company_name: str = Query(...),
+    current_user = Depends(get_current_active_user)
+):
+    """Scan counts and sizes of the indexes on a process's data tables (pg_stat_user_indexes).
+
+    For processes stored in the fact tables, one row per index of each of
+    the process's partitions, with the parent index it was cloned from.
+    """
+    try:
+        with company_connection(company_name) as conn:
+            legacy, partitions = _process_index_tables(conn, process_id)
+            indexes = index_manager.index_usage(conn, legacy, partitions=partitions)
+            return {
+                "indexes": indexes,
+                "unused": [i["index_name"] for i in indexes if i["unused"] and i["managed"]],
+                "total_size_bytes": sum(i["size_bytes"] or 0 for i in indexes)
+            }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading index usage: {str(e)}")
+
+@router.post("/processes/{process_id}/indexes/drop-unused")
+async def drop_unused_process_indexes(
+    process_id: str,
+    company_name: str = Query(...),
+    dry_run: bool = Query(True, description="Only list the indexes that would be dropped"),
+    current_user = Depends(get_current_active_user)
+):
+    """Drop managed indexes that have not been scanned since statistics were last reset."""
+    try:
+        with company_connection(company_name) as conn:
+            dropped = index_manager.drop_unused_indexes(conn, _require_legacy_tables(conn, process_id), dry_run=dry_run)
+            return {"dry_run": dry_run, "indexes": dropped}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error dropping unused indexes: {str(e)}")
+
+# ============================================================================
+# FACT TABLE PARTITIONS
+# ============================================================================
+
+@router.post("/processes/{process_id}/fact-tables/migrate", status_code=202)
+async def migrate_process_to_fact_tables(
+    process_id: str,
+    company_name: str = Query(...),
+    all_processes: bool = Query(False, description="Migrate every legacy process table in the company"),
+    current_user = Depends(get_current_active_user)
+):
+    """Queue moving legacy per-process entry tables into the partitioned fact tables."""
+    def _work(job):
+        with company_connection(company_name) as conn:
+            table_names = None if all_processes else _process_entry_tables(conn, process_id)
+            result = fact_tables.migrate_all(conn, table_names)
+            for migrated in result["migrated"]:
+                for migrated_process in migrated["processes"]:
+                    roll_forward.mark_stale(conn, migrated_process)
+                    scenario_variance.invalidate_process(company_name, migrated_process)
+                job.emit("table_migrated", table=migrated["table"], rows=migrated["rows"])
+            conn.commit()
+            return result
+    
+    job = process_jobs.submit_job(process_id, "fact_migration", _work)
+    return _execution_accepted(process_id, job, company_name)
+
+@router.get("/processes/{process_id}/fact-partitions")
+async def get_process_fact_partitions(
+    process_id: str,
+    company_name: str = Query(...),
+    current_user = Depends(get_current_active_user)
+):
+    """Fact table partitions of a process with their status and row counts."""
+    try:
+        with company_connection(company_name) as conn:
+            return {"partitions": fact_tables.partitions(conn, process_id)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error listing partitions: {str(e)}")
+
+@router.post("/processes/{process_id}/fact-partitions/{data_type}/{action}")
+async def change_fact_partition(
+    process_id: str,
+    data_type: str,
+    action: str,
+    fiscal_year: str = Query(..., description="Fiscal year as stored on the entries"),
+    company_name: str = Query(...),
+    current_user = Depends(get_current_active_user)
+):
+    """Archive (detach) or restore (re-attach) the partition of a closed fiscal year."""
+    if action not in ("archive", "restore"):
+        raise HTTPException(status_code=404, detail=f"Unknown partition action: {action}")
+    if data_type not in fact_tables.DATA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown data type: {data_type}")
+    try:
+        with company_connection(company_name) as conn:
+            if action == "archive":
+                result = fact_tables.archive_year(conn, data_type, process_id, fiscal_year)
+            else:
+                result = fact_tables.restore_year(conn, data_type, process_id, fiscal_year)
+            roll_forward.mark_stale(conn, process_id)
+            conn.commit()
+            scenario_variance.invalidate_process(company_name, process_id)
+            return result
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error changing partition: {str(e)}")
+
+# ============================================================================
+# CSV EXPORT ENDPOINTS
+# ============================================================================
+
+@router.post("/processes/{process_id}/export-csv")
+async def export_process_data_to_csv(
+    process_id: str,
+    export_request: CSVExportRequest,
+    company_name: str = Query(...),
+    current_user = Depends(get_current_active_user)
+):
+    """Export process data to CSV files for consolidation."""
+    try:
         ensure_tables_via_sqlalchemy(company_name)
         csv_dir = ensure_csv_directory(company_name)
         
@@ -2971,6 +3645,97 @@ async def get_csv_export_history(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching export history: {str(e)}")
 
+def ensure_columnar_directory(company_name: str, process_id: str) -> str:
+    """Ensure the Parquet dataset directory of a process exists and return its path."""
+    columnar_dir = Path(f"./columnar_exports/{normalize_company_db_name(company_name)}/{process_id}")
+    columnar_dir.mkdir(parents=True, exist_ok=True)
+    return str(columnar_dir)
+
+@router.post("/processes/{process_id}/parquet-export", status_code=202)
+async def export_process_data_to_parquet(
+    process_id: str,
+    company_name: str = Query(...),
+    data_types: List[str] = Query(["entity_amounts", "ic_amounts", "other_amounts"]),
+    incremental: bool = Query(True, description="Only rewrite partitions whose data changed"),
+    current_user = Depends(get_current_active_user)
+):
+    """Queue a Parquet dataset export partitioned by period and entity."""
+    if not columnar_export.available():
+        raise HTTPException(status_code=501, detail="Parquet export needs the pyarrow package")
+    unknown = [data_type for data_type in data_types if data_type not in columnar_export.PARTITION_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown data types: {unknown}")
+    columnar_dir = ensure_columnar_directory(company_name, process_id)
+    
+    def _work(job):
+        results = []
+        with company_connection(company_name) as conn:
+            cur = conn.cursor()
+            for data_type in data_types:
+                table_name = get_process_table_name(conn, process_id, data_type)
+                if not table_name:
+                    continue
+                result = columnar_export.export_parquet(
+                    conn, table_name, data_type, process_id, columnar_dir,
+                    incremental=incremental, progress=job.emit
+                )
+                conn.rollback()  # End the read transaction before recording the export
+                cur.execute("""
+                    INSERT INTO csv_exports
+                    (process_id, export_type, file_path, file_size, row_count, export_date)
+                    VALUES (%s, %s, %s, %s, %s, NOW())
+                """, (process_id, f"parquet_{data_type}", result["path"], result["total_bytes"], result["total_rows"]))
+                conn.commit()
+                results.append(result)
+        return {"exports": results, "directory": columnar_dir}
+    
+    job = process_jobs.submit_job(process_id, "parquet_export", _work)
+    return _execution_accepted(process_id, job, company_name)
+
+@router.get("/processes/{process_id}/data-input/{data_type}/arrow")
+async def stream_data_input_arrow(
+    process_id: str,
+    data_type: str,
+    company_name: str = Query(...),
+    period_code: Optional[str] = Query(None),
+    entity_code: Optional[str] = Query(None),
+    scenario_id: Optional[str] = Query(None),
+    current_user = Depends(get_current_active_user)
+):
+    """Stream data input entries as an Arrow IPC stream with flattened, typed custom fields."""
+    if not columnar_export.available():
+        raise HTTPException(status_code=501, detail="Arrow export needs the pyarrow package")
+    if data_type not in columnar_export.PARTITION_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Unknown data type: {data_type}")
+    
+    with company_connection(company_name) as conn:
+        table_name = get_process_table_name(conn, process_id, data_type)
+    if not table_name:
+        raise HTTPException(status_code=404, detail=f"No {data_type} data for this process")
+    
+    where_conditions = ["process_id = %s"]
+    params: List[Any] = [process_id]
+    if period_code:
+        where_conditions.append("period_code = %s")
+        params.append(period_code)
+    if entity_code:
+        entity_column = columnar_export.PARTITION_COLUMNS[data_type][1]
+        where_conditions.append(f"{entity_column} = %s")
+        params.append(entity_code)
+    if scenario_id:
+        where_conditions.append("(scenario_id = %s OR scenario_id IS NULL)")
+        params.append(scenario_id)
+    
+    def _stream():
+        with company_connection(company_name) as conn:
+            yield from columnar_export.arrow_stream(conn, table_name, data_type, " AND ".join(where_conditions), params)
+    
+    return StreamingResponse(
+        _stream(),
+        media_type=columnar_export.ARROW_STREAM_MEDIA_TYPE,
+        headers={"Content-Disposition": f"attachment; filename={data_type}_{process_id}.arrows"}
+    )
+
 @router.get("/debug/fiscal-years")
 async def debug_fiscal_years(company_name: str = Query(...)):
     """Debug endpoint to check fiscal years setup"""
@@ -20,24 +20,16 @@ import json
 import uuid
 import psycopg2
 import psycopg2.extras
-import pandas as pd
-import io
+import numpy as np
 import os
-import tempfile
+import re
+import time
 import logging
+from pathlib import Path
 
 # Try to import reportlab, but make it optional
 try:
     from reportlab.lib.pagesizes import letter, A4
-    from reportlab.platypus import (
-        SimpleDocTemplate,
-        Table,
-        TableStyle,
-        Paragraph,
-        Spacer,
-    )
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib import colors
     from reportlab.lib.units import inch
 
     REPORTLAB_AVAILABLE = True
@@ -47,6 +39,12 @@ except ImportError:
     A4 = (595.27, 841.89)
 
 from database import get_db
+from config import settings
+from routers import cash_flow as cash_flow_engine
+from routers import (
+    balance_cube, fst_compiler, lineage_index, pagination, process_jobs, report_cache, report_pack,
+    streaming_export, tree_engine,
+)
 
 try:
     from auth.dependencies import get_current_active_user
@@ -117,6 +115,24 @@ class ReportRequest(BaseModel):
     filters: Optional[Dict[str, Any]] = None
 
 
+class ReportPackRequest(BaseModel):
+    """Report pack: every report type for every entity and period"""
+
+    process_context: ProcessContext
+    hierarchy_selection: HierarchySelection
+    periods: List[str]
+    report_types: List[
+        Literal["balance_sheet", "income_statement", "cash_flow", "statement_equity"]
+    ] = list(report_pack.REPORT_TYPES)
+    formats: List[Literal["pdf", "excel"]] = list(report_pack.FORMATS)
+    entity_ids: Optional[List[str]] = None  # None = every entity with balances
+    include_entities: bool = True
+    include_consolidated: bool = True
+    show_zero_balances: bool = False
+    currency: str = "USD"
+    rounding_factor: int = 1
+
+
 class AccountHierarchyNode(BaseModel):
     """Account hierarchy tree node"""
 
@@ -214,21 +230,12 @@ async def get_report_hierarchies(
 
 def build_hierarchy_tree(hierarchies):
     """Build hierarchical tree structure"""
-    hierarchy_dict = {h["hierarchy_id"]: dict(h) for h in hierarchies}
-
-    # Add children array to each hierarchy
-    for h in hierarchy_dict.values():
-        h["children"] = []
-
-    # Build parent-child relationships
-    root_hierarchies = []
-    for h in hierarchy_dict.values():
-        if h["parent_hierarchy_id"] and h["parent_hierarchy_id"] in hierarchy_dict:
-            hierarchy_dict[h["parent_hierarchy_id"]]["children"].append(h)
-        else:
-            root_hierarchies.append(h)
-
-    return root_hierarchies
+    hierarchies = [dict(h) for h in hierarchies]
+    tree = tree_engine.Tree(
+        [h["hierarchy_id"] for h in hierarchies],
+        [h["parent_hierarchy_id"] or None for h in hierarchies],
+    )
+    return tree.nest(hierarchies)
 
 
 @router.get("/accounts/hierarchy/{hierarchy_id}")
@@ -270,14 +277,18 @@ async def get_accounts_by_hierarchy(
         else:
             account_amounts = {}
 
-        # Build account tree with amounts
+        # Build account list with amounts and rolled-up subtotals
         account_tree = []
-        for account in accounts:
+        if include_amounts:
+            tree, measures = account_measures(accounts, account_amounts)
+            subtotals = tree.rollup(measures).sum(axis=1)
+        for index, account in enumerate(accounts):
             account_dict = dict(account)
             if include_amounts:
                 account_dict["amounts"] = account_amounts.get(
                     account["account_code"], {}
                 )
+                account_dict["subtotal"] = float(subtotals[index])
             account_tree.append(account_dict)
 
         cur.close()
@@ -296,178 +307,38 @@ async def get_accounts_by_hierarchy(
 
 
 def get_account_amounts(cursor, accounts, context):
-    """Get financial amounts for accounts from data input tables"""
+    """Get financial amounts for accounts from the pre-aggregated balance cube"""
     account_codes = [acc["account_code"] for acc in accounts]
     if not account_codes:
         return {}
 
     amounts = {}
+    amount_fields = {"entity": "entity_amount", "ic": "ic_amount", "other": "other_amount"}
 
     try:
-        # Build filter conditions based on context
-        process_filter = ""
-        scenario_filter = ""
-        period_filter = ""
-
-        filter_params = [account_codes]
-
-        if context.get("process_id"):
-            process_filter = " AND ea.process_id = %s"
-            filter_params.append(context.get("process_id"))
-
-        if context.get("scenario_id"):
-            scenario_filter = " AND ea.scenario_id = %s"
-            filter_params.append(context.get("scenario_id"))
-
-        if context.get("period_ids") and len(context.get("period_ids", [])) > 0:
-            period_filter = " AND ea.period_id = ANY(%s)"
-            filter_params.append(context.get("period_ids"))
-
-        # Get entity amounts with process, scenario, and period filters
-        entity_query = f"""
-            SELECT ea.account_id, acc.account_code, ea.entity_id,
-                   SUM(ea.amount) as total_amount, ea.currency
-            FROM entity_amounts ea
-            JOIN accounts acc ON ea.account_id = acc.account_code::int
-            WHERE acc.account_code = ANY(%s)
-              {process_filter}
-              {scenario_filter}
-              {period_filter}
-            GROUP BY ea.account_id, acc.account_code, ea.entity_id, ea.currency
-        """
-
-        cursor.execute(entity_query, tuple(filter_params))
-        entity_amounts = cursor.fetchall()
-
-        for amount in entity_amounts:
-            account_code = amount["account_code"]
-            entity_id = amount.get("entity_id", "unknown")
-
-            if account_code not in amounts:
-                amounts[account_code] = {}
-            if "entities" not in amounts[account_code]:
-                amounts[account_code]["entities"] = {}
-
-            if entity_id not in amounts[account_code]["entities"]:
-                amounts[account_code]["entities"][entity_id] = {
-                    "entity_amount": 0,
-                    "ic_amount": 0,
-                    "other_amount": 0,
-                }
-
-            amounts[account_code]["entities"][entity_id]["entity_amount"] += float(
-                amount["total_amount"] or 0
-            )
-            amounts[account_code]["currency"] = amount["currency"]
-
-        # Get IC amounts with same filters
-        ic_filter_params = [account_codes]
-        ic_process_filter = ""
-        ic_scenario_filter = ""
-        ic_period_filter = ""
-
-        if context.get("process_id"):
-            ic_process_filter = " AND ic.process_id = %s"
-            ic_filter_params.append(context.get("process_id"))
-
-        if context.get("scenario_id"):
-            ic_scenario_filter = " AND ic.scenario_id = %s"
-            ic_filter_params.append(context.get("scenario_id"))
-
-        if context.get("period_ids") and len(context.get("period_ids", [])) > 0:
-            ic_period_filter = " AND ic.period_id = ANY(%s)"
-            ic_filter_params.append(context.get("period_ids"))
-
-        ic_query = f"""
-            SELECT ic.account_id, acc.account_code, ic.from_entity_id,
-                   SUM(ic.amount) as total_amount, ic.currency
-            FROM ic_amounts ic
-            JOIN accounts acc ON ic.account_id = acc.account_code::int
-            WHERE acc.account_code = ANY(%s)
-              {ic_process_filter}
-              {ic_scenario_filter}
-              {ic_period_filter}
-            GROUP BY ic.account_id, acc.account_code, ic.from_entity_id, ic.currency
-        """
-
-        cursor.execute(ic_query, tuple(ic_filter_params))
-        ic_amounts = cursor.fetchall()
-
-        for amount in ic_amounts:
-            account_code = amount["account_code"]
-            entity_id = amount.get("from_entity_id", "unknown")
-
-            if account_code not in amounts:
-                amounts[account_code] = {}
-            if "entities" not in amounts[account_code]:
-                amounts[account_code]["entities"] = {}
-
-            if entity_id not in amounts[account_code]["entities"]:
-                amounts[account_code]["entities"][entity_id] = {
-                    "entity_amount": 0,
-                    "ic_amount": 0,
-                    "other_amount": 0,
-                }
-
-            amounts[account_code]["entities"][entity_id]["ic_amount"] += float(
-                amount["total_amount"] or 0
-            )
-
-        # Get other amounts with same filters
-        other_filter_params = [account_codes]
-        other_process_filter = ""
-        other_scenario_filter = ""
-        other_period_filter = ""
-
-        if context.get("process_id"):
-            other_process_filter = " AND oa.process_id = %s"
-            other_filter_params.append(context.get("process_id"))
-
-        if context.get("scenario_id"):
-            other_scenario_filter = " AND oa.scenario_id = %s"
-            other_filter_params.append(context.get("scenario_id"))
-
-        if context.get("period_ids") and len(context.get("period_ids", [])) > 0:
-            other_period_filter = " AND oa.period_id = ANY(%s)"
-            other_filter_params.append(context.get("period_ids"))
-
-        other_query = f"""
-            SELECT oa.account_id, acc.account_code, oa.entity_id,
-                   SUM(oa.amount) as total_amount, oa.currency
-            FROM other_amounts oa
-            JOIN accounts acc ON oa.account_id = acc.account_code::int
-            WHERE acc.account_code = ANY(%s)
-              {other_process_filter}
-              {other_scenario_filter}
-              {other_period_filter}
-            GROUP BY oa.account_id, acc.account_code, oa.entity_id, oa.currency
-        """
-
-        cursor.execute(other_query, tuple(other_filter_params))
-        other_amounts = cursor.fetchall()
-
-        for amount in other_amounts:
-            account_code = amount["account_code"]
-            entity_id = amount.get("entity_id", "unknown")
-
-            if account_code not in amounts:
-                amounts[account_code] = {}
-            if "entities" not in amounts[account_code]:
-                amounts[account_code]["entities"] = {}
+        cells = balance_cube.query(
+            cursor.connection,
+            process_id=context.get("process_id"),
+            scenario_id=context.get("scenario_id"),
+            period_keys=context.get("period_ids") or [],
+            account_keys=account_codes,
+        )
 
-            if entity_id not in amounts[account_code]["entities"]:
-                amounts[account_code]["entities"][entity_id] = {
-                    "entity_amount": 0,
-                    "ic_amount": 0,
-                    "other_amount": 0,
-                }
+        for cell in cells:
+            account_code = cell["account_key"]
+            entity_id = cell["entity_key"] or "unknown"
 
-            amounts[account_code]["entities"][entity_id]["other_amount"] += float(
-                amount["total_amount"] or 0
+            account = amounts.setdefault(account_code, {"entities": {}})
+            entity = account["entities"].setdefault(
+                entity_id, {"entity_amount": 0, "ic_amount": 0, "other_amount": 0}
             )
+            entity[amount_fields[cell["source_type"]]] += float(cell["total_amount"] or 0)
+            if cell["source_type"] == "entity" and cell["currency"]:
+                account["currency"] = cell["currency"]
 
     except Exception as e:
         logger.error(f"Error getting account amounts: {e}")
+        cursor.connection.rollback()
 
     return amounts
 
@@ -486,28 +357,7 @@ async def generate_financial_report(
         conn = get_company_connection(company_name)
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-        # Get hierarchical account structure
-        account_tree = get_hierarchical_accounts(
-            cur, report_request.hierarchy_selection, report_request.process_context
-        )
-
-        # Generate report based on type
-        report_data = None
-        if report_request.report_settings.report_type == "balance_sheet":
-            report_data = generate_balance_sheet(cur, account_tree, report_request)
-        elif report_request.report_settings.report_type == "income_statement":
-            report_data = generate_income_statement(cur, account_tree, report_request)
-        elif report_request.report_settings.report_type == "cash_flow":
-            report_data = generate_cash_flow(cur, account_tree, report_request)
-        elif report_request.report_settings.report_type == "statement_equity":
-            report_data = generate_statement_equity(cur, account_tree, report_request)
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported report type")
-
-        # Apply report settings (rounding, filtering, etc.)
-        formatted_report = apply_report_settings(
-            report_data, report_request.report_settings
-        )
+        formatted_report = get_cached_report(cur, report_request, company_name)
 
         # Save report metadata
         report_metadata = save_report_metadata(cur, report_request, company_name)
@@ -531,9 +381,52 @@ async def generate_financial_report(
         )
 
 
-def get_hierarchical_accounts(cursor, hierarchy_selection, process_context):
-    """Get hierarchical account structure with amounts"""
-    # Get accounts under selected hierarchy
+def build_report(cursor, report_request):
+    """Build and format a report from the current data"""
+    # Get hierarchical account structure
+    account_tree = get_hierarchical_accounts(
+        cursor, report_request.hierarchy_selection, report_request.process_context
+    )
+
+    # Generate report based on type
+    report_type = report_request.report_settings.report_type
+    if report_type == "balance_sheet":
+        report_data = generate_balance_sheet(cursor, account_tree, report_request)
+    elif report_type == "income_statement":
+        report_data = generate_income_statement(cursor, account_tree, report_request)
+    elif report_type == "cash_flow":
+        report_data = generate_cash_flow(cursor, account_tree, report_request)
+    elif report_type == "statement_equity":
+        report_data = generate_statement_equity(cursor, account_tree, report_request)
+    else:
+        raise HTTPException(status_code=400, detail="Unsupported report type")
+
+    # Apply report settings (rounding, filtering, etc.)
+    return apply_report_settings(report_data, report_request.report_settings)
+
+
+def get_cached_report(cursor, report_request, company_name):
+    """Serve a report from the cache while the company's data version is unchanged"""
+    version = report_cache.data_version(cursor.connection, company_name)
+    key = report_cache.cache_key(
+        company_name,
+        version,
+        "report",
+        {
+            "hierarchy_selection": report_request.hierarchy_selection.dict(),
+            "process_context": report_request.process_context.dict(),
+            "report_settings": report_request.report_settings.dict(),
+        },
+    )
+    report_data = report_cache.get(key)
+    if report_data is None:
+        report_data = build_report(cursor, report_request)
+        report_cache.put(key, report_data)
+    return report_data
+
+
+def hierarchy_accounts(cursor, hierarchy_id):
+    """Accounts under a hierarchy and its descendants, ordered by level"""
     cursor.execute(
         """
         WITH RECURSIVE hierarchy_tree AS (
@@ -549,7 +442,6 @@ def get_hierarchical_accounts(cursor, hierarchy_selection, process_context):
                    h.level_number, ht.depth + 1
             FROM hierarchies h
             JOIN hierarchy_tree ht ON h.parent_hierarchy_id = ht.hierarchy_id
-            WHERE (%s IS NULL OR ht.depth < %s)
         )
         SELECT DISTINCT a.account_code, a.account_name, a.account_type,
                a.hierarchy_id, h.hierarchy_name, h.level_number,
@@ -558,64 +450,65 @@ def get_hierarchical_accounts(cursor, hierarchy_selection, process_context):
         JOIN hierarchy_tree h ON a.hierarchy_id = h.hierarchy_id
         ORDER BY h.level_number, a.account_code
     """,
-        (
-            hierarchy_selection.hierarchy_id,
-            hierarchy_selection.level_limit,
-            hierarchy_selection.level_limit,
-        ),
+        (hierarchy_id,),
     )
+    return cursor.fetchall()
 
-    accounts = cursor.fetchall()
+
+def get_hierarchical_accounts(cursor, hierarchy_selection, process_context):
+    """Get hierarchical account structure with amounts"""
+    # Get accounts under selected hierarchy
+    accounts = hierarchy_accounts(cursor, hierarchy_selection.hierarchy_id)
 
     # Get amounts for these accounts
     account_amounts = get_account_amounts(cursor, accounts, process_context.dict())
 
-    # Build hierarchical structure
-    account_tree = build_account_tree(accounts, account_amounts)
+    # Build hierarchical structure; levels past the limit are rolled into their ancestors
+    account_tree = build_account_tree(
+        accounts, account_amounts, hierarchy_selection.level_limit
+    )
 
     return account_tree
 
 
-def build_account_tree(accounts, amounts):
-    """Build hierarchical account tree with amounts"""
-    account_dict = {}
+AMOUNT_MEASURES = ["entity_amount", "ic_amount", "other_amount"]
 
+
+def account_measures(accounts, amounts):
+    """Account tree and per-account measure matrix (accounts x AMOUNT_MEASURES)"""
+    # An account hangs under the first account of its parent hierarchy
+    hierarchy_heads = {}
     for account in accounts:
-        account_dict[account["account_code"]] = {
+        hierarchy_heads.setdefault(account["hierarchy_id"], account["account_code"])
+    tree = tree_engine.Tree(
+        [account["account_code"] for account in accounts],
+        [hierarchy_heads.get(account["parent_hierarchy_id"]) for account in accounts],
+    )
+
+    measures = np.zeros((len(accounts), len(AMOUNT_MEASURES)))
+    for index, account in enumerate(accounts):
+        entities = amounts.get(account["account_code"], {}).get("entities", {})
+        for entity_amounts in entities.values():
+            measures[index] += [entity_amounts.get(m, 0) for m in AMOUNT_MEASURES]
+    return tree, measures
+
+
+def build_account_tree(accounts, amounts, level_limit=None):
+    """Build hierarchical account tree with amounts and rolled-up subtotals"""
+    tree, measures = account_measures(accounts, amounts)
+    totals = tree.rollup(measures)
+
+    records = []
+    for index, account in enumerate(accounts):
+        records.append({
             **dict(account),
-            "children": [],
             "amounts": amounts.get(account["account_code"], {}),
-            "subtotal": 0,
-        }
+            "own_subtotal": float(measures[index].sum()),
+            "subtotals": dict(zip(AMOUNT_MEASURES, totals[index].tolist())),
+            "subtotal": float(totals[index].sum()),
+        })
 
-    # Calculate subtotals and build tree
-    root_accounts = []
-
-    for account in account_dict.values():
-        # Calculate account total
-        account_amounts = account["amounts"]
-        entity_amt = account_amounts.get("entity_amount", 0)
-        ic_amt = account_amounts.get("ic_amount", 0)
-        other_amt = account_amounts.get("other_amount", 0)
-
-        account["subtotal"] = entity_amt + ic_amt + other_amt
-
-        # Add to appropriate parent or root
-        if account["parent_hierarchy_id"]:
-            # Find parent account with same hierarchy
-            parent_found = False
-            for parent_account in account_dict.values():
-                if parent_account["hierarchy_id"] == account["parent_hierarchy_id"]:
-                    parent_account["children"].append(account)
-                    parent_found = True
-                    break
-
-            if not parent_found:
-                root_accounts.append(account)
-        else:
-            root_accounts.append(account)
-
-    return root_accounts
+    return tree.nest(records, level_limit)
 
 
 def generate_balance_sheet(cursor, account_tree, report_request):
@@ -745,7 +638,37 @@ def generate_income_statement(cursor, account_tree, report_request):
 
 
 def generate_cash_flow(cursor, account_tree, report_request):
-    """Generate Cash Flow Statement"""
+    """Generate Cash Flow Statement
+
+    Within a process the indirect-method statement comes from the balance
+    snapshots (see cash_flow); the report's entity, or the group without
+    one, over the selected periods. Report pack workers render without a
+    database cursor and get the closing-cash statement below.
+    """
+    context = report_request.process_context
+    entity_id = None if context.entity_id == cash_flow_engine.CONSOLIDATED else context.entity_id
+    if cursor is not None and context.process_id and context.period_ids:
+        try:
+            result = cash_flow_engine.generate(
+                cursor.connection, context.process_id, context.scenario_id, context.period_ids,
+                [entity_id] if entity_id else [], consolidated=not entity_id,
+            )
+        except (LookupError, ValueError) as e:
+            # No snapshots for the process yet: fall back to the closing cash below
+            logger.warning(f"Cash flow from balance snapshots unavailable: {e}")
+        else:
+            entity = 0 if entity_id else len(result["entity_codes"]) - 1
+            statement = cash_flow_engine.statement(result, entity, range(len(result["periods"])))
+            return {
+                "report_type": "Cash Flow Statement",
+                "report_title": f"Cash Flow Statement - {context.entity_name or 'Consolidated'}",
+                "periods": report_request.report_settings.periods,
+                "currency": report_request.report_settings.currency,
+                "method": "indirect",
+                "snapshot_stale": result["is_stale"],
+                **statement,
+            }
+
     cash_flow = {
         "report_type": "Cash Flow Statement",
         "report_title": f"Cash Flow Statement - {report_request.process_context.entity_name or 'Consolidated'}",
@@ -771,8 +694,11 @@ def generate_cash_flow(cursor, account_tree, report_request):
         "totals": {"net_cash_flow": 0, "opening_cash": 0, "closing_cash": 0},
     }
 
-    # This would require more sophisticated logic to categorize cash flows
-    # For now, return basic structure
+    # Closing cash from the cash accounts' rolled-up subtotals; flows need movement analysis
+    for account in account_tree:
+        account_name = account.get("account_name", "").lower()
+        if "cash" in account_name or "bank" in account_name:
+            cash_flow["totals"]["closing_cash"] += account.get("subtotal", 0)
 
     return cash_flow
 
@@ -793,8 +719,24 @@ def generate_statement_equity(cursor, account_tree, report_request):
         "totals": {"total_opening": 0, "total_movements": 0, "total_closing": 0},
     }
 
-    # This would require movement analysis from previous periods
-    # For now, return basic structure
+    # Closing balances per component from the equity accounts' rolled-up subtotals;
+    # opening balances and movements need movement analysis
+    components = statement_equity["components"]
+    for account in account_tree:
+        account_type = account.get("account_type", "").lower()
+        account_name = account.get("account_name", "").lower()
+        if "equity" not in account_type and "capital" not in account_type:
+            continue
+        if "capital" in account_name or "share" in account_name:
+            component = components["share_capital"]
+        elif "retained" in account_name:
+            component = components["retained_earnings"]
+        elif "nci" in account_name or "non-controlling" in account_name or "minority" in account_name:
+            component = components["nci"]
+        else:
+            component = components["other_reserves"]
+        component["closing"] += account.get("subtotal", 0)
+        statement_equity["totals"]["total_closing"] += account.get("subtotal", 0)
 
     return statement_equity
 
@@ -915,36 +857,8 @@ async def export_report(
         if not report_metadata:
             raise HTTPException(status_code=404, detail="Report not found")
 
-        # Regenerate report (or could cache it)
-        process_context = ProcessContext(
-            **json.loads(report_metadata["process_context"])
-        )
-        hierarchy_selection = HierarchySelection(
-            **json.loads(report_metadata["hierarchy_selection"])
-        )
-        report_settings = ReportSettings(
-            **json.loads(report_metadata["report_settings"])
-        )
-
-        report_request = ReportRequest(
-            process_context=process_context,
-            hierarchy_selection=hierarchy_selection,
-            report_settings=report_settings,
-        )
-
-        # Generate report data
-        account_tree = get_hierarchical_accounts(
-            cur, hierarchy_selection, process_context
-        )
-
-        if report_settings.report_type == "balance_sheet":
-            report_data = generate_balance_sheet(cur, account_tree, report_request)
-        elif report_settings.report_type == "income_statement":
-            report_data = generate_income_statement(cur, account_tree, report_request)
-        else:
-            report_data = {"error": "Unsupported report type for export"}
-
-        formatted_report = apply_report_settings(report_data, report_settings)
+        report_request = report_request_from_metadata(report_metadata)
+        formatted_report = get_cached_report(cur, report_request, company_name)
 
         cur.close()
         conn.close()
@@ -965,94 +879,147 @@ async def export_report(
         )
 
 
+def report_request_from_metadata(report_metadata):
+    """Rebuild the original report request from saved report metadata"""
+
+    def load(value):
+        # JSONB columns come back decoded; older rows may hold JSON text
+        return json.loads(value) if isinstance(value, str) else value
+
+    return ReportRequest(
+        process_context=ProcessContext(**load(report_metadata["process_context"])),
+        hierarchy_selection=HierarchySelection(
+            **load(report_metadata["hierarchy_selection"])
+        ),
+        report_settings=ReportSettings(**load(report_metadata["report_settings"])),
+    )
+
+
+@router.get("/reports/{report_id}")
+async def reopen_report(report_id: str, company_name: str = Query(...)):
+    """Re-open a generated report; served from the cache while its data is unchanged"""
+    try:
+        conn = get_company_connection(company_name)
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+        cur.execute(
+            """
+            SELECT * FROM financial_reports WHERE report_id = %s
+        """,
+            (report_id,),
+        )
+
+        report_metadata = cur.fetchone()
+        if not report_metadata:
+            raise HTTPException(status_code=404, detail="Report not found")
+
+        report_request = report_request_from_metadata(report_metadata)
+        formatted_report = get_cached_report(cur, report_request, company_name)
+
+        cur.close()
+        conn.close()
+
+        return {
+            "success": True,
+            "report_id": report_id,
+            "report_data": formatted_report,
+            "generated_at": report_metadata["generated_at"],
+            "settings": report_request.report_settings.dict(),
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error re-opening report: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to re-open report: {str(e)}",
+        )
+
+
+def report_tables(report_data, number_format="{:,.2f}"):
+    """(title, header, rows) per report section, rows generated lazily"""
+    header = ["Account Code", "Account Name", "Amount"]
+
+    def section_rows(section):
+        for account in section.get("accounts", []):
+            yield [
+                account.get("account_code", ""),
+                account.get("account_name", ""),
+                number_format.format(account.get("subtotal", 0))
+                if number_format
+                else account.get("subtotal", 0),
+            ]
+        # Section total
+        yield [
+            "",
+            f"Total {section['title']}",
+            number_format.format(section.get("total", 0))
+            if number_format
+            else section.get("total", 0),
+        ]
+
+    for section in report_data.get("sections", {}).values():
+        yield section["title"], header, section_rows(section)
+
+
+def report_pdf_file(report_data):
+    """A report as a PDF in a spooled temp file"""
+    return streaming_export.pdf_file(
+        report_data.get("report_title", "Financial Report"),
+        report_tables(report_data),
+        column_widths=[100, 295, 120],
+    )
+
+
+def report_workbook_file(report_data):
+    """A report as an .xlsx in a spooled temp file"""
+
+    def report_rows():
+        yield ["Account Code", "Account Name", "Amount"]
+        for title, header, rows in report_tables(report_data, number_format=None):
+            # Section header
+            yield [title, "", ""]
+            yield header
+            yield from rows
+            yield ["", "", ""]  # Empty row
+
+    sheets = [("Report", report_rows())]
+
+    # Add summary sheet if calculations exist
+    if "calculations" in report_data:
+        sheets.append(
+            (
+                "Summary",
+                [["Metric", "Value"]]
+                + [
+                    [calc_name.replace("_", " ").title(), calc_value]
+                    for calc_name, calc_value in report_data["calculations"].items()
+                ],
+            )
+        )
+
+    return streaming_export.workbook_file(sheets)
+
+
 def export_to_pdf(report_data, report_id):
-    """Export report to PDF"""
+    """Export report to PDF, drawn page by page into a spooled temp file"""
     if not REPORTLAB_AVAILABLE:
         raise HTTPException(
             status_code=503,
             detail="PDF export is not available. Please install reportlab: pip install reportlab",
         )
 
-    # Create temporary file
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-
     try:
-        # Create PDF document
-        doc = SimpleDocTemplate(temp_file.name, pagesize=A4)
-        styles = getSampleStyleSheet()
-        story = []
-
-        # Title
-        title_style = ParagraphStyle(
-            "CustomTitle",
-            parent=styles["Heading1"],
-            fontSize=16,
-            spaceAfter=30,
-            alignment=1,  # Center
-        )
+        output = report_pdf_file(report_data)
 
-        story.append(
-            Paragraph(report_data.get("report_title", "Financial Report"), title_style)
+        return StreamingResponse(
+            streaming_export.file_chunks(output),
+            media_type="application/pdf",
+            headers={
+                "Content-Disposition": f"attachment; filename=report_{report_id}.pdf"
+            },
         )
-        story.append(Spacer(1, 12))
-
-        # Report sections
-        if "sections" in report_data:
-            for section_key, section in report_data["sections"].items():
-                # Section header
-                story.append(Paragraph(section["title"], styles["Heading2"]))
-                story.append(Spacer(1, 6))
-
-                # Account table
-                table_data = [["Account Code", "Account Name", "Amount"]]
-
-                for account in section.get("accounts", []):
-                    table_data.append(
-                        [
-                            account.get("account_code", ""),
-                            account.get("account_name", ""),
-                            f"{account.get('subtotal', 0):,.2f}",
-                        ]
-                    )
-
-                # Section total
-                table_data.append(
-                    ["", f"Total {section['title']}", f"{section.get('total', 0):,.2f}"]
-                )
-
-                if len(table_data) > 1 and REPORTLAB_AVAILABLE:
-                    table = Table(table_data)
-                    table.setStyle(
-                        TableStyle(
-                            [
-                                ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
-                                ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
-                                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-                                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                                ("FONTSIZE", (0, 0), (-1, 0), 10),
-                                ("BOTTOMPADDING", (0, 0), (-1, 0), 12),
-                                ("BACKGROUND", (0, -1), (-1, -1), colors.beige),
-                                ("GRID", (0, 0), (-1, -1), 1, colors.black),
-                            ]
-                        )
-                    )
-                    story.append(table)
-                    story.append(Spacer(1, 12))
-
-        if REPORTLAB_AVAILABLE:
-            # Build PDF
-            doc.build(story)
-
-            # Return file response
-            from fastapi.responses import FileResponse
-
-            return FileResponse(
-                temp_file.name,
-                media_type="application/pdf",
-                filename=f"report_{report_id}.pdf",
-            )
-        else:
-            raise HTTPException(status_code=503, detail="PDF export not available")
 
     except HTTPException:
         raise
@@ -1062,75 +1029,21 @@ def export_to_pdf(report_data, report_id):
 
 
 def export_to_excel(report_data, report_id):
-    """Export report to Excel"""
-    output = io.BytesIO()
-
+    """Export report to Excel, written in openpyxl write-only mode"""
     try:
-        # Check if openpyxl is available
-        try:
-            import openpyxl
-        except ImportError:
-            # Fallback to xlsxwriter if available, or raise error
-            try:
-                with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-                    pass  # Test if xlsxwriter works
-                engine = "xlsxwriter"
-            except:
-                raise HTTPException(
-                    status_code=503,
-                    detail="Excel export requires openpyxl or xlsxwriter. Install with: pip install openpyxl",
-                )
-        else:
-            engine = "openpyxl"
-
-        with pd.ExcelWriter(output, engine=engine) as writer:
-            # Create main report sheet
-            if "sections" in report_data:
-                all_data = []
-
-                for section_key, section in report_data["sections"].items():
-                    # Section header
-                    all_data.append([section["title"], "", ""])
-                    all_data.append(["Account Code", "Account Name", "Amount"])
-
-                    # Account data
-                    for account in section.get("accounts", []):
-                        all_data.append(
-                            [
-                                account.get("account_code", ""),
-                                account.get("account_name", ""),
-                                account.get("subtotal", 0),
-                            ]
-                        )
-
-                    # Section total
-                    all_data.append(
-                        ["", f"Total {section['title']}", section.get("total", 0)]
-                    )
-                    all_data.append(["", "", ""])  # Empty row
-
-                # Write to Excel
-                df = pd.DataFrame(
-                    all_data, columns=["Account Code", "Account Name", "Amount"]
-                )
-                df.to_excel(writer, sheet_name="Report", index=False)
-
-                # Add summary sheet if calculations exist
-                if "calculations" in report_data:
-                    calc_data = []
-                    for calc_name, calc_value in report_data["calculations"].items():
-                        calc_data.append(
-                            [calc_name.replace("_", " ").title(), calc_value]
-                        )
-
-                    df_calc = pd.DataFrame(calc_data, columns=["Metric", "Value"])
-                    df_calc.to_excel(writer, sheet_name="Summary", index=False)
+        import openpyxl  # noqa: F401
+    except ImportError:
+        raise HTTPException(
+            status_code=503,
+            detail="Excel export requires openpyxl. Install with: pip install openpyxl",
+        )
 
-        output.seek(0)
+    try:
+        output = report_workbook_file(report_data)
 
         return StreamingResponse(
-            output,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            streaming_export.file_chunks(output),
+            media_type=streaming_export.XLSX_MEDIA_TYPE,
             headers={
                 "Content-Disposition": f"attachment; filename=report_{report_id}.xlsx"
             },
@@ -1139,98 +1052,422 @@ def export_to_excel(report_data, report_id):
     except Exception as e:
         logger.error(f"Error creating Excel: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to create Excel: {str(e)}")
-    finally:
-        output.seek(0)  # Reset to beginning for reading
 
 
 # ============================================================================
-# DRILL-DOWN FUNCTIONALITY
+# REPORT PACKS
 # ============================================================================
 
 
-@router.get("/drill-down/{account_code}")
-async def drill_down_account(
-    account_code: str,
-    company_name: str = Query(...),
-    process_context: Optional[str] = Query(None),
-    start_date: Optional[date] = Query(None),
-    end_date: Optional[date] = Query(None),
+REPORT_GENERATORS = {
+    "balance_sheet": generate_balance_sheet,
+    "income_statement": generate_income_statement,
+    "cash_flow": generate_cash_flow,
+    "statement_equity": generate_statement_equity,
+}
+REPORT_FILE_WRITERS = {"pdf": report_pdf_file, "excel": report_workbook_file}
+
+
+def render_pack_item(accounts, amounts, entity_key, entity_name, period, report_types, formats, options):
+    """Every report type and format of one pack item; runs inside report_pack workers"""
+    started = time.perf_counter()
+    account_tree = build_account_tree(accounts, amounts, options.get("level_limit"))
+    tree_ms = (time.perf_counter() - started) * 1000
+    files = []
+    for report_type in report_types:
+        report_request = ReportRequest(
+            process_context=ProcessContext(
+                **{**options.get("process_context", {}), "entity_id": entity_key,
+                   "entity_name": entity_name, "period_ids": [period], "period_names": [period]}
+            ),
+            hierarchy_selection=HierarchySelection(**options["hierarchy_selection"]),
+            report_settings=ReportSettings(
+                report_type=report_type,
+                periods=[period],
+                currency=options.get("currency", "USD"),
+                rounding_factor=options.get("rounding_factor", 1),
+                show_zero_balances=options.get("show_zero_balances", False),
+                consolidation_level="group" if entity_key == "consolidated" else "entity",
+            ),
+        )
+        build_started = time.perf_counter()
+        report_data = apply_report_settings(
+            REPORT_GENERATORS[report_type](None, account_tree, report_request),
+            report_request.report_settings,
+        )
+        # The shared tree build is spread over the item's reports
+        build_ms = (time.perf_counter() - build_started) * 1000 + tree_ms / len(report_types)
+        for file_format in formats:
+            render_started = time.perf_counter()
+            output = REPORT_FILE_WRITERS[file_format](report_data)
+            try:
+                content = output.read()
+            finally:
+                output.close()
+            files.append({
+                "report_type": report_type,
+                "format": file_format,
+                "content": content,
+                "duration_ms": round(
+                    build_ms / len(formats) + (time.perf_counter() - render_started) * 1000, 3
+                ),
+            })
+    return files
+
+
+def report_pack_path(company_name, pack_id):
+    """Archive path of a report pack; ValueError for ids or names that would leave REPORT_PACK_DIR"""
+    try:
+        pack_id = str(uuid.UUID(str(pack_id)))
+    except ValueError:
+        raise ValueError(f"Invalid report pack id {pack_id!r}")
+    company_dir = re.sub(r"[^a-z0-9_]", "_", company_name.lower().replace(" ", "_")).strip("_")
+    if not company_dir:
+        raise ValueError(f"Invalid company name {company_name!r}")
+    root = Path(settings.REPORT_PACK_DIR).resolve()
+    path = (root / company_dir / f"{pack_id}.zip").resolve()
+    if root not in path.parents:
+        raise ValueError(f"Invalid company name {company_name!r}")
+    return str(path)
+
+
+def _get_pack_job(pack_id):
+    job = process_jobs.get_job(pack_id)
+    if not job or job.kind != "report_pack":
+        raise HTTPException(status_code=404, detail="Report pack not found on this server")
+    return job
+
+
+@router.post("/packs", status_code=202)
+async def generate_report_pack(
+    pack_request: ReportPackRequest, company_name: str = Query(...)
 ):
-    """Get detailed transaction data for an account"""
+    """Queue a report pack; every (entity x report type x period) is rendered from one data load"""
+    if "pdf" in pack_request.formats and not REPORTLAB_AVAILABLE:
+        raise HTTPException(
+            status_code=503,
+            detail="PDF export is not available. Please install reportlab: pip install reportlab",
+        )
+    if "excel" in pack_request.formats:
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            raise HTTPException(
+                status_code=503,
+                detail="Excel export requires openpyxl. Install with: pip install openpyxl",
+            )
+    if not pack_request.periods or not pack_request.report_types or not pack_request.formats:
+        raise HTTPException(status_code=400, detail="periods, report_types and formats must not be empty")
     try:
+        report_pack_path(company_name, uuid.uuid4())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    context = pack_request.process_context
+    options = {
+        "process_context": context.dict(),
+        "hierarchy_selection": pack_request.hierarchy_selection.dict(),
+        "level_limit": pack_request.hierarchy_selection.level_limit,
+        "currency": pack_request.currency,
+        "rounding_factor": pack_request.rounding_factor,
+        "show_zero_balances": pack_request.show_zero_balances,
+    }
+
+    def work(job):
         conn = get_company_connection(company_name)
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        try:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            accounts = hierarchy_accounts(cur, pack_request.hierarchy_selection.hierarchy_id)
+            pack_data = report_pack.load_pack_data(
+                conn, accounts, context.process_id, context.scenario_id,
+                pack_request.periods, pack_request.entity_ids,
+            )
+        finally:
+            conn.close()
+        job.emit("pack_data_loaded", accounts=len(pack_data["accounts"]),
+                 entities=len(pack_data["entity_keys"]), periods=len(pack_data["periods"]))
+        return report_pack.generate_pack(
+            pack_data,
+            render_pack_item,
+            report_pack_path(company_name, job.execution_id),
+            report_types=pack_request.report_types,
+            formats=pack_request.formats,
+            include_entities=pack_request.include_entities,
+            include_consolidated=pack_request.include_consolidated,
+            options=options,
+            job=job,
+        )
 
-        # Parse process context
-        context = json.loads(process_context) if process_context else {}
+    job = process_jobs.submit_job(context.process_id or "", "report_pack", work)
+    base = f"/api/financial-reports/packs/{job.execution_id}"
+    return {
+        "message": "Report pack queued",
+        "pack_id": job.execution_id,
+        "status": job.status,
+        "status_url": f"{base}?company_name={company_name}",
+        "events_url": f"{base}/events?company_name={company_name}",
+        "cancel_url": f"{base}/cancel?company_name={company_name}",
+        "download_url": f"{base}/download?company_name={company_name}",
+    }
 
-        # Get entity amounts
-        entity_query = """
-            SELECT ea.*, e.entity_name, s.scenario_name, p.period_name
-            FROM entity_amounts ea
-            LEFT JOIN entity_axes e ON ea.entity_id = e.id
-            LEFT JOIN scenarios s ON ea.scenario_id = s.id
-            LEFT JOIN periods p ON ea.period_id = p.id
-            WHERE ea.account_id = (SELECT id FROM account_axes WHERE account_code = %s LIMIT 1)
-        """
 
-        params = [account_code]
+@router.get("/packs/{pack_id}")
+async def get_report_pack_status(pack_id: str, company_name: str = Query(...)):
+    """Progress of a report pack; the result holds per-item timings once finished"""
+    return _get_pack_job(pack_id).snapshot()
+
+
+@router.get("/packs/{pack_id}/events")
+async def stream_report_pack_events(pack_id: str, request: Request, company_name: str = Query(...)):
+    """Server-Sent Events stream of pack progress (one event per entity and period)"""
+    job = _get_pack_job(pack_id)
+    last_event_id = request.headers.get("last-event-id")
+    return StreamingResponse(
+        process_jobs.stream_events(job, int(last_event_id) if last_event_id and last_event_id.isdigit() else 0),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/packs/{pack_id}/cancel")
+async def cancel_report_pack(pack_id: str, company_name: str = Query(...)):
+    """Request cancellation; the pack stops after the item in progress"""
+    job = _get_pack_job(pack_id)
+    process_jobs.cancel_job(pack_id)
+    return {"pack_id": pack_id, "status": job.status, "cancel_requested": True}
+
+
+@router.get("/packs/{pack_id}/download")
+async def download_report_pack(pack_id: str, company_name: str = Query(...)):
+    """Download a finished report pack archive"""
+    job = _get_pack_job(pack_id)
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"Report pack is {job.status}")
+    try:
+        path = report_pack_path(company_name, job.execution_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Report pack archive not found")
+    return StreamingResponse(
+        streaming_export.file_chunks(open(path, "rb")),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=report_pack_{pack_id}.zip"},
+    )
+
+
+# ============================================================================
+# DRILL-DOWN FUNCTIONALITY
+# ============================================================================
+
 
-        if context.get("entity_id"):
-            entity_query += " AND ea.entity_id = %s"
-            params.append(context["entity_id"])
+def drill_down_sources(conn, account_code, context, start_date, end_date, limit, cursor):
+    """Drill-down without a process: keyset pages of the source tables filtered by account."""
+    positions = pagination.decode_cursor(cursor) or {}
+    account_filter = "account_id = (SELECT id FROM account_axes WHERE account_code = %s LIMIT 1)"
 
-        if context.get("scenario_id"):
-            entity_query += " AND ea.scenario_id = %s"
-            params.append(context["scenario_id"])
+    # Get entity amounts
+    entity_where = "ea." + account_filter
+    entity_params = [account_code]
 
-        if start_date and end_date:
-            entity_query += " AND ea.created_at BETWEEN %s AND %s"
-            params.extend([start_date, end_date])
+    if context.get("entity_id"):
+        entity_where += " AND ea.entity_id = %s"
+        entity_params.append(context["entity_id"])
 
-        entity_query += " ORDER BY ea.created_at DESC"
+    if context.get("scenario_id"):
+        entity_where += " AND ea.scenario_id = %s"
+        entity_params.append(context["scenario_id"])
 
-        cur.execute(entity_query, params)
-        entity_amounts = cur.fetchall()
+    if start_date and end_date:
+        entity_where += " AND ea.created_at BETWEEN %s AND %s"
+        entity_params.extend([start_date, end_date])
 
+    sources = {
+        "entity_amounts": (
+            """
+            SELECT ea.*, e.entity_name, s.scenario_name, p.period_name
+            FROM entity_amounts ea
+            LEFT JOIN entity_axes e ON ea.entity_id = e.id
+            LEFT JOIN scenarios s ON ea.scenario_id = s.id
+            LEFT JOIN periods p ON ea.period_id = p.id
+            """,
+            entity_where, entity_params, "ea",
+        ),
         # Get IC amounts
-        ic_query = """
+        "ic_amounts": (
+            """
             SELECT ic.*, fe.entity_name as from_entity, te.entity_name as to_entity
             FROM ic_amounts ic
             LEFT JOIN entity_axes fe ON ic.from_entity_id = fe.id
             LEFT JOIN entity_axes te ON ic.to_entity_id = te.id
-            WHERE ic.account_id = (SELECT id FROM account_axes WHERE account_code = %s LIMIT 1)
-            ORDER BY ic.created_at DESC
-        """
-
-        cur.execute(ic_query, [account_code])
-        ic_amounts = cur.fetchall()
-
+            """,
+            "ic." + account_filter, [account_code], "ic",
+        ),
         # Get other amounts
-        other_query = """
+        "other_amounts": (
+            """
             SELECT oa.*, e.entity_name
             FROM other_amounts oa
             LEFT JOIN entity_axes e ON oa.entity_id = e.id
-            WHERE oa.account_id = (SELECT id FROM account_axes WHERE account_code = %s LIMIT 1)
-            ORDER BY oa.created_at DESC
-        """
+            """,
+            "oa." + account_filter, [account_code], "oa",
+        ),
+    }
+
+    pages = {}
+    next_positions = {}
+    for source_name, (select_sql, where_sql, params, alias) in sources.items():
+        position = positions.get(source_name)
+        if cursor and position is None:
+            # Exhausted on an earlier page
+            pages[source_name] = []
+            continue
+        page = pagination.keyset_page(
+            conn,
+            select_sql,
+            where_sql,
+            params,
+            [f"{alias}.created_at", f"{alias}.id"],
+            limit,
+            pagination.encode_cursor(position) if position else None,
+        )
+        pages[source_name] = page["rows"]
+        if page["has_more"]:
+            next_positions[source_name] = pagination.decode_cursor(
+                page["next_cursor"]
+            )
+
+    entity_amounts = pages["entity_amounts"]
+    ic_amounts = pages["ic_amounts"]
+    other_amounts = pages["other_amounts"]
+
+    return {
+        "success": True,
+        "account_code": account_code,
+        "entity_amounts": entity_amounts or [],
+        "ic_amounts": ic_amounts or [],
+        "other_amounts": other_amounts or [],
+        "total_records": len(entity_amounts or [])
+        + len(ic_amounts or [])
+        + len(other_amounts or []),
+        "next_cursor": pagination.encode_cursor(next_positions)
+        if next_positions
+        else None,
+        "has_more": bool(next_positions),
+    }
+
+
+def drill_down_lineage(conn, account_code, context, start_date, end_date, limit, cursor):
+    """Drill-down within a process through the lineage index.
+
+    The first hop finds the cell's lineage entries (data input and every
+    journal step), the second fetches the rows behind them by id range or
+    journal key. ``next_cursor`` carries one position per source.
+    """
+    entries = lineage_index.lookup(
+        conn,
+        context["process_id"],
+        [account_code],
+        entity_key=context.get("entity_id") or context.get("entity_key"),
+        period_keys=context.get("period_ids") or [],
+        scenario_key=context.get("scenario_id"),
+    )
+    positions = pagination.decode_cursor(cursor) or {}
+    where_sql, params = "TRUE", []
+    if start_date and end_date:
+        where_sql, params = "t.created_at BETWEEN %s AND %s", [start_date, end_date]
+
+    pages = {}
+    next_positions = {}
+    for table_name in balance_cube.SOURCE_TABLES.values():
+        if cursor and table_name not in positions:
+            # Exhausted on an earlier page
+            pages[table_name] = []
+            continue
+        page = lineage_index.source_rows(conn, table_name, entries, limit, positions.get(table_name),
+                                         where_sql, params)
+        pages[table_name] = page["rows"]
+        if page["has_more"]:
+            next_positions[table_name] = page["next_cursor"]
+    journal_entries = [entry for entry in entries if entry["step"] != lineage_index.INPUT_STEP]
+    adjustments = []
+    if journal_entries and (not cursor or "adjustments" in positions):
+        page = lineage_index.journal_lines(conn, journal_entries, limit, positions.get("adjustments"))
+        adjustments = page["rows"]
+        if page["has_more"]:
+            next_positions["adjustments"] = page["next_cursor"]
+
+    steps = {}
+    for entry in entries:
+        step = steps.setdefault(entry["step"], {"step": entry["step"], "row_count": 0, "amount": 0.0})
+        step["row_count"] += int(entry["row_count"] or 0)
+        step["amount"] += float(entry["amount"] or 0)
+    return {
+        "success": True,
+        "account_code": account_code,
+        "lineage": list(steps.values()),
+        "entity_amounts": pages["entity_amounts"],
+        "ic_amounts": pages["ic_amounts"],
+        "other_amounts": pages["other_amounts"],
+        "adjustments": adjustments,
+        "total_records": sum(len(rows) for rows in pages.values()) + len(adjustments),
+        "next_cursor": pagination.encode_cursor(next_positions) if next_positions else None,
+        "has_more": bool(next_positions),
+    }
 
-        cur.execute(other_query, [account_code])
-        other_amounts = cur.fetchall()
 
+@router.get("/drill-down/{account_code}")
+async def drill_down_account(
+    account_code: str,
+    company_name: str = Query(...),
+    process_context: Optional[str] = Query(None),
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    limit: int = Query(500, ge=1, le=10000),
+    cursor: Optional[str] = Query(None),
+):
+    """Get one page of detailed transaction data for an account.
+
+    Each source (entity, IC, other amounts) is keyset-paged on
+    (created_at, id), newest first; ``next_cursor`` carries the position in
+    every source that still has rows.
+    """
+    try:
+        conn = get_company_connection(company_name)
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+        # Parse process context
+        context = json.loads(process_context) if process_context else {}
+
+        # Drill-backs from a report repeat the same lookups; reuse them until the data changes
+        drill_key = report_cache.cache_key(
+            company_name,
+            report_cache.data_version(conn, company_name),
+            "drill-down",
+            {
+                "account_code": account_code,
+                "context": context,
+                "start_date": start_date,
+                "end_date": end_date,
+                "limit": limit,
+                "cursor": cursor,
+            },
+        )
+        cached = report_cache.get(drill_key)
+        if cached is not None:
+            cur.close()
+            conn.close()
+            return cached
+
+        if context.get("process_id"):
+            result = drill_down_lineage(conn, account_code, context, start_date, end_date, limit, cursor)
+        else:
+            result = drill_down_sources(conn, account_code, context, start_date, end_date, limit, cursor)
         cur.close()
         conn.close()
 
-        return {
-            "success": True,
-            "account_code": account_code,
-            "entity_amounts": entity_amounts or [],
-            "ic_amounts": ic_amounts or [],
-            "other_amounts": other_amounts or [],
-            "total_records": len(entity_amounts or [])
-            + len(ic_amounts or [])
-            + len(other_amounts or []),
-        }
+        report_cache.put(drill_key, result)
+        return result
 
     except Exception as e:
         logger.error(f"Error in drill-down: {e}")
@@ -1243,6 +1480,63 @@ async def drill_down_account(
         }
 
 
+@router.get("/lineage")
+async def get_cell_lineage(
+    company_name: str = Query(...),
+    process_id: str = Query(...),
+    account_code: Optional[List[str]] = Query(None),
+    fst_template_id: Optional[int] = Query(None),
+    fst_line_id: Optional[str] = Query(None),
+    entity_key: Optional[str] = Query(None),
+    period_key: Optional[List[str]] = Query(None),
+    scenario_id: Optional[str] = Query(None),
+):
+    """Lineage of a report cell: its contributing steps with source row-id ranges and journal keys.
+
+    The cell's line is either account codes or a line of a compiled FST
+    template; the rows behind an entry come from the drill-down endpoint.
+    """
+    conn = None
+    try:
+        conn = get_company_connection(company_name)
+        account_codes = list(account_code or [])
+        line = None
+        weights = {}
+        if fst_template_id is not None and fst_line_id is not None:
+            compiled = fst_compiler.get_compiled(conn, company_name, fst_template_id)
+            positions = [i for i, candidate in enumerate(compiled.lines) if candidate["id"] == str(fst_line_id)]
+            if not positions:
+                raise HTTPException(status_code=404, detail="Template line not found")
+            line = compiled.lines[positions[0]]
+            in_line = compiled.rows == positions[0]
+            weights = dict(zip((compiled.account_codes[column] for column in compiled.columns[in_line]),
+                               compiled.coefficients[in_line].tolist()))
+            account_codes += list(weights)
+        if not account_codes:
+            raise HTTPException(status_code=400, detail="Pass account_code or fst_template_id with fst_line_id")
+        entries = lineage_index.lookup(conn, process_id, account_codes, entity_key=entity_key,
+                                       period_keys=period_key or [], scenario_key=scenario_id)
+        return {
+            "success": True,
+            "line": line,
+            "account_codes": account_codes,
+            "entries": entries,
+            "row_count": sum(int(entry["row_count"] or 0) for entry in entries),
+            # Signed as the line adds its accounts up
+            "amount": sum(weights.get(entry["account_key"], 1.0) * float(entry["amount"] or 0) for entry in entries),
+        }
+    except HTTPException:
+        raise
+    except fst_compiler.FSTCompileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error reading lineage: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if conn:
+            conn.close()
+
+
 # ============================================================================
 # REPORT TEMPLATES AND CACHING
 # ============================================================================
@@ -13,6 +13,8 @@ import io
 from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 
+from routers import cash_flow
+
 router = APIRouter(prefix="/financial-statements", tags=["Financial Statements"])
 
 class GenerateRequest(BaseModel):
@@ -470,30 +472,35 @@ def generate_income_statement(entries):
         "gross_profit": total_revenue - sum(e['balance_amount'] for e in expenses if e['account_code'].startswith(('5', '50')))
     }
 
-def generate_cash_flow_statement(entries):
-    """Generate simplified cash flow statement"""
-    # This is a simplified version - in practice, this would require more detailed analysis
-    cash_accounts = [e for e in entries if e[0].startswith(('1000', '1001', '1002'))]  # Cash accounts
-    
-    total_cash = sum(float(e[4]) if e[4] else 0 for e in cash_accounts)
+def generate_cash_flow_statement(conn, process_id, scenario_id, period_ids, entity_ids=None):
+    """Generate the indirect cash flow statement of the group (or the given entities) from balance snapshots"""
+    result = cash_flow.generate(conn, str(process_id), scenario_id, period_ids,
+                                [str(e) for e in entity_ids or []], consolidated=True)
+    statement = cash_flow.statement(result, len(result["entity_codes"]) - 1, range(len(result["periods"])))
+    sections = statement["sections"]
+    operating = sections[cash_flow.OPERATING]["items"]
+    net_income = sum(item["amount"] for item in operating if item["line_name"] == cash_flow.PROFIT_LINE)
     
     return {
         "operating_activities": {
-            "net_income": 0,  # Would be calculated from income statement
-            "adjustments": [],
-            "net_cash_from_operations": 0
+            "net_income": net_income,
+            "adjustments": [item for item in operating if item["is_non_cash"]],
+            "working_capital_changes": [item for item in operating
+                                        if not item["is_non_cash"] and item["line_name"] != cash_flow.PROFIT_LINE],
+            "net_cash_from_operations": sections[cash_flow.OPERATING]["total"]
         },
         "investing_activities": {
-            "items": [],
-            "net_cash_from_investing": 0
+            "items": sections[cash_flow.INVESTING]["items"],
+            "net_cash_from_investing": sections[cash_flow.INVESTING]["total"]
         },
         "financing_activities": {
-            "items": [],
-            "net_cash_from_financing": 0
+            "items": sections[cash_flow.FINANCING]["items"],
+            "net_cash_from_financing": sections[cash_flow.FINANCING]["total"]
         },
-        "net_change_in_cash": 0,
-        "cash_beginning": 0,
-        "cash_ending": total_cash
+        "effect_of_exchange_rates": sections[cash_flow.FX]["total"],
+        "net_change_in_cash": statement["totals"]["net_cash_flow"],
+        "cash_beginning": statement["totals"]["opening_cash"],
+        "cash_ending": statement["totals"]["closing_cash"]
     }
 
 def generate_sample_statements(period, year, company_name):
@@ -3,7 +3,7 @@ Fiscal Year & Scenario Management API Router
 Clean working version - no syntax errors
 """
 
-from fastapi import APIRouter, HTTPException, Query, Header
+from fastapi import APIRouter, Depends, HTTPException, Query, Header, Request, Response
 from typing import List, Optional, Dict, Any
 from datetime import datetime, date, timedelta
 from pydantic import BaseModel, Field
@@ -12,7 +12,16 @@ import psycopg2.extras
 import os
 import json
 
-router = APIRouter(prefix="/fiscal-management", tags=["Fiscal Management"])
+from routers import conditional_get, report_cache
+
+# Fiscal years and periods are validated by ETag; writes through this router drop the remembered versions
+FISCAL_DOMAINS = [report_cache.FISCAL_DOMAIN]
+
+router = APIRouter(
+    prefix="/fiscal-management",
+    tags=["Fiscal Management"],
+    dependencies=[Depends(conditional_get.invalidate_after_write(*FISCAL_DOMAINS))],
+)
 
 # ===== DATABASE CONNECTION =====
 
@@ -251,20 +260,28 @@ async def test_database_connection(company_name: str):
 
 @router.get("/fiscal-years")
 async def get_fiscal_years(
+    request: Request,
+    response: Response,
     x_company_database: str = Header(..., alias="X-Company-Database")
 ):
     """Get all fiscal years"""
     try:
+        not_modified = conditional_get.not_modified(request, x_company_database, FISCAL_DOMAINS)
+        if not_modified:
+            return not_modified
+
         print(f"📡 Fetching fiscal years for company: {x_company_database}")
         ensure_fiscal_tables(x_company_database)
         
         with get_company_connection(x_company_database) as conn:
+            etag = conditional_get.current_etag(conn, x_company_database, FISCAL_DOMAINS)
             cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
             
             cur.execute("SELECT * FROM fiscal_years ORDER BY start_date DESC")
             fiscal_years = cur.fetchall()
             
             print(f"✅ Found {len(fiscal_years)} fiscal years")
+            conditional_get.set_etag(response, etag)
             return {
                 "fiscal_years": fiscal_years,
                 "total": len(fiscal_years)
@@ -408,18 +425,26 @@ async def update_fiscal_year(
 @router.get("/fiscal-years/{fiscal_year_id}/periods")
 async def get_periods(
     fiscal_year_id: int,
+    request: Request,
+    response: Response,
     x_company_database: str = Header(..., alias="X-Company-Database")
 ):
     """Get periods for a fiscal year"""
     try:
+        not_modified = conditional_get.not_modified(request, x_company_database, FISCAL_DOMAINS)
+        if not_modified:
+            return not_modified
+
         ensure_fiscal_tables(x_company_database)
         
         with get_company_connection(x_company_database) as conn:
+            etag = conditional_get.current_etag(conn, x_company_database, FISCAL_DOMAINS)
             cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
             
             cur.execute("SELECT * FROM periods WHERE fiscal_year_id = %s ORDER BY sort_order", (fiscal_year_id,))
             periods = cur.fetchall()
             
+            conditional_get.set_etag(response, etag)
             return {
                 "periods": periods,
                 "fiscal_year_id": fiscal_year_id,
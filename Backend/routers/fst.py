@@ -4,6 +4,9 @@ from pydantic import BaseModel
 import psycopg2
 import os
 import json
+import numpy as np
+
+from routers import fst_compiler, report_pack
 
 router = APIRouter(prefix="/fst", tags=["Financial Statement Templates"])
 
@@ -33,6 +36,14 @@ class FSTElement(BaseModel):
     account_mapping: Optional[dict] = None
     display_order: Optional[int] = None
 
+class FSTEvaluateRequest(BaseModel):
+    periods: List[str]
+    process_id: Optional[str] = None
+    scenario_id: Optional[str] = None
+    entity_keys: Optional[List[str]] = None
+    include_consolidated: bool = True
+    decimals: int = 2
+
 @router.get("/templates")
 def get_fst_templates(company_name: str = Query(...)):
     """Get FST templates for current company"""
@@ -207,6 +218,81 @@ def get_fst_elements(template_id: int, company_name: str = Query(...)):
         print(f"Error getting FST elements: {e}")
         return {"elements": []}
 
+@router.get("/templates/{template_id}/compiled")
+def get_compiled_fst_template(template_id: int, company_name: str = Query(...)):
+    """Compiled form of a template: line order, account axis and the sparse line x account matrix"""
+    conn = None
+    try:
+        conn = psycopg2.connect(
+            database=company_name.lower().replace(' ', '_').replace('-', '_'),
+            **get_db_config()
+        )
+        compiled = fst_compiler.get_compiled(conn, company_name, template_id)
+        return {
+            **compiled.describe(),
+            "lines": compiled.lines,
+            "account_codes": compiled.account_codes,
+            "evaluation_order": compiled.evaluation_order,
+            "matrix": {
+                "rows": compiled.rows.tolist(),
+                "columns": compiled.columns.tolist(),
+                "coefficients": compiled.coefficients.tolist(),
+            },
+        }
+    except fst_compiler.FSTCompileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except psycopg2.Error as e:
+        print(f"Error compiling FST template: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to compile template: {str(e)}")
+    finally:
+        if conn:
+            conn.close()
+
+@router.post("/templates/{template_id}/evaluate")
+def evaluate_fst_template(template_id: int, request: FSTEvaluateRequest, company_name: str = Query(...)):
+    """Evaluate a template for every requested entity and period in one matrix operation"""
+    conn = None
+    try:
+        conn = psycopg2.connect(
+            database=company_name.lower().replace(' ', '_').replace('-', '_'),
+            **get_db_config()
+        )
+        compiled = fst_compiler.get_compiled(conn, company_name, template_id)
+        pack_data = report_pack.load_pack_data(
+            conn,
+            [{"account_code": code} for code in compiled.account_codes],
+            request.process_id,
+            request.scenario_id,
+            request.periods,
+            request.entity_keys,
+        )
+        # periods x entities x accounts, measures summed -> accounts x periods x entities
+        balances = pack_data["balances"].sum(axis=3).transpose(2, 0, 1)
+        values = compiled.evaluate(balances)
+        entity_keys = list(pack_data["entity_keys"])
+        entity_names = list(pack_data["entity_names"])
+        if request.include_consolidated:
+            values = np.concatenate([values, values.sum(axis=2, keepdims=True)], axis=2)
+            entity_keys.append("consolidated")
+            entity_names.append("Consolidated")
+        return {
+            **compiled.describe(),
+            "lines": compiled.lines,
+            "periods": pack_data["periods"],
+            "entity_keys": entity_keys,
+            "entity_names": entity_names,
+            # values[line][period][entity]
+            "values": np.round(values, request.decimals).tolist(),
+        }
+    except fst_compiler.FSTCompileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except psycopg2.Error as e:
+        print(f"Error evaluating FST template: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to evaluate template: {str(e)}")
+    finally:
+        if conn:
+            conn.close()
+
 @router.get("/hierarchies")
 def get_fst_hierarchies(company_name: str = Query(...)):
     """Get FST hierarchies for current company"""
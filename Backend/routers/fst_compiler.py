@@ -0,0 +1,375 @@
+"""
+Compiled financial statement templates (FST).
+
+A template is an ordered list of elements (fst_elements): headers, line
+items mapped to account codes, and subtotals / totals built from other
+lines. Instead of walking the elements for every statement, compile()
+turns a template into one sparse ``lines x accounts`` coefficient matrix:
+
+* line items contribute +1 for each mapped account (account_codes, the
+  ``accounts`` list of account_mapping, or a formula of account codes and
+  ``SUM(from:to)`` ranges resolved against the chart of accounts);
+* subtotal and total formulas are resolved in dependency order and folded
+  into the same matrix, so a total is itself a row of account
+  coefficients. In a formula ``[line]`` / ``{line}`` references another
+  element by id or name and a bare token is always an account code.
+  Account codes may contain hyphens, so a ``-`` operator needs whitespace
+  before it (``1000-01 - 2000``, not ``1000-01-2000``). A
+  subtotal without a formula adds the line items since the previous
+  header / subtotal / total; a total without one adds the subtotals since
+  the previous total plus the line items none of them covers;
+* headers are empty rows kept for the layout.
+
+The matrix is stored in coordinate form (line, account, coefficient), and
+CompiledTemplate.evaluate() computes ``lines = matrix @ balances`` for a
+balance array of shape ``accounts x ...`` - a single vector, or every
+entity and period at once - with one scatter-add over the non-zeros.
+
+Compiled templates are cached per company and template, keyed by the fst
+data version of report_cache (bumped by triggers on fst_templates,
+fst_elements and accounts), so an edited template or a new account is
+recompiled on the next request and nothing else is.
+"""
+
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from psycopg2.extras import RealDictCursor
+
+from routers import report_cache
+
+logger = logging.getLogger(__name__)
+
+HEADER = "Header"
+LINE_ITEM = "Line Item"
+SUBTOTAL = "Subtotal"
+TOTAL = "Total"
+ELEMENT_TYPES = (HEADER, LINE_ITEM, SUBTOTAL, TOTAL)
+
+COMPILED_CACHE_SIZE = 256  # Compiled templates kept, across companies
+
+_TERM_PATTERN = re.compile(
+    r"\s*([+-])?\s*(?:SUM\(\s*([^:()\s]+)\s*:\s*([^:()\s]+)\s*\)|\[([^\]]+)\]|\{([^}]+)\}|([^\s+-](?:[^\s+]*[^\s+-])?))",
+    re.IGNORECASE,
+)
+
+
+class FSTCompileError(ValueError):
+    """The template cannot be compiled (unknown reference, circular formula, bad syntax)."""
+
+
+# ============================================================================
+# ELEMENTS
+# ============================================================================
+
+def _normalize_element(row: Dict[str, Any], position: int) -> Dict[str, Any]:
+    """One element in the shape the compiler expects, whichever fst_elements schema the company has."""
+    codes = row.get("account_codes")
+    if codes is None:
+        mapping = row.get("account_mapping")
+        if isinstance(mapping, dict):
+            codes = mapping.get("accounts") or mapping.get("account_codes")
+        elif isinstance(mapping, list):
+            codes = mapping
+    if codes is None and row.get("account_code"):
+        codes = [row["account_code"]]
+    element_type = str(row.get("element_type") or LINE_ITEM).strip()
+    for known in ELEMENT_TYPES:
+        if element_type.lower() == known.lower():
+            element_type = known
+            break
+    order = row.get("order_index", row.get("display_order"))
+    return {
+        "id": str(row.get("id", position)),
+        "name": row.get("element_name") or row.get("name") or str(row.get("id", position)),
+        "type": element_type,
+        "account_codes": [str(code) for code in (codes or [])],
+        "formula": (row.get("calculation_formula") or row.get("formula") or "").strip(),
+        "order": order if order is not None else position,
+    }
+
+
+def load_elements(conn, template_id: int) -> List[Dict[str, Any]]:
+    """Active elements of a template in display order."""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("SELECT * FROM fst_elements WHERE template_id = %s", (template_id,))
+    rows = [row for row in cur.fetchall() if row.get("is_active", True) is not False]
+    elements = [_normalize_element(row, position) for position, row in enumerate(rows)]
+    elements.sort(key=lambda element: (element["order"], element["name"]))
+    return elements
+
+
+def load_chart(conn) -> List[str]:
+    """Account codes of the chart of accounts, for SUM(from:to) ranges."""
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('accounts')")
+    if cur.fetchone()[0] is None:
+        return []
+    cur.execute("SELECT DISTINCT account_code FROM accounts WHERE account_code IS NOT NULL ORDER BY account_code")
+    return [str(row[0]) for row in cur.fetchall()]
+
+
+# ============================================================================
+# COMPILATION
+# ============================================================================
+
+def _code_key(code: str) -> Tuple[int, Any]:
+    # Numeric codes compare as numbers so 900 falls before 1000 in a range
+    return (0, int(code)) if code.isdigit() else (1, code)
+
+
+def _parse_formula(formula: str) -> List[Tuple[int, str, Any]]:
+    """Signed terms of a formula: ("range", (from, to)), ("line", ref) or ("token", text)."""
+    terms = []
+    position = 0
+    formula = formula.strip()
+    if formula.startswith("="):
+        formula = formula[1:]
+    while position < len(formula):
+        if not formula[position:].strip():
+            break
+        match = _TERM_PATTERN.match(formula, position)
+        if not match or match.end() == position:
+            raise FSTCompileError(f"Cannot parse formula {formula!r} at position {position}")
+        sign = -1 if match.group(1) == "-" else 1
+        if match.group(2):
+            terms.append((sign, "range", (match.group(2), match.group(3))))
+        elif match.group(4) or match.group(5):
+            terms.append((sign, "line", (match.group(4) or match.group(5)).strip()))
+        else:
+            terms.append((sign, "token", match.group(6)))
+        position = match.end()
+    return terms
+
+
+def _default_references(elements: Sequence[Dict[str, Any]], index: int,
+                        line_terms: Sequence[Dict[int, float]]) -> List[int]:
+    """Lines an un-formulated subtotal or total adds up; ``line_terms`` holds the earlier lines' references."""
+    element_type = elements[index]["type"]
+    items: List[int] = []
+    subtotals: List[int] = []
+    for previous in range(index - 1, -1, -1):
+        previous_type = elements[previous]["type"]
+        if element_type == SUBTOTAL:
+            if previous_type in (HEADER, SUBTOTAL, TOTAL):
+                break
+            items.append(previous)
+        else:
+            if previous_type == TOTAL:
+                break
+            if previous_type == SUBTOTAL:
+                subtotals.append(previous)
+            elif previous_type == LINE_ITEM:
+                items.append(previous)
+    if element_type == TOTAL and subtotals:
+        # Lines already inside a collected subtotal would be counted twice
+        covered = set()
+        pending = list(subtotals)
+        while pending:
+            for referenced in line_terms[pending.pop()]:
+                if referenced not in covered:
+                    covered.add(referenced)
+                    pending.append(referenced)
+        return sorted(line for line in subtotals + items if line not in covered)
+    return sorted(items)
+
+
+class CompiledTemplate:
+    """A template as a sparse lines x accounts coefficient matrix."""
+
+    def __init__(self, template_id: Any, lines: List[Dict[str, Any]], account_codes: List[str],
+                 rows: np.ndarray, columns: np.ndarray, coefficients: np.ndarray,
+                 evaluation_order: List[int], version: int = 0):
+        self.template_id = template_id
+        self.lines = lines
+        self.account_codes = account_codes
+        self.account_index = {code: index for index, code in enumerate(account_codes)}
+        self.rows = rows
+        self.columns = columns
+        self.coefficients = coefficients
+        self.evaluation_order = evaluation_order
+        self.version = version
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self.lines), len(self.account_codes)
+
+    def dense(self) -> np.ndarray:
+        matrix = np.zeros(self.shape)
+        np.add.at(matrix, (self.rows, self.columns), self.coefficients)
+        return matrix
+
+    def evaluate(self, balances: np.ndarray) -> np.ndarray:
+        """Line values for ``balances`` of shape accounts x ... (any trailing axes, e.g. entities x periods)."""
+        balances = np.asarray(balances, dtype=np.float64)
+        if balances.shape[0] != len(self.account_codes):
+            raise ValueError(f"Expected {len(self.account_codes)} account rows, got {balances.shape[0]}")
+        result = np.zeros((len(self.lines),) + balances.shape[1:])
+        if self.coefficients.size:
+            contributions = balances[self.columns] * self.coefficients.reshape((-1,) + (1,) * (balances.ndim - 1))
+            np.add.at(result, self.rows, contributions)
+        return result
+
+    def balance_vector(self, amounts: Dict[str, float]) -> np.ndarray:
+        """Align a code -> amount mapping with the template's account axis; other codes are ignored."""
+        vector = np.zeros(len(self.account_codes))
+        for code, amount in amounts.items():
+            index = self.account_index.get(str(code))
+            if index is not None:
+                vector[index] += float(amount or 0)
+        return vector
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "template_id": self.template_id,
+            "version": self.version,
+            "lines": len(self.lines),
+            "accounts": len(self.account_codes),
+            "non_zeros": int(self.coefficients.size),
+        }
+
+
+def compile_template(template_id: Any, elements: Sequence[Dict[str, Any]], chart: Sequence[str] = (),
+                     version: int = 0) -> CompiledTemplate:
+    """Compile normalized elements (see load_elements) into a CompiledTemplate."""
+    elements = list(elements)
+    by_reference: Dict[str, int] = {}
+    for index, element in enumerate(elements):
+        by_reference.setdefault(element["id"], index)
+        by_reference.setdefault(element["name"].strip().lower(), index)
+    chart_sorted = sorted({str(code) for code in chart}, key=_code_key)
+
+    def _reference(text: str) -> Optional[int]:
+        return by_reference.get(text) if text in by_reference else by_reference.get(text.strip().lower())
+
+    # Each line's direct dependencies: accounts it maps and lines it adds up
+    account_terms: List[Dict[str, float]] = []
+    line_terms: List[Dict[int, float]] = []
+    for index, element in enumerate(elements):
+        accounts: Dict[str, float] = {}
+        lines: Dict[int, float] = {}
+        if element["type"] == LINE_ITEM:
+            for code in element["account_codes"]:
+                accounts[code] = accounts.get(code, 0.0) + 1.0
+        if element["formula"]:
+            for sign, kind, value in _parse_formula(element["formula"]):
+                if kind == "range":
+                    low, high = _code_key(value[0]), _code_key(value[1])
+                    for code in chart_sorted:
+                        if low <= _code_key(code) <= high:
+                            accounts[code] = accounts.get(code, 0.0) + sign
+                    continue
+                if kind == "token":
+                    accounts[value] = accounts.get(value, 0.0) + sign
+                    continue
+                referenced = _reference(value)
+                if referenced is None:
+                    raise FSTCompileError(f"{element['name']!r} references unknown line {value!r}")
+                if elements[referenced]["type"] != HEADER:
+                    lines[referenced] = lines.get(referenced, 0.0) + sign
+        elif element["type"] in (SUBTOTAL, TOTAL):
+            for referenced in _default_references(elements, index, line_terms):
+                lines[referenced] = lines.get(referenced, 0.0) + 1.0
+        account_terms.append(accounts)
+        line_terms.append(lines)
+
+    # Dependency order (Kahn), so every referenced line is resolved before the lines using it
+    dependents: Dict[int, List[int]] = {index: [] for index in range(len(elements))}
+    pending = [len(terms) for terms in line_terms]
+    for index, terms in enumerate(line_terms):
+        for referenced in terms:
+            dependents[referenced].append(index)
+    ready = [index for index, count in enumerate(pending) if count == 0]
+    order: List[int] = []
+    while ready:
+        index = ready.pop(0)
+        order.append(index)
+        for dependent in dependents[index]:
+            pending[dependent] -= 1
+            if pending[dependent] == 0:
+                ready.append(dependent)
+    if len(order) != len(elements):
+        cycle = [elements[index]["name"] for index, count in enumerate(pending) if count]
+        raise FSTCompileError(f"Circular formulas between lines: {', '.join(cycle)}")
+
+    # Fold referenced lines into account coefficients
+    resolved: List[Dict[str, float]] = [{} for _ in elements]
+    for index in order:
+        row = dict(account_terms[index])
+        for referenced, factor in line_terms[index].items():
+            for code, coefficient in resolved[referenced].items():
+                row[code] = row.get(code, 0.0) + factor * coefficient
+        resolved[index] = {code: coefficient for code, coefficient in row.items() if coefficient}
+
+    account_codes = sorted({code for row in resolved for code in row}, key=_code_key)
+    account_index = {code: index for index, code in enumerate(account_codes)}
+    rows, columns, coefficients = [], [], []
+    for index, row in enumerate(resolved):
+        for code, coefficient in row.items():
+            rows.append(index)
+            columns.append(account_index[code])
+            coefficients.append(coefficient)
+
+    lines = [
+        {"id": element["id"], "name": element["name"], "type": element["type"], "order": element["order"]}
+        for element in elements
+    ]
+    return CompiledTemplate(
+        template_id, lines, account_codes,
+        np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64), np.array(coefficients, dtype=np.float64),
+        order, version,
+    )
+
+
+# ============================================================================
+# CACHE
+# ============================================================================
+
+class CompiledTemplateCache:
+    """Compiled templates per (company, template), valid for one fst data version."""
+
+    def __init__(self, max_entries: int = COMPILED_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, Any], CompiledTemplate]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.compiles = 0
+
+    def get(self, conn, company_name: str, template_id: Any) -> CompiledTemplate:
+        version = report_cache.data_version(conn, company_name, report_cache.FST_DOMAIN)
+        key = (company_name, template_id)
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None and compiled.version == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compiled
+        compiled = compile_template(template_id, load_elements(conn, template_id), load_chart(conn), version)
+        with self._lock:
+            self.compiles += 1
+            self._entries[key] = compiled
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        logger.info(f"Compiled FST template {template_id} for {company_name} (v{version}): "
+                    f"{compiled.shape[0]} lines x {compiled.shape[1]} accounts, {compiled.coefficients.size} non-zeros")
+        return compiled
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "compiles": self.compiles}
+
+
+_cache = CompiledTemplateCache()
+
+
+def get_compiled(conn, company_name: str, template_id: Any) -> CompiledTemplate:
+    return _cache.get(conn, company_name, template_id)
+
+
+def stats() -> Dict[str, Any]:
+    return _cache.stats()
@@ -0,0 +1,236 @@
+"""
+Unrealized intercompany profit elimination.
+
+Intercompany sales of inventory and transfers of assets from a process'
+``{process}_ic_amounts_entries`` table are classified by transaction_type
+(custom_transaction_type in custom_fields refines it), loaded for a period
+as columns and grouped by seller, buyer and product class. For every line
+the profit still held by the buyer is
+
+    amount x margin x on-hand ratio
+
+where margin and on-hand ratio come from the line's custom_fields, else the
+most specific configured ratio (seller / buyer / product class, any of
+which may be a wildcard), else the defaults. The elimination and its
+deferred tax at the buyer's rate are computed over the whole dataset at
+once and emitted as journals through journal_sink.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from routers import journal_sink
+
+logger = logging.getLogger(__name__)
+
+INVENTORY = "inventory"
+ASSET = "asset_transfer"
+GROUP_KEYS = ["seller_entity", "buyer_entity", "product_class", "kind"]
+JOURNAL_PREFIX = "upe:"
+
+DEFAULT_ACCOUNTS: Dict[str, str] = {
+    "inventory_profit_account": "IC_COGS_UNREALIZED",  # Seller: cost of sales / revenue
+    "inventory_account": "INVENTORY",  # Buyer: stock carried at IC price
+    "asset_gain_account": "IC_GAIN_ON_TRANSFER",  # Seller: gain on transfer
+    "asset_account": "PROPERTY_PLANT_EQUIPMENT",  # Buyer: asset carried at IC price
+    "deferred_tax_asset_account": "DEFERRED_TAX_ASSET",
+    "tax_expense_account": "DEFERRED_TAX_EXPENSE",
+}
+
+
+def classify_transactions(transaction_type: pd.Series, custom_type: pd.Series) -> np.ndarray:
+    """Map transaction types onto INVENTORY / ASSET; anything else is not a profit-bearing transfer."""
+    # A period holds a handful of distinct types, so only those are matched
+    type_codes, types = pd.factorize(transaction_type.fillna(""))
+    custom_codes, custom_types = pd.factorize(custom_type.fillna(""))
+    pairs, codes = np.unique(type_codes * max(len(custom_types), 1) + custom_codes, return_inverse=True)
+    text = pd.Series([
+        f"{types[pair // max(len(custom_types), 1)]} {custom_types[pair % max(len(custom_types), 1)]}".lower()
+        for pair in pairs
+    ], dtype=object)
+    is_asset = text.str.contains("asset|fixed|equipment|property", regex=True).to_numpy(dtype=bool)
+    is_inventory = text.str.contains("inventor|goods|stock|sale|product", regex=True).to_numpy(dtype=bool)
+    kinds = np.where(is_asset, ASSET, np.where(is_inventory, INVENTORY, "")).astype(object)
+    return kinds[codes]
+
+
+# ============================================================================
+# LOADING
+# ============================================================================
+
+def load_ic_sales(conn, table_name: str, process_id: str, period_code: str,
+                  scenario_id: Optional[str] = None) -> pd.DataFrame:
+    """IC lines of a period with their classification inputs, one row per entry."""
+    conditions = ["process_id = %s", "period_code = %s"]
+    params: List[Any] = [process_id, period_code]
+    if scenario_id:
+        conditions.append("scenario_id = %s")
+        params.append(scenario_id)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT from_entity_code, to_entity_code, amount, currency, transaction_type,
+               custom_fields->>'custom_transaction_type',
+               COALESCE(custom_fields->>'product_class', custom_fields->>'custom_transaction_type', transaction_type),
+               NULLIF(custom_fields->>'margin', ''),
+               NULLIF(custom_fields->>'on_hand_ratio', '')
+        FROM {table_name}
+        WHERE {' AND '.join(conditions)}
+    """, params)
+    frame = pd.DataFrame(cur.fetchall(), columns=[
+        "seller_entity", "buyer_entity", "amount", "currency", "transaction_type",
+        "custom_transaction_type", "product_class", "margin", "on_hand_ratio",
+    ])
+    frame["amount"] = pd.to_numeric(frame["amount"], errors="coerce").fillna(0.0).astype(np.float64)
+    frame["margin"] = pd.to_numeric(frame["margin"], errors="coerce")
+    frame["on_hand_ratio"] = pd.to_numeric(frame["on_hand_ratio"], errors="coerce")
+    frame["product_class"] = frame["product_class"].fillna("").astype(str)
+    frame["kind"] = classify_transactions(frame["transaction_type"].astype(object),
+                                          frame["custom_transaction_type"].astype(object))
+    return frame[frame["kind"] != ""].reset_index(drop=True)
+
+
+def load_entity_tax_rates(conn) -> Dict[str, float]:
+    """Per-entity tax rates from axes_entities custom fields, where set."""
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('axes_entities')")
+    if cur.fetchone()[0] is None:
+        return {}
+    cur.execute("""
+        SELECT code, NULLIF(custom_fields->>'tax_rate', '') FROM axes_entities
+        WHERE custom_fields ? 'tax_rate'
+    """)
+    rates = {}
+    for code, rate in cur.fetchall():
+        try:
+            rates[code] = float(rate)
+        except (TypeError, ValueError):
+            continue
+    return rates
+
+
+# ============================================================================
+# COMPUTATION
+# ============================================================================
+
+def _apply_ratios(frame: pd.DataFrame, ratios: Sequence[Dict[str, Any]], column: str) -> pd.Series:
+    """Fill ``column`` from the most specific matching ratio; blanks in a ratio are wildcards."""
+    values = frame[column].copy()
+    if not ratios:
+        return values
+    table = pd.DataFrame(ratios).reindex(columns=["seller_entity", "buyer_entity", "product_class", column])
+    table = table[table[column].notna()]
+    keys = ["seller_entity", "buyer_entity", "product_class"]
+    specified = table[keys].notna() & (table[keys] != "")
+    # Most specific first: every subset of the three keys, largest subsets first
+    for mask in sorted({tuple(row) for row in specified.itertuples(index=False)}, key=sum, reverse=True):
+        used = [key for key, on in zip(keys, mask) if on]
+        level = table[(specified[keys] == list(mask)).all(axis=1)]
+        if level.empty:
+            continue
+        if used:
+            level = level.drop_duplicates(subset=used, keep="last")
+            matched = frame[used].merge(level[used + [column]], how="left", on=used)[column]
+        else:
+            matched = pd.Series(level[column].iloc[-1], index=frame.index)
+        values = values.fillna(pd.Series(matched.to_numpy(), index=frame.index))
+    return values
+
+
+def compute_eliminations(frame: pd.DataFrame, ratios: Sequence[Dict[str, Any]], default_margin: float,
+                         default_on_hand_ratio: float, default_tax_rate: float,
+                         entity_tax_rates: Dict[str, float]) -> pd.DataFrame:
+    """Unrealized profit and deferred tax per (seller, buyer, product class, kind)."""
+    if frame.empty:
+        return pd.DataFrame(columns=GROUP_KEYS + ["sales", "lines", "unrealized_profit", "tax_rate", "deferred_tax"])
+    margin = _apply_ratios(frame, ratios, "margin").fillna(default_margin).clip(-1.0, 1.0)
+    on_hand = _apply_ratios(frame, ratios, "on_hand_ratio").fillna(default_on_hand_ratio).clip(0.0, 1.0)
+    tax_rate = frame["buyer_entity"].map(entity_tax_rates).astype(np.float64).fillna(default_tax_rate)
+
+    work = frame[GROUP_KEYS].copy()
+    work["sales"] = frame["amount"]
+    work["unrealized_profit"] = frame["amount"].to_numpy() * margin.to_numpy() * on_hand.to_numpy()
+    work["deferred_tax"] = work["unrealized_profit"] * tax_rate.to_numpy()
+    work["lines"] = 1
+    groups = work.groupby(GROUP_KEYS, sort=True, dropna=False).sum(numeric_only=True).reset_index()
+    groups["unrealized_profit"] = groups["unrealized_profit"].round(2)
+    groups["deferred_tax"] = groups["deferred_tax"].round(2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        groups["tax_rate"] = np.where(groups["unrealized_profit"] != 0,
+                                      groups["deferred_tax"] / groups["unrealized_profit"], default_tax_rate)
+    return groups
+
+
+def post_journals(conn, process_id: str, period_code: str, groups: pd.DataFrame,
+                  accounts: Dict[str, str], currency: Optional[str] = None) -> Dict[str, Any]:
+    """Replace the period's UPE journals: one per transfer kind plus one for deferred tax.
+
+    Empty ``groups`` still swap, which clears the journals of an earlier run.
+    """
+    sink = journal_sink.JournalSink(
+        conn, process_id, period=period_code,
+        journal_table="process_run_journals", line_table="process_run_journal_lines",
+        key_prefix=JOURNAL_PREFIX,
+    )
+    for kind, profit_account, carrying_account in (
+        (INVENTORY, accounts["inventory_profit_account"], accounts["inventory_account"]),
+        (ASSET, accounts["asset_gain_account"], accounts["asset_account"]),
+    ):
+        block = groups[groups["kind"] == kind]
+        if block.empty:
+            continue
+        profit = block["unrealized_profit"].to_numpy()
+        # Seller gives up the profit, the buyer's carrying amount is reduced by it
+        sink.add(
+            f"{JOURNAL_PREFIX}{kind}:{period_code}", f"unrealized_profit_{kind}",
+            np.concatenate([block["seller_entity"], block["buyer_entity"]]),
+            np.concatenate([np.full(len(block), profit_account, dtype=object),
+                            np.full(len(block), carrying_account, dtype=object)]),
+            np.concatenate([profit, -profit]),
+            counterparty_entity_code=np.concatenate([block["buyer_entity"], block["seller_entity"]]),
+            currency=currency,
+            description=np.concatenate([block["product_class"], block["product_class"]]),
+            source="ic_unrealized_profit",
+        )
+    if groups.empty:
+        return sink.swap()
+    tax = groups["deferred_tax"].to_numpy()
+    buyers = groups["buyer_entity"].to_numpy(dtype=object)
+    sink.add(
+        f"{JOURNAL_PREFIX}deferred_tax:{period_code}", "unrealized_profit_deferred_tax",
+        np.concatenate([buyers, buyers]),
+        np.concatenate([np.full(len(groups), accounts["deferred_tax_asset_account"], dtype=object),
+                        np.full(len(groups), accounts["tax_expense_account"], dtype=object)]),
+        np.concatenate([tax, -tax]),
+        counterparty_entity_code=np.concatenate([groups["seller_entity"], groups["seller_entity"]]),
+        currency=currency,
+        source="ic_unrealized_profit",
+    )
+    return sink.swap()
+
+
+def run_elimination(conn, table_name: str, process_id: str, period_code: str,
+                    scenario_id: Optional[str], ratios: Sequence[Dict[str, Any]],
+                    default_margin: float, default_on_hand_ratio: float, default_tax_rate: float,
+                    accounts: Optional[Dict[str, str]] = None, post: bool = True,
+                    currency: Optional[str] = None) -> Dict[str, Any]:
+    """Load, compute and (optionally) journal the period's unrealized profit elimination."""
+    frame = load_ic_sales(conn, table_name, process_id, period_code, scenario_id)
+    groups = compute_eliminations(frame, ratios, default_margin, default_on_hand_ratio,
+                                  default_tax_rate, load_entity_tax_rates(conn))
+    journals = None
+    if post:
+        # Also with no groups left, so a rerun clears the journals of the previous one
+        journals = post_journals(conn, process_id, period_code, groups,
+                                 {**DEFAULT_ACCOUNTS, **(accounts or {})}, currency)
+    logger.info(f"Eliminated unrealized profit over {len(frame)} IC lines in {len(groups)} groups "
+                f"for process {process_id} period {period_code}")
+    return {
+        "lines": len(frame),
+        "groups": groups,
+        "total_unrealized_profit": round(float(groups["unrealized_profit"].sum()), 2) if len(groups) else 0.0,
+        "total_deferred_tax": round(float(groups["deferred_tax"].sum()), 2) if len(groups) else 0.0,
+        "journals": journals,
+    }
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, status, Query, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from typing import List, Optional
 from pydantic import BaseModel
 import psycopg2
@@ -7,7 +7,14 @@ import json
 import re
 from datetime import datetime
 
-router = APIRouter(prefix="/ifrs-accounts", tags=["IFRS Accounts"])
+from routers import conditional_get, report_cache
+
+# Writes drop the remembered reference-data versions used for ETags
+router = APIRouter(
+    prefix="/ifrs-accounts",
+    tags=["IFRS Accounts"],
+    dependencies=[Depends(conditional_get.invalidate_after_write(report_cache.REFERENCE_DOMAIN))],
+)
 
 class IFRSAccountCreate(BaseModel):
     account_code: str
@@ -0,0 +1,236 @@
+"""
+Index manager for the per-process ``{process}_{type}_entries`` tables.
+
+Those tables are created with nothing but a primary key, while every read
+path filters them by process, scenario, entity, account and period and
+pages them by (created_at, id). INDEX_SPECS lists the indexes each data
+type needs:
+
+* (process_id, created_at DESC, id DESC) for the newest-first keyset pages;
+* (process_id, scenario_id, created_at DESC) plus a partial index over the
+  scenario-less rows, which "scenario_id = x OR scenario_id IS NULL" filters
+  combine in a bitmap OR;
+* entity / account / period lookups used by reports, rules and AI queries;
+* a trigram GIN index for the ``fiscal_year ILIKE`` filter when pg_trgm is
+  available.
+
+ensure_indexes() creates them with the table (it is empty, so a plain
+CREATE INDEX is instant). backfill_indexes() adds missing ones to existing
+tables with CREATE INDEX CONCURRENTLY, so writers are not blocked, after
+dropping any invalid leftovers of an interrupted build. index_usage() reads
+pg_stat_user_indexes, and drop_unused_indexes() removes managed indexes
+that have never been scanned.
+
+Processes routed to the partitioned ``{data_type}_facts`` tables (see
+fact_tables) get the same indexes on the partitioned parents, which
+PostgreSQL clones onto every partition. Those cannot be built
+concurrently or dropped one partition at a time, so only index_usage()
+covers them: pass the process's leaf partitions as ``partitions`` to get
+per-partition stats, each row naming the parent index it was cloned from.
+"""
+
+import hashlib
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+DATA_TYPES = ("entity_amounts", "ic_amounts", "other_amounts")
+INDEX_PREFIX = "ixm_"  # Marks indexes owned by the manager
+
+# (suffix, column list, partial predicate) per data type
+COMMON_SPECS: List[Tuple[str, str, Optional[str]]] = [
+    ("page", "process_id, created_at DESC, id DESC", None),
+    ("scenario", "process_id, scenario_id, created_at DESC", None),
+    ("no_scenario", "process_id, created_at DESC", "scenario_id IS NULL"),
+    ("period", "process_id, period_code, fiscal_year", None),
+    ("period_id", "process_id, period_id", "period_id IS NOT NULL"),
+]
+INDEX_SPECS: Dict[str, List[Tuple[str, str, Optional[str]]]] = {
+    "entity_amounts": COMMON_SPECS + [
+        ("entity_code", "process_id, entity_code, period_code", None),
+        ("entity_id", "process_id, entity_id", "entity_id IS NOT NULL"),
+        ("account", "process_id, account_code, period_code", None),
+    ],
+    "other_amounts": COMMON_SPECS + [
+        ("entity_code", "process_id, entity_code, period_code", None),
+        ("entity_id", "process_id, entity_id", "entity_id IS NOT NULL"),
+        ("account", "process_id, account_code, period_code", None),
+    ],
+    "ic_amounts": COMMON_SPECS + [
+        ("from_entity", "process_id, from_entity_code, to_entity_code", None),
+        ("to_entity", "process_id, to_entity_code", None),
+        ("from_entity_id", "process_id, from_entity_id", "from_entity_id IS NOT NULL"),
+        ("to_entity_id", "process_id, to_entity_id", "to_entity_id IS NOT NULL"),
+        ("account", "process_id, from_account_code, period_code", None),
+        ("transaction_type", "process_id, period_code, transaction_type", None),
+    ],
+}
+TRIGRAM_SPEC = ("fiscal_year_trgm", "fiscal_year gin_trgm_ops")
+
+
+def index_name(table_name: str, suffix: str) -> str:
+    """Index name within PostgreSQL's 63-byte limit, stable for a table and suffix."""
+    name = f"{INDEX_PREFIX}{table_name}_{suffix}"
+    if len(name) <= 63:
+        return name
+    digest = hashlib.md5(table_name.encode("utf-8")).hexdigest()[:8]
+    return f"{INDEX_PREFIX}{table_name[:63 - len(INDEX_PREFIX) - len(suffix) - 10]}_{digest}_{suffix}"
+
+
+def table_data_type(table_name: str) -> Optional[str]:
+    for data_type in DATA_TYPES:
+        if table_name.endswith(f"_{data_type}_entries"):
+            return data_type
+    return None
+
+
+def _has_trigram(conn) -> bool:
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    return cur.fetchone() is not None
+
+
+def index_definitions(conn, table_name: str, data_type: str) -> List[Tuple[str, str]]:
+    """(index name, CREATE INDEX tail) for every index a table should have."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = %s AND table_schema = current_schema()
+    """, (table_name,))
+    columns = {row[0] for row in cur.fetchall()}
+    definitions = []
+    for suffix, column_list, predicate in INDEX_SPECS.get(data_type, COMMON_SPECS):
+        used = [part.split()[0] for part in column_list.split(",")]
+        if not all(column in columns for column in used):
+            # Older tables may predate a column; skip rather than fail
+            continue
+        tail = f"ON {table_name} ({column_list})"
+        if predicate:
+            tail += f" WHERE {predicate}"
+        definitions.append((index_name(table_name, suffix), tail))
+    if "fiscal_year" in columns and _has_trigram(conn):
+        definitions.append((index_name(table_name, TRIGRAM_SPEC[0]),
+                            f"ON {table_name} USING gin ({TRIGRAM_SPEC[1]})"))
+    return definitions
+
+
+def ensure_indexes(conn, table_name: str, data_type: str) -> List[str]:
+    """Create missing indexes in the caller's transaction; meant for new or small tables."""
+    cur = conn.cursor()
+    created = []
+    for name, tail in index_definitions(conn, table_name, data_type):
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} {tail}")
+        created.append(name)
+    return created
+
+
+def _existing_indexes(conn, table_name: str) -> Dict[str, bool]:
+    """Index name -> is valid, for one table."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT c.relname, i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = to_regclass(%s)
+    """, (table_name,))
+    return {name: valid for name, valid in cur.fetchall()}
+
+
+def process_tables(conn, table_names: Optional[Sequence[str]] = None) -> List[Tuple[str, str]]:
+    """(table, data type) of the per-process entry tables, optionally limited to some names."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT table_name FROM information_schema.tables
+        WHERE table_schema = current_schema() AND table_name LIKE '%%\\_entries'
+        ORDER BY table_name
+    """)
+    tables = []
+    for (table_name,) in cur.fetchall():
+        data_type = table_data_type(table_name)
+        if data_type and (table_names is None or table_name in table_names):
+            tables.append((table_name, data_type))
+    return tables
+
+
+def backfill_indexes(conn, table_names: Optional[Sequence[str]] = None,
+                     progress: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+    """Build missing indexes on existing tables with CREATE INDEX CONCURRENTLY.
+
+    Switches ``conn`` to autocommit, as concurrent builds cannot run inside
+    a transaction block; use a dedicated connection.
+    """
+    conn.rollback()
+    conn.autocommit = True
+    cur = conn.cursor()
+    created, skipped, failed = [], 0, []
+    for table_name, data_type in process_tables(conn, table_names):
+        existing = _existing_indexes(conn, table_name)
+        for name, tail in index_definitions(conn, table_name, data_type):
+            if existing.get(name) is True:
+                skipped += 1
+                continue
+            try:
+                if name in existing:
+                    # Invalid index left behind by an interrupted concurrent build
+                    cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {tail}")
+                created.append(name)
+                if progress:
+                    progress("index_created", table=table_name, index=name)
+            except Exception as e:
+                logger.warning(f"Could not build index {name} on {table_name}: {e}")
+                failed.append({"index": name, "error": str(e)})
+        cur.execute(f"ANALYZE {table_name}")
+    logger.info(f"Index backfill: {len(created)} created, {skipped} present, {len(failed)} failed")
+    return {"created": created, "already_present": skipped, "failed": failed}
+
+
+def index_usage(conn, table_names: Optional[Sequence[str]] = None,
+                partitions: Sequence[str] = ()) -> List[Dict[str, Any]]:
+    """Scan counts and sizes of the indexes on the per-process tables and the given fact partitions."""
+    tables = [table for table, _ in process_tables(conn, table_names)] + list(partitions)
+    if not tables:
+        return []
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT s.relname AS table_name, s.indexrelname AS index_name, s.idx_scan,
+               s.idx_tup_read, s.idx_tup_fetch,
+               pg_relation_size(s.indexrelid) AS size_bytes,
+               i.indisprimary AS is_primary, i.indisunique AS is_unique, i.indisvalid AS is_valid,
+               s.indexrelname LIKE %s AS managed,
+               parent.relname AS parent_index,
+               (SELECT stats_reset FROM pg_stat_database WHERE datname = current_database()) AS stats_since
+        FROM pg_stat_user_indexes s
+        JOIN pg_index i ON i.indexrelid = s.indexrelid
+        LEFT JOIN pg_inherits inh ON inh.inhrelid = s.indexrelid
+        LEFT JOIN pg_class parent ON parent.oid = inh.inhparent
+        WHERE s.relname = ANY(%s)
+        ORDER BY s.relname, s.idx_scan, s.indexrelname
+    """, (INDEX_PREFIX.replace("_", "\\_") + "%", tables))
+    rows = cur.fetchall()
+    for row in rows:
+        row["unused"] = row["idx_scan"] == 0 and not row["is_primary"] and not row["is_unique"]
+    return rows
+
+
+def drop_unused_indexes(conn, table_names: Optional[Sequence[str]] = None,
+                        dry_run: bool = True) -> List[str]:
+    """Drop managed indexes never scanned since statistics were last reset.
+
+    Only indexes created by this module on the per-process tables are
+    considered; fact partition indexes belong to their parent's. Switches
+    ``conn`` to autocommit when not a dry run.
+    """
+    unused = [row["index_name"] for row in index_usage(conn, table_names) if row["unused"] and row["managed"]]
+    if dry_run or not unused:
+        return unused
+    conn.rollback()
+    conn.autocommit = True
+    cur = conn.cursor()
+    for name in unused:
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    logger.info(f"Dropped {len(unused)} unused process table indexes")
+    return unused
@@ -0,0 +1,196 @@
+"""
+Bulk journal sink for consolidation runs.
+
+Calculations hand the sink whole columns (entity codes, account codes,
+amounts, ...) per journal instead of building ORM objects. Buffers are
+streamed with COPY into a transaction-local staging table whenever they
+reach JOURNAL_SINK_BUFFER_ROWS, and swap() replaces the previous run's
+journals of the same process/period with the staged lines and derives the
+journal headers (line counts, debit/credit totals, balanced flag) with one
+GROUP BY. The drill-down lineage of the swapped scope is re-indexed in the
+same transaction, so readers see either the old run or the new one.
+
+Final tables: consolidation_run_journals / consolidation_run_journal_lines
+(see consolidation.ensure_consolidation_schema) by default; financial
+processes write process_run_journals / process_run_journal_lines (see
+financial_process.ensure_financial_tables), which have the same columns.
+"""
+
+import io
+import logging
+import uuid
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from config import settings
+from routers import lineage_index
+
+logger = logging.getLogger(__name__)
+
+LINE_COLUMNS = [
+    "run_id", "process_id", "journal_key", "journal_type", "line_number",
+    "entity_code", "account_code", "counterparty_entity_code", "period",
+    "debit_amount", "credit_amount", "currency", "description", "source",
+]
+
+
+class JournalSink:
+    """Columnar journal line buffer for one consolidation run."""
+
+    def __init__(self, conn, process_id: Any, run_id: Optional[str] = None,
+                 period: Optional[str] = None, buffer_rows: Optional[int] = None,
+                 journal_table: str = "consolidation_run_journals",
+                 line_table: str = "consolidation_run_journal_lines",
+                 key_prefix: Optional[str] = None):
+        self.conn = conn
+        self.process_id = process_id
+        self.journal_table = journal_table
+        self.line_table = line_table
+        self.key_prefix = key_prefix
+        self.run_id = run_id or str(uuid.uuid4())
+        self.period = period
+        self.buffer_rows = buffer_rows or settings.JOURNAL_SINK_BUFFER_ROWS
+        self.staging_table = f"journal_sink_{uuid.uuid4().hex[:12]}"
+        self._frames: List[pd.DataFrame] = []
+        self._buffered = 0
+        self._line_numbers: Dict[str, int] = {}
+        self._staging_ready = False
+        self.lines_written = 0
+
+    def add(self, journal_key: str, journal_type: str, entity_code: Sequence[Any],
+            account_code: Sequence[Any], amount: Sequence[float], period: Any = None,
+            counterparty_entity_code: Any = None, currency: Any = None,
+            description: Any = None, source: Any = None) -> int:
+        """Buffer a block of lines for one journal; scalars broadcast over the block.
+
+        Positive amounts are debits, negative amounts credits; zero lines are dropped.
+        """
+        amount = np.round(np.asarray(amount, dtype=np.float64), 2)
+        keep = amount != 0
+        count = int(keep.sum())
+        if not count:
+            return 0
+
+        def _column(values: Any) -> Any:
+            if values is None or np.isscalar(values):
+                return values
+            return np.asarray(values, dtype=object)[keep]
+
+        start = self._line_numbers.get(journal_key, 0)
+        self._line_numbers[journal_key] = start + count
+        kept = amount[keep]
+        self._frames.append(pd.DataFrame({
+            "run_id": self.run_id,
+            "process_id": self.process_id,
+            "journal_key": journal_key,
+            "journal_type": journal_type,
+            "line_number": np.arange(start + 1, start + count + 1),
+            "entity_code": _column(entity_code),
+            "account_code": _column(account_code),
+            "counterparty_entity_code": _column(counterparty_entity_code),
+            "period": _column(period if period is not None else self.period),
+            "debit_amount": np.where(kept > 0, kept, 0.0),
+            "credit_amount": np.where(kept < 0, -kept, 0.0),
+            "currency": _column(currency),
+            "description": _column(description),
+            "source": _column(source),
+        }, index=pd.RangeIndex(count), columns=LINE_COLUMNS))
+        self._buffered += count
+        if self._buffered >= self.buffer_rows:
+            self.flush()
+        return count
+
+    def _ensure_staging(self) -> None:
+        if self._staging_ready:
+            return
+        cur = self.conn.cursor()
+        cur.execute(f"""
+            CREATE TEMP TABLE {self.staging_table}
+            (LIKE {self.line_table} INCLUDING DEFAULTS)
+            ON COMMIT DROP
+        """)
+        self._staging_ready = True
+
+    def flush(self) -> int:
+        """COPY buffered lines into the staging table."""
+        if not self._frames:
+            return 0
+        self._ensure_staging()
+        frame = pd.concat(self._frames, ignore_index=True)
+        buffer = io.StringIO()
+        frame.to_csv(buffer, header=False, index=False, na_rep="\\N")
+        buffer.seek(0)
+        cur = self.conn.cursor()
+        cur.copy_expert(
+            f"COPY {self.staging_table} ({', '.join(LINE_COLUMNS)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer,
+        )
+        written = len(frame)
+        self.lines_written += written
+        self._frames = []
+        self._buffered = 0
+        return written
+
+    def swap(self) -> Dict[str, Any]:
+        """Replace the process' previous run journals with this run and commit.
+
+        The scope replaced is the process, narrowed to ``period`` and to
+        journal keys starting with ``key_prefix`` when the sink was created
+        with them. Returns the journal headers of the run.
+        """
+        self.flush()
+        cur = self.conn.cursor()
+        try:
+            # Two runs of the same process swap one after the other
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s), hashtext(%s))",
+                        (self.journal_table, str(self.process_id)))
+            scope = "process_id = %s"
+            params: List[Any] = [self.process_id]
+            if self.period is not None:
+                scope += " AND period = %s"
+                params.append(self.period)
+            if self.key_prefix:
+                scope += " AND journal_key LIKE %s"
+                params.append(self.key_prefix.replace("%", "\\%").replace("_", "\\_") + "%")
+            cur.execute(f"DELETE FROM {self.line_table} WHERE {scope}", params)
+            replaced = cur.rowcount
+            cur.execute(f"DELETE FROM {self.journal_table} WHERE {scope}", params)
+            if self._staging_ready:
+                cur.execute(f"""
+                    INSERT INTO {self.line_table} ({', '.join(LINE_COLUMNS)})
+                    SELECT {', '.join(LINE_COLUMNS)} FROM {self.staging_table}
+                """)
+            cur.execute(f"""
+                INSERT INTO {self.journal_table}
+                (run_id, process_id, journal_key, journal_type, period,
+                 line_count, total_debit, total_credit, is_balanced)
+                SELECT run_id, process_id, journal_key, MAX(journal_type), period,
+                       COUNT(*), SUM(debit_amount), SUM(credit_amount),
+                       SUM(debit_amount) = SUM(credit_amount)
+                FROM {self.line_table}
+                WHERE run_id = %s
+                GROUP BY run_id, process_id, journal_key, period
+                RETURNING journal_key, journal_type, period, line_count,
+                          total_debit, total_credit, is_balanced
+            """, (self.run_id,))
+            journals = cur.fetchall()
+            lineage_index.index_journals(self.conn, self.line_table, self.process_id, self.period)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        self._staging_ready = False
+        logger.info(f"Swapped {self.lines_written} journal lines for run {self.run_id} "
+                    f"(replaced {replaced}) in process {self.process_id}")
+        return {
+            "run_id": self.run_id,
+            "lines_written": self.lines_written,
+            "lines_replaced": replaced,
+            "journals": [
+                dict(zip(("journal_key", "journal_type", "period", "line_count",
+                          "total_debit", "total_credit", "is_balanced"), row))
+                for row in journals
+            ],
+        }
@@ -0,0 +1,404 @@
+"""
+Precomputed dashboard KPIs.
+
+The dashboard is the landing page for every user, and its figures used to be
+aggregated from tb_entries, accounts, entities, uploads and
+consolidation_journals on every load. They are now computed into a snapshot
+per company:
+
+* ``financial_summary`` - current-year totals by account type and ratios;
+* ``company_overview`` - entity / account / upload / journal counts;
+* ``recent_activities`` - the newest uploads and journals of the last 30 days;
+* ``period_trends`` - revenue, expenses and net income per year and period.
+
+Snapshots are kept in memory, so a dashboard request is a dict lookup, and
+persisted in dashboard_kpi_snapshots inside the company database, so other
+workers and restarts pick them up without recomputing.
+
+Freshness comes from the "dashboard" domain of report_cache's data
+versions, which statement-level triggers on the source tables bump on
+every write. A snapshot is recomputed:
+
+* by the scheduler thread, every KPI_SNAPSHOT_REFRESH_SECONDS, for
+  companies whose version moved or whose snapshot is older than
+  KPI_SNAPSHOT_MAX_AGE_SECONDS;
+* after writes reported through notify_write(), debounced by
+  KPI_SNAPSHOT_DEBOUNCE_SECONDS and at most KPI_SNAPSHOT_MAX_DELAY_SECONDS
+  behind the first write of a burst;
+* on demand through refresh().
+"""
+
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, ContextManager, Dict, List, Optional
+
+import psycopg2
+
+from config import settings
+from routers import report_cache
+
+logger = logging.getLogger(__name__)
+
+SECTIONS = ("financial_summary", "company_overview", "recent_activities", "period_trends")
+
+ACCOUNT_TYPE_TOTALS = {
+    "Asset": "total_assets",
+    "Liability": "total_liabilities",
+    "Equity": "total_equity",
+    "Revenue": "total_revenue",
+    "Expense": "total_expenses",
+}
+
+
+class KpiSnapshot:
+    """One company's dashboard sections with the data version they were computed at."""
+
+    def __init__(self, sections: Dict[str, Any], data_version: int, computed_at: datetime,
+                 duration_ms: int = 0):
+        self.sections = sections
+        self.data_version = data_version
+        self.computed_at = computed_at
+        self.duration_ms = duration_ms
+
+    def age_seconds(self) -> float:
+        return max((datetime.utcnow() - self.computed_at).total_seconds(), 0.0)
+
+    def freshness(self) -> Dict[str, Any]:
+        return {
+            "computed_at": self.computed_at.isoformat(),
+            "age_seconds": round(self.age_seconds(), 1),
+            "data_version": self.data_version,
+            "duration_ms": self.duration_ms,
+        }
+
+
+# ============================================================================
+# KPI QUERIES
+# ============================================================================
+
+def _financial_summary(cur) -> Dict[str, Any]:
+    cur.execute("""
+        SELECT a.account_type, SUM(tb.balance_amount) AS net_balance
+        FROM accounts a
+        JOIN tb_entries tb ON a.account_code = tb.account_code
+        WHERE tb.year::text = to_char(CURRENT_DATE, 'YYYY')
+        GROUP BY a.account_type
+    """)
+    summary = {key: 0.0 for key in ACCOUNT_TYPE_TOTALS.values()}
+    for account_type, balance in cur.fetchall():
+        key = ACCOUNT_TYPE_TOTALS.get(account_type)
+        if key:
+            summary[key] += float(balance or 0)
+    summary["net_income"] = summary["total_revenue"] - summary["total_expenses"]
+    summary["current_ratio"] = (
+        summary["total_assets"] / summary["total_liabilities"] if summary["total_liabilities"] > 0 else 0
+    )
+    summary["debt_to_equity"] = (
+        summary["total_liabilities"] / summary["total_equity"] if summary["total_equity"] > 0 else 0
+    )
+    return summary
+
+
+def _company_overview(cur) -> Dict[str, Any]:
+    cur.execute("""
+        SELECT (SELECT COUNT(*) FROM entities),
+               (SELECT COUNT(*) FROM accounts),
+               (SELECT COUNT(*) FROM uploads WHERE upload_date >= CURRENT_DATE - INTERVAL '30 days'),
+               (SELECT COUNT(*) FROM consolidation_journals)
+    """)
+    entity_count, account_count, recent_uploads, journal_count = cur.fetchone()
+    return {
+        "total_entities": entity_count,
+        "total_accounts": account_count,
+        "recent_uploads": recent_uploads,
+        "total_journals": journal_count,
+    }
+
+
+def _recent_activities(cur) -> List[Dict[str, Any]]:
+    cur.execute("""
+        SELECT 'upload' AS type, filename AS description, upload_date AS created_at
+        FROM uploads
+        WHERE upload_date >= CURRENT_DATE - INTERVAL '30 days'
+        UNION ALL
+        SELECT 'journal' AS type, journal_name AS description, created_at
+        FROM consolidation_journals
+        WHERE created_at >= CURRENT_DATE - INTERVAL '30 days'
+        ORDER BY created_at DESC
+        LIMIT %s
+    """, (settings.KPI_RECENT_ACTIVITY_LIMIT,))
+    return [
+        {
+            "type": activity_type,
+            "description": description,
+            "timestamp": created_at.isoformat() if created_at else None,
+            "user": "System",
+        }
+        for activity_type, description, created_at in cur.fetchall()
+    ]
+
+
+def _period_trends(cur) -> List[Dict[str, Any]]:
+    cur.execute("""
+        SELECT tb.year::text AS year, tb.period,
+               SUM(CASE WHEN a.account_type = 'Revenue' THEN tb.balance_amount ELSE 0 END) AS revenue,
+               SUM(CASE WHEN a.account_type = 'Expense' THEN tb.balance_amount ELSE 0 END) AS expenses,
+               SUM(CASE WHEN a.account_type = 'Asset' THEN tb.balance_amount ELSE 0 END) AS assets,
+               SUM(CASE WHEN a.account_type = 'Liability' THEN tb.balance_amount ELSE 0 END) AS liabilities
+        FROM tb_entries tb
+        JOIN accounts a ON a.account_code = tb.account_code
+        GROUP BY tb.year::text, tb.period
+        ORDER BY tb.year::text DESC, MAX(tb.created_at) DESC
+        LIMIT %s
+    """, (settings.KPI_TREND_PERIODS,))
+    trends = []
+    for year, period, revenue, expenses, assets, liabilities in reversed(cur.fetchall()):
+        revenue, expenses = float(revenue or 0), float(expenses or 0)
+        trends.append({
+            "year": year,
+            "period": period,
+            "revenue": revenue,
+            "expenses": expenses,
+            "net_income": revenue - expenses,
+            "total_assets": float(assets or 0),
+            "total_liabilities": float(liabilities or 0),
+        })
+    return trends
+
+
+SECTION_QUERIES: Dict[str, Callable[[Any], Any]] = {
+    "financial_summary": _financial_summary,
+    "company_overview": _company_overview,
+    "recent_activities": _recent_activities,
+    "period_trends": _period_trends,
+}
+
+
+def compute_sections(conn) -> Dict[str, Any]:
+    """Run every KPI query; a section whose tables are missing is left as None."""
+    sections: Dict[str, Any] = {}
+    cur = conn.cursor()
+    for name, query in SECTION_QUERIES.items():
+        try:
+            sections[name] = query(cur)
+        except psycopg2.Error as e:
+            conn.rollback()
+            logger.warning(f"KPI section {name} unavailable: {e}")
+            sections[name] = None
+    return sections
+
+
+# ============================================================================
+# PERSISTENCE
+# ============================================================================
+
+def ensure_snapshot_table(conn) -> None:
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS dashboard_kpi_snapshots (
+            section VARCHAR(50) PRIMARY KEY,
+            payload JSONB,
+            data_version BIGINT NOT NULL DEFAULT 0,
+            computed_at TIMESTAMP NOT NULL,
+            duration_ms INTEGER DEFAULT 0
+        )
+    """)
+    conn.commit()
+
+
+def load_snapshot(conn) -> Optional[KpiSnapshot]:
+    """The persisted snapshot, if every section was stored at the same version."""
+    cur = conn.cursor()
+    cur.execute("SELECT section, payload, data_version, computed_at, duration_ms FROM dashboard_kpi_snapshots")
+    rows = cur.fetchall()
+    if {row[0] for row in rows} != set(SECTIONS) or len({row[2] for row in rows}) != 1:
+        return None
+    sections = {row[0]: row[1] for row in rows}
+    return KpiSnapshot(sections, int(rows[0][2]), min(row[3] for row in rows), max(row[4] or 0 for row in rows))
+
+
+def save_snapshot(conn, snapshot: KpiSnapshot) -> None:
+    cur = conn.cursor()
+    for section in SECTIONS:
+        cur.execute("""
+            INSERT INTO dashboard_kpi_snapshots (section, payload, data_version, computed_at, duration_ms)
+            VALUES (%s, %s::jsonb, %s, %s, %s)
+            ON CONFLICT (section) DO UPDATE SET
+                payload = EXCLUDED.payload,
+                data_version = EXCLUDED.data_version,
+                computed_at = EXCLUDED.computed_at,
+                duration_ms = EXCLUDED.duration_ms
+        """, (section, json.dumps(snapshot.sections.get(section)), snapshot.data_version,
+              snapshot.computed_at, snapshot.duration_ms))
+    conn.commit()
+
+
+# ============================================================================
+# SNAPSHOT STORE
+# ============================================================================
+
+class KpiSnapshotStore:
+    """In-memory snapshots per company with debounced and scheduled refreshes."""
+
+    def __init__(self, refresh_seconds: int, max_age_seconds: int, debounce_seconds: float,
+                 max_delay_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self.max_age_seconds = max_age_seconds
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._connect: Optional[Callable[[str], ContextManager[Any]]] = None
+        self._snapshots: Dict[str, KpiSnapshot] = {}
+        self._company_locks: Dict[str, threading.Lock] = {}
+        self._timers: Dict[str, threading.Timer] = {}
+        self._first_pending: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, connect: Callable[[str], ContextManager[Any]]) -> None:
+        """Set the company connection factory (a context manager taking the company name)."""
+        self._connect = connect
+
+    def _company_lock(self, company_name: str) -> threading.Lock:
+        with self._lock:
+            return self._company_locks.setdefault(company_name, threading.Lock())
+
+    def get(self, company_name: str) -> KpiSnapshot:
+        """The company's snapshot; only the first request of a worker touches the database."""
+        snapshot = self._snapshots.get(company_name)
+        if snapshot is not None:
+            return snapshot
+        return self.refresh(company_name, force=False)
+
+    def refresh(self, company_name: str, force: bool = True) -> KpiSnapshot:
+        """Bring a company's snapshot up to date.
+
+        Without ``force`` a snapshot at the current data version and within
+        the maximum age - in memory or persisted by another worker - is kept.
+        """
+        if self._connect is None:
+            raise RuntimeError("KPI snapshot store has no connection factory")
+        with self._company_lock(company_name):
+            with self._connect(company_name) as conn:
+                version = report_cache.data_version(conn, company_name, report_cache.DASHBOARD_DOMAIN)
+                if not force:
+                    current = self._snapshots.get(company_name)
+                    if self._usable(current, version):
+                        return current
+                    ensure_snapshot_table(conn)
+                    persisted = load_snapshot(conn)
+                    if self._usable(persisted, version):
+                        self._snapshots[company_name] = persisted
+                        return persisted
+                else:
+                    ensure_snapshot_table(conn)
+                started = time.perf_counter()
+                sections = compute_sections(conn)
+                snapshot = KpiSnapshot(sections, version, datetime.utcnow(),
+                                       int((time.perf_counter() - started) * 1000))
+                save_snapshot(conn, snapshot)
+        self._snapshots[company_name] = snapshot
+        logger.info(f"KPI snapshot for {company_name} refreshed at version {version} "
+                    f"in {snapshot.duration_ms} ms")
+        return snapshot
+
+    def _usable(self, snapshot: Optional[KpiSnapshot], version: int) -> bool:
+        return (snapshot is not None and snapshot.data_version == version
+                and snapshot.age_seconds() < self.max_age_seconds)
+
+    # ------------------------------------------------------------------
+    # Debounced refresh after writes
+    # ------------------------------------------------------------------
+
+    def notify_write(self, company_name: str) -> None:
+        """Schedule a refresh once writes to a company have been quiet for the debounce delay."""
+        if self._connect is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            first = self._first_pending.setdefault(company_name, now)
+            delay = min(self.debounce_seconds, max(first + self.max_delay_seconds - now, 0.0))
+            timer = self._timers.pop(company_name, None)
+            if timer is not None:
+                timer.cancel()
+            timer = threading.Timer(delay, self._debounced_refresh, args=(company_name,))
+            timer.daemon = True
+            self._timers[company_name] = timer
+            timer.start()
+
+    def _debounced_refresh(self, company_name: str) -> None:
+        with self._lock:
+            self._timers.pop(company_name, None)
+            self._first_pending.pop(company_name, None)
+        try:
+            self.refresh(company_name, force=False)
+        except Exception as e:
+            logger.warning(f"Debounced KPI refresh for {company_name} failed: {e}")
+
+    # ------------------------------------------------------------------
+    # Scheduled refresh
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        """Start the scheduler thread; companies are tracked once they have a snapshot."""
+        if self._thread is not None or self.refresh_seconds <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="kpi-snapshots", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+            self._first_pending.clear()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.refresh_seconds):
+            for company_name in list(self._snapshots):
+                if self._stop.is_set():
+                    break
+                try:
+                    self.refresh(company_name, force=False)
+                except Exception as e:
+                    logger.warning(f"Scheduled KPI refresh for {company_name} failed: {e}")
+
+
+_store = KpiSnapshotStore(
+    settings.KPI_SNAPSHOT_REFRESH_SECONDS,
+    settings.KPI_SNAPSHOT_MAX_AGE_SECONDS,
+    settings.KPI_SNAPSHOT_DEBOUNCE_SECONDS,
+    settings.KPI_SNAPSHOT_MAX_DELAY_SECONDS,
+)
+
+
+def configure(connect: Callable[[str], ContextManager[Any]]) -> None:
+    _store.configure(connect)
+
+
+def get(company_name: str) -> KpiSnapshot:
+    return _store.get(company_name)
+
+
+def refresh(company_name: str) -> KpiSnapshot:
+    return _store.refresh(company_name, force=True)
+
+
+def notify_write(company_name: str) -> None:
+    _store.notify_write(company_name)
+
+
+def start() -> None:
+    _store.start()
+
+
+def stop() -> None:
+    _store.stop()
@@ -0,0 +1,379 @@
+"""
+Drill-down lineage index.
+
+Maps every aggregated cell - (process, scenario, period, entity, account) -
+to what contributed to it, one row per adjustment step:
+
+* ``data_input`` rows from entity_amounts / ic_amounts / other_amounts, as
+  the source row ids of the cell. Integer ids are stored as inclusive
+  ranges (``range_starts`` / ``range_ends``, runs of consecutive ids that
+  all belong to the cell, found with one gaps-and-islands GROUP BY), other
+  ids (UUIDs) as an id array;
+* journal steps (eliminations, rule adjustments, translations - whatever
+  journal_type the run wrote) from the run journal line tables, as the
+  journal keys that posted to the cell.
+
+Both use the balance cube's period key, the period id: a journal line's
+``period`` is resolved to the id of the period it names (by id, or by a
+period code that is unique across fiscal years) and kept as written only
+when it names none.
+
+So a drill-down from a consolidated or report figure is two indexed hops:
+lineage_index.lookup() for the cell's steps, then source_rows() /
+journal_lines() for the transactions behind one step, fetched by id range
+or journal key instead of scanning the source tables by account.
+
+Writers:
+* balance_cube.refresh_process() rebuilds a process' input lineage in the
+  same transaction as its cube slice; apply_rows() marks it stale and the
+  next lookup rebuilds it;
+* journal_sink.JournalSink.swap() re-indexes the journals of the swapped
+  process / period before committing.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+
+from psycopg2.extras import RealDictCursor
+
+from routers import balance_cube, pagination
+
+logger = logging.getLogger(__name__)
+
+INPUT_STEP = "data_input"
+DEFAULT_JOURNAL_STEP = "adjustment"
+JOURNAL_LINE_TABLES = ("process_run_journal_lines", "consolidation_run_journal_lines")
+INTEGER_TYPES = ("smallint", "integer", "bigint")
+
+CELL_KEYS = ("process_key", "scenario_key", "period_key", "entity_key", "account_key")
+
+
+def ensure_index(conn) -> None:
+    """Create the lineage tables if needed."""
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS report_lineage_index (
+            process_key VARCHAR(64) NOT NULL,
+            scenario_key VARCHAR(100) NOT NULL DEFAULT '',
+            period_key VARCHAR(100) NOT NULL DEFAULT '',
+            entity_key VARCHAR(100) NOT NULL DEFAULT '',
+            account_key VARCHAR(100) NOT NULL DEFAULT '',
+            step VARCHAR(100) NOT NULL,
+            source_table VARCHAR(100) NOT NULL,
+            range_starts BIGINT[],
+            range_ends BIGINT[],
+            row_ids TEXT[],
+            journal_keys TEXT[],
+            run_id VARCHAR(100),
+            row_count BIGINT NOT NULL DEFAULT 0,
+            amount NUMERIC(20, 2) NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (process_key, account_key, entity_key, period_key, scenario_key, source_table, step)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS report_lineage_state (
+            process_key VARCHAR(64) NOT NULL,
+            source_table VARCHAR(100) NOT NULL,
+            stale BOOLEAN NOT NULL DEFAULT FALSE,
+            built_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (process_key, source_table)
+        )
+    """)
+
+
+def _id_type(conn, table_name: str) -> Optional[str]:
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = %s AND column_name = 'id' AND table_schema = current_schema()
+    """, (table_name,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _input_tables(conn) -> List[tuple]:
+    """(source type, table, key projection, id type) of the balance-cube sources that exist."""
+    tables = []
+    for source_type, table_name in balance_cube.SOURCE_TABLES.items():
+        projection = balance_cube.source_projection(conn, source_type)
+        id_type = _id_type(conn, table_name)
+        if projection is not None and id_type is not None:
+            tables.append((source_type, table_name, projection, id_type))
+    return tables
+
+
+def _journal_period(conn) -> tuple:
+    """(JOIN clause, key expression) mapping the ``period`` of journal lines aliased ``l`` to a period id."""
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('periods')")
+    if cur.fetchone()[0] is None:
+        return "", "COALESCE(l.period, '')"
+    # An id wins over a period code spelling the same text
+    join = """
+        LEFT JOIN (
+            SELECT DISTINCT ON (period_ref) period_ref, period_id
+            FROM (
+                SELECT CAST(id AS VARCHAR) AS period_ref, CAST(id AS VARCHAR) AS period_id, 0 AS priority
+                FROM periods
+                UNION ALL
+                SELECT CAST(period_code AS VARCHAR), CAST(MIN(id) AS VARCHAR), 1
+                FROM periods WHERE period_code IS NOT NULL
+                GROUP BY period_code HAVING COUNT(*) = 1
+            ) refs
+            ORDER BY period_ref, priority
+        ) period_map ON period_map.period_ref = l.period
+    """
+    return join, "COALESCE(period_map.period_id, l.period, '')"
+
+
+def _mark_built(cur, process_key: str, source_table: str) -> None:
+    cur.execute("""
+        INSERT INTO report_lineage_state (process_key, source_table, stale, built_at)
+        VALUES (%s, %s, FALSE, NOW())
+        ON CONFLICT (process_key, source_table) DO UPDATE SET stale = FALSE, built_at = NOW()
+    """, (process_key, source_table))
+
+
+# ============================================================================
+# WRITERS
+# ============================================================================
+
+def index_inputs(conn, process_id: Any) -> int:
+    """Rebuild the data-input lineage of one process. Does not commit; returns the cells written."""
+    ensure_index(conn)
+    process_key = str(process_id)
+    cur = conn.cursor()
+    written = 0
+    for _, table_name, projection, id_type in _input_tables(conn):
+        cur.execute("DELETE FROM report_lineage_index WHERE process_key = %s AND source_table = %s",
+                    (process_key, table_name))
+        process_condition, process_params = balance_cube.column_in(conn, table_name, "process_id", [process_key])
+        keys = ", ".join(f"{projection[key]} AS {key}" for key in CELL_KEYS)
+        partition = ", ".join(projection[key] for key in CELL_KEYS)
+        if id_type in INTEGER_TYPES:
+            # Consecutive ids of a cell share id - row_number(), so each island is one range
+            cur.execute(f"""
+                INSERT INTO report_lineage_index
+                ({', '.join(CELL_KEYS)}, step, source_table, range_starts, range_ends, row_count, amount)
+                SELECT {', '.join(CELL_KEYS)}, %s, %s,
+                       array_agg(range_start ORDER BY range_start), array_agg(range_end ORDER BY range_start),
+                       SUM(rows_in_range), SUM(amount)
+                FROM (
+                    SELECT {', '.join(CELL_KEYS)}, MIN(id) AS range_start, MAX(id) AS range_end,
+                           COUNT(*) AS rows_in_range, COALESCE(SUM(amount), 0) AS amount
+                    FROM (
+                        SELECT {keys}, id, amount,
+                               id - ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY id) AS island
+                        FROM {table_name}
+                        WHERE {process_condition}
+                    ) numbered
+                    GROUP BY {', '.join(CELL_KEYS)}, island
+                ) ranges
+                GROUP BY {', '.join(CELL_KEYS)}
+            """, [INPUT_STEP, table_name] + process_params)
+        else:
+            cur.execute(f"""
+                INSERT INTO report_lineage_index
+                ({', '.join(CELL_KEYS)}, step, source_table, row_ids, row_count, amount)
+                SELECT {partition}, %s, %s,
+                       array_agg(CAST(id AS VARCHAR) ORDER BY id), COUNT(*), COALESCE(SUM(amount), 0)
+                FROM {table_name}
+                WHERE {process_condition}
+                GROUP BY {partition}
+            """, [INPUT_STEP, table_name] + process_params)
+        written += cur.rowcount
+        _mark_built(cur, process_key, table_name)
+    return written
+
+
+def index_journals(conn, line_table: str, process_id: Any, period: Optional[str] = None) -> int:
+    """Rebuild the journal lineage of a process (and period) from a run journal line table. Does not commit."""
+    ensure_index(conn)
+    process_key = str(process_id)
+    cur = conn.cursor()
+    period_join, period_key = _journal_period(conn)
+    scope = "process_key = %s AND source_table = %s"
+    line_scope, params = balance_cube.column_in(conn, line_table, "process_id", [process_key], alias="l.")
+    scope_params: List[Any] = [process_key, line_table]
+    if period is not None:
+        cur.execute(f"SELECT {period_key} FROM (SELECT CAST(%s AS VARCHAR) AS period) l {period_join}", (period,))
+        scope += " AND period_key = %s"
+        line_scope += " AND l.period = %s"
+        scope_params.append(cur.fetchone()[0])
+        params.append(period)
+    cur.execute(f"DELETE FROM report_lineage_index WHERE {scope}", scope_params)
+    cur.execute(f"""
+        INSERT INTO report_lineage_index
+        ({', '.join(CELL_KEYS)}, step, source_table, journal_keys, run_id, row_count, amount)
+        SELECT CAST(l.process_id AS VARCHAR), '', {period_key}, COALESCE(l.entity_code, ''),
+               COALESCE(l.account_code, ''), COALESCE(l.journal_type, %s), %s,
+               array_agg(DISTINCT l.journal_key), MAX(l.run_id), COUNT(*),
+               COALESCE(SUM(l.debit_amount - l.credit_amount), 0)
+        FROM {line_table} l
+        {period_join}
+        WHERE {line_scope}
+        GROUP BY 1, 2, 3, 4, 5, 6
+    """, [DEFAULT_JOURNAL_STEP, line_table] + params)
+    written = cur.rowcount
+    if period is None:
+        _mark_built(cur, process_key, line_table)
+    return written
+
+
+def mark_stale(conn, source_table: str, row_ids: Sequence[Any]) -> None:
+    """Flag the input lineage of the processes owning ``row_ids`` for a rebuild. Does not commit."""
+    if not row_ids:
+        return
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('report_lineage_state')")
+    if cur.fetchone()[0] is None:
+        return
+    condition, params = balance_cube.column_in(conn, source_table, "id", row_ids)
+    cur.execute(f"""
+        UPDATE report_lineage_state SET stale = TRUE
+        WHERE source_table = %s AND process_key IN (
+            SELECT DISTINCT CAST(process_id AS VARCHAR) FROM {source_table}
+            WHERE {condition}
+        )
+    """, [source_table] + params)
+
+
+def ensure_fresh(conn, process_id: Any) -> None:
+    """Build missing or stale lineage of a process (inputs and journals) and commit."""
+    ensure_index(conn)
+    process_key = str(process_id)
+    cur = conn.cursor()
+    cur.execute("SELECT source_table, stale FROM report_lineage_state WHERE process_key = %s", (process_key,))
+    state = {row[0]: row[1] for row in cur.fetchall()}
+    changed = False
+    try:
+        if any(state.get(table_name, True) for _, table_name, _, _ in _input_tables(conn)):
+            index_inputs(conn, process_key)
+            changed = True
+        for line_table in JOURNAL_LINE_TABLES:
+            cur.execute("SELECT to_regclass(%s)", (line_table,))
+            if cur.fetchone()[0] is not None and line_table not in state:
+                index_journals(conn, line_table, process_key)
+                changed = True
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if changed:
+        logger.info(f"Rebuilt lineage index for process {process_key}")
+
+
+# ============================================================================
+# LOOKUPS
+# ============================================================================
+
+def lookup(conn, process_id: Any, account_keys: Sequence[Any], entity_key: Any = None,
+           period_keys: Sequence[Any] = (), scenario_key: Any = None,
+           source_tables: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """Lineage entries of the cells of ``account_keys`` (first hop), one per cell, source table and step.
+
+    Journal entries carry no scenario, so a scenario filter keeps them.
+    """
+    ensure_fresh(conn, process_id)
+    conditions = ["process_key = %s", "account_key = ANY(%s)"]
+    params: List[Any] = [str(process_id), [str(key) for key in account_keys]]
+    if entity_key is not None:
+        conditions.append("entity_key = %s")
+        params.append(str(entity_key))
+    if period_keys:
+        conditions.append("period_key = ANY(%s)")
+        params.append([str(key) for key in period_keys])
+    if scenario_key is not None:
+        conditions.append("scenario_key IN (%s, '')")
+        params.append(str(scenario_key))
+    if source_tables:
+        conditions.append("source_table = ANY(%s)")
+        params.append(list(source_tables))
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    pagination.float_numerics(cur)
+    cur.execute(f"""
+        SELECT {', '.join(CELL_KEYS)}, step, source_table, range_starts, range_ends, row_ids,
+               journal_keys, run_id, row_count, amount
+        FROM report_lineage_index
+        WHERE {' AND '.join(conditions)}
+        ORDER BY account_key, entity_key, period_key, source_table, step
+    """, params)
+    entries = []
+    for row in cur.fetchall():
+        entry = dict(row)
+        entry["ranges"] = [list(pair) for pair in zip(entry.pop("range_starts") or [], entry.pop("range_ends") or [])]
+        entries.append(entry)
+    return entries
+
+
+def source_rows(conn, source_table: str, entries: Sequence[Dict[str, Any]], limit: int,
+                cursor: Optional[str] = None, where_sql: str = "TRUE",
+                params: Sequence[Any] = ()) -> Dict[str, Any]:
+    """One page of the source rows behind data-input entries (second hop), in id order.
+
+    ``where_sql`` narrows the rows further (alias ``t``).
+    """
+    entries = [entry for entry in entries if entry["source_table"] == source_table and entry["step"] == INPUT_STEP]
+    ranges = [pair for entry in entries for pair in entry["ranges"]]
+    row_ids = [row_id for entry in entries for row_id in (entry.get("row_ids") or [])]
+    if not ranges and not row_ids:
+        return {"rows": [], "has_more": False, "next_cursor": None}
+    if ranges:
+        return pagination.keyset_page(
+            conn,
+            f"""
+            SELECT t.* FROM {source_table} t
+            JOIN unnest(%s::bigint[], %s::bigint[]) AS r(range_start, range_end)
+              ON t.id BETWEEN r.range_start AND r.range_end
+            """,
+            where_sql,
+            [[pair[0] for pair in ranges], [pair[1] for pair in ranges]] + list(params),
+            ["t.id"], limit, cursor, descending=False,
+        )
+    condition, id_params = balance_cube.column_in(conn, source_table, "id", row_ids, alias="t.")
+    return pagination.keyset_page(
+        conn, f"SELECT t.* FROM {source_table} t", f"{condition} AND ({where_sql})",
+        id_params + list(params),
+        ["t.id"], limit, cursor, descending=False,
+    )
+
+
+def journal_lines(conn, entries: Sequence[Dict[str, Any]], limit: int,
+                  cursor: Optional[str] = None) -> Dict[str, Any]:
+    """One page of the journal lines behind journal entries (second hop), across their line tables."""
+    positions = pagination.decode_cursor(cursor) or {}
+    rows: List[Dict[str, Any]] = []
+    next_positions: Dict[str, Any] = {}
+    period_join, period_key = _journal_period(conn)
+    for line_table in JOURNAL_LINE_TABLES:
+        table_entries = [entry for entry in entries if entry["source_table"] == line_table]
+        if not table_entries or (cursor and line_table not in positions):
+            continue
+        # The lines of the entry's journals that hit its cell
+        cell_conditions = " OR ".join(
+            f"({period_key} = %s AND COALESCE(l.entity_code, '') = %s"
+            " AND COALESCE(l.account_code, '') = %s AND l.journal_key = ANY(%s))"
+            for _ in table_entries
+        )
+        process_condition, params = balance_cube.column_in(
+            conn, line_table, "process_id", [table_entries[0]["process_key"]], alias="l.")
+        for entry in table_entries:
+            params.extend([entry["period_key"], entry["entity_key"], entry["account_key"], entry["journal_keys"]])
+        page = pagination.keyset_page(
+            conn,
+            f"SELECT l.* FROM {line_table} l {period_join}",
+            f"{process_condition} AND ({cell_conditions})",
+            params,
+            ["l.journal_key", "l.line_number"], limit,
+            pagination.encode_cursor(positions[line_table]) if line_table in positions else None,
+            descending=False,
+        )
+        rows.extend(dict(row, source_table=line_table) for row in page["rows"])
+        if page["has_more"]:
+            next_positions[line_table] = pagination.decode_cursor(page["next_cursor"])
+    return {
+        "rows": rows,
+        "has_more": bool(next_positions),
+        "next_cursor": pagination.encode_cursor(next_positions) if next_positions else None,
+    }
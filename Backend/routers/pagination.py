@@ -0,0 +1,151 @@
+"""
+Keyset pagination shared by the list endpoints.
+
+A page is fetched with ``WHERE (k1, k2, ...) < (last values) ORDER BY
+k1 DESC, k2 DESC LIMIT n + 1`` (``>`` / ASC for ascending keys), so page
+5,000 costs the same index range scan as page one, unlike OFFSET which
+reads and discards every earlier row. The last row's key values travel
+back to the client as an opaque, URL-safe cursor token; the extra row only
+tells whether another page exists.
+
+Helpers:
+* encode_cursor() / decode_cursor() for the tokens (bad tokens raise
+  InvalidCursor, which endpoints turn into a 400);
+* keyset_page() to run a page query and build the next cursor, through a
+  named server-side cursor when the page is large;
+* float_numerics() so NUMERIC columns arrive as floats straight from the
+  driver instead of being converted row by row afterwards;
+* estimated_count() which returns the planner's row estimate and only
+  counts exactly when the estimate is small.
+"""
+
+import base64
+import json
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+NAMED_CURSOR_MIN_ROWS = 2000  # Pages at least this large are read through a server-side cursor
+EXACT_COUNT_MAX_ROWS = 100000  # Below this estimate an exact COUNT(*) is cheap enough
+
+FLOAT_NUMERIC = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values, "FLOAT_NUMERIC",
+    lambda value, cur: float(value) if value is not None else None,
+)
+
+
+class InvalidCursor(ValueError):
+    """A pagination cursor that cannot be decoded."""
+
+
+def encode_cursor(values: Any) -> str:
+    """Opaque token for key values (or any JSON-able structure of them)."""
+    def _default(value):
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        return str(value)
+
+    raw = json.dumps(values, default=_default, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: Optional[str]) -> Any:
+    """Key values of a token from encode_cursor(); None for no token."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        return json.loads(raw.decode("utf-8"))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"Invalid pagination cursor: {e}")
+
+
+def float_numerics(cur) -> None:
+    """Return NUMERIC/DECIMAL columns as floats on this cursor."""
+    psycopg2.extensions.register_type(FLOAT_NUMERIC, cur)
+
+
+def keyset_condition(key_columns: Sequence[str], after: Optional[Sequence[Any]],
+                     descending: bool = True) -> Tuple[str, List[Any]]:
+    """SQL condition (and params) selecting rows past ``after`` in key order."""
+    if not after:
+        return "TRUE", []
+    if len(after) != len(key_columns):
+        raise InvalidCursor("Pagination cursor does not match the sort keys")
+    operator = "<" if descending else ">"
+    placeholders = ", ".join(["%s"] * len(key_columns))
+    return f"({', '.join(key_columns)}) {operator} ({placeholders})", list(after)
+
+
+def keyset_page(conn, select_sql: str, where_sql: str, params: Sequence[Any], key_columns: Sequence[str],
+                limit: int, cursor: Optional[str] = None, descending: bool = True,
+                key_fields: Optional[Sequence[str]] = None, cursor_factory=RealDictCursor,
+                numeric_as_float: bool = True) -> Dict[str, Any]:
+    """One page of ``select_sql WHERE where_sql`` ordered by ``key_columns``.
+
+    ``select_sql`` is everything up to (not including) WHERE. ``key_fields``
+    names the result columns holding the key values (defaults to the key
+    column names with any table prefix removed). Returns the rows, whether
+    more rows exist and the cursor of the next page.
+    """
+    after = decode_cursor(cursor)
+    condition, condition_params = keyset_condition(key_columns, after, descending)
+    direction = "DESC" if descending else "ASC"
+    query = f"""
+        {select_sql}
+        WHERE ({where_sql or 'TRUE'}) AND {condition}
+        ORDER BY {', '.join(f'{column} {direction}' for column in key_columns)}
+        LIMIT %s
+    """
+    all_params = list(params) + condition_params + [limit + 1]
+
+    if limit >= NAMED_CURSOR_MIN_ROWS:
+        cur = conn.cursor(name="keyset_page", cursor_factory=cursor_factory)
+        cur.itersize = NAMED_CURSOR_MIN_ROWS
+    else:
+        cur = conn.cursor(cursor_factory=cursor_factory)
+    try:
+        if numeric_as_float:
+            float_numerics(cur)
+        cur.execute(query, all_params)
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more and rows:
+        fields = key_fields or [column.split(".")[-1] for column in key_columns]
+        last = rows[-1]
+        if isinstance(last, dict):
+            next_cursor = encode_cursor([last[field] for field in fields])
+        else:
+            next_cursor = encode_cursor([last[index] for index in fields])
+    return {"rows": rows, "has_more": has_more, "next_cursor": next_cursor}
+
+
+def estimated_count(conn, from_sql: str, where_sql: str, params: Sequence[Any],
+                    exact_below: int = EXACT_COUNT_MAX_ROWS) -> Tuple[int, bool]:
+    """Row count of ``FROM from_sql WHERE where_sql``: (count, is_estimate)."""
+    cur = conn.cursor()
+    try:
+        cur.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {from_sql} WHERE {where_sql or 'TRUE'}", list(params))
+        plan = cur.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = int(plan[0]["Plan"]["Plan Rows"])
+        if estimate >= exact_below:
+            return estimate, True
+        cur.execute(f"SELECT COUNT(*) FROM {from_sql} WHERE {where_sql or 'TRUE'}", list(params))
+        return int(cur.fetchone()[0]), False
+    finally:
+        cur.close()
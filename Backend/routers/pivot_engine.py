@@ -0,0 +1,198 @@
+"""
+Pivot engine for the report grids.
+
+Report data arrives as (row key, column key, measure, value) triples - for
+ProcessReports one triple per account, entity and card type straight from
+the balance cube. Pivot.from_cells() encodes the keys to integer positions
+in one pass and scatters the values into a dense ``measures x rows x
+columns`` NumPy array with a single np.add.at, so the work after the query
+is proportional to the number of cells.
+
+with_hierarchy() re-lays the rows along a hierarchy (for ProcessReports the
+axes hierarchy nodes with their accounts) and rolls every node's values up
+from its descendants with tree_engine.Tree.
+
+to_columnar() serializes the matrix as parallel arrays instead of nested
+per-account / per-entity objects:
+
+    {"row_keys": [...], "row_labels": [...], "column_keys": [...],
+     "column_labels": [...], "measures": [...],
+     "values": {measure: [[row 0 values by column], ...]}, ...}
+
+so the payload grows with rows x columns, not with the number of source
+rows or the repetition of keys inside nested objects.
+"""
+
+import logging
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from routers import tree_engine
+
+logger = logging.getLogger(__name__)
+
+
+class Pivot:
+    """Dense measures x rows x columns matrix with its row and column keys."""
+
+    def __init__(self, row_keys: Sequence[Hashable], column_keys: Sequence[Hashable], measures: Sequence[str],
+                 values: np.ndarray, row_labels: Optional[Sequence[str]] = None,
+                 column_labels: Optional[Sequence[str]] = None):
+        self.row_keys = list(row_keys)
+        self.column_keys = list(column_keys)
+        self.measures = list(measures)
+        self.values = values
+        self.row_labels = list(row_labels) if row_labels is not None else [str(k) for k in self.row_keys]
+        self.column_labels = list(column_labels) if column_labels is not None else [str(k) for k in self.column_keys]
+        self.row_parent: Optional[np.ndarray] = None
+        self.row_depth: Optional[np.ndarray] = None
+        self.row_kind: Optional[List[str]] = None
+        self._labels: Optional[Dict[Hashable, str]] = None
+
+    @classmethod
+    def from_cells(cls, cells: Iterable[Dict[str, Any]], row_field: str, column_field: str, measure_field: str,
+                   value_field: str, measures: Sequence[str], row_label_field: Optional[str] = None,
+                   column_label_field: Optional[str] = None) -> "Pivot":
+        """Pivot cell dicts; cells of measures not listed are ignored."""
+        measure_index = {measure: index for index, measure in enumerate(measures)}
+        rows: Dict[Hashable, int] = {}
+        columns: Dict[Hashable, int] = {}
+        row_labels: List[str] = []
+        column_labels: List[str] = []
+        m_idx: List[int] = []
+        r_idx: List[int] = []
+        c_idx: List[int] = []
+        amounts: List[float] = []
+        for cell in cells:
+            measure = measure_index.get(cell[measure_field])
+            if measure is None:
+                continue
+            row_key, column_key = cell[row_field], cell[column_field]
+            row = rows.get(row_key)
+            if row is None:
+                row = rows[row_key] = len(rows)
+                row_labels.append((cell.get(row_label_field) if row_label_field else None) or str(row_key))
+            column = columns.get(column_key)
+            if column is None:
+                column = columns[column_key] = len(columns)
+                column_labels.append((cell.get(column_label_field) if column_label_field else None) or str(column_key))
+            m_idx.append(measure)
+            r_idx.append(row)
+            c_idx.append(column)
+            amounts.append(float(cell[value_field] or 0))
+
+        values = np.zeros((len(measures), len(rows), len(columns)))
+        if amounts:
+            np.add.at(values, (np.array(m_idx), np.array(r_idx), np.array(c_idx)), np.array(amounts))
+        pivot = cls(list(rows), list(columns), measures, values, row_labels, column_labels)
+        pivot.sort_columns()
+        return pivot
+
+    def sort_columns(self) -> None:
+        order = sorted(range(len(self.column_keys)), key=lambda index: str(self.column_keys[index]))
+        self.column_keys = [self.column_keys[i] for i in order]
+        self.column_labels = [self.column_labels[i] for i in order]
+        self.values = self.values[:, :, order]
+
+    def with_hierarchy(self, nodes: Sequence[Dict[str, Any]], leaves: Sequence[Dict[str, Any]],
+                       keep_unmapped: bool = True) -> "Pivot":
+        """Rows laid out along a hierarchy with rolled-up node values.
+
+        ``nodes`` are dicts with key / parent / label; ``leaves`` map a row key
+        of this pivot to its node (key / node / label). Pivot rows without a
+        leaf entry become extra roots when ``keep_unmapped`` is set.
+        """
+        keys: List[Hashable] = []
+        parents: List[Optional[Hashable]] = []
+        labels: List[str] = []
+        kinds: List[str] = []
+        sources: List[int] = []
+        row_position = {key: index for index, key in enumerate(self.row_keys)}
+
+        for node in nodes:
+            keys.append(("node", node["key"]))
+            parents.append(("node", node["parent"]) if node.get("parent") is not None else None)
+            labels.append(node.get("label") or str(node["key"]))
+            kinds.append("node")
+            sources.append(-1)
+        mapped = set()
+        for leaf in leaves:
+            if ("row", leaf["key"]) in mapped:
+                continue
+            mapped.add(("row", leaf["key"]))
+            keys.append(("row", leaf["key"]))
+            parents.append(("node", leaf["node"]) if leaf.get("node") is not None else None)
+            labels.append(leaf.get("label") or self._row_label(leaf["key"]))
+            kinds.append("row")
+            sources.append(row_position.get(leaf["key"], -1))
+        if keep_unmapped:
+            for key in self.row_keys:
+                if ("row", key) not in mapped:
+                    keys.append(("row", key))
+                    parents.append(None)
+                    labels.append(self._row_label(key))
+                    kinds.append("row")
+                    sources.append(row_position[key])
+
+        tree = tree_engine.Tree(keys, parents)
+        measure_count, _, column_count = self.values.shape
+        flat = np.zeros((len(keys), measure_count * column_count))
+        source_index = np.array(sources, dtype=np.int64)
+        present = source_index >= 0
+        if present.any():
+            # rows x (measures * columns), so one roll-up covers every measure and column
+            flat[present] = self.values[:, source_index[present], :].transpose(1, 0, 2).reshape(
+                int(present.sum()), -1
+            )
+        totals = tree.rollup(flat).reshape(len(keys), measure_count, column_count).transpose(1, 0, 2)
+
+        order = tree.preorder()
+        rolled = Pivot([keys[i][1] for i in order], self.column_keys, self.measures, totals[:, order, :],
+                       [labels[i] for i in order], self.column_labels)
+        new_position = np.empty(len(keys), dtype=np.int64)
+        new_position[order] = np.arange(len(keys))
+        parent = tree.parent[order]
+        rolled.row_parent = np.where(parent >= 0, new_position[np.maximum(parent, 0)], -1)
+        rolled.row_depth = tree.depth[order]
+        rolled.row_kind = [kinds[i] for i in order]
+        return rolled
+
+    def _row_label(self, key: Hashable) -> str:
+        if self._labels is None:
+            self._labels = dict(zip(self.row_keys, self.row_labels))
+        return self._labels.get(key) or str(key)
+
+    def column_totals(self, leaf_rows_only: bool = True) -> np.ndarray:
+        """measures x columns totals; with a hierarchy only root rows are added, avoiding double counts."""
+        if self.row_parent is not None and leaf_rows_only:
+            return self.values[:, self.row_parent < 0, :].sum(axis=1)
+        return self.values.sum(axis=1)
+
+    def to_columnar(self, decimals: int = 2, drop_empty_rows: bool = False) -> Dict[str, Any]:
+        values = np.round(self.values, decimals)
+        rows = np.arange(len(self.row_keys))
+        if drop_empty_rows and len(rows):
+            keep = np.abs(values).sum(axis=(0, 2)) > 0
+            if self.row_kind is not None:
+                # Hierarchy nodes stay so the tree keeps its shape
+                keep |= np.array([kind == "node" for kind in self.row_kind])
+            rows = rows[keep]
+        payload: Dict[str, Any] = {
+            "row_keys": [self.row_keys[i] for i in rows],
+            "row_labels": [self.row_labels[i] for i in rows],
+            "column_keys": self.column_keys,
+            "column_labels": self.column_labels,
+            "measures": self.measures,
+            "values": {measure: values[index][rows].tolist() for index, measure in enumerate(self.measures)},
+            "column_totals": dict(zip(self.measures, np.round(self.column_totals(), decimals).tolist())),
+            "shape": [len(self.measures), int(len(rows)), len(self.column_keys)],
+        }
+        if self.row_parent is not None:
+            remap = np.full(len(self.row_keys), -1, dtype=np.int64)
+            remap[rows] = np.arange(len(rows))
+            parent = self.row_parent[rows]
+            payload["row_parent"] = np.where(parent >= 0, remap[np.maximum(parent, 0)], -1).tolist()
+            payload["row_depth"] = self.row_depth[rows].tolist()
+            payload["row_kind"] = [self.row_kind[i] for i in rows]
+        return payload
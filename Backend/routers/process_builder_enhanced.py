@@ -4,7 +4,7 @@ All 26 Features with Detailed Business Logic
 Includes: Profit/Loss, NCI, FX Translation, Deferred Taxes, EPS, Scenarios, Alerts, etc.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import text, func, and_, or_, desc
 from pydantic import BaseModel, Field, validator
@@ -18,6 +18,8 @@ import logging
 
 from database import get_db
 from auth.dependencies import get_current_active_user
+from routers import conditional_get, process_scheduler, report_cache, scenario_variance
+from routers.financial_process import company_connection, get_process_table_name
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/process", tags=["Process Builder"])
@@ -742,11 +744,20 @@ async def delete_process_catalog(
 
 @router.get("/reference-data")
 async def get_reference_data(
+    request: Request,
+    response: Response,
     company_name: str = Query(...),
     db: Session = Depends(get_db)
 ):
     """Get reference data for process forms (accounts, entities, currencies, hierarchies)"""
+    # Read from the application database, so its versions are keyed by that database
+    tenant = db.get_bind().url.database
+    not_modified = conditional_get.not_modified(request, tenant, [report_cache.REFERENCE_DOMAIN])
+    if not_modified:
+        return not_modified
     try:
+        etag = conditional_get.current_etag(db.connection().connection, tenant, [report_cache.REFERENCE_DOMAIN])
+
         # Get accounts
         accounts_result = db.execute(text("""
             SELECT id, account_code, account_name, ifrs_category, statement
@@ -822,6 +833,7 @@ async def get_reference_data(
                 "type": row[3]
             })
         
+        conditional_get.set_etag(response, etag)
         return {
             "accounts": accounts,
             "entities": entities,
@@ -1217,12 +1229,28 @@ async def connect_nodes(
 ):
     """Create connection between two nodes"""
     try:
+        process_row = db.execute(text("""
+            SELECT process_id FROM process_nodes WHERE id = :node_id
+        """), {"node_id": connection.from_node_id}).fetchone()
+        if not process_row:
+            raise HTTPException(status_code=404, detail="Source node not found")
+        process_id = process_row[0]
+
+        # Reject connections that would close a cycle in the node graph
+        edges = [tuple(row) for row in db.execute(text("""
+            SELECT from_node_id, to_node_id FROM process_node_connections
+            WHERE process_id = :process_id
+        """), {"process_id": process_id})]
+        edges.append((connection.from_node_id, connection.to_node_id))
+        process_scheduler.assert_acyclic({node for edge in edges for node in edge}, edges)
+
         result = db.execute(text("""
             INSERT INTO process_node_connections 
-            (from_node_id, to_node_id, connection_type, data_mapping, conditional_logic)
-            VALUES (:from_node_id, :to_node_id, :connection_type, :data_mapping::jsonb, :conditional_logic)
+            (process_id, from_node_id, to_node_id, connection_type, data_mapping, conditional_logic)
+            VALUES (:process_id, :from_node_id, :to_node_id, :connection_type, :data_mapping::jsonb, :conditional_logic)
             RETURNING id
         """), {
+            "process_id": process_id,
             "from_node_id": connection.from_node_id,
             "to_node_id": connection.to_node_id,
             "connection_type": connection.connection_type,
@@ -1234,6 +1262,12 @@ async def connect_nodes(
         db.commit()
         
         return {"success": True, "connection_id": conn_id}
+    except HTTPException:
+        db.rollback()
+        raise
+    except process_scheduler.ProcessGraphCycleError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         db.rollback()
         logger.error(f"Error creating connection: {e}")
@@ -1432,6 +1466,51 @@ async def compare_scenarios(
         logger.error(f"Error comparing scenarios: {e}")
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.get("/scenario/variance")
+async def compare_scenario_variance(
+    process_id: str,
+    company_name: str = Query(...),
+    scenario_ids: List[str] = Query(..., description="First id is the base scenario"),
+    data_type: str = Query("entity_amounts"),
+    periods: List[str] = Query([]),
+    entities: List[str] = Query([]),
+    hierarchy_id: Optional[int] = Query(None, description="Account or entity hierarchy to roll up"),
+    top_n: int = Query(20, ge=1, le=500),
+    include_rows: bool = Query(False),
+    current_user = Depends(get_current_active_user)
+):
+    """Absolute/% variance, top movers and roll-ups of scenario balances against the first scenario"""
+    if len(scenario_ids) < 2:
+        raise HTTPException(status_code=400, detail="At least two scenario_ids are required")
+    try:
+        with company_connection(company_name) as conn:
+            table_name = get_process_table_name(conn, process_id, data_type)
+            if not table_name:
+                raise HTTPException(status_code=404, detail=f"No {data_type} data for this process")
+            
+            vectors, cache_hits = [], 0
+            for scenario_id in scenario_ids:
+                vector, hit = scenario_variance.load_scenario_vector(
+                    conn, company_name, table_name, process_id, scenario_id, periods
+                )
+                vectors.append(vector)
+                cache_hits += hit
+            
+            hierarchy = scenario_variance.load_hierarchy(conn, hierarchy_id) if hierarchy_id else None
+        
+        result = scenario_variance.compare(
+            vectors, scenario_ids, entities=entities, top_n=top_n,
+            hierarchy=hierarchy, include_rows=include_rows
+        )
+        return {"success": True, "cache_hits": cache_hits, **result}
+    except HTTPException:
+        raise
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error computing scenario variance: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
 # ============================================================================
 # API ENDPOINTS - Execution & Validation
 # ============================================================================
@@ -1517,6 +1596,23 @@ async def validate_process(
         if len(nci_nodes) > 0:
             validations.append({"check": "NCI_CONFIGURED", "status": "pass"})
         
+        # Check 4: Node graph must be a DAG
+        node_ids = [row[0] for row in db.execute(text("""
+            SELECT id FROM process_nodes WHERE process_id = :process_id AND is_active = true
+        """), {"process_id": process_id})]
+        edges = [tuple(row) for row in db.execute(text("""
+            SELECT from_node_id, to_node_id FROM process_node_connections WHERE process_id = :process_id
+        """), {"process_id": process_id})]
+        graph = process_scheduler.validate_graph(node_ids, edges)
+        if graph["cycle"]:
+            errors.append("Node connections contain a cycle: " + " -> ".join(str(n) for n in graph["cycle"]))
+        else:
+            validations.append({"check": "GRAPH_ACYCLIC", "status": "pass", "levels": graph["levels"]})
+        for source, target in graph["dangling_edges"]:
+            warnings.append(f"Connection {source} -> {target} references an inactive or missing node")
+        for node_id in graph["isolated_nodes"]:
+            warnings.append(f"Node {node_id} is not connected to any other node")
+        
         return {
             "success": True,
             "process_id": process_id,
@@ -1718,6 +1814,14 @@ async def save_workflow(
         if not result.fetchone():
             raise HTTPException(status_code=404, detail="Process not found")
         
+        try:
+            process_scheduler.assert_acyclic(
+                [node.id for node in workflow.nodes],
+                [(edge.source, edge.target) for edge in workflow.edges]
+            )
+        except process_scheduler.ProcessGraphCycleError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
         # Convert workflow to JSON
         workflow_json = workflow.model_dump(exclude_none=True)
         
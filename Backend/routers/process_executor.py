@@ -0,0 +1,489 @@
+"""
+Per-entity execution of entity-mode process nodes.
+
+Entity flow steps (data_input -> journal_entry -> fx_translation -> deferred_tax ->
+profit_loss -> retained_earnings -> validation) are independent per entity, so a
+node run is split into one task per entity and dispatched to a process pool.
+Reference data (account classification, FX rates, entity currencies) is shipped
+to each worker once through the pool initializer; each task only carries the
+entity's own balance arrays. Results are written back in batches.
+"""
+
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from psycopg2.extras import RealDictCursor, execute_values
+
+from config import settings
+from routers import simulation_overlay
+
+logger = logging.getLogger(__name__)
+
+ENTITY_FLOW_STEPS = [
+    "data_input", "journal_entry", "fx_translation", "deferred_tax",
+    "profit_loss", "retained_earnings", "validation",
+]
+
+# Account classes used by the per-entity kernels
+ASSET, LIABILITY, EQUITY, REVENUE, EXPENSE, OTHER = range(6)
+
+DEFAULT_TAX_RATE = 0.25
+BALANCE_TOLERANCE = 0.01
+
+# Reference data installed once per worker process by _init_worker
+_reference_data: Dict[str, Any] = {}
+
+
+def classify_account(category: Optional[str], account_type: Optional[str], statement: Optional[str]) -> int:
+    """Map axes_accounts category/type/statement text onto an account class."""
+    text_value = " ".join(filter(None, [category, account_type, statement])).lower()
+    if "asset" in text_value:
+        return ASSET
+    if "liabilit" in text_value or "payable" in text_value:
+        return LIABILITY
+    if "equity" in text_value or "capital" in text_value or "retained" in text_value:
+        return EQUITY
+    # Expense before revenue: expense accounts usually sit on the "income_statement"
+    if "expense" in text_value or "cost" in text_value:
+        return EXPENSE
+    if "revenue" in text_value or "income" in text_value or "sales" in text_value:
+        return REVENUE
+    return OTHER
+
+
+# ============================================================================
+# REFERENCE DATA AND BALANCE LOADING
+# ============================================================================
+
+def load_reference_data(conn, process_id: str) -> Dict[str, Any]:
+    """Load read-only reference data shared by every entity task."""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+
+    cur.execute("SELECT reporting_currency FROM financial_processes WHERE id = %s", (process_id,))
+    process_row = cur.fetchone()
+    reporting_currency = (process_row or {}).get("reporting_currency") or "USD"
+
+    account_codes: List[str] = []
+    account_class: List[int] = []
+    cur.execute("SELECT to_regclass('axes_accounts') AS present")
+    if cur.fetchone()["present"]:
+        cur.execute("SELECT code, category, account_type, statement FROM axes_accounts ORDER BY code")
+        for row in cur.fetchall():
+            account_codes.append(row["code"])
+            account_class.append(classify_account(row["category"], row["account_type"], row["statement"]))
+
+    entity_currency: Dict[str, str] = {}
+    cur.execute("SELECT to_regclass('axes_entities') AS present")
+    if cur.fetchone()["present"]:
+        cur.execute("SELECT code, currency FROM axes_entities")
+        entity_currency = {row["code"]: row["currency"] or reporting_currency for row in cur.fetchall()}
+
+    # Latest rate per currency pair and rate type
+    fx_rates: Dict[str, float] = {}
+    cur.execute("SELECT to_regclass('fp_fx_rates') AS present")
+    if cur.fetchone()["present"]:
+        cur.execute("""
+            SELECT DISTINCT ON (from_currency, to_currency, rate_type)
+                   from_currency, to_currency, COALESCE(rate_type, 'closing') AS rate_type, rate
+            FROM fp_fx_rates
+            WHERE process_id = %s OR process_id IS NULL
+            ORDER BY from_currency, to_currency, rate_type, rate_date DESC
+        """, (process_id,))
+        fx_rates = {
+            f"{row['from_currency']}/{row['to_currency']}/{row['rate_type']}": float(row["rate"])
+            for row in cur.fetchall()
+        }
+
+    return {
+        "reporting_currency": reporting_currency,
+        "account_codes": account_codes,
+        "account_class": np.asarray(account_class, dtype=np.int8),
+        "entity_currency": entity_currency,
+        "fx_rates": fx_rates,
+    }
+
+
+def load_entity_balances(
+    conn,
+    table_name: Optional[str],
+    process_id: str,
+    entities: List[str],
+    periods: List[str],
+    scenario_id: Optional[str],
+    reference_data: Dict[str, Any],
+    simulation_run_id: Optional[str] = None,
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """Load aggregated balances for all requested entities in one query.
+
+    Account codes are resolved to indexes into reference_data["account_codes"];
+    codes missing from the chart are appended with the OTHER class. With a
+    simulation run id the base rows are read through that run's overlay.
+    """
+    conditions = ["process_id = %s", "entity_code = ANY(%s)"]
+    params: List[Any] = [process_id, entities]
+    if periods:
+        conditions.append("(period_code = ANY(%s) OR period_id = ANY(%s))")
+        params.extend([periods, periods])
+    if scenario_id:
+        conditions.append("(scenario_id = %s OR scenario_id IS NULL)")
+        params.append(scenario_id)
+
+    rows = []
+    if table_name:
+        source, source_params = simulation_overlay.merged_source(conn, table_name, simulation_run_id)
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT entity_code, account_code, period_code, SUM(amount)
+            FROM {source}
+            WHERE {' AND '.join(conditions)}
+            GROUP BY entity_code, account_code, period_code
+        """, source_params + params)
+        rows = cur.fetchall()
+
+    account_index = {code: idx for idx, code in enumerate(reference_data["account_codes"])}
+    extra_codes: List[str] = []
+    period_index: Dict[str, int] = {}
+    grouped: Dict[str, List[tuple]] = {}
+    for entity_code, account_code, period_code, amount in rows:
+        idx = account_index.get(account_code)
+        if idx is None:
+            idx = len(account_index)
+            account_index[account_code] = idx
+            extra_codes.append(account_code)
+        period_idx = period_index.setdefault(period_code, len(period_index))
+        grouped.setdefault(entity_code, []).append((idx, period_idx, float(amount or 0)))
+
+    if extra_codes:
+        reference_data["account_codes"] = reference_data["account_codes"] + extra_codes
+        reference_data["account_class"] = np.concatenate([
+            reference_data["account_class"],
+            np.full(len(extra_codes), OTHER, dtype=np.int8),
+        ])
+    reference_data["period_codes"] = list(period_index)
+
+    balances = {}
+    for entity_code in entities:
+        entity_rows = grouped.get(entity_code, [])
+        data = np.asarray(entity_rows, dtype=np.float64).reshape(-1, 3)
+        balances[entity_code] = {
+            "account_idx": data[:, 0].astype(np.int32),
+            "period_idx": data[:, 1].astype(np.int32),
+            "amount": data[:, 2],
+        }
+    return balances
+
+
+def load_entity_settings(conn, process_id: str, node_id: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    """Return entity_node_configurations settings for a node keyed by entity code."""
+    if not node_id:
+        return {}
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT entity_code, enabled, settings
+        FROM entity_node_configurations
+        WHERE process_id = %s AND node_id = %s
+    """, (process_id, node_id))
+    return {
+        row["entity_code"]: dict(row["settings"] or {}, enabled=row["enabled"])
+        for row in cur.fetchall()
+    }
+
+
+# ============================================================================
+# PER-ENTITY KERNELS (run inside pool workers)
+# ============================================================================
+
+def _init_worker(reference_data: Dict[str, Any]) -> None:
+    global _reference_data
+    _reference_data = reference_data
+
+
+def _class_totals(balances: Dict[str, np.ndarray], reference: Dict[str, Any]) -> np.ndarray:
+    classes = reference["account_class"][balances["account_idx"]]
+    return np.bincount(classes, weights=balances["amount"], minlength=OTHER + 1)
+
+
+def _net_income(totals: np.ndarray) -> float:
+    return float(totals[REVENUE] - totals[EXPENSE])
+
+
+def _data_input(entity_code, balances, node_settings, reference):
+    amounts = balances["amount"]
+    return {
+        "rows": int(amounts.size),
+        "accounts": int(np.unique(balances["account_idx"]).size),
+        "total_amount": float(amounts.sum()),
+    }
+
+
+def _journal_entry(entity_code, balances, node_settings, reference):
+    amounts = balances["amount"]
+    debits = float(amounts[amounts > 0].sum())
+    credits = float(abs(amounts[amounts < 0].sum()))
+    return {"debits": debits, "credits": credits, "out_of_balance": debits - credits}
+
+
+def _fx_translation(entity_code, balances, node_settings, reference):
+    source = node_settings.get("functional_currency") or reference["entity_currency"].get(entity_code) \
+        or reference["reporting_currency"]
+    target = node_settings.get("reporting_currency") or reference["reporting_currency"]
+    if source == target:
+        closing = average = 1.0
+    else:
+        rates = reference["fx_rates"]
+        closing = float(node_settings.get("closing_rate") or rates.get(f"{source}/{target}/closing")
+                        or rates.get(f"{source}/{target}/spot") or 1.0)
+        average = float(node_settings.get("average_rate") or rates.get(f"{source}/{target}/average") or closing)
+
+    # Balance sheet at closing rate, P&L at average rate; the gap is the CTA
+    classes = reference["account_class"][balances["account_idx"]]
+    is_pl = (classes == REVENUE) | (classes == EXPENSE)
+    rate_vector = np.where(is_pl, average, closing)
+    local_total = float(balances["amount"].sum())
+    translated_total = float((balances["amount"] * rate_vector).sum())
+    return {
+        "from_currency": source,
+        "to_currency": target,
+        "closing_rate": closing,
+        "average_rate": average,
+        "translated_total": translated_total,
+        "translation_difference": translated_total - local_total * closing,
+    }
+
+
+def _deferred_tax(entity_code, balances, node_settings, reference):
+    tax_rate = float(node_settings.get("tax_rate", DEFAULT_TAX_RATE))
+    profit_before_tax = _net_income(_class_totals(balances, reference))
+    temporary_differences = float(node_settings.get("temporary_differences", 0))
+    return {
+        "tax_rate": tax_rate,
+        "profit_before_tax": profit_before_tax,
+        "current_tax": profit_before_tax * tax_rate,
+        "deferred_tax": temporary_differences * tax_rate,
+    }
+
+
+def _profit_loss(entity_code, balances, node_settings, reference):
+    totals = _class_totals(balances, reference)
+    return {
+        "revenue": float(totals[REVENUE]),
+        "expenses": float(totals[EXPENSE]),
+        "net_income": _net_income(totals),
+    }
+
+
+def _retained_earnings(entity_code, balances, node_settings, reference):
+    totals = _class_totals(balances, reference)
+    opening = float(node_settings.get("opening_retained_earnings", 0))
+    dividends = float(node_settings.get("dividends", 0))
+    net_income = _net_income(totals)
+    return {
+        "opening": opening,
+        "net_income": net_income,
+        "dividends": dividends,
+        "closing": opening + net_income - dividends,
+    }
+
+
+def _validation(entity_code, balances, node_settings, reference):
+    totals = _class_totals(balances, reference)
+    tolerance = float(node_settings.get("tolerance", BALANCE_TOLERANCE))
+    difference = float(totals[ASSET] - totals[LIABILITY] - totals[EQUITY] - _net_income(totals))
+    return {
+        "balance_difference": difference,
+        "unclassified_amount": float(totals[OTHER]),
+        "passed": abs(difference) <= tolerance,
+    }
+
+
+NODE_KERNELS = {
+    "data_input": _data_input,
+    "journal_entry": _journal_entry,
+    "fx_translation": _fx_translation,
+    "deferred_tax": _deferred_tax,
+    "profit_loss": _profit_loss,
+    "retained_earnings": _retained_earnings,
+    "validation": _validation,
+}
+
+
+def check_node_type(node_type: str) -> None:
+    if node_type not in NODE_KERNELS:
+        raise ValueError(f"Unsupported node type {node_type!r}; expected one of {', '.join(NODE_KERNELS)}")
+
+
+def _execute_entity(task: tuple) -> Dict[str, Any]:
+    """Run one node kernel for one entity and time it."""
+    node_type, entity_code, balances, node_settings = task
+    started_at = datetime.now()
+    started = time.perf_counter()
+    result = {"entity_code": entity_code, "status": "completed", "outputs": {}, "error": None}
+    try:
+        result["outputs"] = NODE_KERNELS[node_type](entity_code, balances, node_settings, _reference_data)
+        result["rows_processed"] = int(balances["amount"].size)
+    except Exception as exc:
+        result["status"] = "error"
+        result["error"] = str(exc)
+        result["rows_processed"] = 0
+    result["start_time"] = started_at
+    result["end_time"] = datetime.now()
+    result["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+
+# ============================================================================
+# DISPATCH AND BATCHED WRITE-BACK
+# ============================================================================
+
+def write_execution_batch(conn, process_id: str, node_id: Optional[str], execution_id: str,
+                          request_data: Dict[str, Any], results: List[Dict[str, Any]]) -> None:
+    """Bulk-insert one batch of per-entity results into process_executions."""
+    if not results:
+        return
+    rows = [
+        (
+            str(uuid.uuid4()), process_id, result["entity_code"], node_id, "node", result["status"],
+            result["start_time"], result["end_time"],
+            json.dumps({
+                **request_data,
+                "execution_id": execution_id,
+                "duration_ms": result["duration_ms"],
+                "rows_processed": result["rows_processed"],
+                "outputs": result["outputs"],
+            }),
+            result["error"],
+        )
+        for result in results
+    ]
+    cur = conn.cursor()
+    execute_values(cur, """
+        INSERT INTO process_executions
+        (id, process_id, entity_code, node_id, execution_type, status,
+         start_time, end_time, execution_data, error_message)
+        VALUES %s
+    """, rows)
+    conn.commit()
+
+
+def execute_node_for_entities(
+    conn,
+    table_name: Optional[str],
+    process_id: str,
+    node_id: Optional[str],
+    node_type: str,
+    entities: List[str],
+    request_data: Dict[str, Any],
+    max_workers: Optional[int] = None,
+    execution_id: Optional[str] = None,
+    job=None,
+) -> Dict[str, Any]:
+    """Execute one entity-mode node for every entity and return per-entity timings.
+
+    ``job`` is an optional process_jobs.ProcessJob receiving progress events;
+    its cancel flag is checked after every entity result. Raises ValueError
+    for a node type without a kernel.
+    """
+    check_node_type(node_type)
+    execution_id = execution_id or str(uuid.uuid4())
+    started = time.perf_counter()
+
+    reference_data = load_reference_data(conn, process_id)
+    balances = load_entity_balances(
+        conn, table_name, process_id, entities,
+        request_data.get("periods") or [], request_data.get("scenario_id"), reference_data,
+        simulation_run_id=request_data.get("simulation_run_id"),
+    )
+    entity_settings = load_entity_settings(conn, process_id, node_id)
+
+    tasks = [
+        (node_type, entity_code, balances[entity_code], entity_settings.get(entity_code, {}))
+        for entity_code in entities
+        if entity_settings.get(entity_code, {}).get("enabled", True)
+    ]
+
+    workers = max(1, min(max_workers or settings.PROCESS_POOL_WORKERS, len(tasks) or 1))
+    batch_size = max(1, settings.PROCESS_EXECUTION_BATCH_SIZE)
+    timings: List[Dict[str, Any]] = []
+    pending: List[Dict[str, Any]] = []
+    rows_processed = 0
+
+    if job:
+        job.emit("node_started", node_id=node_id, node_type=node_type, entities=len(tasks))
+
+    def _collect(result: Dict[str, Any]) -> None:
+        nonlocal rows_processed
+        pending.append(result)
+        rows_processed += result["rows_processed"]
+        timings.append({
+            "entity_code": result["entity_code"],
+            "status": result["status"],
+            "duration_ms": result["duration_ms"],
+            "rows_processed": result["rows_processed"],
+            "error": result["error"],
+        })
+        if len(pending) >= batch_size:
+            write_execution_batch(conn, process_id, node_id, execution_id, request_data, pending)
+            pending.clear()
+            if job:
+                job.emit("rows_processed", node_id=node_id, node_type=node_type,
+                         entities_done=len(timings), entities_total=len(tasks), rows_processed=rows_processed)
+        if job:
+            job.check_cancelled()
+
+    try:
+        if workers == 1 or len(tasks) < settings.PROCESS_POOL_MIN_ENTITIES:
+            # Pool start-up costs more than it saves for small groups
+            workers = 1
+            _init_worker(reference_data)
+            for task in tasks:
+                _collect(_execute_entity(task))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(reference_data,)) as pool:
+                futures = [pool.submit(_execute_entity, task) for task in tasks]
+                try:
+                    for future in as_completed(futures):
+                        _collect(future.result())
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+    except BaseException:
+        # Keep whatever finished before a cancel or failure
+        try:
+            write_execution_batch(conn, process_id, node_id, execution_id, request_data, pending)
+        except Exception as exc:
+            conn.rollback()
+            logger.warning(f"Could not record partial results for node {node_id}: {exc}")
+        raise
+    write_execution_batch(conn, process_id, node_id, execution_id, request_data, pending)
+
+    durations = np.asarray([t["duration_ms"] for t in timings], dtype=np.float64)
+    failed = [t for t in timings if t["status"] == "error"]
+    logger.info(f"Node {node_type} executed for {len(timings)} entities on {workers} worker(s)")
+
+    summary = {
+        "execution_id": execution_id,
+        "node_type": node_type,
+        "workers": workers,
+        "entities_processed": len(timings),
+        "entities_failed": len(failed),
+        "total_time_ms": round((time.perf_counter() - started) * 1000, 3),
+        "timing_summary": {
+            "mean_ms": float(durations.mean()) if durations.size else 0.0,
+            "p95_ms": float(np.percentile(durations, 95)) if durations.size else 0.0,
+            "max_ms": float(durations.max()) if durations.size else 0.0,
+        },
+        "stragglers": sorted(timings, key=lambda t: t["duration_ms"], reverse=True)[:5],
+        "entity_timings": timings,
+    }
+    if job:
+        job.emit("node_finished", node_id=node_id, node_type=node_type, rows_processed=rows_processed,
+                 entities_failed=len(failed), total_time_ms=summary["total_time_ms"])
+    return summary
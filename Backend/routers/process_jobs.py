@@ -0,0 +1,173 @@
+"""
+Background jobs for process execution.
+
+execute-node and execute-flow submit their work here and return an execution
+id straight away. Each job owns an append-only event log (started, rows
+processed, finished, error, ...) that the SSE endpoint streams to the UI, and
+a cancel flag checked by the executor between batches and by the scheduler
+between nodes. Jobs live in this API worker's memory; the durable record is
+still process_run_logs / process_executions.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"completed", "error", "cancelled"}
+
+
+class ExecutionCancelled(Exception):
+    """Raised inside a job when its cancel flag has been set."""
+
+
+class ProcessJob:
+    """State, event log and cancel flag for one background execution."""
+
+    def __init__(self, execution_id: str, process_id: str, kind: str):
+        self.execution_id = execution_id
+        self.process_id = process_id
+        self.kind = kind
+        self.status = "queued"
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.now()
+        self.finished_at: Optional[datetime] = None
+        self.cancel_event = threading.Event()
+        self._events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def emit(self, event: str, **data: Any) -> None:
+        """Append an event; safe to call from worker threads."""
+        with self._lock:
+            self._events.append({
+                "seq": len(self._events) + 1,
+                "event": event,
+                "timestamp": datetime.now().isoformat(),
+                **data,
+            })
+
+    def events_since(self, seq: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self._events[seq:]
+
+    def check_cancelled(self) -> None:
+        if self.cancel_event.is_set():
+            raise ExecutionCancelled(f"Execution {self.execution_id} was cancelled")
+
+    @property
+    def finished(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            last_event = self._events[-1] if self._events else None
+            event_count = len(self._events)
+        return {
+            "execution_id": self.execution_id,
+            "process_id": self.process_id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "cancel_requested": self.cancel_event.is_set(),
+            "event_count": event_count,
+            "last_event": last_event,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+_jobs: Dict[str, ProcessJob] = {}
+_jobs_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=settings.PROCESS_JOB_WORKERS, thread_name_prefix="process-job")
+
+
+def _prune_finished_jobs() -> None:
+    cutoff = time.time() - settings.PROCESS_JOB_RETENTION_SECONDS
+    with _jobs_lock:
+        for execution_id in [
+            job_id for job_id, job in _jobs.items()
+            if job.finished_at and job.finished_at.timestamp() < cutoff
+        ]:
+            del _jobs[execution_id]
+
+
+def submit_job(process_id: str, kind: str, work: Callable[[ProcessJob], Dict[str, Any]],
+               execution_id: Optional[str] = None) -> ProcessJob:
+    """Queue ``work(job)`` on the job pool and return the job immediately."""
+    _prune_finished_jobs()
+    job = ProcessJob(execution_id or str(uuid.uuid4()), process_id, kind)
+    with _jobs_lock:
+        existing = _jobs.get(job.execution_id)
+        if existing and not existing.finished:
+            raise ValueError(f"Execution {job.execution_id} is already running")
+        _jobs[job.execution_id] = job
+    job.emit("queued", kind=kind)
+
+    def _run() -> None:
+        job.status = "running"
+        job.emit("started", kind=kind)
+        try:
+            job.check_cancelled()
+            job.result = work(job)
+            status = "cancelled" if job.cancel_event.is_set() else "completed"
+        except ExecutionCancelled as exc:
+            status = "cancelled"
+            job.error = str(exc)
+        except Exception as exc:
+            logger.exception(f"Process job {job.execution_id} failed")
+            status = "error"
+            job.error = str(exc)
+        # The final event goes out before the job reads as finished, so a
+        # stream that sees ``finished`` has already been handed it
+        job.emit(status, result=job.result, error=job.error)
+        job.finished_at = datetime.now()
+        job.status = status
+
+    _executor.submit(_run)
+    return job
+
+
+def get_job(execution_id: str) -> Optional[ProcessJob]:
+    with _jobs_lock:
+        return _jobs.get(execution_id)
+
+
+def cancel_job(execution_id: str) -> Optional[ProcessJob]:
+    job = get_job(execution_id)
+    if job and not job.finished:
+        job.cancel_event.set()
+        job.emit("cancel_requested")
+    return job
+
+
+async def stream_events(job: ProcessJob, last_event_id: int = 0) -> AsyncIterator[str]:
+    """Yield the job's events in Server-Sent Events format until it finishes."""
+    seq = last_event_id
+    idle = 0.0
+    while True:
+        events = job.events_since(seq)
+        for event in events:
+            seq = event["seq"]
+            yield f"id: {seq}\nevent: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n"
+        if job.finished and not job.events_since(seq):
+            break
+        if events:
+            idle = 0.0
+        else:
+            idle += settings.PROCESS_EVENT_POLL_SECONDS
+            if idle >= 15:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+                idle = 0.0
+        await asyncio.sleep(settings.PROCESS_EVENT_POLL_SECONDS)
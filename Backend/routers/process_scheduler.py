@@ -0,0 +1,377 @@
+"""
+DAG scheduling for process nodes.
+
+The node graph stored in process_connections (financial process) or
+process_node_connections (process builder) is turned into a DAG. Cycles are
+rejected when connections are saved, topological levels are computed for
+display/validation, and execute-flow runs every node as soon as all of its
+predecessors have completed, so independent branches run concurrently.
+
+Per-node start/end times, outputs and failures are persisted in
+process_run_logs / process_node_run_logs, which lets a failed run resume from
+the failed node: completed nodes are kept, everything else is re-run.
+"""
+
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+from psycopg2.extras import RealDictCursor
+
+from config import settings
+from routers import process_executor
+from routers.process_jobs import ExecutionCancelled
+
+logger = logging.getLogger(__name__)
+
+Edge = Tuple[Hashable, Hashable]
+
+
+class ProcessGraphCycleError(ValueError):
+    """Raised when the node connections contain a cycle."""
+
+    def __init__(self, cycle: List[Hashable]):
+        self.cycle = cycle
+        super().__init__("Process graph contains a cycle: " + " -> ".join(str(n) for n in cycle))
+
+
+# ============================================================================
+# GRAPH HELPERS
+# ============================================================================
+
+def build_dag(node_ids: Iterable[Hashable], edges: Iterable[Edge]):
+    """Return (successors, predecessors, dangling_edges) for the given nodes."""
+    nodes = list(dict.fromkeys(node_ids))
+    known = set(nodes)
+    successors: Dict[Hashable, List[Hashable]] = {n: [] for n in nodes}
+    predecessors: Dict[Hashable, List[Hashable]] = {n: [] for n in nodes}
+    dangling: List[Edge] = []
+    for source, target in edges:
+        if source not in known or target not in known:
+            dangling.append((source, target))
+            continue
+        if target not in successors[source]:
+            successors[source].append(target)
+            predecessors[target].append(source)
+    return successors, predecessors, dangling
+
+
+def find_cycle(node_ids: Iterable[Hashable], edges: Iterable[Edge]) -> Optional[List[Hashable]]:
+    """Return one cycle as a node list (first node repeated at the end), or None."""
+    successors, _, _ = build_dag(node_ids, edges)
+    WHITE, GREY, BLACK = 0, 1, 2
+    colour = {n: WHITE for n in successors}
+    for root in successors:
+        if colour[root] != WHITE:
+            continue
+        path = [root]
+        stack = [iter(successors[root])]
+        colour[root] = GREY
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                colour[path.pop()] = BLACK
+                stack.pop()
+            elif colour[child] == GREY:
+                return path[path.index(child):] + [child]
+            elif colour[child] == WHITE:
+                colour[child] = GREY
+                path.append(child)
+                stack.append(iter(successors[child]))
+    return None
+
+
+def assert_acyclic(node_ids: Iterable[Hashable], edges: Iterable[Edge]) -> None:
+    node_ids, edges = list(node_ids), list(edges)
+    cycle = find_cycle(node_ids, edges)
+    if cycle:
+        raise ProcessGraphCycleError(cycle)
+
+
+def topological_levels(node_ids: Sequence[Hashable], edges: Iterable[Edge]) -> List[List[Hashable]]:
+    """Group nodes into levels; every node's predecessors sit in earlier levels."""
+    successors, predecessors, _ = build_dag(node_ids, edges)
+    indegree = {n: len(p) for n, p in predecessors.items()}
+    current = [n for n in successors if indegree[n] == 0]
+    levels: List[List[Hashable]] = []
+    placed = 0
+    while current:
+        levels.append(current)
+        placed += len(current)
+        following = []
+        for node in current:
+            for child in successors[node]:
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    following.append(child)
+        current = following
+    if placed != len(successors):
+        raise ProcessGraphCycleError(find_cycle(list(successors), [
+            (s, t) for s, targets in successors.items() for t in targets
+        ]) or [])
+    return levels
+
+
+def validate_graph(node_ids: Sequence[Hashable], edges: Iterable[Edge]) -> Dict[str, Any]:
+    """Structural checks used by process validation endpoints."""
+    edges = list(edges)
+    successors, predecessors, dangling = build_dag(node_ids, edges)
+    cycle = find_cycle(list(successors), [(s, t) for s, t in edges if (s, t) not in dangling])
+    isolated = [n for n in successors if not successors[n] and not predecessors[n]] if edges else []
+    return {
+        "cycle": cycle,
+        "dangling_edges": dangling,
+        "isolated_nodes": isolated,
+        "levels": [] if cycle else topological_levels(list(successors), edges),
+    }
+
+
+def sequence_edges(ordered_node_ids: Sequence[Hashable]) -> List[Edge]:
+    """Chain nodes by their stored sequence when a process has no connections."""
+    return list(zip(ordered_node_ids, ordered_node_ids[1:]))
+
+
+# ============================================================================
+# RUN LOG PERSISTENCE
+# ============================================================================
+
+def _start_run(cur, process_id: str, summary: Dict[str, Any], run_id: Optional[str] = None) -> str:
+    run_id = run_id or str(uuid.uuid4())
+    cur.execute("""
+        INSERT INTO process_run_logs (id, process_id, start_time, status, summary, created_at)
+        VALUES (%s, %s, NOW(), 'Running', %s, NOW())
+    """, (run_id, process_id, json.dumps(summary)))
+    return run_id
+
+
+def _check_run(cur, run_id: str, process_id: str) -> None:
+    cur.execute("SELECT id FROM process_run_logs WHERE id = %s AND process_id = %s", (run_id, process_id))
+    if not cur.fetchone():
+        raise LookupError(f"Run {run_id} not found for process {process_id}")
+
+
+def _load_completed_nodes(cur, run_id: str, process_id: str) -> Dict[str, Dict[str, Any]]:
+    _check_run(cur, run_id, process_id)
+    cur.execute("""
+        SELECT node_id, output_data FROM process_node_run_logs
+        WHERE run_log_id = %s AND status = 'Completed'
+    """, (run_id,))
+    return {str(row["node_id"]): row["output_data"] or {} for row in cur.fetchall()}
+
+
+def _mark_node(cur, run_id: str, node_id: str, status: str, input_data: Dict[str, Any],
+               start_time: datetime, end_time: Optional[datetime] = None,
+               output_data: Optional[Dict[str, Any]] = None, error: Optional[str] = None,
+               duration_ms: Optional[int] = None) -> None:
+    cur.execute("DELETE FROM process_node_run_logs WHERE run_log_id = %s AND node_id = %s", (run_id, node_id))
+    cur.execute("""
+        INSERT INTO process_node_run_logs
+        (id, run_log_id, node_id, start_time, end_time, status, input_data, output_data,
+         error_message, execution_time_ms, created_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+    """, (
+        str(uuid.uuid4()), run_id, node_id, start_time, end_time, status,
+        json.dumps(input_data), json.dumps(output_data or {}), error, duration_ms,
+    ))
+
+
+def _load_graph(cur, process_id: str) -> Tuple[Dict[str, Dict[str, Any]], List[Edge]]:
+    """Active nodes of a process and the edges between them (node order when there are none)."""
+    cur.execute("""
+        SELECT id, node_type, name, sequence
+        FROM financial_process_nodes
+        WHERE process_id = %s AND is_active = true
+        ORDER BY sequence, created_at
+    """, (process_id,))
+    nodes = {str(row["id"]): dict(row) for row in cur.fetchall()}
+
+    cur.execute("""
+        SELECT from_node_id, to_node_id FROM process_connections WHERE process_id = %s
+    """, (process_id,))
+    edges = [(str(r["from_node_id"]), str(r["to_node_id"])) for r in cur.fetchall()]
+    edges = [(s, t) for s, t in edges if s in nodes and t in nodes] or sequence_edges(list(nodes))
+    return nodes, edges
+
+
+# ============================================================================
+# EXECUTION
+# ============================================================================
+
+def check_flow(conn, process_id: str, resume_run_id: Optional[str] = None) -> None:
+    """Reject a flow before it is queued.
+
+    Raises ProcessGraphCycleError for a cyclic graph and LookupError for a
+    resume run that does not belong to the process.
+    """
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    nodes, edges = _load_graph(cur, process_id)
+    assert_acyclic(list(nodes), edges)
+    if resume_run_id:
+        _check_run(cur, resume_run_id, process_id)
+
+
+def run_process_flow(
+    conn,
+    connect: Callable[[], Any],
+    process_id: str,
+    table_name: Optional[str],
+    entities: List[str],
+    request_data: Dict[str, Any],
+    resume_run_id: Optional[str] = None,
+    run_id: Optional[str] = None,
+    job=None,
+) -> Dict[str, Any]:
+    """Execute all active nodes of a process in dependency order.
+
+    ``conn`` is used for reading the graph and writing run logs from the
+    scheduling thread; ``connect`` must return a context manager yielding a
+    fresh connection, one per concurrently running node. ``job`` is an
+    optional process_jobs.ProcessJob that receives per-node events and whose
+    cancel flag stops new nodes from being started.
+    """
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    nodes, edges = _load_graph(cur, process_id)
+    node_ids = list(nodes)
+
+    levels = topological_levels(node_ids, edges)
+    level_of = {node_id: depth for depth, level in enumerate(levels) for node_id in level}
+    successors, predecessors, _ = build_dag(node_ids, edges)
+
+    if resume_run_id:
+        run_id = resume_run_id
+        outputs = _load_completed_nodes(cur, run_id, process_id)
+        cur.execute("""
+            UPDATE process_run_logs SET status = 'Running', end_time = NULL WHERE id = %s
+        """, (run_id,))
+    else:
+        outputs = {}
+        run_id = _start_run(cur, process_id, {"request": request_data, "levels": levels}, run_id)
+    conn.commit()
+    if job:
+        job.emit("run_started", run_id=run_id, levels=levels, resumed=bool(resume_run_id))
+
+    completed = set(outputs) & set(nodes)
+    failed: Dict[str, str] = {}
+    cancelled: List[str] = []
+    skipped: set = set()
+    remaining = {n: sum(1 for p in predecessors[n] if p not in completed) for n in node_ids if n not in completed}
+    ready = [n for n, count in remaining.items() if count == 0]
+    max_parallel = max(1, max((len(level) for level in levels), default=1))
+    started = time.perf_counter()
+
+    def _run_node(node_id: str, workers: int) -> Dict[str, Any]:
+        node = nodes[node_id]
+        with connect() as node_conn:
+            summary = process_executor.execute_node_for_entities(
+                node_conn, table_name, process_id, node_id, node["node_type"], entities,
+                dict(request_data, node_type=node["node_type"]), max_workers=workers, job=job,
+            )
+        summary.pop("entity_timings", None)
+        return summary
+
+    def _skip_descendants(node_id: str) -> None:
+        stack = list(successors[node_id])
+        while stack:
+            child = stack.pop()
+            if child in skipped or child in completed:
+                continue
+            skipped.add(child)
+            remaining.pop(child, None)
+            now = datetime.now()
+            _mark_node(cur, run_id, child, "Skipped", {"level": level_of[child]}, now, now,
+                       error=f"Upstream node {node_id} did not complete")
+            if job:
+                job.emit("node_skipped", node_id=child, upstream_node_id=node_id)
+            stack.extend(successors[child])
+
+    with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+        running: Dict[Any, Tuple[str, datetime, float]] = {}
+        while ready or running:
+            # Split the process pool between concurrently running nodes
+            workers = max(1, settings.PROCESS_POOL_WORKERS // max(1, len(ready) + len(running)))
+            if job and job.cancel_event.is_set():
+                # Let running nodes stop at their next batch; start nothing new
+                ready = []
+                if not running:
+                    break
+            for node_id in ready:
+                start_time = datetime.now()
+                input_data = {"level": level_of[node_id], "predecessors": predecessors[node_id]}
+                _mark_node(cur, run_id, node_id, "Running", input_data, start_time)
+                running[pool.submit(_run_node, node_id, workers)] = (node_id, start_time, time.perf_counter())
+            ready = []
+            conn.commit()
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                node_id, start_time, tick = running.pop(future)
+                duration_ms = int((time.perf_counter() - tick) * 1000)
+                input_data = {"level": level_of[node_id], "predecessors": predecessors[node_id]}
+                try:
+                    summary = future.result()
+                    error = None
+                    if summary["entities_failed"]:
+                        error = f"{summary['entities_failed']} entities failed"
+                except ExecutionCancelled as exc:
+                    remaining.pop(node_id, None)
+                    cancelled.append(node_id)
+                    _mark_node(cur, run_id, node_id, "Cancelled", input_data, start_time, datetime.now(),
+                               error=str(exc), duration_ms=duration_ms)
+                    if job:
+                        job.emit("node_cancelled", node_id=node_id)
+                    continue
+                except Exception as exc:
+                    summary, error = {}, str(exc)
+
+                remaining.pop(node_id, None)
+                if error:
+                    failed[node_id] = error
+                    _mark_node(cur, run_id, node_id, "Error", input_data, start_time, datetime.now(),
+                               summary, error, duration_ms)
+                    if job:
+                        job.emit("node_error", node_id=node_id, node_type=nodes[node_id]["node_type"], error=error)
+                    _skip_descendants(node_id)
+                else:
+                    completed.add(node_id)
+                    outputs[node_id] = summary
+                    _mark_node(cur, run_id, node_id, "Completed", input_data, start_time, datetime.now(),
+                               summary, None, duration_ms)
+                    for child in successors[node_id]:
+                        if child in remaining:
+                            remaining[child] -= 1
+                            if remaining[child] == 0:
+                                ready.append(child)
+            conn.commit()
+
+    if job and job.cancel_event.is_set():
+        status = "Cancelled"
+    else:
+        status = "Error" if failed else "Completed"
+    cur.execute("""
+        UPDATE process_run_logs
+        SET status = %s, end_time = NOW(), nodes_executed = %s, nodes_failed = %s,
+            summary = summary || %s::jsonb
+        WHERE id = %s
+    """, (status, len(completed), len(failed), json.dumps({
+        "failed": failed, "skipped": sorted(skipped), "cancelled": cancelled
+    }), run_id))
+    conn.commit()
+
+    logger.info(f"Process {process_id} run {run_id}: {len(completed)} completed, {len(failed)} failed")
+    return {
+        "run_id": run_id,
+        "status": status,
+        "resumed": bool(resume_run_id),
+        "levels": levels,
+        "nodes_total": len(nodes),
+        "nodes_completed": len(completed),
+        "nodes_failed": failed,
+        "nodes_skipped": sorted(skipped),
+        "nodes_cancelled": cancelled,
+        "node_outputs": outputs,
+        "total_time_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
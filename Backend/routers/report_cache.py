@@ -0,0 +1,240 @@
+"""
+Versioned cache for generated financial reports.
+
+Entries are keyed by the company, a hash of the request parts
+(hierarchy_selection, process_context, report_settings for reports; the
+drill-down arguments for drill-backs) and the company's current data
+version. The version lives in report_data_versions inside the company
+database and is bumped by statement-level triggers on the tables reports
+are built from, so every writer - whichever router it is in - invalidates
+the cache without having to know about it. Stale entries are never read
+again and simply age out.
+
+Two tiers:
+* an in-process LRU bounded by the serialized size of its entries
+  (REPORT_CACHE_MAX_BYTES);
+* optionally Redis (REPORT_CACHE_REDIS + REDIS_URL), shared by all workers,
+  with REPORT_CACHE_TTL_SECONDS expiry. Redis errors disable the tier for
+  the rest of the process instead of failing requests.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from config import settings
+
+try:
+    import redis
+except ImportError:  # Optional dependency
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+REPORTS_DOMAIN = "reports"
+DASHBOARD_DOMAIN = "dashboard"
+ENTITY_AXES_DOMAIN = "entity_axes"
+ACCOUNT_AXES_DOMAIN = "account_axes"
+FISCAL_DOMAIN = "fiscal"
+REFERENCE_DOMAIN = "reference_data"
+FST_DOMAIN = "fst"
+
+# Tables whose writes change report output, per version domain
+VERSIONED_TABLES: Dict[str, Tuple[str, ...]] = {
+    # The cube is refreshed after the source rows commit; journals feed drill-downs
+    REPORTS_DOMAIN: ("entity_amounts", "ic_amounts", "other_amounts", "accounts", "hierarchies",
+                     "report_balance_cube", "process_run_journal_lines", "consolidation_run_journal_lines"),
+    DASHBOARD_DOMAIN: ("tb_entries", "accounts", "entities", "uploads", "consolidation_journals"),
+    ENTITY_AXES_DOMAIN: ("axes_entities", "hierarchies", "hierarchy_nodes", "axes_settings"),
+    ACCOUNT_AXES_DOMAIN: ("axes_accounts", "hierarchies", "hierarchy_nodes", "axes_settings"),
+    FISCAL_DOMAIN: ("fiscal_years", "periods"),
+    REFERENCE_DOMAIN: ("accounts", "entities", "hierarchies"),
+    FST_DOMAIN: ("fst_templates", "fst_elements", "accounts"),
+}
+VERSIONING_RETRY_SECONDS = 60  # Companies missing a versioned table are re-checked at most this often
+
+_versioned_companies = set()
+_incomplete_companies: Dict[str, float] = {}
+_versioned_lock = threading.Lock()
+
+
+# ============================================================================
+# DATA VERSIONS
+# ============================================================================
+
+def ensure_versioning(conn, company_name: str) -> None:
+    """Create the version table and the bump triggers once per company and process."""
+    if company_name in _versioned_companies:
+        return
+    checked_at = _incomplete_companies.get(company_name)
+    if checked_at is not None and time.monotonic() - checked_at < VERSIONING_RETRY_SECONDS:
+        # Triggers on the tables that exist are in place; the rest are retried later
+        return
+    with _versioned_lock:
+        if company_name in _versioned_companies:
+            return
+        cur = conn.cursor()
+        complete = True
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS report_data_versions (
+                domain VARCHAR(50) PRIMARY KEY,
+                version BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION bump_report_data_version()
+            RETURNS TRIGGER AS $$
+            BEGIN
+                INSERT INTO report_data_versions (domain, version, updated_at)
+                VALUES (TG_ARGV[0], 1, CURRENT_TIMESTAMP)
+                ON CONFLICT (domain) DO UPDATE SET
+                    version = report_data_versions.version + 1,
+                    updated_at = CURRENT_TIMESTAMP;
+                RETURN NULL;
+            END;
+            $$ language 'plpgsql';
+        """)
+        for domain, tables in VERSIONED_TABLES.items():
+            for table_name in tables:
+                cur.execute("SELECT to_regclass(%s)", (table_name,))
+                if cur.fetchone()[0] is None:
+                    # Attached on a later call, once the table exists
+                    complete = False
+                    continue
+                trigger_name = f"bump_{domain}_version_{table_name}"
+                cur.execute(f"""
+                    DROP TRIGGER IF EXISTS {trigger_name} ON {table_name};
+                    CREATE TRIGGER {trigger_name}
+                        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table_name}
+                        FOR EACH STATEMENT
+                        EXECUTE FUNCTION bump_report_data_version('{domain}');
+                """)
+        conn.commit()
+        if complete:
+            _versioned_companies.add(company_name)
+            _incomplete_companies.pop(company_name, None)
+        else:
+            _incomplete_companies[company_name] = time.monotonic()
+
+
+def data_version(conn, company_name: str, domain: str = REPORTS_DOMAIN) -> int:
+    """Current data version of a company for one domain."""
+    ensure_versioning(conn, company_name)
+    cur = conn.cursor()
+    cur.execute("SELECT version FROM report_data_versions WHERE domain = %s", (domain,))
+    row = cur.fetchone()
+    if row is None:
+        return 0
+    return int(row["version"] if isinstance(row, dict) else row[0])
+
+
+def data_versions(conn, company_name: str, domains: Sequence[str]) -> Dict[str, int]:
+    """Current data versions of several domains in one query."""
+    ensure_versioning(conn, company_name)
+    cur = conn.cursor()
+    cur.execute("SELECT domain, version FROM report_data_versions WHERE domain = ANY(%s)", (list(domains),))
+    versions = {domain: 0 for domain in domains}
+    for row in cur.fetchall():
+        domain, version = (row["domain"], row["version"]) if isinstance(row, dict) else row
+        versions[domain] = int(version)
+    return versions
+
+
+def cache_key(company_name: str, version: int, namespace: str, parts: Dict[str, Any]) -> str:
+    """Cache key for a request: its parts are hashed in canonical JSON form."""
+    digest = hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+    return f"report-cache:{company_name}:{namespace}:v{version}:{digest}"
+
+
+# ============================================================================
+# CACHE
+# ============================================================================
+
+class ReportCache:
+    """Size-bounded LRU of serialized reports with an optional shared Redis tier."""
+
+    def __init__(self, max_bytes: int, ttl_seconds: int, redis_url: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._redis = None
+        if redis_url and redis is not None:
+            self._redis = redis.Redis.from_url(redis_url, socket_timeout=1.0, socket_connect_timeout=1.0)
+        elif redis_url:
+            logger.warning("REPORT_CACHE_REDIS is set but the redis package is not installed")
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+        if payload is None and self._redis is not None:
+            try:
+                payload = self._redis.get(key)
+            except Exception as e:
+                self._disable_redis(e)
+            if payload is not None:
+                self._store(key, payload)
+        return json.loads(payload) if payload is not None else None
+
+    def put(self, key: str, value: Any) -> None:
+        # Encoded the way responses are, so cached and fresh answers look the same
+        payload = json.dumps(jsonable_encoder(value)).encode("utf-8")
+        self._store(key, payload)
+        if self._redis is not None:
+            try:
+                self._redis.set(key, payload, ex=self.ttl_seconds)
+            except Exception as e:
+                self._disable_redis(e)
+
+    def _store(self, key: str, payload: bytes) -> None:
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = payload
+            self._size += len(payload)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _disable_redis(self, error: Exception) -> None:
+        logger.warning(f"Report cache Redis tier disabled: {error}")
+        self._redis = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "max_bytes": self.max_bytes,
+                    "redis": self._redis is not None}
+
+
+_cache = ReportCache(
+    settings.REPORT_CACHE_MAX_BYTES,
+    settings.REPORT_CACHE_TTL_SECONDS,
+    settings.REDIS_URL if settings.REPORT_CACHE_REDIS else None,
+)
+
+
+def get(key: str) -> Optional[Any]:
+    return _cache.get(key)
+
+
+def put(key: str, value: Any) -> None:
+    _cache.put(key, value)
+
+
+def stats() -> Dict[str, Any]:
+    return _cache.stats()
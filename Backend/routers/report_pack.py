@@ -0,0 +1,276 @@
+"""
+Report packs: every requested report for every entity and period in one job.
+
+A month-end pack is the balance sheet, income statement, cash flow and
+equity statement for each entity plus the consolidated group, usually as
+both PDF and Excel. Generating them one HTTP call at a time re-runs the
+hierarchy CTE and the balance aggregation for every report; a pack loads
+both once:
+
+* the account list of the selected hierarchy (passed in by the caller);
+* one balance cube query per period, scattered into a dense
+  ``periods x entities x accounts x measures`` array.
+
+Both are shipped to each pool worker once through the initializer, the
+way process_executor ships its reference data. A task is one (entity,
+period) pair - the consolidated group being the sum over the entity axis -
+and renders every report type and format for it from that array through
+the ``render`` callable, so the account tree is built once per pair rather
+than once per report. Workers return file bytes with per-item timings; the
+parent process writes them into the pack's zip archive as they arrive,
+followed by a manifest.json of the timings.
+"""
+
+import json
+import logging
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from config import settings
+from routers import balance_cube
+
+logger = logging.getLogger(__name__)
+
+REPORT_TYPES = ("balance_sheet", "income_statement", "cash_flow", "statement_equity")
+FORMATS = ("pdf", "excel")
+FILE_EXTENSIONS = {"pdf": "pdf", "excel": "xlsx"}
+MEASURES = ("entity_amount", "ic_amount", "other_amount")
+SOURCE_MEASURE = {"entity": 0, "ic": 1, "other": 2}
+CONSOLIDATED = -1  # Entity index of the group total
+
+# Pack data installed once per worker process by _init_worker
+_pack_data: Dict[str, Any] = {}
+_render: Optional[Callable[..., List[Dict[str, Any]]]] = None
+
+
+# ============================================================================
+# SHARED PACK DATA
+# ============================================================================
+
+def load_pack_data(conn, accounts: Sequence[Dict[str, Any]], process_id: Optional[str],
+                   scenario_id: Optional[str], periods: Sequence[str],
+                   entity_keys: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """Accounts and the balances of every entity and period, loaded once for the whole pack.
+
+    Without ``entity_keys`` every entity with balances in any of the periods
+    is included.
+    """
+    accounts = [dict(account) for account in accounts]
+    account_index = {account["account_code"]: index for index, account in enumerate(accounts)}
+    entity_index: Dict[str, int] = {key: index for index, key in enumerate(entity_keys or [])}
+    entity_names: Dict[str, str] = {}
+    currencies: Dict[str, str] = {}
+    cells: List[tuple] = []
+
+    for period_position, period in enumerate(periods):
+        for cell in balance_cube.query(conn, process_id=process_id, scenario_id=scenario_id,
+                                       period_keys=[period], account_keys=list(account_index)):
+            account = account_index.get(cell["account_key"])
+            entity_key = cell["entity_key"] or "unknown"
+            if account is None or (entity_keys and entity_key not in entity_index):
+                continue
+            entity = entity_index.setdefault(entity_key, len(entity_index))
+            if cell.get("entity_name"):
+                entity_names.setdefault(entity_key, cell["entity_name"])
+            if cell["source_type"] == "entity" and cell["currency"]:
+                currencies[cell["account_key"]] = cell["currency"]
+            cells.append((period_position, entity, account, SOURCE_MEASURE[cell["source_type"]],
+                          float(cell["total_amount"] or 0)))
+
+    balances = np.zeros((len(periods), len(entity_index), len(accounts), len(MEASURES)))
+    if cells:
+        p, e, a, m, amount = (np.array(column) for column in zip(*cells))
+        np.add.at(balances, (p.astype(np.int64), e.astype(np.int64), a.astype(np.int64), m.astype(np.int64)),
+                  amount)
+    keys = list(entity_index)
+    return {
+        "accounts": accounts,
+        "entity_keys": keys,
+        "entity_names": [entity_names.get(key, key) for key in keys],
+        "periods": list(periods),
+        "currencies": currencies,
+        "balances": balances,
+    }
+
+
+def item_amounts(pack_data: Dict[str, Any], entity: int, period: int) -> Dict[str, Any]:
+    """Per-account amounts of one entity (or the group) and period, shaped like a single report's."""
+    accounts = pack_data["accounts"]
+    entity_keys = pack_data["entity_keys"]
+    balances = pack_data["balances"][period]  # entities x accounts x measures
+    entities = range(len(entity_keys)) if entity == CONSOLIDATED else [entity]
+    amounts: Dict[str, Any] = {}
+    for e in entities:
+        nonzero = np.flatnonzero(np.abs(balances[e]).sum(axis=1))
+        for a in nonzero:
+            code = accounts[a]["account_code"]
+            account = amounts.setdefault(code, {"entities": {}})
+            account["entities"][entity_keys[e]] = dict(zip(MEASURES, balances[e, a].tolist()))
+            if code in pack_data["currencies"]:
+                account["currency"] = pack_data["currencies"][code]
+    return amounts
+
+
+# ============================================================================
+# WORKERS
+# ============================================================================
+
+def _init_worker(pack_data: Dict[str, Any], render: Callable[..., List[Dict[str, Any]]]) -> None:
+    global _pack_data, _render
+    _pack_data = pack_data
+    _render = render
+
+
+def _render_item(task: tuple) -> Dict[str, Any]:
+    """Render every report type and format of one (entity, period) and time each file."""
+    entity, period, report_types, formats, options = task
+    started = time.perf_counter()
+    if entity == CONSOLIDATED:
+        entity_key, entity_name = "consolidated", "Consolidated"
+    else:
+        entity_key, entity_name = _pack_data["entity_keys"][entity], _pack_data["entity_names"][entity]
+    result = {"entity_key": entity_key, "period": _pack_data["periods"][period], "files": [], "error": None}
+    try:
+        amounts = item_amounts(_pack_data, entity, period)
+        result["files"] = _render(_pack_data["accounts"], amounts, entity_key, entity_name,
+                                  result["period"], report_types, formats, options)
+    except Exception as exc:
+        result["error"] = str(exc)
+    result["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+
+def _safe_name(value: Any) -> str:
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in str(value))
+
+
+def _file_name(entity_key: str, period: str, report_type: str, file_format: str) -> str:
+    return f"{_safe_name(entity_key)}/{_safe_name(period)}/{report_type}.{FILE_EXTENSIONS[file_format]}"
+
+
+# ============================================================================
+# PACK GENERATION
+# ============================================================================
+
+def generate_pack(
+    pack_data: Dict[str, Any],
+    render: Callable[..., List[Dict[str, Any]]],
+    archive_path: str,
+    report_types: Sequence[str] = REPORT_TYPES,
+    formats: Sequence[str] = FORMATS,
+    include_entities: bool = True,
+    include_consolidated: bool = True,
+    options: Optional[Dict[str, Any]] = None,
+    max_workers: Optional[int] = None,
+    job=None,
+) -> Dict[str, Any]:
+    """Render the pack into a zip archive and return per-item timings.
+
+    ``render(accounts, amounts, entity_key, entity_name, period, report_types,
+    formats, options)`` must be a module-level function (it is sent to the
+    pool workers) returning dicts with report_type, format, content and
+    duration_ms. ``job`` is an optional process_jobs.ProcessJob receiving
+    progress events; its cancel flag is checked after every item.
+    """
+    started = time.perf_counter()
+    entities = list(range(len(pack_data["entity_keys"]))) if include_entities else []
+    if include_consolidated:
+        entities.append(CONSOLIDATED)
+    tasks = [
+        (entity, period, list(report_types), list(formats), options or {})
+        for entity in entities
+        for period in range(len(pack_data["periods"]))
+    ]
+    workers = max(1, min(max_workers or settings.REPORT_PACK_WORKERS, len(tasks) or 1))
+    timings: List[Dict[str, Any]] = []
+    failed: List[Dict[str, Any]] = []
+    files_written = 0
+
+    if job:
+        job.emit("pack_started", items=len(tasks), entities=len(entities),
+                 periods=len(pack_data["periods"]), workers=workers)
+
+    os.makedirs(os.path.dirname(archive_path) or ".", exist_ok=True)
+    partial_path = archive_path + ".partial"
+    with zipfile.ZipFile(partial_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+
+        def _collect(result: Dict[str, Any]) -> None:
+            nonlocal files_written
+            if result["error"]:
+                failed.append({"entity_key": result["entity_key"], "period": result["period"],
+                               "error": result["error"]})
+            for item in result["files"]:
+                name = _file_name(result["entity_key"], result["period"], item["report_type"], item["format"])
+                archive.writestr(name, item["content"])
+                files_written += 1
+                timings.append({
+                    "entity_key": result["entity_key"],
+                    "period": result["period"],
+                    "report_type": item["report_type"],
+                    "format": item["format"],
+                    "file": name,
+                    "bytes": len(item["content"]),
+                    "duration_ms": item["duration_ms"],
+                })
+            if job:
+                job.emit("item_finished", entity_key=result["entity_key"], period=result["period"],
+                         duration_ms=result["duration_ms"], error=result["error"],
+                         files_written=files_written)
+                job.check_cancelled()
+
+        try:
+            if workers == 1 or len(tasks) < settings.PROCESS_POOL_MIN_ENTITIES:
+                # Pool start-up costs more than it saves for small packs
+                workers = 1
+                _init_worker(pack_data, render)
+                for task in tasks:
+                    _collect(_render_item(task))
+            else:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                         initargs=(pack_data, render)) as pool:
+                    futures = [pool.submit(_render_item, task) for task in tasks]
+                    try:
+                        for future in as_completed(futures):
+                            _collect(future.result())
+                    except BaseException:
+                        for future in futures:
+                            future.cancel()
+                        raise
+        except BaseException:
+            archive.close()
+            os.remove(partial_path)
+            raise
+
+        durations = np.asarray([t["duration_ms"] for t in timings], dtype=np.float64)
+        summary = {
+            "archive": os.path.basename(archive_path),
+            "generated_at": datetime.utcnow().isoformat(),
+            "workers": workers,
+            "entities": len(entities),
+            "periods": pack_data["periods"],
+            "report_types": list(report_types),
+            "formats": list(formats),
+            "items": len(tasks),
+            "files_written": files_written,
+            "items_failed": len(failed),
+            "failures": failed,
+            "total_time_ms": round((time.perf_counter() - started) * 1000, 3),
+            "timing_summary": {
+                "mean_ms": float(durations.mean()) if durations.size else 0.0,
+                "p95_ms": float(np.percentile(durations, 95)) if durations.size else 0.0,
+                "max_ms": float(durations.max()) if durations.size else 0.0,
+            },
+            "stragglers": sorted(timings, key=lambda t: t["duration_ms"], reverse=True)[:5],
+        }
+        archive.writestr("manifest.json", json.dumps({**summary, "item_timings": timings}, indent=2, default=str))
+
+    os.replace(partial_path, archive_path)
+    logger.info(f"Report pack {archive_path}: {files_written} files from {len(tasks)} items "
+                f"on {workers} worker(s) in {summary['total_time_ms']} ms")
+    return summary
@@ -0,0 +1,377 @@
+"""
+Balance roll-forward engine.
+
+Movements of a process are loaded once as a dense (entity x account, period)
+matrix ordered by the fiscal calendar (fiscal_years / periods). Closing
+balances are cumulative sums along the period axis:
+
+* balance sheet accounts accumulate over the whole calendar, so each fiscal
+  year opens with the previous year's closing balance;
+* P&L accounts (revenue / expense) accumulate within their fiscal year only
+  and are closed into the retained earnings account at year end, which then
+  opens the next year with the accumulated net income.
+
+The resulting opening / movement / closing rows are persisted per period in
+process_balance_snapshots, so "balance as of period N" is a single indexed
+lookup instead of a scan over every prior movement. Snapshot run headers in
+process_balance_snapshot_runs are flagged stale when the process data changes.
+"""
+
+import io
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from psycopg2.extras import RealDictCursor
+
+from routers.process_executor import EXPENSE, REVENUE, classify_account
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_COLUMNS = [
+    "process_id", "scenario_key", "entity_code", "account_code", "fiscal_year_id",
+    "period_id", "period_code", "period_seq", "opening_balance", "movement", "closing_balance",
+]
+
+
+def scenario_key(scenario_id: Optional[str]) -> str:
+    """Snapshot key of a scenario; rows without a scenario share the empty key."""
+    return str(scenario_id) if scenario_id else ""
+
+
+# ============================================================================
+# CALENDAR AND MOVEMENTS
+# ============================================================================
+
+def load_calendar(conn) -> List[Dict[str, Any]]:
+    """Posting periods of every fiscal year in chronological order.
+
+    Roll-up periods (quarters, halves) are skipped; they do not carry
+    movements of their own. Each period gets its sequence number and whether
+    it closes its fiscal year.
+    """
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT p.id AS period_id, p.period_code, p.period_name, p.start_date, p.end_date,
+               fy.id AS fiscal_year_id, fy.year_code, fy.year_name
+        FROM periods p
+        JOIN fiscal_years fy ON fy.id = p.fiscal_year_id
+        WHERE COALESCE(p.is_rollup_period, FALSE) = FALSE
+        ORDER BY fy.start_date, fy.id, p.start_date, p.sort_order, p.id
+    """)
+    calendar = cur.fetchall()
+    for seq, period in enumerate(calendar):
+        following = calendar[seq + 1] if seq + 1 < len(calendar) else None
+        period["period_seq"] = seq
+        period["is_year_end"] = following is None or following["fiscal_year_id"] != period["fiscal_year_id"]
+    return calendar
+
+
+def _period_resolver(calendar: Sequence[Dict[str, Any]]):
+    """Map (period_id, period_code, fiscal_year) of an entry row to a calendar position."""
+    by_id = {str(p["period_id"]): p["period_seq"] for p in calendar}
+    by_year_code: Dict[Tuple[str, str], int] = {}
+    code_count: Dict[str, int] = {}
+    by_code: Dict[str, int] = {}
+    for p in calendar:
+        for year in (p["year_code"], p["year_name"]):
+            by_year_code[(str(year), p["period_code"])] = p["period_seq"]
+        code_count[p["period_code"]] = code_count.get(p["period_code"], 0) + 1
+        by_code[p["period_code"]] = p["period_seq"]
+
+    def resolve(period_id: Any, period_code: Any, fiscal_year: Any) -> int:
+        if period_id is not None and str(period_id) in by_id:
+            return by_id[str(period_id)]
+        if fiscal_year is not None and (str(fiscal_year), period_code) in by_year_code:
+            return by_year_code[(str(fiscal_year), period_code)]
+        # A bare period code only identifies a period when no other year reuses it
+        if code_count.get(period_code) == 1:
+            return by_code[period_code]
+        return -1
+
+    return resolve
+
+
+def load_movements(conn, table_name: str, process_id: str, scenario_id: Optional[str],
+                   calendar: Sequence[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """Aggregate entry amounts per (entity, account, period) in one query.
+
+    Returns entity/account code arrays, the calendar position of each row and
+    its amount. Rows whose period is not in the calendar get position -1.
+    """
+    conditions = ["process_id = %s"]
+    params: List[Any] = [process_id]
+    if scenario_id:
+        conditions.append("scenario_id = %s")
+        params.append(scenario_id)
+    else:
+        conditions.append("scenario_id IS NULL")
+
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT entity_code, account_code, period_id, period_code, fiscal_year, SUM(amount)
+        FROM {table_name}
+        WHERE {' AND '.join(conditions)}
+        GROUP BY entity_code, account_code, period_id, period_code, fiscal_year
+    """, params)
+    rows = cur.fetchall()
+
+    resolve = _period_resolver(calendar)
+    return {
+        "entity_code": np.asarray([r[0] for r in rows], dtype=object),
+        "account_code": np.asarray([r[1] for r in rows], dtype=object),
+        "period_seq": np.asarray([resolve(r[2], r[3], r[4]) for r in rows], dtype=np.int64),
+        "amount": np.asarray([float(r[5] or 0) for r in rows], dtype=np.float64),
+    }
+
+
+def load_account_classes(conn) -> Dict[str, int]:
+    """Account class of every axes_accounts code."""
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('axes_accounts')")
+    if cur.fetchone()[0] is None:
+        return {}
+    cur.execute("SELECT code, category, account_type, statement FROM axes_accounts")
+    return {code: classify_account(category, account_type, statement)
+            for code, category, account_type, statement in cur.fetchall()}
+
+
+def default_retained_earnings_account(conn) -> Optional[str]:
+    """First equity account whose name or type mentions retained earnings."""
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('axes_accounts')")
+    if cur.fetchone()[0] is None:
+        return None
+    cur.execute("""
+        SELECT code FROM axes_accounts
+        WHERE LOWER(CONCAT_WS(' ', name, category, account_type)) LIKE '%%retained%%'
+        ORDER BY code
+        LIMIT 1
+    """)
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+# ============================================================================
+# ROLL-FORWARD
+# ============================================================================
+
+def roll_forward(movements: Dict[str, np.ndarray], calendar: Sequence[Dict[str, Any]],
+                 account_classes: Dict[str, int],
+                 retained_earnings_account: Optional[str]) -> Dict[str, Any]:
+    """Compute opening / closing balances for every (entity, account) and period.
+
+    Returns the key arrays, the (keys x periods) opening, movement and
+    closing matrices and the net income closed into retained earnings per
+    (entity, fiscal year).
+    """
+    in_calendar = movements["period_seq"] >= 0
+    entity_codes = movements["entity_code"][in_calendar]
+    account_codes = movements["account_code"][in_calendar]
+    period_seq = movements["period_seq"][in_calendar]
+    amounts = movements["amount"][in_calendar]
+
+    n_periods = len(calendar)
+    period_year = np.asarray([p["fiscal_year_id"] for p in calendar], dtype=np.int64)
+    year_start = np.r_[True, period_year[1:] != period_year[:-1]] if n_periods else np.zeros(0, dtype=bool)
+
+    account_class = np.fromiter((account_classes.get(code, -1) for code in account_codes),
+                                dtype=np.int64, count=len(account_codes))
+    pnl_rows = (account_class == REVENUE) | (account_class == EXPENSE)
+    if pnl_rows.any():
+        if not retained_earnings_account:
+            raise ValueError("A retained earnings account is required to close P&L accounts")
+        # Every entity with P&L activity gets a retained earnings row to close into
+        closing_entities = np.unique(entity_codes[pnl_rows])
+        entity_codes = np.concatenate([entity_codes, closing_entities])
+        account_codes = np.concatenate([account_codes, np.full(len(closing_entities), retained_earnings_account, dtype=object)])
+        period_seq = np.concatenate([period_seq, np.zeros(len(closing_entities), dtype=np.int64)])
+        amounts = np.concatenate([amounts, np.zeros(len(closing_entities))])
+
+    keys = pd.MultiIndex.from_arrays([entity_codes, account_codes], names=["entity_code", "account_code"])
+    if not len(keys):
+        empty = np.zeros((0, n_periods))
+        return {"entity_code": entity_codes, "account_code": account_codes, "opening": empty,
+                "movement": empty, "closing": empty, "year_end_close": []}
+    codes, uniques = keys.factorize()
+    movement = np.zeros((len(uniques), n_periods), dtype=np.float64)
+    np.add.at(movement, (codes, period_seq), amounts)
+
+    key_entity = uniques.get_level_values(0).to_numpy(dtype=object)
+    key_account = uniques.get_level_values(1).to_numpy(dtype=object)
+    key_class = np.fromiter((account_classes.get(code, -1) for code in key_account),
+                            dtype=np.int64, count=len(uniques))
+    is_pnl = (key_class == REVENUE) | (key_class == EXPENSE)
+
+    # Balance sheet: one running sum over the calendar carries every closing
+    # balance into the next period and the next fiscal year
+    closing = np.cumsum(movement, axis=1)
+
+    year_end_close: List[Dict[str, Any]] = []
+    if is_pnl.any():
+        # P&L: the calendar-wide running sum minus its value at the end of the
+        # previous fiscal year, i.e. a running sum restarted every year
+        running = closing[is_pnl]
+        starts = np.flatnonzero(year_start)
+        carried = np.zeros_like(running)
+        carried[:, starts[1:]] = running[:, starts[1:] - 1]
+        closing[is_pnl] = running - _carry_forward(carried, year_start)
+
+        # Year-end close: net income of each year feeds retained earnings from
+        # the first period of the following year onwards
+        sign = np.where(key_class[is_pnl] == REVENUE, 1.0, -1.0)
+        year_ends = np.flatnonzero(np.r_[year_start[1:], True])
+        entity_pos, entity_index = pd.factorize(key_entity)
+        net_income = np.zeros((len(entity_index), len(year_ends)), dtype=np.float64)
+        np.add.at(net_income, entity_pos[is_pnl], closing[is_pnl][:, year_ends] * sign[:, None])
+
+        re_rows = np.flatnonzero(key_account == retained_earnings_account)
+        re_entity_pos = entity_pos[re_rows]
+        closed = np.zeros((len(entity_index), n_periods), dtype=np.float64)
+        closed[:, year_ends[:-1] + 1] = net_income[:, :-1]
+        closing[re_rows] += np.cumsum(closed, axis=1)[re_entity_pos]
+
+        for year_pos, end in enumerate(year_ends):
+            for entity_idx in np.flatnonzero(net_income[:, year_pos]):
+                year_end_close.append({
+                    "entity_code": entity_index[entity_idx],
+                    "fiscal_year_id": calendar[end]["fiscal_year_id"],
+                    "year_code": calendar[end]["year_code"],
+                    "closing_period_code": calendar[end]["period_code"],
+                    "net_income": round(float(net_income[entity_idx, year_pos]), 2),
+                    "retained_earnings_account": retained_earnings_account,
+                    "carried_forward": end != year_ends[-1],
+                })
+
+    # Opening is whatever the period did not move: the prior closing balance,
+    # zero for P&L accounts at a year start, and prior closing plus the
+    # year-end close for retained earnings
+    opening = closing - movement
+
+    return {
+        "entity_code": key_entity,
+        "account_code": key_account,
+        "opening": opening,
+        "movement": movement,
+        "closing": closing,
+        "year_end_close": year_end_close,
+    }
+
+
+def _carry_forward(carried: np.ndarray, year_start: np.ndarray) -> np.ndarray:
+    """Broadcast the value set at each fiscal year start over that year's periods."""
+    start_index = np.maximum.accumulate(np.where(year_start, np.arange(len(year_start)), 0))
+    return carried[:, start_index]
+
+
+# ============================================================================
+# SNAPSHOTS
+# ============================================================================
+
+def write_snapshots(conn, process_id: str, scenario_id: Optional[str],
+                    calendar: Sequence[Dict[str, Any]], result: Dict[str, Any],
+                    data_type: str, retained_earnings_account: Optional[str]) -> Dict[str, Any]:
+    """Replace the process/scenario snapshots with ``result`` and commit.
+
+    Only (key, period) cells with a non-zero opening, movement or closing
+    balance are stored; a key that is zero in a period has no balance to look
+    up. Rows are streamed with COPY.
+    """
+    opening, movement, closing = result["opening"], result["movement"], result["closing"]
+    rows, cols = np.nonzero(np.round(np.abs(opening) + np.abs(movement) + np.abs(closing), 2))
+    key = scenario_key(scenario_id)
+    frame = pd.DataFrame({
+        "process_id": process_id,
+        "scenario_key": key,
+        "entity_code": result["entity_code"][rows],
+        "account_code": result["account_code"][rows],
+        "fiscal_year_id": np.asarray([p["fiscal_year_id"] for p in calendar], dtype=np.int64)[cols],
+        "period_id": np.asarray([p["period_id"] for p in calendar], dtype=np.int64)[cols],
+        "period_code": np.asarray([p["period_code"] for p in calendar], dtype=object)[cols],
+        "period_seq": cols,
+        "opening_balance": np.round(opening[rows, cols], 2),
+        "movement": np.round(movement[rows, cols], 2),
+        "closing_balance": np.round(closing[rows, cols], 2),
+    }, columns=SNAPSHOT_COLUMNS)
+
+    buffer = io.StringIO()
+    frame.to_csv(buffer, header=False, index=False, na_rep="\\N")
+    buffer.seek(0)
+
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('process_balance_snapshots'), hashtext(%s))",
+                    (f"{process_id}/{key}",))
+        cur.execute("DELETE FROM process_balance_snapshots WHERE process_id = %s AND scenario_key = %s",
+                    (process_id, key))
+        replaced = cur.rowcount
+        cur.copy_expert(
+            f"COPY process_balance_snapshots ({', '.join(SNAPSHOT_COLUMNS)}) "
+            f"FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer,
+        )
+        cur.execute("""
+            INSERT INTO process_balance_snapshot_runs
+            (process_id, scenario_key, data_type, retained_earnings_account,
+             period_count, row_count, is_stale, built_at)
+            VALUES (%s, %s, %s, %s, %s, %s, FALSE, NOW())
+            ON CONFLICT (process_id, scenario_key) DO UPDATE SET
+                data_type = EXCLUDED.data_type,
+                retained_earnings_account = EXCLUDED.retained_earnings_account,
+                period_count = EXCLUDED.period_count,
+                row_count = EXCLUDED.row_count,
+                is_stale = FALSE,
+                built_at = EXCLUDED.built_at
+            RETURNING built_at
+        """, (process_id, key, data_type, retained_earnings_account, len(calendar), len(frame)))
+        built_at = cur.fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info(f"Wrote {len(frame)} balance snapshot rows for process {process_id} "
+                f"scenario '{key}' (replaced {replaced})")
+    return {"rows_written": len(frame), "rows_replaced": replaced, "built_at": built_at}
+
+
+def mark_stale(conn, process_id: str) -> int:
+    """Flag every snapshot run of a process as stale. Does not commit."""
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE process_balance_snapshot_runs SET is_stale = TRUE
+        WHERE process_id = %s AND is_stale = FALSE
+    """, (process_id,))
+    return cur.rowcount
+
+
+def balances_as_of(conn, process_id: str, scenario_id: Optional[str], period_id: int,
+                   entities: Sequence[str] = (), accounts: Sequence[str] = ()) -> Dict[str, Any]:
+    """Snapshot lookup of opening / movement / closing balances for one period."""
+    key = scenario_key(scenario_id)
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT data_type, retained_earnings_account, period_count, row_count, is_stale, built_at
+        FROM process_balance_snapshot_runs
+        WHERE process_id = %s AND scenario_key = %s
+    """, (process_id, key))
+    run = cur.fetchone()
+    if not run:
+        raise LookupError("No balance snapshots have been built for this process and scenario")
+
+    conditions = ["process_id = %s", "scenario_key = %s", "period_id = %s"]
+    params: List[Any] = [process_id, key, period_id]
+    if entities:
+        conditions.append("entity_code = ANY(%s)")
+        params.append(list(entities))
+    if accounts:
+        conditions.append("account_code = ANY(%s)")
+        params.append(list(accounts))
+    cur.execute(f"""
+        SELECT entity_code, account_code, fiscal_year_id, period_id, period_code,
+               opening_balance, movement, closing_balance
+        FROM process_balance_snapshots
+        WHERE {' AND '.join(conditions)}
+        ORDER BY entity_code, account_code
+    """, params)
+    return {"snapshot": run, "balances": cur.fetchall()}
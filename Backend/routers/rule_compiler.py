@@ -0,0 +1,453 @@
+"""
+Compiler and vectorized executor for consolidation_rules.rule_logic.
+
+rule_logic is parsed once into a RulePlan of closures over NumPy arrays and
+cached by (rule id, version hash of the logic), so editing a rule recompiles
+it and nothing else does. Plans run over a BalanceSet whose axes are stored
+as factorized integer codes: a filter condition is evaluated once over an
+axis' (small) category list, matching rows come from a per-axis row index,
+arithmetic runs on whole amount vectors, and every effect is appended as new
+lines tagged with the rule key in the ``origin`` axis. No per-row Python is
+involved.
+
+rule_logic DSL::
+
+    {
+      "filter": {"entity": ["E1", "E2"], "account": "4*",
+                 "period": {"between": ["2024-01", "2024-06"]},
+                 "segment": {"not_in": ["X"]},          # any custom axis
+                 "any": [{...}, {...}], "not": {...}},
+      "parameters": {"rate": 0.25},
+      "amount": {"mul": ["amount", {"param": "rate"}]}, # default "amount"
+      "mode": "add" | "move" | "replace",               # default "add"
+      "target_account": "6100", "target_entity": "E9", "percent": 100,
+      "allocations": [{"target_account": "6100", "percent": 60},
+                      {"target_account": "6200", "percent": 40,
+                       "target_entity": "E2"}]
+    }
+
+``add`` posts the computed amount to the targets, ``move`` also posts the
+negative to the source lines (a reclass), ``replace`` posts the difference
+that turns each source line into the computed amount. Rules run in priority
+order; rules sharing a priority read the same snapshot and their lines are
+visible to the next priority. A rule_logic without any of the executable
+keys (EXECUTABLE_KEYS) - the ``{}`` a rule is created with before its logic
+is filled in - compiles to a plan that matches nothing.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from itertools import groupby
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+AXIS_ALIASES = {"entity": "entity_code", "account": "account_code"}
+MODES = {"add", "move", "replace"}
+EXECUTABLE_KEYS = ("filter", "amount", "mode", "target_account", "allocations")
+BINARY_OPS = {
+    "add": np.add,
+    "sub": np.subtract,
+    "mul": np.multiply,
+    "min": np.minimum,
+    "max": np.maximum,
+}
+INPUT_ORIGIN = "input"
+
+
+class RuleCompileError(ValueError):
+    """Raised when rule_logic does not follow the DSL."""
+
+    def __init__(self, message: str, path: str = "rule_logic"):
+        self.path = path
+        super().__init__(f"{path}: {message}")
+
+
+# ============================================================================
+# BALANCE SET
+# ============================================================================
+
+class BalanceSet:
+    """Columnar balance lines: factorized axis codes plus a float64 amount."""
+
+    def __init__(self, axes: Dict[str, Sequence[Any]], amount: Sequence[Any]):
+        self.amount = np.asarray(amount, dtype=np.float64)
+        self.codes: Dict[str, np.ndarray] = {}
+        self.categories: Dict[str, List[Any]] = {}
+        self._index: Dict[str, Dict[Any, int]] = {}
+        self._row_index: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._labels: Dict[str, np.ndarray] = {}
+        axes = dict(axes)
+        axes.setdefault("origin", [INPUT_ORIGIN] * len(self.amount))
+        for axis, values in axes.items():
+            values = np.asarray(["" if v is None else v for v in values], dtype=object)
+            codes, uniques = pd.factorize(values)
+            self.codes[axis] = codes.astype(np.int32)
+            self.categories[axis] = list(uniques)
+            self._index[axis] = {value: pos for pos, value in enumerate(uniques)}
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict[str, Any]], axes: Sequence[str], amount_field: str = "amount"):
+        rows = list(rows)
+        return cls({axis: [row.get(axis) for row in rows] for axis in axes},
+                   [row.get(amount_field) or 0 for row in rows])
+
+    def __len__(self) -> int:
+        return len(self.amount)
+
+    def _axis_index(self, axis: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows sorted by category code plus per-category start offsets (cached until append)."""
+        cached = self._row_index.get(axis)
+        if cached is None:
+            codes = self.codes[axis]
+            counts = np.bincount(codes, minlength=len(self.categories[axis]))
+            # Stable sort of 16-bit keys is a radix sort, i.e. linear in the row count
+            keys = codes.astype(np.uint16) if len(self.categories[axis]) <= 0xFFFF else codes
+            cached = (np.argsort(keys, kind="stable"), np.concatenate([[0], np.cumsum(counts)]))
+        missing = len(self.categories[axis]) + 1 - len(cached[1])
+        if missing > 0:
+            # Categories added by code_for have no rows until the next append
+            cached = (cached[0], np.concatenate([cached[1], np.full(missing, cached[1][-1])]))
+        self._row_index[axis] = cached
+        return cached
+
+    def category_counts(self, axis: str) -> np.ndarray:
+        return np.diff(self._axis_index(axis)[1])
+
+    def rows_for(self, axis: str, matching: np.ndarray) -> np.ndarray:
+        """Sorted row indexes whose category on ``axis`` is flagged in ``matching``."""
+        order, starts = self._axis_index(axis)
+        slices = [order[starts[c]:starts[c + 1]] for c in np.flatnonzero(matching)]
+        return np.sort(np.concatenate(slices)) if slices else np.array([], dtype=np.int64)
+
+    def code_for(self, axis: str, value: Any) -> int:
+        index = self._index[axis]
+        if value not in index:
+            index[value] = len(self.categories[axis])
+            self.categories[axis].append(value)
+        return index[value]
+
+    def category_array(self, axis: str) -> np.ndarray:
+        return np.asarray(self.categories[axis], dtype=object)
+
+    def labels(self, axis: str) -> np.ndarray:
+        """Categories of an axis as a NumPy string array, for vectorized condition tests."""
+        labels = self._labels.get(axis)
+        if labels is None or len(labels) != len(self.categories[axis]):
+            labels = np.asarray([str(c) for c in self.categories[axis]], dtype=str)
+            self._labels[axis] = labels
+        return labels
+
+    def append(self, chunks: Sequence[Tuple[np.ndarray, Dict[str, int], np.ndarray]]) -> None:
+        """Append lines copied from source rows with some axes overridden."""
+        if not chunks:
+            return
+        for axis in self.codes:
+            parts = [self.codes[axis]]
+            for source_idx, overrides, _ in chunks:
+                if axis in overrides:
+                    parts.append(np.full(len(source_idx), overrides[axis], dtype=np.int32))
+                else:
+                    parts.append(self.codes[axis][source_idx])
+            self.codes[axis] = np.concatenate(parts)
+        self.amount = np.concatenate([self.amount] + [values for _, _, values in chunks])
+        self._row_index.clear()
+
+    def columns(self, start: int = 0) -> Dict[str, np.ndarray]:
+        """Decoded axis values and amounts of the lines from ``start``."""
+        columns = {axis: self.category_array(axis)[codes[start:]] for axis, codes in self.codes.items()}
+        columns["amount"] = self.amount[start:]
+        return columns
+
+    def rows(self, start: int = 0) -> List[Dict[str, Any]]:
+        """Materialize lines from ``start`` as dicts (used for generated lines only)."""
+        columns = {axis: self.category_array(axis)[codes[start:]] for axis, codes in self.codes.items()}
+        return [
+            {**{axis: columns[axis][i] for axis in columns}, "amount": round(float(amount), 2)}
+            for i, amount in enumerate(self.amount[start:])
+        ]
+
+
+# ============================================================================
+# COMPILER
+# ============================================================================
+
+Mask = Callable[[BalanceSet], np.ndarray]
+Selector = Callable[[BalanceSet], np.ndarray]
+Expr = Callable[[BalanceSet, np.ndarray], np.ndarray]
+
+
+def _category_test(condition: Any, path: str) -> Callable[[np.ndarray], np.ndarray]:
+    """Compile an axis condition into a vectorized test over that axis' labels."""
+    if isinstance(condition, (str, int, float)) and not isinstance(condition, bool):
+        value = str(condition)
+        if value.endswith("*"):
+            prefix = value[:-1]
+            if not prefix:
+                return lambda labels: np.ones(len(labels), dtype=bool)
+            # Truncating casts run in C, unlike np.char.startswith
+            return lambda labels: labels.astype(f"<U{len(prefix)}") == prefix
+        return lambda labels: labels == value
+    if isinstance(condition, list):
+        members = np.asarray([str(v) for v in condition], dtype=str)
+        return lambda labels: np.isin(labels, members)
+    if isinstance(condition, dict) and len(condition) == 1:
+        op, arg = next(iter(condition.items()))
+        if op == "in":
+            return _category_test(list(arg), path)
+        if op == "not_in":
+            inner = _category_test(list(arg), path)
+            return lambda labels: ~inner(labels)
+        if op == "prefix":
+            return _category_test(f"{arg}*", path)
+        if op == "between":
+            if not isinstance(arg, list) or len(arg) != 2:
+                raise RuleCompileError("between expects [low, high]", path)
+            low, high = str(arg[0]), str(arg[1])
+            return lambda labels: (labels >= low) & (labels <= high)
+        if op in ("eq", "ne"):
+            inner = _category_test(str(arg), path)
+            return inner if op == "eq" else (lambda labels: ~inner(labels))
+        raise RuleCompileError(f"unknown condition '{op}'", path)
+    raise RuleCompileError("condition must be a value, list or single-key object", path)
+
+
+def _compile_mask(spec: Optional[Dict[str, Any]], path: str) -> Mask:
+    """Compile a (nested) filter into a full-length boolean mask."""
+    selector = compile_filter(spec, path)
+
+    def _mask(bs: BalanceSet) -> np.ndarray:
+        mask = np.zeros(len(bs), dtype=bool)
+        mask[selector(bs)] = True
+        return mask
+    return _mask
+
+
+def compile_filter(spec: Optional[Dict[str, Any]], path: str = "rule_logic.filter") -> Selector:
+    """Compile a filter into a function returning the sorted matching row indexes.
+
+    Axis conditions are tested once per category; rows are taken from the
+    most selective axis' row index and narrowed by the remaining conditions,
+    so a rule touching 1% of a large set reads about 1% of it.
+    """
+    if not spec:
+        return lambda bs: np.arange(len(bs))
+    if not isinstance(spec, dict):
+        raise RuleCompileError("filter must be an object", path)
+
+    axis_tests: List[Tuple[str, Callable[[np.ndarray], np.ndarray]]] = []
+    masks: List[Mask] = []
+    for key, condition in spec.items():
+        if key in ("any", "all"):
+            if not isinstance(condition, list) or not condition:
+                raise RuleCompileError(f"'{key}' expects a non-empty list of filters", f"{path}.{key}")
+            subs = [_compile_mask(sub, f"{path}.{key}[{i}]") for i, sub in enumerate(condition)]
+            reducer = np.logical_or if key == "any" else np.logical_and
+            masks.append(lambda bs, subs=subs, reducer=reducer: reducer.reduce([m(bs) for m in subs]))
+        elif key == "not":
+            inner = _compile_mask(condition, f"{path}.not")
+            masks.append(lambda bs, inner=inner: ~inner(bs))
+        else:
+            axis_tests.append((AXIS_ALIASES.get(key, key), _category_test(condition, f"{path}.{key}")))
+
+    def _select(bs: BalanceSet) -> np.ndarray:
+        if any(axis not in bs.codes for axis, _ in axis_tests):
+            return np.array([], dtype=np.int64)
+        luts = [(axis, test(bs.labels(axis))) for axis, test in axis_tests]
+        if luts:
+            sizes = [int(bs.category_counts(axis)[lut].sum()) for axis, lut in luts]
+            best = int(np.argmin(sizes))
+            axis, lut = luts.pop(best)
+            idx = bs.rows_for(axis, lut)
+            for axis, lut in luts:
+                idx = idx[lut[bs.codes[axis][idx]]]
+        else:
+            idx = np.arange(len(bs))
+        for mask in masks:
+            idx = idx[mask(bs)[idx]]
+        return idx
+
+    return _select
+
+
+def compile_expression(spec: Any, parameters: Dict[str, Any], path: str = "rule_logic.amount") -> Expr:
+    if spec is None or spec == "amount":
+        return lambda bs, idx: bs.amount[idx]
+    if isinstance(spec, bool):
+        raise RuleCompileError("booleans are not amounts", path)
+    if isinstance(spec, (int, float)):
+        constant = float(spec)
+        return lambda bs, idx: np.full(len(idx), constant)
+    if not isinstance(spec, dict) or len(spec) != 1:
+        raise RuleCompileError("expression must be a number, \"amount\" or a single-key object", path)
+
+    op, arg = next(iter(spec.items()))
+    if op == "param":
+        if arg not in parameters:
+            raise RuleCompileError(f"unknown parameter '{arg}'", path)
+        return compile_expression(parameters[arg], {}, f"{path}.param")
+    if op == "percent":
+        return compile_expression(float(arg) / 100.0, parameters, path)
+    if op in ("neg", "abs"):
+        inner = compile_expression(arg, parameters, f"{path}.{op}")
+        fn = np.negative if op == "neg" else np.abs
+        return lambda bs, idx: fn(inner(bs, idx))
+    if op == "round":
+        args = arg if isinstance(arg, list) else [arg, 2]
+        inner = compile_expression(args[0], parameters, f"{path}.round")
+        digits = int(args[1])
+        return lambda bs, idx: np.round(inner(bs, idx), digits)
+    if op in BINARY_OPS or op == "div":
+        if not isinstance(arg, list) or len(arg) < 2:
+            raise RuleCompileError(f"'{op}' expects a list of at least two operands", path)
+        operands = [compile_expression(a, parameters, f"{path}.{op}[{i}]") for i, a in enumerate(arg)]
+        if op == "div":
+            def _div(bs, idx):
+                result = operands[0](bs, idx)
+                for operand in operands[1:]:
+                    divisor = operand(bs, idx)
+                    result = np.divide(result, divisor, out=np.zeros_like(result), where=divisor != 0)
+                return result
+            return _div
+        ufunc = BINARY_OPS[op]
+
+        def _reduce(bs, idx):
+            result = operands[0](bs, idx)
+            for operand in operands[1:]:
+                result = ufunc(result, operand(bs, idx))
+            return result
+        return _reduce
+    raise RuleCompileError(f"unknown operator '{op}'", path)
+
+
+class RulePlan:
+    """A compiled rule: filter mask, amount expression and target allocations."""
+
+    def __init__(self, rule_id: Any, rule_key: str, version: str, priority: int, logic: Dict[str, Any]):
+        if not isinstance(logic, dict):
+            raise RuleCompileError("rule_logic must be an object")
+        self.rule_id = rule_id
+        self.rule_key = rule_key
+        self.version = version
+        self.priority = priority
+        self.mode = logic.get("mode", "add")
+        self.is_noop = not any(key in logic for key in EXECUTABLE_KEYS)
+        if self.mode not in MODES:
+            raise RuleCompileError(f"mode must be one of {sorted(MODES)}", "rule_logic.mode")
+        parameters = logic.get("parameters") or {}
+        self.filter = compile_filter(logic.get("filter"))
+        self.amount = compile_expression(logic.get("amount"), parameters)
+
+        allocations = logic.get("allocations")
+        if allocations is None and logic.get("target_account"):
+            allocations = [{
+                "target_account": logic["target_account"],
+                "target_entity": logic.get("target_entity"),
+                "percent": logic.get("percent", 100),
+            }]
+        allocations = allocations or []
+        if self.mode != "replace" and not allocations and not self.is_noop:
+            raise RuleCompileError("target_account or allocations are required", "rule_logic")
+        self.allocations: List[Tuple[str, Optional[str], float]] = []
+        for i, allocation in enumerate(allocations):
+            path = f"rule_logic.allocations[{i}]"
+            if not isinstance(allocation, dict) or not allocation.get("target_account"):
+                raise RuleCompileError("allocation needs a target_account", path)
+            try:
+                factor = float(allocation.get("percent", 100)) / 100.0
+            except (TypeError, ValueError):
+                raise RuleCompileError("percent must be numeric", path)
+            self.allocations.append((str(allocation["target_account"]), allocation.get("target_entity"), factor))
+
+    def execute(self, bs: BalanceSet) -> Tuple[List[Tuple[np.ndarray, Dict[str, int], np.ndarray]], int]:
+        """Return (lines to append, matched row count) for this rule."""
+        if self.is_noop:
+            return [], 0
+        idx = self.filter(bs)
+        if not idx.size:
+            return [], 0
+        value = self.amount(bs, idx)
+        origin = bs.code_for("origin", self.rule_key)
+        chunks = []
+        for account, entity, factor in self.allocations:
+            overrides = {"origin": origin, "account_code": bs.code_for("account_code", account)}
+            if entity:
+                overrides["entity_code"] = bs.code_for("entity_code", entity)
+            chunks.append((idx, overrides, value * factor))
+        if self.mode == "move":
+            relieved = sum(factor for _, _, factor in self.allocations)
+            chunks.append((idx, {"origin": origin}, -value * relieved))
+        elif self.mode == "replace":
+            chunks.append((idx, {"origin": origin}, value - bs.amount[idx]))
+        return chunks, int(idx.size)
+
+
+# ============================================================================
+# PLAN CACHE & EXECUTION
+# ============================================================================
+
+_plans: "OrderedDict[Tuple[Any, str], RulePlan]" = OrderedDict()
+_plans_lock = threading.Lock()
+
+
+def rule_version(rule_logic: Any) -> str:
+    """Stable hash of the rule logic; a changed rule gets a new plan."""
+    return hashlib.md5(json.dumps(rule_logic, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def compile_rule(rule: Dict[str, Any]) -> RulePlan:
+    """Return the cached plan for a consolidation_rules row, compiling on first use."""
+    logic = rule.get("rule_logic") or {}
+    if isinstance(logic, str):
+        logic = json.loads(logic)
+    version = rule_version(logic)
+    key = (rule.get("id"), version)
+    with _plans_lock:
+        plan = _plans.get(key)
+        if plan is not None:
+            _plans.move_to_end(key)
+            return plan
+    plan = RulePlan(rule.get("id"), rule.get("rule_key") or str(rule.get("id")), version,
+                    int(rule.get("priority") or 0), logic)
+    with _plans_lock:
+        _plans[key] = plan
+        while len(_plans) > settings.RULE_PLAN_CACHE_SIZE:
+            _plans.popitem(last=False)
+    return plan
+
+
+def apply_rules(bs: BalanceSet, plans: Sequence[RulePlan]) -> List[Dict[str, Any]]:
+    """Apply plans in priority order, appending their lines to the balance set.
+
+    Returns per-rule stats. Rules of equal priority see the same snapshot.
+    """
+    stats = []
+    ordered = sorted(enumerate(plans), key=lambda item: (item[1].priority, item[0]))
+    for priority, tier in groupby((plan for _, plan in ordered), key=lambda plan: plan.priority):
+        pending = []
+        for plan in tier:
+            started = time.perf_counter()
+            chunks, matched = plan.execute(bs)
+            pending.extend(chunks)
+            stats.append({
+                "rule_id": plan.rule_id,
+                "rule_key": plan.rule_key,
+                "version": plan.version,
+                "priority": priority,
+                "mode": plan.mode,
+                "matched_lines": matched,
+                "generated_lines": sum(len(c[0]) for c in chunks),
+                "amount": round(float(sum(c[2].sum() for c in chunks)), 2),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            })
+        bs.append(pending)
+    return stats
@@ -0,0 +1,288 @@
+"""
+Scenario variance engine.
+
+Balances for each scenario of a process are loaded once as a vector of
+(entity, account, period) keys and amounts and kept in a small LRU cache, so
+comparing scenario A with B, C and D loads A a single time. Vectors are
+aligned into one dense (keys x scenarios) matrix and absolute / percentage
+variance against the base scenario, top movers and hierarchy roll-ups are
+computed with NumPy over the whole matrix.
+
+Cached vectors are dropped when the process data changes (see
+invalidate_process) or after SCENARIO_CACHE_TTL_SECONDS.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_FIELDS = ("entity_code", "account_code", "period_code")
+
+
+class ScenarioVectorCache:
+    """Thread-safe LRU of per-scenario balance vectors with a TTL."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, Dict[str, np.ndarray]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Dict[str, np.ndarray]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            loaded_at, vector = entry
+            if time.time() - loaded_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return vector
+
+    def put(self, key: Hashable, vector: Dict[str, np.ndarray]) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, company_name: str, process_id: str) -> int:
+        with self._lock:
+            stale = [k for k in self._entries if k[0] == company_name and k[1] == process_id]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+
+_cache = ScenarioVectorCache(settings.SCENARIO_CACHE_MAX_ENTRIES, settings.SCENARIO_CACHE_TTL_SECONDS)
+
+
+def invalidate_process(company_name: str, process_id: str) -> int:
+    """Drop cached vectors of a process after its data changed."""
+    return _cache.invalidate(company_name, str(process_id))
+
+
+# ============================================================================
+# LOADING
+# ============================================================================
+
+def load_scenario_vector(conn, company_name: str, table_name: str, process_id: str,
+                         scenario_id: str, periods: Sequence[str] = ()) -> Tuple[Dict[str, np.ndarray], bool]:
+    """Return ({entity_code, account_code, period_code, amount} arrays, cache_hit)."""
+    key = (company_name, str(process_id), table_name, scenario_id, tuple(sorted(periods)))
+    vector = _cache.get(key)
+    if vector is not None:
+        return vector, True
+
+    conditions = ["process_id = %s", "scenario_id = %s"]
+    params: List[Any] = [process_id, scenario_id]
+    if periods:
+        conditions.append("(period_code = ANY(%s) OR period_id = ANY(%s))")
+        params.extend([list(periods), list(periods)])
+
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT entity_code, account_code, period_code, SUM(amount)
+        FROM {table_name}
+        WHERE {' AND '.join(conditions)}
+        GROUP BY entity_code, account_code, period_code
+    """, params)
+    rows = cur.fetchall()
+
+    columns = list(zip(*rows)) if rows else [(), (), (), ()]
+    vector = {
+        field: np.asarray(values, dtype=object)
+        for field, values in zip(KEY_FIELDS, columns[:3])
+    }
+    vector["amount"] = np.asarray(columns[3], dtype=np.float64)
+    _cache.put(key, vector)
+    return vector, False
+
+
+# ============================================================================
+# VARIANCE
+# ============================================================================
+
+def align_vectors(vectors: Sequence[Dict[str, np.ndarray]]) -> Tuple[pd.MultiIndex, np.ndarray]:
+    """Align scenario vectors on (entity, account, period) into a dense matrix.
+
+    Returns the key index and a float64 matrix of shape (keys, scenarios);
+    keys missing from a scenario are 0.
+    """
+    sizes = [len(v["amount"]) for v in vectors]
+    keys = pd.MultiIndex.from_arrays(
+        [np.concatenate([v[field] for v in vectors]) for field in KEY_FIELDS],
+        names=list(KEY_FIELDS),
+    )
+    if not len(keys):
+        return keys, np.zeros((0, len(vectors)), dtype=np.float64)
+    codes, uniques = keys.factorize()
+    matrix = np.zeros((len(uniques), len(vectors)), dtype=np.float64)
+    scenario_pos = np.repeat(np.arange(len(vectors)), sizes)
+    np.add.at(matrix, (codes, scenario_pos), np.concatenate([v["amount"] for v in vectors]))
+    return uniques.set_names(list(KEY_FIELDS)), matrix
+
+
+def variance(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Absolute and % variance of every scenario column against column 0.
+
+    Percentages are NaN where the base amount is zero.
+    """
+    base = matrix[:, :1]
+    absolute = matrix[:, 1:] - base
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percent = np.where(base != 0, absolute / np.abs(base) * 100.0, np.nan)
+    return absolute, percent
+
+
+def top_movers(absolute: np.ndarray, limit: int) -> List[np.ndarray]:
+    """Row indexes of the largest absolute variances per compared scenario."""
+    movers = []
+    for column in absolute.T:
+        magnitude = np.abs(column)
+        limit_here = min(limit, int(np.count_nonzero(magnitude)))
+        if limit_here == 0:
+            movers.append(np.array([], dtype=np.int64))
+            continue
+        candidates = np.argpartition(-magnitude, limit_here - 1)[:limit_here]
+        movers.append(candidates[np.argsort(-magnitude[candidates], kind="stable")])
+    return movers
+
+
+def load_hierarchy(conn, hierarchy_id: int) -> Dict[str, Any]:
+    """Nodes, parent links and member codes of an account or entity hierarchy."""
+    cur = conn.cursor()
+    cur.execute("SELECT hierarchy_type FROM hierarchies WHERE id = %s", (hierarchy_id,))
+    row = cur.fetchone()
+    if not row:
+        raise LookupError(f"Hierarchy {hierarchy_id} not found")
+    axis = "entity" if (row[0] or "").lower() == "entity" else "account"
+    member_table = "axes_entities" if axis == "entity" else "axes_accounts"
+
+    cur.execute("""
+        SELECT id, parent_id, code, name FROM hierarchy_nodes
+        WHERE hierarchy_id = %s
+        ORDER BY level, sort_order, code
+    """, (hierarchy_id,))
+    nodes = cur.fetchall()
+    cur.execute(f"""
+        SELECT code, COALESCE(node_id, parent_id) FROM {member_table}
+        WHERE hierarchy_id = %s AND COALESCE(node_id, parent_id) IS NOT NULL
+    """, (hierarchy_id,))
+    members = dict(cur.fetchall())
+    return {"axis": axis, "nodes": nodes, "members": members}
+
+
+def rollup(keys: pd.MultiIndex, matrix: np.ndarray, hierarchy: Dict[str, Any]) -> Tuple[List[tuple], np.ndarray]:
+    """Sum the matrix into every hierarchy node (members count toward all ancestors)."""
+    nodes = hierarchy["nodes"]
+    node_pos = {node_id: pos for pos, (node_id, _, _, _) in enumerate(nodes)}
+    parent_of = {node_id: parent_id for node_id, parent_id, _, _ in nodes}
+
+    member_codes = sorted(hierarchy["members"])
+    member_pos = {code: pos for pos, code in enumerate(member_codes)}
+    pair_member: List[int] = []
+    pair_node: List[int] = []
+    for code in member_codes:
+        node_id = hierarchy["members"][code]
+        seen = set()
+        while node_id in node_pos and node_id not in seen:
+            seen.add(node_id)
+            pair_member.append(member_pos[code])
+            pair_node.append(node_pos[node_id])
+            node_id = parent_of.get(node_id)
+
+    level = "entity_code" if hierarchy["axis"] == "entity" else "account_code"
+    row_member = np.fromiter(
+        (member_pos.get(code, -1) for code in keys.get_level_values(level)),
+        dtype=np.int64, count=len(keys),
+    )
+    mapped = row_member >= 0
+    member_totals = np.zeros((len(member_codes), matrix.shape[1]), dtype=np.float64)
+    np.add.at(member_totals, row_member[mapped], matrix[mapped])
+
+    node_totals = np.zeros((len(nodes), matrix.shape[1]), dtype=np.float64)
+    if pair_node:
+        np.add.at(node_totals, np.asarray(pair_node), member_totals[np.asarray(pair_member)])
+    return nodes, node_totals
+
+
+def _number(value: float) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), 4)
+
+
+def compare(vectors: Sequence[Dict[str, np.ndarray]], scenario_ids: Sequence[str],
+            entities: Sequence[str] = (), top_n: int = 20,
+            hierarchy: Optional[Dict[str, Any]] = None, include_rows: bool = False) -> Dict[str, Any]:
+    """Align scenario vectors and compute variance, top movers and roll-ups."""
+    keys, matrix = align_vectors(vectors)
+    if entities:
+        keep = np.isin(keys.get_level_values("entity_code"), list(entities))
+        keys, matrix = keys[keep], matrix[keep]
+
+    absolute, percent = variance(matrix)
+    base_id = scenario_ids[0]
+    result: Dict[str, Any] = {
+        "base_scenario_id": base_id,
+        "scenario_ids": list(scenario_ids),
+        "key_count": len(keys),
+        "totals": {sid: round(float(total), 2) for sid, total in zip(scenario_ids, matrix.sum(axis=0))},
+        "comparisons": [],
+    }
+
+    base_total = float(matrix[:, 0].sum())
+    for col, (scenario_id, movers) in enumerate(zip(scenario_ids[1:], top_movers(absolute, top_n))):
+        total_variance = float(absolute[:, col].sum())
+        result["comparisons"].append({
+            "scenario_id": scenario_id,
+            "total_variance": round(total_variance, 2),
+            "total_variance_pct": round(total_variance / abs(base_total) * 100.0, 4) if base_total else None,
+            "changed_keys": int(np.count_nonzero(absolute[:, col])),
+            "top_movers": [
+                {
+                    **dict(zip(KEY_FIELDS, keys[i])),
+                    "base_amount": round(float(matrix[i, 0]), 2),
+                    "amount": round(float(matrix[i, col + 1]), 2),
+                    "variance": round(float(absolute[i, col]), 2),
+                    "variance_pct": _number(percent[i, col]),
+                }
+                for i in movers
+            ],
+        })
+
+    if include_rows:
+        result["rows"] = {
+            "keys": [list(k) for k in keys],
+            "amounts": np.round(matrix, 2).tolist(),
+            "variance": np.round(absolute, 2).tolist(),
+        }
+
+    if hierarchy is not None:
+        nodes, node_totals = rollup(keys, matrix, hierarchy)
+        node_abs, node_pct = variance(node_totals)
+        result["hierarchy"] = {
+            "axis": hierarchy["axis"],
+            "nodes": [
+                {
+                    "node_id": node_id,
+                    "parent_id": parent_id,
+                    "code": code,
+                    "name": name,
+                    "amounts": {sid: round(float(v), 2) for sid, v in zip(scenario_ids, node_totals[pos])},
+                    "variance": {sid: round(float(v), 2) for sid, v in zip(scenario_ids[1:], node_abs[pos])},
+                    "variance_pct": {sid: _number(v) for sid, v in zip(scenario_ids[1:], node_pct[pos])},
+                }
+                for pos, (node_id, parent_id, code, name) in enumerate(nodes)
+            ],
+        }
+    return result
@@ -0,0 +1,279 @@
+"""
+Copy-on-write overlays for process simulations.
+
+A simulation never copies the process data. Each per-process
+``{process}_{type}_entries`` table gets a sibling ``..._overlay`` table with
+the same columns plus ``simulation_run_id`` and ``overlay_op``; a simulation
+stores only the rows it changed ('U', full row image) or removed ('D',
+tombstone) under its run id. Reads union the base rows that the run did not
+touch with the run's upserts, so "actuals plus my changes" costs storage
+proportional to the changes. Promoting a run replaces exactly the touched
+rows in the base table and drops the overlay rows.
+
+Run headers live in process_simulation_runs (see ensure_financial_tables).
+"""
+
+import logging
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from psycopg2.extras import Json, RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+UPSERT = "U"
+DELETE = "D"
+# Columns managed by the overlay itself; callers cannot set them through changes
+RESERVED_COLUMNS = {"id", "process_id", "simulation_run_id", "overlay_op"}
+
+
+class SimulationStateError(ValueError):
+    """Raised when a simulation run has already been promoted or discarded."""
+
+
+def new_run_id() -> str:
+    return f"sim_{uuid.uuid4().hex[:12]}"
+
+
+def overlay_table_name(table_name: str) -> str:
+    return f"{table_name}_overlay"
+
+
+def table_columns(conn, table_name: str) -> List[str]:
+    """Column names of a table in ordinal order."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = %s
+        ORDER BY ordinal_position
+    """, (table_name,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def ensure_overlay_table(conn, table_name: str) -> str:
+    """Create the overlay sibling of a process entries table if needed."""
+    overlay = overlay_table_name(table_name)
+    cur = conn.cursor()
+    # LIKE copies columns and defaults but not the primary key, so the same
+    # row id can be overlaid by several runs
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {overlay} (LIKE {table_name} INCLUDING DEFAULTS)")
+    cur.execute(f"ALTER TABLE {overlay} ADD COLUMN IF NOT EXISTS simulation_run_id VARCHAR(100) NOT NULL")
+    cur.execute(f"ALTER TABLE {overlay} ADD COLUMN IF NOT EXISTS overlay_op CHAR(1) NOT NULL DEFAULT 'U'")
+    cur.execute(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_{overlay}_run_row
+        ON {overlay}(simulation_run_id, id)
+    """)
+    return overlay
+
+
+def get_run(conn, process_id: str, run_id: str, for_update: bool = False) -> Dict[str, Any]:
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(f"""
+        SELECT * FROM process_simulation_runs
+        WHERE id = %s AND process_id = %s
+        {'FOR UPDATE' if for_update else ''}
+    """, (run_id, process_id))
+    run = cur.fetchone()
+    if not run:
+        raise LookupError(f"Simulation run {run_id} not found")
+    return run
+
+
+def _require_open(run: Dict[str, Any]) -> None:
+    if run["status"] != "Open":
+        raise SimulationStateError(f"Simulation run {run['id']} is {run['status'].lower()}")
+
+
+# ============================================================================
+# READS
+# ============================================================================
+
+def merged_source(conn, table_name: str, run_id: Optional[str]) -> Tuple[str, List[Any]]:
+    """Return a FROM-clause fragment and its params for base data plus a run's overlay.
+
+    Without a run id (or before any overlay exists) this is just the base
+    table. The fragment exposes the base columns plus ``is_simulated``.
+    """
+    overlay = overlay_table_name(table_name)
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass(%s)", (overlay,))
+    if not run_id or cur.fetchone()[0] is None:
+        return f"(SELECT *, FALSE AS is_simulated FROM {table_name}) AS src", []
+
+    column_list = ", ".join(table_columns(conn, table_name))
+    return f"""(
+        SELECT {column_list}, FALSE AS is_simulated FROM {table_name} b
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {overlay} o WHERE o.simulation_run_id = %s AND o.id = b.id
+        )
+        UNION ALL
+        SELECT {column_list}, TRUE AS is_simulated FROM {overlay}
+        WHERE simulation_run_id = %s AND overlay_op = '{UPSERT}'
+    ) AS src""", [run_id, run_id]
+
+
+def overlay_stats(conn, table_name: str, run_id: str) -> Dict[str, int]:
+    """Row counts held by a run's overlay."""
+    overlay = overlay_table_name(table_name)
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass(%s)", (overlay,))
+    if cur.fetchone()[0] is None:
+        return {"upserted": 0, "deleted": 0}
+    cur.execute(f"""
+        SELECT COUNT(*) FILTER (WHERE overlay_op = '{UPSERT}'),
+               COUNT(*) FILTER (WHERE overlay_op = '{DELETE}')
+        FROM {overlay} WHERE simulation_run_id = %s
+    """, (run_id,))
+    upserted, deleted = cur.fetchone()
+    return {"upserted": upserted, "deleted": deleted}
+
+
+# ============================================================================
+# WRITES
+# ============================================================================
+
+def _adapt(value: Any) -> Any:
+    return Json(value) if isinstance(value, (dict, list)) else value
+
+
+def record_changes(conn, table_name: str, process_id: str, run_id: str,
+                   changes: Sequence[Dict[str, Any]]) -> Dict[str, int]:
+    """Store upserts/deletes in the run's overlay; nothing is written to the base table.
+
+    Each change is ``{"op": "upsert" | "delete", "id": ..., "values": {...}}``.
+    An upsert of an existing row copies that single row into the overlay once
+    and then applies ``values``; an upsert without a known id adds a new row.
+    Does not commit.
+    """
+    _require_open(get_run(conn, process_id, run_id, for_update=True))
+    overlay = ensure_overlay_table(conn, table_name)
+    columns = table_columns(conn, table_name)
+    writable = set(columns) - RESERVED_COLUMNS
+    column_list = ", ".join(columns)
+    restore_list = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns)
+
+    cur = conn.cursor()
+    counts = {"inserted": 0, "updated": 0, "deleted": 0}
+    for change in changes:
+        op = change.get("op", "upsert")
+        row_id = change.get("id")
+        values = change.get("values") or {}
+        unknown = set(values) - writable
+        if unknown:
+            raise ValueError(f"Unknown or read-only columns for {table_name}: {sorted(unknown)}")
+
+        if op == "delete":
+            if not row_id:
+                raise ValueError("Delete changes require an id")
+            cur.execute(f"SELECT 1 FROM {table_name} WHERE id = %s AND process_id = %s",
+                        (row_id, process_id))
+            if cur.fetchone():
+                cur.execute(f"""
+                    INSERT INTO {overlay} (id, process_id, simulation_run_id, overlay_op)
+                    VALUES (%s, %s, %s, '{DELETE}')
+                    ON CONFLICT (simulation_run_id, id) DO UPDATE SET overlay_op = '{DELETE}'
+                """, (row_id, process_id, run_id))
+            else:
+                # A row that only exists in this simulation is simply dropped
+                cur.execute(f"DELETE FROM {overlay} WHERE simulation_run_id = %s AND id = %s",
+                            (run_id, row_id))
+            counts["deleted"] += 1
+            continue
+
+        if op != "upsert":
+            raise ValueError(f"Unsupported change op: {op}")
+
+        copied = 0
+        if row_id:
+            # Copy-on-write: the first change to a base row (or one following a
+            # delete of it) snapshots that row into the overlay
+            cur.execute(f"""
+                INSERT INTO {overlay} ({column_list}, simulation_run_id, overlay_op)
+                SELECT {column_list}, %s, '{UPSERT}' FROM {table_name}
+                WHERE id = %s AND process_id = %s
+                ON CONFLICT (simulation_run_id, id) DO UPDATE
+                SET {restore_list}, overlay_op = '{UPSERT}'
+                WHERE {overlay}.overlay_op = '{DELETE}'
+            """, (run_id, row_id, process_id))
+            copied = cur.rowcount
+            if not copied:
+                cur.execute(f"SELECT 1 FROM {overlay} WHERE simulation_run_id = %s AND id = %s",
+                            (run_id, row_id))
+                copied = 1 if cur.fetchone() else 0
+
+        if copied:
+            if values:
+                assignments = ", ".join(f"{column} = %s" for column in values)
+                cur.execute(f"""
+                    UPDATE {overlay} SET {assignments}
+                    WHERE simulation_run_id = %s AND id = %s
+                """, [_adapt(v) for v in values.values()] + [run_id, row_id])
+            counts["updated"] += 1
+        else:
+            insert_columns = ["id", "process_id", "simulation_run_id", "overlay_op"] + list(values)
+            cur.execute(f"""
+                INSERT INTO {overlay} ({', '.join(insert_columns)})
+                VALUES ({', '.join(['%s'] * len(insert_columns))})
+            """, [row_id or str(uuid.uuid4()), process_id, run_id, UPSERT]
+                + [_adapt(v) for v in values.values()])
+            counts["inserted"] += 1
+
+    stats = overlay_stats(conn, table_name, run_id)
+    cur.execute("""
+        UPDATE process_simulation_runs
+        SET rows_changed = %s, rows_deleted = %s, updated_at = NOW()
+        WHERE id = %s
+    """, (stats["upserted"], stats["deleted"], run_id))
+    return counts
+
+
+def promote(conn, table_name: str, process_id: str, run_id: str) -> Dict[str, int]:
+    """Apply a run's delta to the base table and close the run. Does not commit.
+
+    Touched base rows are replaced (delete + insert of the overlay image), so
+    the work done is proportional to the overlay, not to the dataset.
+    """
+    _require_open(get_run(conn, process_id, run_id, for_update=True))
+    overlay = overlay_table_name(table_name)
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass(%s)", (overlay,))
+    removed = written = 0
+    if cur.fetchone()[0] is not None:
+        column_list = ", ".join(table_columns(conn, table_name))
+        cur.execute(f"""
+            DELETE FROM {table_name} b USING {overlay} o
+            WHERE o.simulation_run_id = %s AND o.id = b.id
+        """, (run_id,))
+        removed = cur.rowcount
+        cur.execute(f"""
+            INSERT INTO {table_name} ({column_list})
+            SELECT {column_list} FROM {overlay}
+            WHERE simulation_run_id = %s AND overlay_op = '{UPSERT}'
+        """, (run_id,))
+        written = cur.rowcount
+        cur.execute(f"DELETE FROM {overlay} WHERE simulation_run_id = %s", (run_id,))
+
+    cur.execute("""
+        UPDATE process_simulation_runs
+        SET status = 'Promoted', promoted_at = NOW(), updated_at = NOW()
+        WHERE id = %s
+    """, (run_id,))
+    return {"base_rows_replaced": removed, "rows_written": written}
+
+
+def discard(conn, table_name: str, process_id: str, run_id: str) -> int:
+    """Drop a run's overlay rows and mark it discarded. Does not commit."""
+    _require_open(get_run(conn, process_id, run_id, for_update=True))
+    overlay = overlay_table_name(table_name)
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass(%s)", (overlay,))
+    dropped = 0
+    if cur.fetchone()[0] is not None:
+        cur.execute(f"DELETE FROM {overlay} WHERE simulation_run_id = %s", (run_id,))
+        dropped = cur.rowcount
+    cur.execute("""
+        UPDATE process_simulation_runs
+        SET status = 'Discarded', rows_changed = 0, rows_deleted = 0, updated_at = NOW()
+        WHERE id = %s
+    """, (run_id,))
+    return dropped
@@ -5,6 +5,8 @@ import psycopg2
 import os
 from datetime import datetime
 
+from routers import kpi_snapshots, pagination
+
 router = APIRouter(prefix="/tb", tags=["Trial Balance"])
 
 def get_db_config():
@@ -110,9 +112,11 @@ def get_tb_entries(
     company_name: str = Query(...),
     entity_code: Optional[str] = None,
     period: Optional[str] = None,
-    year: Optional[int] = None
+    year: Optional[int] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    cursor: Optional[str] = None
 ):
-    """Get trial balance entries with optional filters"""
+    """Get one page of trial balance entries with optional filters"""
     try:
         db_config = get_db_config()
         company_db_name = company_name.lower().replace(' ', '_').replace('-', '_')
@@ -123,8 +127,6 @@ def get_tb_entries(
                 **db_config
             )
             
-            cur = conn.cursor()
-            
             # Build dynamic query based on filters
             where_conditions = []
             params = []
@@ -141,22 +143,25 @@ def get_tb_entries(
                 where_conditions.append("tb.year = %s")
                 params.append(year)
             
-            where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
+            where_clause = " AND ".join(where_conditions)
             
-            query = f"""
+            # Keyset-paged in (entity, account, id) order; amounts arrive as floats
+            page = pagination.keyset_page(
+                conn,
+                """
                 SELECT tb.id, tb.entity_code, tb.account_code, a.account_name, a.account_type,
                        tb.period, tb.year, tb.debit_amount, tb.credit_amount, 
                        tb.balance_amount, tb.currency, tb.created_at
                 FROM tb_entries tb
                 LEFT JOIN accounts a ON tb.account_code = a.account_code
-                {where_clause}
-                ORDER BY tb.entity_code, tb.account_code
-            """
-            
-            cur.execute(query, params)
+                """,
+                where_clause, params,
+                ["tb.entity_code", "tb.account_code", "tb.id"], limit, cursor,
+                descending=False, key_fields=[1, 2, 0], cursor_factory=None,
+            )
             
             entries = []
-            for row in cur.fetchall():
+            for row in page["rows"]:
                 (entry_id, entity_code, account_code, account_name, account_type,
                  period, year, debit, credit, balance, currency, created_at) = row
                 
@@ -168,17 +173,20 @@ def get_tb_entries(
                     "account_type": account_type,
                     "period": period,
                     "year": year,
-                    "debit_amount": float(debit) if debit else 0,
-                    "credit_amount": float(credit) if credit else 0,
-                    "balance_amount": float(balance) if balance else 0,
+                    "debit_amount": debit or 0,
+                    "credit_amount": credit or 0,
+                    "balance_amount": balance or 0,
                     "currency": currency,
                     "created_at": created_at.isoformat() if created_at else None
                 })
             
-            cur.close()
             conn.close()
             
-            return {"entries": entries}
+            return {
+                "entries": entries,
+                "next_cursor": page["next_cursor"],
+                "has_more": page["has_more"]
+            }
             
         except psycopg2.OperationalError:
             # Return sample entries if database doesn't exist
@@ -214,6 +222,8 @@ def get_tb_entries(
             ]
             return {"entries": sample_entries}
             
+    except pagination.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error getting TB entries: {e}")
         return {"entries": []}
@@ -258,6 +268,7 @@ async def upload_tb_file(
             """, (upload_id,))
         
         conn.commit()
+        kpi_snapshots.notify_write(company_name)
         cur.close()
         conn.close()
         
@@ -304,6 +315,7 @@ def create_tb_entry(entry: TBEntry, company_name: str = Query(...)):
         
         entry_id = cur.fetchone()[0]
         conn.commit()
+        kpi_snapshots.notify_write(company_name)
         cur.close()
         conn.close()
         
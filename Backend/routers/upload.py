@@ -9,6 +9,8 @@ import shutil
 from datetime import datetime
 from pathlib import Path
 
+from routers import kpi_snapshots
+
 router = APIRouter(prefix="/upload", tags=["Upload & File Management"])
 
 def get_db_config():
@@ -173,6 +175,7 @@ async def upload_trial_balance(
                 ))
             
             conn.commit()
+            kpi_snapshots.notify_write(company_name)
             cur.close()
             conn.close()
             
@@ -299,6 +302,7 @@ def delete_uploaded_file(file_id: int, company_name: str = Query(...)):
         cur.execute("DELETE FROM uploads WHERE id = %s", (file_id,))
         
         conn.commit()
+        kpi_snapshots.notify_write(company_name)
         cur.close()
         conn.close()
         
@@ -382,6 +386,7 @@ async def upload_entity_mapping(
             
             upload_id = cur.fetchone()[0]
             conn.commit()
+            kpi_snapshots.notify_write(company_name)
             cur.close()
             conn.close()
             
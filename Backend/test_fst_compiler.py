@@ -0,0 +1,45 @@
+import os
+import sys
+
+# Add the current directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from routers import fst_compiler
+
+
+def _element(element_id, element_type, formula="", account_codes=()):
+    return {"id": element_id, "name": element_id, "type": element_type,
+            "account_codes": list(account_codes), "formula": formula, "order": int(element_id)}
+
+
+def _coefficients(compiled, line):
+    matrix = compiled.dense()
+    return {code: matrix[line, index] for code, index in compiled.account_index.items() if matrix[line, index]}
+
+
+def test_hyphenated_account_code_is_one_operand():
+    assert fst_compiler._parse_formula("1000-01 + 2000") == [(1, "token", "1000-01"), (1, "token", "2000")]
+    compiled = fst_compiler.compile_template(1, [_element("1", fst_compiler.TOTAL, "1000-01 + 2000")])
+    assert _coefficients(compiled, 0) == {"1000-01": 1.0, "2000": 1.0}
+
+
+def test_minus_operator_after_whitespace():
+    assert fst_compiler._parse_formula("1000-01 - 2000 -3000+4000") == [
+        (1, "token", "1000-01"), (-1, "token", "2000"), (-1, "token", "3000"), (1, "token", "4000"),
+    ]
+
+
+def test_ranges_and_line_references():
+    elements = [
+        _element("1", fst_compiler.LINE_ITEM, account_codes=["1000-01"]),
+        _element("2", fst_compiler.TOTAL, "[1] - SUM(2000:2999)"),
+    ]
+    compiled = fst_compiler.compile_template(1, elements, chart=["1000-01", "2000", "2500", "3000"])
+    assert _coefficients(compiled, 1) == {"1000-01": 1.0, "2000": -1.0, "2500": -1.0}
+
+
+if __name__ == "__main__":
+    test_hyphenated_account_code_is_one_operand()
+    test_minus_operator_after_whitespace()
+    test_ranges_and_line_references()
+    print("✓ FST formula parsing checks passed")
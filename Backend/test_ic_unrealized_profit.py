@@ -0,0 +1,61 @@
+import os
+import sys
+
+import pandas as pd
+
+# Add the current directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from routers import ic_unrealized_profit
+
+
+class _Sink:
+    instances = []
+
+    def __init__(self, conn, process_id, **kwargs):
+        self.kwargs = kwargs
+        self.added = []
+        self.swapped = False
+        _Sink.instances.append(self)
+
+    def add(self, journal_key, *args, **kwargs):
+        self.added.append(journal_key)
+
+    def swap(self):
+        self.swapped = True
+        return []
+
+
+def test_rerun_without_groups_clears_journals(monkeypatch):
+    """A rerun after the IC lines are gone still swaps, replacing the earlier upe: journals with none"""
+    _Sink.instances.clear()
+    monkeypatch.setattr(ic_unrealized_profit.journal_sink, "JournalSink", _Sink)
+    monkeypatch.setattr(ic_unrealized_profit, "load_ic_sales", lambda *args: pd.DataFrame())
+    monkeypatch.setattr(ic_unrealized_profit, "load_entity_tax_rates", lambda conn: {})
+
+    result = ic_unrealized_profit.run_elimination(
+        None, "ic_amounts", "process-1", "P01", None, [], 0.2, 0.5, 0.25,
+    )
+
+    assert result["groups"].empty
+    assert result["total_unrealized_profit"] == 0.0
+    assert len(_Sink.instances) == 1
+    sink = _Sink.instances[0]
+    assert sink.swapped
+    assert sink.added == []
+    assert sink.kwargs["period"] == "P01"
+    assert sink.kwargs["key_prefix"] == ic_unrealized_profit.JOURNAL_PREFIX
+
+
+def test_no_post_leaves_journals(monkeypatch):
+    _Sink.instances.clear()
+    monkeypatch.setattr(ic_unrealized_profit.journal_sink, "JournalSink", _Sink)
+    monkeypatch.setattr(ic_unrealized_profit, "load_ic_sales", lambda *args: pd.DataFrame())
+    monkeypatch.setattr(ic_unrealized_profit, "load_entity_tax_rates", lambda conn: {})
+
+    result = ic_unrealized_profit.run_elimination(
+        None, "ic_amounts", "process-1", "P01", None, [], 0.2, 0.5, 0.25, post=False,
+    )
+
+    assert result["journals"] is None
+    assert _Sink.instances == []
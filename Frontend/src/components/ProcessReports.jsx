@@ -159,12 +159,27 @@ const ProcessReports = ({ processContext = {}, onClose }) => {
 
       const reportsData = await reportsDataResponse.json();
 
-      // Map the efficient data format to the expected format
-      const accountsWithData = Object.entries(reportsData.accounts).map(([accountCode, accountData]) => ({
-        code: accountCode,
-        name: accountData.account_name,
-        entityAmounts: accountData.entities,
-      }));
+      // Unpack the columnar account x entity matrix into per-account entity amounts
+      const { row_keys, row_labels, column_keys, column_labels, measures, values } = reportsData;
+      const accountsWithData = row_keys.map((accountCode, row) => {
+        const entityAmounts = {};
+        column_keys.forEach((entityCode, column) => {
+          const cell = { entity_name: column_labels[column] };
+          let hasAmount = false;
+          measures.forEach((measure) => {
+            cell[measure] = values[measure][row][column];
+            hasAmount = hasAmount || cell[measure] !== 0;
+          });
+          if (hasAmount) {
+            entityAmounts[entityCode] = cell;
+          }
+        });
+        return {
+          code: String(accountCode),
+          name: row_labels[row],
+          entityAmounts,
+        };
+      });
 
       // Build report structure
       const reportData = {
@@ -31,6 +31,8 @@ const DataInput = () => {
   const [showManualEntry, setShowManualEntry] = useState(false)
   const [entries, setEntries] = useState([])
   const [loading, setLoading] = useState(false)
+  const [nextCursor, setNextCursor] = useState(null)
+  const [loadingMore, setLoadingMore] = useState(false)
   const [saving, setSaving] = useState(false)
   const [notification, setNotification] = useState(null)
   const [showCustomFieldsSettings, setShowCustomFieldsSettings] = useState(false)
@@ -285,10 +287,15 @@ const DataInput = () => {
     }
   }
 
-  const fetchEntries = async () => {
+  // Entries come in pages; a cursor appends the next page to the loaded ones
+  const fetchEntries = async (cursor = null) => {
     if (!selectedCompany || !processId) return
 
-    setLoading(true)
+    if (cursor) {
+      setLoadingMore(true)
+    } else {
+      setLoading(true)
+    }
     try {
       // Build URL with filtering parameters
       const params = new URLSearchParams({
@@ -317,6 +324,10 @@ const DataInput = () => {
         params.append('scenario_id', scenarioId)
       }
 
+      if (cursor) {
+        params.append('cursor', cursor)
+      }
+
       const url = `/api/financial-process/processes/${processId}/data-input/${activeCard}?${params.toString()}`
       console.log('🔍 Fetching entries from:', url)
       
@@ -329,16 +340,25 @@ const DataInput = () => {
         const data = await response.json()
         console.log('✅ Fetched entries data:', data)
         console.log('📊 Entries count:', data.entries?.length || 0)
-        setEntries(data.entries || [])
+        if (cursor) {
+          setEntries(prev => [...prev, ...(data.entries || [])])
+        } else {
+          setEntries(data.entries || [])
+        }
+        setNextCursor(data.next_cursor || null)
       } else {
         console.error('Failed to fetch entries:', response.status)
-        setEntries([])
+        if (!cursor) {
+          setEntries([])
+        }
+        setNextCursor(null)
       }
     } catch (error) {
       console.error('Error fetching entries:', error)
       showToast('Failed to load entries', 'error')
     } finally {
       setLoading(false)
+      setLoadingMore(false)
     }
   }
 
@@ -856,6 +876,20 @@ const DataInput = () => {
               )}
             </tbody>
           </table>
+          {!loading && nextCursor && (
+            <div className="px-4 py-3 border-t border-gray-200 dark:border-gray-700 flex items-center justify-between">
+              <span className="text-sm text-gray-500 dark:text-gray-400">
+                Showing the first {entries.length.toLocaleString()} entries
+              </span>
+              <button
+                onClick={() => fetchEntries(nextCursor)}
+                disabled={loadingMore}
+                className="px-3 py-1.5 text-sm font-medium text-blue-600 hover:bg-blue-50 dark:hover:bg-gray-800 rounded-lg disabled:opacity-50"
+              >
+                {loadingMore ? 'Loading...' : 'Load more'}
+              </button>
+            </div>
+          )}
         </div>
       </div>
     )